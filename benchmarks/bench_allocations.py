@@ -0,0 +1,185 @@
+#!/usr/bin/python
+
+"""Compares the allocations made by the two ways of receiving framed messages
+(commands, here): reading each chunk as a new string with recv(), pushing it
+to a FrameBuffer, and parsing the messages sliced out of it, versus reading
+into pooled slabs with recv_into(), and parsing the messages in place (see
+SlabFrameBuffer). The messages are sent over a socket-pair, in batches of the
+given size.
+
+For each, the receive buffers allocated and the time taken per message are
+reported, along with the peak of the memory traced by tracemalloc, where it's
+available (Python 3), in a separate (shorter) pass.
+"""
+
+import socket
+import time
+
+from argparse import ArgumentParser
+from struct import pack
+
+from relayserver.message_types import build_msg_cmd_connopen, \
+                                      build_msg_cmd_sessionend, \
+                                      SESSION_END_TOKEN_LENGTH
+from relayserver.message_types.command_pb2 import Command
+from relayserver.frame_buffer import FrameBuffer, SlabFrameBuffer
+from relayserver.slab_pool import SlabPool
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+_READ_SIZE = 65536
+
+def _get_batch(batch_size):
+    """Commands as the relay would send them: assignments and session-ends,
+    framed.
+    """
+
+    frames = []
+    size = 0
+    session_id = 0
+    while size < batch_size:
+        session_id += 1
+
+        if session_id % 2:
+            command = build_msg_cmd_connopen(session_id)
+        else:
+            command = build_msg_cmd_sessionend(
+                        session_id,
+                        b'x' * SESSION_END_TOKEN_LENGTH)
+
+        data = command.SerializeToString()
+        frame = pack('>I', len(data)) + data
+
+        frames.append(frame)
+        size += len(frame)
+
+    return (b''.join(frames), len(frames))
+
+def _receive_strings(skt, length, state):
+    frames = state['frames']
+    command = Command()
+
+    while length > 0:
+        data = skt.recv(_READ_SIZE)
+
+        state['buffers'] += 1
+        length -= len(data)
+
+        frames.push(data)
+        for message_raw in frames.read_messages():
+            command.ParseFromString(message_raw)
+
+def _receive_slabs(skt, length, state):
+    frames = state['frames']
+    command = Command()
+
+    while length > 0:
+        nbytes = skt.recv_into(frames.get_buffer())
+        length -= nbytes
+
+        frames.buffer_updated(nbytes)
+        for message_raw in frames.read_messages():
+            command.ParseFromString(message_raw)
+
+        frames.recycle()
+
+def _run(receive, state, batch, num_batches, trace=False):
+    """Returns the time taken, and, if tracing, the peak of the memory
+    traced.
+    """
+
+    (sender, receiver) = socket.socketpair()
+
+    for s in (sender, receiver):
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, len(batch) * 2)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, len(batch) * 2)
+
+    if trace is True:
+        tracemalloc.start()
+
+    started_at = time.time()
+
+    try:
+        for i in range(num_batches):
+            sender.sendall(batch)
+            receive(receiver, len(batch), state)
+    finally:
+        elapsed = time.time() - started_at
+
+        peak = None
+        if trace is True:
+            (current, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        sender.close()
+        receiver.close()
+
+    return (elapsed, peak)
+
+def _get_state(name, pool):
+    if name == 'slabs':
+        return { 'frames': SlabFrameBuffer(pool) }
+    else:
+        return { 'frames': FrameBuffer(),
+                 'buffers': 0 }
+
+def main():
+    parser = ArgumentParser(description="Compare the allocations made "
+                                        "receiving framed messages as "
+                                        "strings and into slabs.")
+
+    parser.add_argument('-n', '--num-batches',
+                        default=5000,
+                        type=int,
+                        help="Batches of messages to send.")
+
+    parser.add_argument('-b', '--batch-size',
+                        default=4096,
+                        type=int,
+                        help="Bytes of messages in each batch.")
+
+    args = parser.parse_args()
+
+    (batch, messages_per_batch) = _get_batch(args.batch_size)
+    num_messages = messages_per_batch * args.num_batches
+
+    print("%-10s %12s %14s %12s %12s" %
+          ('RECEIVE', 'BUFFERS', 'BUFFER-BYTES', 'USEC/MSG', 'PEAK-KB'))
+
+    for (name, receive) in (('strings', _receive_strings),
+                            ('slabs', _receive_slabs)):
+        pool = SlabPool()
+        state = _get_state(name, pool)
+
+        (elapsed, peak) = _run(receive, state, batch, args.num_batches)
+
+        if tracemalloc is not None:
+            # Tracing slows everything down, so it's done separately.
+            (traced_elapsed, peak) = \
+                _run(receive,
+                     _get_state(name, SlabPool()),
+                     batch,
+                     max(1, args.num_batches // 10),
+                     True)
+
+        if name == 'slabs':
+            (buffers, buffer_bytes) = (pool.allocated_count,
+                                       pool.allocated_count * pool.slab_size)
+        else:
+            # Each recv() allocates a string of the read-size, and then
+            # shrinks it to what was read.
+            (buffers, buffer_bytes) = (state['buffers'],
+                                       state['buffers'] * _READ_SIZE)
+
+        print("%-10s %12d %14d %12.2f %12s" %
+              (name,
+               buffers,
+               buffer_bytes,
+               elapsed * 1000000 / num_messages,
+               '%.1f' % (peak / 1024.0) if peak is not None else 'n/a'))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+"""Announcement throughput over the command-channel, with and without
+batching. The relay's CommandServer and the host-process's CommandListener are
+connected over loopback, in-process. Assignments are announced in bursts (one
+burst per reactor iteration, like a reconnect storm) until the listener has
+applied them all to its pool. The announcements per second and the CPU time
+per announcement (for both ends together) are reported.
+"""
+
+import os
+
+from argparse import ArgumentParser
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import Factory, ClientFactory
+from twisted.python import log
+
+from relayserver import main as relay
+from relayserver.boot.host_process import CommandListener
+
+
+class _Pool(object):
+    """Stands in for the host-process pool, and counts the assignments."""
+
+    def __init__(self, count, done):
+        self.__remaining = count
+        self.__done = done
+
+    def connection_assigned(self, session_id):
+        self.__remaining -= 1
+        if self.__remaining == 0:
+            self.__done.callback(None)
+
+
+class _HostProcessConnection(object):
+    def __init__(self, session_id):
+        self.session_id = session_id
+
+
+def _get_cpu_seconds():
+    (user, system) = os.times()[:2]
+    return user + system
+
+def _announce(command_channel, remaining, burst):
+    for i in range(min(burst, remaining)):
+        command_channel.announce_assignment(_HostProcessConnection(remaining))
+        remaining -= 1
+
+    if remaining > 0:
+        reactor.callLater(0, _announce, command_channel, remaining, burst)
+
+def _run(batch_size, count, burst):
+    relay.command_batch_size = batch_size
+
+    done = Deferred()
+    pool = _Pool(count, done)
+
+    # The command-channel from the previous run might not have gone, yet, so
+    # we hold on to this run's.
+    command_channels = []
+
+    def build_command_channel(addr):
+        command_channel = relay.CommandServer()
+        command_channels.append(command_channel)
+
+        return command_channel
+
+    relay_factory = Factory()
+    relay_factory.buildProtocol = build_command_channel
+
+    port = reactor.listenTCP(0, relay_factory, interface='127.0.0.1')
+
+    listener_factory = ClientFactory()
+    listener_factory.buildProtocol = lambda addr: CommandListener(pool, '')
+
+    connector = reactor.connectTCP('127.0.0.1',
+                                   port.getHost().port,
+                                   listener_factory)
+
+    started = []
+
+    def start():
+        # The listener's hello says that it accepts batches.
+        if not command_channels or \
+           command_channels[0].accepts_batches is False:
+            reactor.callLater(.1, start)
+            return
+
+        started.extend((time(), _get_cpu_seconds()))
+        _announce(command_channels[0], count, burst)
+
+    def finish(result):
+        elapsed = time() - started[0]
+        cpu = _get_cpu_seconds() - started[1]
+
+        connector.disconnect()
+        port.stopListening()
+
+        return (count / elapsed, cpu / count)
+
+    reactor.callLater(0, start)
+
+    return done.addCallback(finish)
+
+def main():
+    parser = ArgumentParser(description="Benchmark announcements with and "
+                                        "without batching.")
+
+    parser.add_argument('-c', '--count',
+                        default=100000,
+                        type=int,
+                        help="Assignments to announce per run.")
+
+    parser.add_argument('-u', '--burst',
+                        default=500,
+                        type=int,
+                        help="Assignments announced per reactor iteration.")
+
+    parser.add_argument('-s', '--batch-size',
+                        default=100,
+                        type=int,
+                        help="Largest batch, when batching.")
+
+    args = parser.parse_args()
+
+    modes = (('single', 1),
+             ('batched', args.batch_size))
+
+    print("%-10s %12s %14s" % ('MODE', 'ANNOUNCE/S', 'CPU-USEC/EACH'))
+
+    def run_next(result, remaining):
+        if not remaining:
+            reactor.stop()
+            return
+
+        (name, batch_size) = remaining[0]
+
+        def report(result):
+            (rate, cpu) = result
+            print("%-10s %12.0f %14.2f" % (name, rate, cpu * 1000000))
+
+        d = _run(batch_size, args.count, args.burst)
+        d.addCallback(report)
+        d.addCallback(run_next, remaining[1:])
+        d.addErrback(log.err)
+
+    reactor.callWhenRunning(run_next, None, modes)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
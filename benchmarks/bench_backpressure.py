@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+"""Show the relay's memory staying bounded while a fast client writes to a
+slow host-process. A relay is started with the given watermarks, and its RSS
+is sampled while one client pushes data as fast as it can and the host-process
+side reads at a fixed, slow rate. Passing a huge high watermark effectively 
+turns flow-control off, for comparison.
+"""
+
+import time
+
+from argparse import ArgumentParser
+from threading import Thread
+
+from loopback import start_relay, connect, say_hello, get_rss_bytes
+
+def _flood(port, stop):
+    s = connect(port)
+    block = b'x' * 65536
+
+    try:
+        while not stop:
+            s.sendall(block)
+    except Exception:
+        pass
+
+def _run(base_port, high_watermark, low_watermark, seconds, read_rate):
+    relay = start_relay(base_port, 
+                        '--high-watermark', str(high_watermark), 
+                        '--low-watermark', str(low_watermark))
+
+    stop = []
+
+    try:
+        command = connect(base_port + 1)
+        hp = say_hello(base_port)
+
+        time.sleep(.5)
+        baseline = get_rss_bytes(relay.pid)
+
+        flooder = Thread(target=_flood, args=(base_port + 2, stop))
+        flooder.daemon = True
+        flooder.start()
+
+        # Read slowly, in 10ms ticks.
+        per_tick = max(1, read_rate // 100)
+        received = 0
+        peak = baseline
+
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            received += len(hp.recv(per_tick))
+            peak = max(peak, get_rss_bytes(relay.pid))
+            time.sleep(.01)
+
+        stop.append(True)
+    finally:
+        relay.terminate()
+        relay.wait()
+
+    return (baseline, peak, received)
+
+def main():
+    parser = ArgumentParser(description="Benchmark relay memory under a slow "
+                                        "reader.")
+
+    parser.add_argument('-s', '--seconds', 
+                        default=5, 
+                        type=int, 
+                        help="How long to run each case.")
+
+    parser.add_argument('-r', '--read-rate', 
+                        default=1024 * 1024, 
+                        type=int, 
+                        help="Bytes/second read by the slow host-process.")
+
+    parser.add_argument('-b', '--base-port', 
+                        default=19100, 
+                        type=int, 
+                        help="First of three consecutive ports to use.")
+
+    args = parser.parse_args()
+
+    cases = (('watermarks', 65536, 16384), 
+             ('unbounded', 2 ** 30, 2 ** 29))
+
+    print("%-12s %14s %14s %14s" % 
+          ('CASE', 'BASE-RSS-MB', 'PEAK-RSS-MB', 'READ-MB'))
+
+    for (i, (name, high, low)) in enumerate(cases):
+        (baseline, peak, received) = _run(args.base_port + i * 3, 
+                                          high, 
+                                          low, 
+                                          args.seconds, 
+                                          args.read_rate)
+
+        print("%-12s %14.1f %14.1f %14.1f" % 
+              (name, 
+               float(baseline) / 2 ** 20, 
+               float(peak) / 2 ** 20, 
+               float(received) / 2 ** 20))
+
+if __name__ == '__main__':
+    main()
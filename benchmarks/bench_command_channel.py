@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+"""Messages-per-second benchmark for the command-channel writer. A sender and
+a receiver are connected over loopback, in-process. The sender writes
+CONNECTION_OPEN commands in bursts (one burst per reactor iteration, like a
+relay announcing many assignments at once) and the receiver frames and parses
+them, until they've all arrived. It's run with the original writer (the prefix
+and the message written separately, with a log message built for each), with
+each message written as one string, and with the messages of each iteration
+gathered into one write (on a TCP_NODELAY socket, as the command-channel does).
+"""
+
+from argparse import ArgumentParser
+from struct import pack
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import Factory, ClientFactory
+from twisted.python import log
+
+from relayserver.base_protocol import BaseProtocol
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types import build_msg_cmd_connopen
+
+
+class _Sender(BaseProtocol):
+    def __init__(self, count, burst, batch):
+        self.__count = count
+        self.__burst = burst
+        self.__batch = batch
+
+    def connectionMade(self):
+        if self.__batch is True:
+            self.transport.setTcpNoDelay(True)
+            self.batch_writes()
+
+        reactor.callLater(0, self.__send_burst)
+
+    def __send_burst(self):
+        for i in range(min(self.__burst, self.__count)):
+            self.write_message(build_msg_cmd_connopen(self.__count))
+            self.__count -= 1
+
+        if self.__count > 0:
+            reactor.callLater(0, self.__send_burst)
+
+
+class _SplitSender(_Sender):
+    """Writes messages the way that BaseProtocol originally did."""
+
+    def write_message(self, message):
+        data = message.SerializeToString()
+        message_len = len(data)
+        prefix = pack('>I', message_len)
+
+        total_len = len(prefix) + message_len
+
+        log.msg("Message type [%s] serialized into (%d) bytes and wrapped as "
+                "(%d) bytes." %
+                (message.__class__.__name__, message_len, total_len))
+
+        self.transport.write(prefix)
+        self.transport.write(data)
+
+
+class _Receiver(BaseProtocol):
+    def __init__(self, count, done):
+        self.__remaining = count
+        self.__done = done
+
+        self.set_frame_handlers(Command, { None: self.__handle_command })
+
+    def dataReceived(self, data):
+        self.dispatch_frames(data)
+
+    def __handle_command(self, command):
+        self.__remaining -= 1
+        if self.__remaining == 0:
+            self.__done.callback(None)
+
+
+def _run(sender_class, batch, count, burst):
+    done = Deferred()
+
+    receiver_factory = Factory()
+    receiver_factory.buildProtocol = lambda addr: _Receiver(count, done)
+
+    port = reactor.listenTCP(0, receiver_factory, interface='127.0.0.1')
+
+    sender_factory = ClientFactory()
+    sender_factory.buildProtocol = \
+        lambda addr: sender_class(count, burst, batch)
+
+    start = time()
+    connector = reactor.connectTCP('127.0.0.1',
+                                   port.getHost().port,
+                                   sender_factory)
+
+    def finish(result):
+        elapsed = time() - start
+
+        connector.disconnect()
+        port.stopListening()
+
+        return count / elapsed
+
+    return done.addCallback(finish)
+
+def main():
+    parser = ArgumentParser(description="Benchmark the command-channel "
+                                        "writer.")
+
+    parser.add_argument('-c', '--count',
+                        default=200000,
+                        type=int,
+                        help="Messages to send per run.")
+
+    parser.add_argument('-u', '--burst',
+                        default=100,
+                        type=int,
+                        help="Messages written per reactor iteration.")
+
+    args = parser.parse_args()
+
+    modes = (('split', _SplitSender, False),
+             ('single', _Sender, False),
+             ('batched', _Sender, True))
+
+    print("%-10s %12s" % ('WRITER', 'MSGS/S'))
+
+    def run_next(result, remaining):
+        if not remaining:
+            reactor.stop()
+            return
+
+        (name, sender_class, batch) = remaining[0]
+
+        def report(rate):
+            print("%-10s %12.0f" % (name, rate))
+
+        d = _run(sender_class, batch, args.count, args.burst)
+        d.addCallback(report)
+        d.addCallback(run_next, remaining[1:])
+        d.addErrback(log.err)
+
+    reactor.callWhenRunning(run_next, None, modes)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/python
+
+"""Runs the suite's workloads (see suite.py) against the Twisted relay and the
+asyncio one (see relayserver.aio), with the same host-process, and prints
+their results side by side.
+
+The asyncio relay needs Python 3 (and protobuf modules generated for it), so
+it's run with its own interpreter, and, if need be, from its own tree. The
+Twisted relay and the host-process are run with this interpreter, from this
+tree.
+"""
+
+import sys
+
+from argparse import ArgumentParser, Namespace
+
+from suite import run_churn, run_streams
+
+def _run_core(args, relay_python, relay_root, relay_args, base_port):
+    suite_args = Namespace(clients=args.clients,
+                           num_connections=args.num_connections,
+                           seconds=args.seconds,
+                           churn_rate=0,
+                           churn_payload_size=64,
+                           streams=args.streams,
+                           relay_args=relay_args,
+                           hp_args=[],
+                           relay_python=relay_python,
+                           relay_root=relay_root)
+
+    results = { }
+
+    sys.stderr.write("Running [churn].\n")
+    results['churn'] = run_churn(suite_args, base_port)
+
+    for (i, payload_size) in enumerate(args.payload_sizes):
+        name = 'streams-%d' % (payload_size)
+
+        sys.stderr.write("Running [%s].\n" % (name))
+        results[name] = run_streams(suite_args,
+                                    base_port + (i + 1) * 3,
+                                    payload_size)
+
+    return results
+
+def main():
+    parser = ArgumentParser(description="Compare the Twisted and asyncio "
+                                        "relay cores.")
+
+    parser.add_argument('--asyncio-python',
+                        default='python3',
+                        help="Interpreter to run the asyncio relay with.")
+
+    parser.add_argument('--asyncio-root',
+                        help="Tree to run the asyncio relay from (see "
+                             "suite.py's --relay-root). Defaults to this "
+                             "one.")
+
+    parser.add_argument('--uvloop',
+                        action='store_true',
+                        help="Also run the asyncio relay on uvloop.")
+
+    parser.add_argument('-c', '--clients',
+                        default=4,
+                        type=int,
+                        help="Concurrent client processes.")
+
+    parser.add_argument('-n', '--num-connections',
+                        default=20,
+                        type=int,
+                        help="Host-process connections in the (fixed) pool, "
+                             "beyond one for each stream.")
+
+    parser.add_argument('-s', '--seconds',
+                        default=5,
+                        type=int,
+                        help="How long to drive each workload.")
+
+    parser.add_argument('--streams',
+                        default=100,
+                        type=int,
+                        help="Concurrent long-lived streams, across clients.")
+
+    parser.add_argument('--payload-size',
+                        dest='payload_sizes',
+                        action='append',
+                        type=int,
+                        help="Bytes per round-trip, for streams (may be "
+                             "repeated). Defaults to 64 and 65536.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=20900,
+                        type=int,
+                        help="First of the consecutive ports to use.")
+
+    args = parser.parse_args()
+
+    args.payload_sizes = args.payload_sizes or [64, 65536]
+
+    cores = [('twisted', None, None, []),
+             ('asyncio',
+              args.asyncio_python,
+              args.asyncio_root,
+              ['--core', 'asyncio'])]
+
+    if args.uvloop is True:
+        cores.append(('uvloop',
+                      args.asyncio_python,
+                      args.asyncio_root,
+                      ['--core', 'asyncio', '--uvloop']))
+
+    # Each core uses the next set of ports.
+    ports_per_core = (len(args.payload_sizes) + 1) * 3
+
+    results = []
+    for (i, (name, relay_python, relay_root, relay_args)) in enumerate(cores):
+        sys.stderr.write("Running the [%s] relay.\n" % (name))
+
+        results.append(_run_core(args,
+                                 relay_python,
+                                 relay_root,
+                                 relay_args,
+                                 args.base_port + i * ports_per_core))
+
+    header = "%-14s %-24s" % ('WORKLOAD', 'RESULT') + \
+             ''.join(" %12s" % (name.upper()) for (name, p, r, a) in cores)
+
+    print(header)
+
+    for workload in sorted(results[0]):
+        for result_name in sorted(results[0][workload]):
+            line = "%-14s %-24s" % (workload, result_name) + \
+                   ''.join(" %12.2f" % (core_results[workload][result_name])
+                           for core_results
+                           in results)
+
+            print(line)
+
+if __name__ == '__main__':
+    main()
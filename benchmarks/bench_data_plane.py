@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+"""Measure relay throughput and CPU for each data-plane mode. For every mode, 
+a relay is started as a subprocess on loopback. This script then plays the 
+host-process (it says hello on N data connections, and sinks whatever arrives) 
+and N clients, each of which pushes a fixed amount of data through the relay.
+"""
+
+import time
+
+from argparse import ArgumentParser
+from threading import Thread
+
+from loopback import start_relay, connect, say_hello, get_cpu_seconds
+
+def _sink(s, counts, i):
+    while 1:
+        data = s.recv(262144)
+        if not data:
+            break
+
+        counts[i] += len(data)
+
+def _source(port, num_bytes):
+    s = connect(port)
+    block = b'x' * 65536
+
+    sent = 0
+    while sent < num_bytes:
+        s.sendall(block)
+        sent += len(block)
+
+    return s
+
+def _run_mode(mode, base_port, num_pairs, num_bytes):
+    (dport, cport, tport) = (base_port, base_port + 1, base_port + 2)
+
+    relay = start_relay(base_port, '-p', mode)
+
+    try:
+        command = connect(cport)
+        hps = [say_hello(dport) for i in range(num_pairs)]
+
+        counts = [0] * num_pairs
+        sinks = [Thread(target=_sink, args=(s, counts, i)) 
+                 for (i, s) 
+                 in enumerate(hps)]
+
+        for thread in sinks:
+            thread.daemon = True
+            thread.start()
+
+        cpu_start = get_cpu_seconds(relay.pid)
+        start = time.time()
+
+        clients = []
+        sources = [Thread(target=lambda: clients.append(_source(tport, 
+                                                                num_bytes))) 
+                   for i in range(num_pairs)]
+
+        for thread in sources:
+            thread.start()
+
+        for thread in sources:
+            thread.join()
+
+        expected = num_pairs * (num_bytes + (-num_bytes % 65536))
+        while sum(counts) < expected:
+            time.sleep(.01)
+
+        elapsed = time.time() - start
+        cpu = get_cpu_seconds(relay.pid) - cpu_start
+
+        for s in clients + hps + [command]:
+            s.close()
+    finally:
+        relay.terminate()
+        relay.wait()
+
+    return (float(expected) / 1024 / 1024 / elapsed, cpu / num_pairs)
+
+def main():
+    parser = ArgumentParser(description="Benchmark the relay data-planes.")
+
+    parser.add_argument('-n', '--num-pairs', 
+                        default=8, 
+                        type=int, 
+                        help="Concurrent client/host-process pairs.")
+
+    parser.add_argument('-m', '--megabytes', 
+                        default=64, 
+                        type=int, 
+                        help="Megabytes sent by each client.")
+
+    parser.add_argument('-b', '--base-port', 
+                        default=19000, 
+                        type=int, 
+                        help="First of three consecutive ports to use.")
+
+    parser.add_argument('modes', 
+                        nargs='*', 
+                        default=['twisted', 'splice'], 
+                        help="Data-plane modes to measure.")
+
+    args = parser.parse_args()
+
+    print("%-10s %12s %20s" % ('MODE', 'MB/S', 'CPU-SEC/CONNECTION'))
+
+    for (i, mode) in enumerate(args.modes):
+        (rate, cpu) = _run_mode(mode, 
+                                args.base_port + i * 3, 
+                                args.num_pairs, 
+                                args.megabytes * 1024 * 1024)
+
+        print("%-10s %12.1f %20.4f" % (mode, rate, cpu))
+
+if __name__ == '__main__':
+    main()
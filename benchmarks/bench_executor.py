@@ -0,0 +1,218 @@
+#!/usr/bin/python
+
+"""Runs the CPU-bound example server (relayserver.real.digest_server) for many
+sessions at once, in-process, on the reactor (as the host-process calls a
+real-server), and off it, on a pool of threads and on a pool of processes of
+each of the given sizes (see relayserver.real.executor).
+
+Each session is fed its requests (lines) a few at a time, once per reactor
+iteration, unless it has been paused, until every reply has come back. The
+requests served per second, the longest that the reactor was held up for (a
+timer is scheduled every 10ms, and the lateness of each is measured), and the
+number of times that a session was paused are reported.
+"""
+
+from argparse import ArgumentParser
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks
+
+from relayserver.real.digest_server import DigestServer
+from relayserver.real.executor import off_reactor, ThreadExecutor, \
+                                      ProcessExecutor
+
+from loopback import get_percentile
+
+_TICK_SECONDS = .01
+
+
+class _Connection(object):
+    """Stands in for the host-process connection, and its transport."""
+
+    def __init__(self, requests):
+        self.__requests = requests
+
+        self.replied_count = 0
+        self.paused = False
+        self.pause_count = 0
+
+    @property
+    def transport(self):
+        return self
+
+    @property
+    def remaining(self):
+        return len(self.__requests)
+
+    def take(self, count):
+        taken = self.__requests[:count]
+        self.__requests = self.__requests[count:]
+
+        return b''.join(taken)
+
+    def write(self, data):
+        self.replied_count += data.count(b'\n')
+
+    def writeSequence(self, data):
+        for chunk in data:
+            self.write(chunk)
+
+    def pauseProducing(self):
+        self.paused = True
+        self.pause_count += 1
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class _Ticker(object):
+    """Measures how late the reactor runs a timer."""
+
+    def __init__(self):
+        self.lateness = []
+        self.__call = None
+
+    def start(self):
+        self.__schedule()
+
+    def stop(self):
+        self.__call.cancel()
+
+    def __schedule(self):
+        self.__call = reactor.callLater(_TICK_SECONDS,
+                                        self.__tick,
+                                        time() + _TICK_SECONDS)
+
+    def __tick(self, due_at):
+        self.lateness.append(time() - due_at)
+        self.__schedule()
+
+
+def _run(create_server, args):
+    """Feed every session, and fire with the results once every reply has
+    come back.
+    """
+
+    connections = []
+    servers = []
+    for i in range(args.sessions):
+        requests = [b'session-%d-request-%d\n' % (i, j)
+                    for j
+                    in range(args.requests)]
+
+        connection = _Connection(requests)
+
+        connections.append(connection)
+        servers.append(create_server(connection))
+
+    expected = args.sessions * args.requests
+
+    ticker = _Ticker()
+    ticker.start()
+
+    finished = Deferred()
+    started_at = time()
+
+    def feed():
+        for (connection, server) in zip(connections, servers):
+            if connection.paused is False and connection.remaining > 0:
+                server.receive_data(connection.take(args.chunk))
+
+        if sum(c.replied_count for c in connections) < expected:
+            reactor.callLater(0, feed)
+            return
+
+        seconds = time() - started_at
+        ticker.stop()
+
+        for server in servers:
+            server.shutdown()
+
+        finished.callback((expected / seconds,
+                           max(ticker.lateness or [0]),
+                           get_percentile(ticker.lateness, .99),
+                           sum(c.pause_count for c in connections)))
+
+    reactor.callLater(0, feed)
+    return finished
+
+def main():
+    parser = ArgumentParser(description="Run a CPU-bound real-server on and "
+                                        "off the reactor.")
+
+    parser.add_argument('-s', '--sessions',
+                        default=16,
+                        type=int,
+                        help="Sessions at once.")
+
+    parser.add_argument('-n', '--requests',
+                        default=25,
+                        type=int,
+                        help="Requests for each session.")
+
+    parser.add_argument('-c', '--chunk',
+                        default=4,
+                        type=int,
+                        help="Requests fed to a session at a time.")
+
+    parser.add_argument('-r', '--rounds',
+                        default=2000,
+                        type=int,
+                        help="PBKDF2 rounds for each request.")
+
+    parser.add_argument('--high-watermark',
+                        default=256,
+                        type=int,
+                        help="Unprocessed bytes for a session before it's "
+                             "paused.")
+
+    parser.add_argument('sizes',
+                        nargs='*',
+                        default=[1, 2, 4],
+                        type=int,
+                        help="The pool sizes to run with.")
+
+    args = parser.parse_args()
+
+    # The pool processes are forked with the rounds, before the reactor has
+    # started.
+    DigestServer.ROUNDS = args.rounds
+
+    runs = [('inline', 0, DigestServer)]
+    for (name, executor_class) in (('threads', ThreadExecutor),
+                                   ('processes', ProcessExecutor)):
+        for size in args.sizes:
+            create_server = off_reactor(DigestServer,
+                                        executor_class(size),
+                                        args.high_watermark,
+                                        args.high_watermark // 4)
+
+            runs.append((name, size, create_server))
+
+    print("%-10s %8s %10s %12s %12s %8s" %
+          ('MODE', 'WORKERS', 'REQ/S', 'MAX-LAG-MS', 'P99-LAG-MS',
+           'PAUSES'))
+
+    @inlineCallbacks
+    def run_all():
+        try:
+            for (name, size, create_server) in runs:
+                (rate, max_lag, p99_lag, pause_count) = \
+                    yield _run(create_server, args)
+
+                print("%-10s %8d %10.1f %12.1f %12.1f %8d" %
+                      (name,
+                       size,
+                       rate,
+                       max_lag * 1000,
+                       p99_lag * 1000,
+                       pause_count))
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(run_all)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
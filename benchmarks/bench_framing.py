@@ -0,0 +1,114 @@
+#!/usr/bin/python
+
+"""Compare the throughput of the original extent-list ReadBuffer with the
+FrameBuffer framing engine. A stream of length-prefixed frames is cut into
+fixed-size chunks (the way it would come off of a socket) and pushed through
+each implementation, draining every complete frame after each chunk.
+"""
+
+from argparse import ArgumentParser
+from struct import pack
+from time import time
+
+from relayserver.read_buffer import ReadBuffer
+from relayserver.frame_buffer import FrameBuffer
+
+_FRAME_SIZES = ((1024, '1 KB'), 
+                (65536, '64 KB'), 
+                (4 * 1024 * 1024, '4 MB'))
+
+def _build_chunks(frame_size, total_bytes, chunk_size):
+    frame = pack('>I', frame_size) + (b'x' * frame_size)
+    num_frames = max(1, total_bytes // len(frame))
+    stream = frame * num_frames
+
+    chunks = [stream[i:i + chunk_size] 
+              for i 
+              in range(0, len(stream), chunk_size)]
+
+    return (chunks, num_frames, len(stream))
+
+def _run_read_buffer(chunks):
+    buffer_ = ReadBuffer()
+    count = 0
+
+    for chunk in chunks:
+        buffer_.push(chunk)
+
+        while 1:
+            message = buffer_.read_message()
+            if message is None:
+                break
+
+            count += 1
+
+    return count
+
+def _run_frame_buffer(chunks):
+    buffer_ = FrameBuffer()
+    count = 0
+
+    for chunk in chunks:
+        buffer_.push(chunk)
+
+        for message in buffer_.read_messages():
+            count += 1
+
+    return count
+
+def _measure(runner, chunks, expected_frames, repeat):
+    best = None
+    for i in range(repeat):
+        start = time()
+        count = runner(chunks)
+        elapsed = time() - start
+
+        if count != expected_frames:
+            raise Exception("Expected (%d) frames but read (%d)." % 
+                            (expected_frames, count))
+
+        if best is None or elapsed < best:
+            best = elapsed
+
+    return best
+
+def main():
+    parser = ArgumentParser(description="Benchmark the framing engines.")
+
+    parser.add_argument('-t', '--total-mb', 
+                        default=32, 
+                        type=int, 
+                        help="Megabytes of framed data to push per run.")
+
+    parser.add_argument('-c', '--chunk-size', 
+                        default=65536, 
+                        type=int, 
+                        help="Size of each pushed chunk.")
+
+    parser.add_argument('-r', '--repeat', 
+                        default=3, 
+                        type=int, 
+                        help="Runs per measurement (the best is reported).")
+
+    args = parser.parse_args()
+
+    total_bytes = args.total_mb * 1024 * 1024
+
+    print("%-8s %-12s %10s %12s %12s" % 
+          ('FRAME', 'ENGINE', 'FRAMES', 'SECONDS', 'MB/S'))
+
+    for (frame_size, label) in _FRAME_SIZES:
+        (chunks, num_frames, num_bytes) = _build_chunks(frame_size, 
+                                                        total_bytes, 
+                                                        args.chunk_size)
+
+        for (name, runner) in (('ReadBuffer', _run_read_buffer), 
+                               ('FrameBuffer', _run_frame_buffer)):
+            elapsed = _measure(runner, chunks, num_frames, args.repeat)
+            rate = (float(num_bytes) / 1024 / 1024) / elapsed
+
+            print("%-8s %-12s %10d %12.4f %12.1f" % 
+                  (label, name, num_frames, elapsed, rate))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+"""Measures the cost of the host-process's handshake buffer (see
+EndpointBaseProtocol) against the payload, for the original buffer, which
+appended each chunk to a string and re-sliced it, and the current one. The
+data is pushed in chunks of the given size, as it would be received, until
+the initial message is complete, and whatever is left over is then taken:
+
+    early      A hello-response, followed by the payload (a client's data,
+               sent right behind it).
+    split      An initial message that is as big as the payload, so that
+               every chunk is pushed before it's complete.
+
+The time per megabyte of payload is reported for each payload size. If the
+cost is linear in the payload, it stays flat as the payload grows.
+"""
+
+import time
+
+from argparse import ArgumentParser
+from struct import pack, unpack
+
+from relayserver.endpoint import EndpointBaseProtocol
+from relayserver.message_types import build_msg_data_hphelloresponse
+
+
+class _ConcatenatingEndpoint(object):
+    """The original buffer."""
+
+    def __init__(self):
+        self.__buffer = b''
+
+    def push_data(self, data):
+        self.__buffer += data
+
+    def get_and_clear_chunks(self):
+        buffer_ = self.__buffer
+        self.__buffer = b''
+
+        return [buffer_]
+
+    def get_initial_message(self):
+        current_bytes = len(self.__buffer)
+        if current_bytes < 4:
+            return None
+
+        (length,) = unpack('>I', self.__buffer[0:4])
+        if current_bytes < (4 + length):
+            return None
+
+        message = self.__buffer[4:(4 + length)]
+        self.__buffer = self.__buffer[(4 + length):]
+
+        return message
+
+def _get_chunks(scenario, payload_size, chunk_size):
+    if scenario == 'early':
+        response = build_msg_data_hphelloresponse(1, 'localhost', 8002).\
+                    SerializeToString()
+
+        stream = pack('>I', len(response)) + response + b'x' * payload_size
+    else:
+        stream = pack('>I', payload_size) + b'x' * payload_size
+
+    return [stream[i:i + chunk_size]
+            for i
+            in range(0, len(stream), chunk_size)]
+
+def _handshake(endpoint, chunks):
+    """Push chunks until the initial message is complete. Returns the bytes
+    left over (including any chunks that weren't pushed).
+    """
+
+    for (i, chunk) in enumerate(chunks):
+        endpoint.push_data(chunk)
+
+        if endpoint.get_initial_message() is not None:
+            remaining = endpoint.get_and_clear_chunks() + chunks[i + 1:]
+            return sum(len(chunk) for chunk in remaining)
+
+    raise Exception("The initial message was never completed.")
+
+def main():
+    parser = ArgumentParser(description="Measure the handshake buffer's cost "
+                                        "against the payload.")
+
+    parser.add_argument('-c', '--chunk-size',
+                        default=65536,
+                        type=int,
+                        help="Bytes per chunk received.")
+
+    parser.add_argument('-r', '--repeat',
+                        default=3,
+                        type=int,
+                        help="Runs of each (the fastest is reported).")
+
+    parser.add_argument('sizes',
+                        nargs='*',
+                        default=[1, 4, 16],
+                        type=int,
+                        help="Payload sizes, in megabytes.")
+
+    args = parser.parse_args()
+
+    print("%-10s %-14s %10s %12s" % ('SCENARIO', 'BUFFER', 'MB', 'MSEC/MB'))
+
+    for scenario in ('early', 'split'):
+        for (name, endpoint_class) in \
+                (('concatenating', _ConcatenatingEndpoint),
+                 ('current', EndpointBaseProtocol)):
+            for megabytes in args.sizes:
+                chunks = _get_chunks(scenario,
+                                     megabytes * 1048576,
+                                     args.chunk_size)
+
+                best = None
+                for i in range(args.repeat):
+                    started_at = time.time()
+                    _handshake(endpoint_class(), chunks)
+                    elapsed = time.time() - started_at
+
+                    best = elapsed if best is None else min(best, elapsed)
+
+                print("%-10s %-14s %10d %12.3f" %
+                      (scenario, name, megabytes, best * 1000 / megabytes))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/python
+
+"""CPU cost of logging, for short-lived clients. For each logging
+configuration, a relay and a host-process (running the configured real-server,
+which should be the echo server) are started on loopback with it, and several
+client processes connect, send a small payload, wait for it to come back, and
+disconnect, for a fixed period. The CPU time used by the relay and the
+host-process, per thousand sessions, is reported.
+
+"eager" logs every event, unsampled, to Twisted's log (which nothing observes),
+which is what every event cost before the events were categorized: the
+formatting alone. "eager-file" writes them all to a file. "default" uses the
+default levels and sampling, and writes to a file.
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from loopback import start_relay, start_host_process, connect, \
+                     get_cpu_seconds
+
+_PAYLOAD = b'ping'
+
+_EAGER_ARGS = ('--log-level', 'debug', '--log-sample-rate', '0')
+
+def _drive(args):
+    (port, seconds) = args
+
+    completed = 0
+
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        s = socket.create_connection(('127.0.0.1', port))
+        s.settimeout(30)
+
+        try:
+            s.sendall(_PAYLOAD)
+
+            received = b''
+            while len(received) < len(_PAYLOAD):
+                data = s.recv(len(_PAYLOAD) - len(received))
+                if not data:
+                    break
+
+                received += data
+        except socket.error:
+            received = b''
+        finally:
+            s.close()
+
+        if received == _PAYLOAD:
+            completed += 1
+
+    return completed
+
+def _run(log_args, directory, base_port, num_connections, num_clients, 
+         seconds):
+    relay_args = log_args
+    hp_args = log_args
+    if directory is not None:
+        relay_args += ('--log-file', os.path.join(directory, 'relay.log'))
+        hp_args += ('--log-file', os.path.join(directory, 'hp.log'))
+
+    relay = start_relay(base_port, '--pending-timeout', '30', *relay_args)
+    connect(base_port + 1).close()
+
+    host_process = start_host_process(base_port,
+                                      num_connections,
+                                      '--min-connections',
+                                      str(num_connections),
+                                      '--max-connections',
+                                      str(num_connections),
+                                      *hp_args)
+
+    try:
+        # Let the host-process fill its pool.
+        time.sleep(3)
+
+        relay_cpu = get_cpu_seconds(relay.pid)
+        hp_cpu = get_cpu_seconds(host_process.pid)
+
+        pool = Pool(num_clients)
+        try:
+            completed = sum(pool.map(_drive,
+                                     [(base_port + 2, seconds)] * num_clients))
+        finally:
+            pool.close()
+            pool.join()
+
+        relay_cpu = get_cpu_seconds(relay.pid) - relay_cpu
+        hp_cpu = get_cpu_seconds(host_process.pid) - hp_cpu
+    finally:
+        host_process.terminate()
+        host_process.wait()
+
+        relay.terminate()
+        relay.wait()
+
+    return (completed,
+            relay_cpu * 1000 / completed,
+            hp_cpu * 1000 / completed)
+
+def main():
+    parser = ArgumentParser(description="Benchmark the CPU cost of logging.")
+
+    parser.add_argument('-c', '--clients',
+                        default=4,
+                        type=int,
+                        help="Concurrent client processes.")
+
+    parser.add_argument('-n', '--num-connections',
+                        default=10,
+                        type=int,
+                        help="Host-process connections in the (fixed) pool.")
+
+    parser.add_argument('-s', '--seconds',
+                        default=10,
+                        type=int,
+                        help="How long to drive each configuration.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=19800,
+                        type=int,
+                        help="First of three consecutive ports to use.")
+
+    args = parser.parse_args()
+
+    configurations = (('eager', _EAGER_ARGS, False),
+                      ('eager-file', _EAGER_ARGS, True),
+                      ('default', (), True))
+
+    print("%-12s %10s %16s %16s" %
+          ('LOGGING', 'SESSIONS', 'RELAY-CPU-S/1K', 'HP-CPU-S/1K'))
+
+    for (i, (name, log_args, to_file)) in enumerate(configurations):
+        directory = tempfile.mkdtemp() if to_file is True else None
+
+        (completed, relay_cpu, hp_cpu) = _run(log_args,
+                                              directory,
+                                              args.base_port + i * 3,
+                                              args.num_connections,
+                                              args.clients,
+                                              args.seconds)
+
+        print("%-12s %10d %16.3f %16.3f" %
+              (name, completed, relay_cpu, hp_cpu))
+
+        if directory is not None:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+"""Drives a relay that several host-processes are connected to, and checks
+that each is told about the clients assigned to its own connections.
+
+The benchmark plays the host-processes itself, with plain sockets. Each opens
+a command-channel and says hello on it with its ID, and then opens its data
+connections, which give the same ID. Client threads then connect, make one
+round trip (the host-processes echo whatever arrives on a data connection),
+and disconnect, until every data connection has served a client. For each
+host-process, the assignments that were announced to it for its own
+connections, those that were announced to it for another's (misrouted), and
+the clients that it served are reported.
+"""
+
+import select
+import socket
+import threading
+import time
+
+from argparse import ArgumentParser
+from struct import pack, unpack
+
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types import build_msg_cmd_hello
+
+from loopback import start_relay, connect, greet, recv_exactly
+
+_PAYLOAD = b'0123456789abcdef' * 64
+
+
+class _HostProcess(object):
+    def __init__(self, host_process_id, base_port, num_connections):
+        self.host_process_id = host_process_id
+
+        self.command_channel = connect(base_port + 1)
+
+        hello = build_msg_cmd_hello(host_process_id).SerializeToString()
+        self.command_channel.sendall(pack('>I', len(hello)) + hello)
+
+        self.__received = b''
+
+        # Session-ID => socket, for the connections that are still open.
+        self.connections = {}
+        for i in range(num_connections):
+            (s, session_id) = greet(base_port, host_process_id)
+            self.connections[session_id] = s
+
+        self.__session_ids = set(self.connections)
+        self.__served = set()
+
+        self.assigned_count = 0
+        self.misrouted_count = 0
+
+    @property
+    def served_count(self):
+        return len(self.__served)
+
+    def handle_commands(self):
+        data = self.command_channel.recv(65536)
+        if not data:
+            raise Exception("The command-channel was dropped.")
+
+        self.__received += data
+
+        while len(self.__received) >= 4:
+            (length,) = unpack('>I', self.__received[:4])
+            if len(self.__received) < 4 + length:
+                break
+
+            command = Command()
+            command.ParseFromString(self.__received[4:4 + length])
+
+            self.__received = self.__received[4 + length:]
+
+            if command.message_type == Command.CONNECTION_OPEN:
+                opened = [command.open_properties.assigned_to_session]
+            elif command.message_type == Command.BATCH:
+                opened = command.batch.opened_sessions
+            else:
+                continue
+
+            for session_id in opened:
+                if session_id in self.__session_ids:
+                    self.assigned_count += 1
+                else:
+                    self.misrouted_count += 1
+
+    def handle_data(self, session_id):
+        s = self.connections[session_id]
+
+        try:
+            data = s.recv(65536)
+        except socket.error:
+            data = b''
+
+        if not data:
+            # The relay drops the connection once its client has gone.
+            del self.connections[session_id]
+            s.close()
+            return
+
+        self.__served.add(session_id)
+        s.sendall(data)
+
+
+def _serve(host_processes, stopped):
+    """Echo on every data connection, and read every command-channel, until
+    stopped.
+    """
+
+    while stopped.is_set() is False:
+        readers = {}
+        for host_process in host_processes:
+            readers[host_process.command_channel] = (host_process, None)
+
+            for (session_id, s) in host_process.connections.items():
+                readers[s] = (host_process, session_id)
+
+        (readable, writable, failed) = select.select(list(readers), [], [], .1)
+
+        for s in readable:
+            (host_process, session_id) = readers[s]
+
+            if session_id is None:
+                host_process.handle_commands()
+            else:
+                host_process.handle_data(session_id)
+
+def _run_clients(port, num_clients, num_threads):
+    """Make num_clients round trips, each on a connection of its own. Returns
+    the number that failed.
+    """
+
+    locker = threading.Lock()
+    counts = { 'remaining': num_clients, 'failed': 0 }
+
+    def run():
+        while 1:
+            with locker:
+                if counts['remaining'] == 0:
+                    return
+
+                counts['remaining'] -= 1
+
+            try:
+                s = socket.create_connection(('127.0.0.1', port))
+                s.settimeout(10)
+
+                try:
+                    s.sendall(_PAYLOAD)
+                    recv_exactly(s, len(_PAYLOAD))
+                finally:
+                    s.close()
+            except Exception:
+                with locker:
+                    counts['failed'] += 1
+
+    threads = [threading.Thread(target=run) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    return counts['failed']
+
+def main():
+    parser = ArgumentParser(description="Check that the relay announces each "
+                                        "host-process's assignments to its "
+                                        "own command-channel.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=19600,
+                        type=int,
+                        help="First of three consecutive ports to use.")
+
+    parser.add_argument('-k', '--host-processes',
+                        default=4,
+                        type=int,
+                        help="Host-processes.")
+
+    parser.add_argument('-n', '--connections',
+                        default=50,
+                        type=int,
+                        help="Data connections for each host-process.")
+
+    parser.add_argument('-c', '--client-threads',
+                        default=20,
+                        type=int,
+                        help="Clients making round trips at once.")
+
+    parser.add_argument('-p', '--selection-policy',
+                        default='least-loaded',
+                        help="The relay's --selection-policy.")
+
+    parser.add_argument('--root',
+                        help="Run the relay from this tree (the directory "
+                             "that holds the relayserver package), to "
+                             "compare against it.")
+
+    args = parser.parse_args()
+
+    relay = start_relay(args.base_port,
+                        '--selection-policy', args.selection_policy,
+                        root=args.root)
+
+    stopped = threading.Event()
+    server = None
+
+    try:
+        connect(args.base_port + 1).close()
+
+        host_processes = [_HostProcess('hp-%d' % (i),
+                                       args.base_port,
+                                       args.connections)
+                          for i in range(args.host_processes)]
+
+        server = threading.Thread(target=_serve,
+                                  args=(host_processes, stopped))
+        server.start()
+
+        # Let the relay take the connections' hellos.
+        time.sleep(1)
+
+        start = time.time()
+        failed = _run_clients(args.base_port + 2,
+                              args.host_processes * args.connections,
+                              args.client_threads)
+        seconds = time.time() - start
+
+        # Let the last announcements arrive.
+        time.sleep(.5)
+    finally:
+        stopped.set()
+        if server is not None:
+            server.join()
+
+        relay.terminate()
+        relay.wait()
+
+    print("%-8s %12s %10s %10s %8s" %
+          ('HP', 'CONNECTIONS', 'ASSIGNED', 'MISROUTED', 'SERVED'))
+
+    for host_process in host_processes:
+        print("%-8s %12d %10d %10d %8d" %
+              (host_process.host_process_id,
+               args.connections,
+               host_process.assigned_count,
+               host_process.misrouted_count,
+               host_process.served_count))
+
+    print("")
+    print("(%d) clients in (%.2f) seconds, (%d) failed." %
+          (args.host_processes * args.connections, seconds, failed))
+
+if __name__ == '__main__':
+    main()
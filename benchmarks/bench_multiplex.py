@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+"""Resource and latency benchmark for many concurrent clients, with one
+host-process connection per client and with the clients multiplexed over a
+few connections. For each, a relay and a host-process (running the configured
+real-server, which should be the echo server) are started on loopback, and the
+clients all connect and stay connected. Each client then sends a small
+payload and waits for it to come back, in turn, for several rounds. The file
+descriptors and resident memory of the relay and the host-process, and the
+round-trip latency, are reported.
+"""
+
+import os
+import socket
+import time
+
+from argparse import ArgumentParser
+
+from loopback import start_relay, start_host_process, connect, \
+                     recv_exactly, get_rss_bytes, get_percentile
+
+_PAYLOAD = b'ping'
+
+def _count_fds(pid):
+    return len(os.listdir('/proc/%d/fd' % (pid)))
+
+def _run(base_port, num_clients, num_connections, rounds, multiplex):
+    relay = start_relay(base_port, '--pending-timeout', '30')
+    connect(base_port + 1).close()
+
+    if multiplex is True:
+        host_process = start_host_process(base_port,
+                                          num_connections,
+                                          '--multiplex')
+    else:
+        # One connection per client, and no more.
+        host_process = start_host_process(base_port,
+                                          num_clients,
+                                          '--min-connections',
+                                          str(num_clients),
+                                          '--max-connections',
+                                          str(num_clients))
+
+    clients = []
+    latencies = []
+
+    try:
+        # Let the host-process fill its pool.
+        time.sleep(3)
+
+        for i in range(num_clients):
+            s = socket.create_connection(('127.0.0.1', base_port + 2))
+            s.settimeout(30)
+
+            clients.append(s)
+
+        for i in range(rounds):
+            for s in clients:
+                start = time.time()
+
+                s.sendall(_PAYLOAD)
+                recv_exactly(s, len(_PAYLOAD))
+
+                latencies.append(time.time() - start)
+
+        result = (_count_fds(relay.pid),
+                  get_rss_bytes(relay.pid),
+                  _count_fds(host_process.pid),
+                  get_rss_bytes(host_process.pid),
+                  get_percentile(latencies, .5),
+                  get_percentile(latencies, .99))
+    finally:
+        for s in clients:
+            s.close()
+
+        host_process.terminate()
+        host_process.wait()
+
+        relay.terminate()
+        relay.wait()
+
+    return result
+
+def main():
+    parser = ArgumentParser(description="Benchmark the descriptors, memory, "
+                                        "and latency of many concurrent "
+                                        "clients, with and without "
+                                        "multiplexing.")
+
+    parser.add_argument('-c', '--clients',
+                        default=200,
+                        type=int,
+                        help="Concurrent clients.")
+
+    parser.add_argument('-n', '--num-connections',
+                        default=4,
+                        type=int,
+                        help="Host-process connections when multiplexing.")
+
+    parser.add_argument('-r', '--rounds',
+                        default=10,
+                        type=int,
+                        help="Round-trips per client.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=19700,
+                        type=int,
+                        help="First of three consecutive ports to use.")
+
+    args = parser.parse_args()
+
+    print("%-10s %9s %9s %9s %9s %8s %8s" %
+          ('MODE', 'RELAY-FDS', 'RELAY-MB', 'HP-FDS', 'HP-MB', 'P50-MS',
+           'P99-MS'))
+
+    modes = (('1:1', False),
+             ('multiplex', True))
+
+    for (i, (name, multiplex)) in enumerate(modes):
+        (relay_fds, relay_rss, hp_fds, hp_rss, p50, p99) = \
+            _run(args.base_port + i * 3,
+                 args.clients,
+                 args.num_connections,
+                 args.rounds,
+                 multiplex)
+
+        print("%-10s %9d %9.1f %9d %9.1f %8.2f %8.2f" %
+              (name, relay_fds, relay_rss / 1048576.0, hp_fds,
+               hp_rss / 1048576.0, p50 * 1000, p99 * 1000))
+
+if __name__ == '__main__':
+    main()
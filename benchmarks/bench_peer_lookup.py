@@ -0,0 +1,91 @@
+#!/usr/bin/python
+
+"""Compare the per-chunk cost of finding the peer of an assigned connection 
+through the assignment manager (a lock and a dictionary lookup, as it was 
+done before pairs were bound to each other) against the bound attribute. The 
+real assignment manager is populated with N pairs over fake transports.
+"""
+
+from argparse import ArgumentParser
+from random import shuffle
+from time import time
+
+from twisted.test.proto_helpers import StringTransport
+
+from relayserver import main as relay
+
+class _Transport(StringTransport):
+    def __init__(self, sessionno):
+        StringTransport.__init__(self)
+        self.sessionno = sessionno
+
+    def write(self, data):
+        pass
+
+    def setTcpNoDelay(self, enabled):
+        pass
+
+def _build_pairs(num_pairs):
+    command_channel = relay.CommandServer()
+    command_channel.makeConnection(_Transport(0))
+
+    hps = []
+    for i in range(num_pairs):
+        hp = relay.HostProcessServer()
+        hp.makeConnection(_Transport(1 + i))
+        relay._assignments.queue_new_hp(hp)
+        hps.append(hp)
+
+    clients = []
+    for i in range(num_pairs):
+        client = relay.TrivialClientServer()
+        client.makeConnection(_Transport(1 + num_pairs + i))
+        clients.append(client)
+
+    return clients
+
+def _by_lookup(clients, chunk):
+    for client in clients:
+        relay._assignments.get_assigned_hp(client.session_id).transport.\
+            write(chunk)
+
+def _by_peer(clients, chunk):
+    for client in clients:
+        client.peer.transport.write(chunk)
+
+def main():
+    parser = ArgumentParser(description="Benchmark peer lookups.")
+
+    parser.add_argument('-n', '--num-pairs', 
+                        default=10000, 
+                        type=int, 
+                        help="Concurrent assigned pairs.")
+
+    parser.add_argument('-r', '--rounds', 
+                        default=50, 
+                        type=int, 
+                        help="Chunks relayed per pair.")
+
+    args = parser.parse_args()
+
+    clients = _build_pairs(args.num_pairs)
+
+    # Chunks arrive on random connections.
+    shuffle(clients)
+
+    chunk = b'x' * 1024
+    chunks = args.num_pairs * args.rounds
+
+    print("%-10s %16s" % ('PATH', 'USEC/CHUNK'))
+
+    for (name, runner) in (('lookup', _by_lookup), ('peer', _by_peer)):
+        start = time()
+        for i in range(args.rounds):
+            runner(clients, chunk)
+
+        elapsed = time() - start
+
+        print("%-10s %16.3f" % (name, elapsed * 1000000 / chunks))
+
+if __name__ == '__main__':
+    main()
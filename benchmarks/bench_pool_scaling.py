@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+"""Simulated traffic against a fixed and an adaptive host-process pool. For
+each, a relay (which turns clients away as soon as it has no host-process
+connection waiting) and a host-process running the echo server are started on
+loopback. Clients then arrive at a steady, quiet rate, then in a burst, then
+quietly again. Each one sends a small payload, waits for it to come back, holds
+its connection for a while, and disconnects. The clients that were turned away
+and the number of host-process connections (the peak and at the end) are
+reported.
+"""
+
+import socket
+import threading
+import time
+
+from argparse import ArgumentParser
+
+from loopback import start_relay, start_host_process, connect
+
+_PAYLOAD = b'ping'
+
+# (seconds, arrivals per second, seconds that each client stays connected)
+_PHASES = ((3, 2, .5),
+           (6, 30, 1),
+           (8, 2, .5))
+
+_POOLS = (('fixed', ('--min-connections', '10', '--max-connections', '10')),
+          ('adaptive', ('--min-connections', '2',
+                        '--max-connections', '200',
+                        '--target-idle', '5')))
+
+def _count_connections(port):
+    """Count the established connections accepted on the given port."""
+
+    count = 0
+    for filename in ('/proc/net/tcp', '/proc/net/tcp6'):
+        try:
+            with open(filename) as f:
+                rows = f.readlines()[1:]
+        except IOError:
+            continue
+
+        for row in rows:
+            fields = row.split()
+            local_port = int(fields[1].rsplit(':', 1)[1], 16)
+
+            if local_port == port and fields[3] == '01':
+                count += 1
+
+    return count
+
+def _visit(port, hold, results):
+    accepted = False
+
+    try:
+        s = socket.create_connection(('127.0.0.1', port))
+        s.settimeout(2)
+
+        try:
+            s.sendall(_PAYLOAD)
+
+            received = b''
+            while len(received) < len(_PAYLOAD):
+                data = s.recv(len(_PAYLOAD) - len(received))
+                if not data:
+                    break
+
+                received += data
+
+            accepted = (received == _PAYLOAD)
+            if accepted is True:
+                time.sleep(hold)
+        finally:
+            s.close()
+    except socket.error:
+        pass
+
+    results.append(accepted)
+
+def _run(base_port, pool_args):
+    relay = start_relay(base_port, '--pending-max', '0')
+    connect(base_port + 1).close()
+
+    host_process = start_host_process(base_port, 10, *pool_args)
+
+    results = []
+    threads = []
+    peak = 0
+
+    try:
+        # Let the host-process fill its pool.
+        time.sleep(3)
+
+        for (seconds, rate, hold) in _PHASES:
+            deadline = time.time() + seconds
+            while time.time() < deadline:
+                thread = threading.Thread(target=_visit,
+                                          args=(base_port + 2, hold, results))
+                thread.start()
+                threads.append(thread)
+
+                peak = max(peak, _count_connections(base_port))
+                time.sleep(1.0 / rate)
+
+        for thread in threads:
+            thread.join()
+
+        # Give it a few checks to settle.
+        time.sleep(3)
+
+        final = _count_connections(base_port)
+        peak = max(peak, final)
+    finally:
+        host_process.terminate()
+        host_process.wait()
+
+        relay.terminate()
+        relay.wait()
+
+    return (len(results), results.count(False), peak, final)
+
+def main():
+    parser = ArgumentParser(description="Benchmark fixed and adaptive "
+                                        "host-process pools under bursty "
+                                        "traffic.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=19400,
+                        type=int,
+                        help="First of three consecutive ports to use.")
+
+    args = parser.parse_args()
+
+    print("%-10s %8s %10s %12s %12s" %
+          ('POOL', 'CLIENTS', 'REJECTED', 'PEAK-CONNS', 'FINAL-CONNS'))
+
+    for (i, (name, pool_args)) in enumerate(_POOLS):
+        (total, rejected, peak, final) = _run(args.base_port + i * 3,
+                                              pool_args)
+
+        print("%-10s %8d %10d %12d %12d" %
+              (name, total, rejected, peak, final))
+
+if __name__ == '__main__':
+    main()
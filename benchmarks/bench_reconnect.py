@@ -0,0 +1,218 @@
+#!/usr/bin/python
+
+"""Simulates a relay restart against a host-process's pool of data
+connections, for the original slots, which each backed off on their own
+(ReconnectingClientFactory), and for the slots connected by the pool's
+scheduler (see relayserver.reconnect). Time is simulated (with a Clock), so
+long outages take no longer to run than short ones.
+
+Every slot starts connected. The relay then goes down, dropping them all, and
+comes back up after the given number of seconds. While it's down, connecting
+fails straight away. Once it's up, a connection's handshake succeeds after a
+few milliseconds. For each outage, the time from the relay coming back up
+until every slot had connected again (the time to full capacity), the
+connection attempts made, and the most attempts made within any 100ms (the
+stampede) are reported.
+"""
+
+from argparse import ArgumentParser
+from collections import deque
+
+from twisted.internet.protocol import ReconnectingClientFactory
+from twisted.internet.task import Clock
+
+from relayserver.reconnect import ReconnectScheduler
+
+_HANDSHAKE_SECONDS = .005
+_REFUSE_SECONDS = .001
+_STEP_SECONDS = .005
+_WINDOW_SECONDS = .1
+
+
+class _Relay(object):
+    def __init__(self, clock, up_at):
+        self.__clock = clock
+        self.__up_at = up_at
+
+        self.attempted_at = []
+
+    def connect(self, succeeded, failed):
+        now = self.__clock.seconds()
+        self.attempted_at.append(now)
+
+        if now >= self.__up_at:
+            self.__clock.callLater(_HANDSHAKE_SECONDS, succeeded)
+        else:
+            self.__clock.callLater(_REFUSE_SECONDS, failed)
+
+
+class _Connector(object):
+    """Connects a slot to the simulated relay."""
+
+    def __init__(self, relay, succeeded, failed):
+        self.__relay = relay
+        self.__succeeded = succeeded
+        self.__failed = failed
+
+    def connect(self):
+        self.__relay.connect(self.__succeeded, self.__failed)
+
+
+class _Simulation(object):
+    def __init__(self, num_slots, downtime):
+        self.num_slots = num_slots
+
+        self.clock = Clock()
+        self.relay = _Relay(self.clock, downtime)
+
+        self.connected = set()
+
+    def _succeeded(self, slot):
+        self.connected.add(slot)
+
+    def run(self, limit):
+        """Drop every slot, and run until they've all connected again (or
+        until the limit). Returns when they had.
+        """
+
+        for slot in list(self.connected):
+            self.connected.discard(slot)
+            self._dropped(slot)
+
+        while len(self.connected) < self.num_slots:
+            if self.clock.seconds() >= limit:
+                return None
+
+            self.clock.advance(_STEP_SECONDS)
+
+        return self.clock.seconds()
+
+
+class _IndependentSimulation(_Simulation):
+    """Each slot is a ReconnectingClientFactory."""
+
+    def __init__(self, num_slots, downtime):
+        _Simulation.__init__(self, num_slots, downtime)
+
+        self.__connectors = {}
+
+        for i in range(num_slots):
+            factory = ReconnectingClientFactory()
+            factory.clock = self.clock
+            factory.noisy = False
+
+            self.__connectors[factory] = _Connector(
+                self.relay,
+                lambda factory=factory: self._succeeded(factory),
+                lambda factory=factory: self.__failed(factory))
+
+            self.connected.add(factory)
+
+    def _succeeded(self, factory):
+        factory.resetDelay()
+        _Simulation._succeeded(self, factory)
+
+    def __failed(self, factory):
+        factory.clientConnectionFailed(self.__connectors[factory], None)
+
+    def _dropped(self, factory):
+        factory.clientConnectionLost(self.__connectors[factory], None)
+
+
+class _ScheduledSimulation(_Simulation):
+    """The slots are connected by a ReconnectScheduler."""
+
+    def __init__(self, num_slots, downtime, rate):
+        _Simulation.__init__(self, num_slots, downtime)
+
+        self.__scheduler = ReconnectScheduler(rate, clock=self.clock)
+        self.__connectors = {}
+
+        for slot in range(num_slots):
+            self.__connectors[slot] = _Connector(
+                self.relay,
+                lambda slot=slot: self._succeeded(slot),
+                lambda slot=slot: self.__schedule(slot, True))
+
+            self.connected.add(slot)
+
+    def _succeeded(self, slot):
+        self.__scheduler.handshake_succeeded(slot)
+        _Simulation._succeeded(self, slot)
+
+    def __schedule(self, slot, failed):
+        self.__scheduler.schedule(slot,
+                                  self.__connectors[slot].connect,
+                                  failed)
+
+    def _dropped(self, slot):
+        # It had been configured.
+        self.__schedule(slot, False)
+
+def _get_peak(attempted_at):
+    """The most attempts within any window."""
+
+    window = deque()
+    peak = 0
+    for at in attempted_at:
+        window.append(at)
+        while window[0] <= at - _WINDOW_SECONDS:
+            window.popleft()
+
+        peak = max(peak, len(window))
+
+    return peak
+
+def main():
+    parser = ArgumentParser(description="Simulate a relay restart against "
+                                        "independently backed-off and "
+                                        "scheduled host-process slots.")
+
+    parser.add_argument('-n', '--num-slots',
+                        default=100,
+                        type=int,
+                        help="Data connections in the pool.")
+
+    parser.add_argument('-r', '--rate',
+                        default=100,
+                        type=float,
+                        help="The scheduler's connections per second.")
+
+    parser.add_argument('-l', '--limit',
+                        default=3600,
+                        type=float,
+                        help="Give up on reaching full capacity after this "
+                             "many (simulated) seconds.")
+
+    parser.add_argument('downtimes',
+                        nargs='*',
+                        default=[1, 5, 30, 120],
+                        type=float,
+                        help="Seconds that the relay is down for.")
+
+    args = parser.parse_args()
+
+    print("%-12s %8s %12s %10s %12s" %
+          ('SLOTS', 'DOWN-S', 'CAPACITY-S', 'ATTEMPTS', 'PEAK/100MS'))
+
+    for downtime in args.downtimes:
+        for (name, simulation) in \
+                (('independent',
+                  _IndependentSimulation(args.num_slots, downtime)),
+                 ('scheduled',
+                  _ScheduledSimulation(args.num_slots, downtime,
+                                       args.rate))):
+            full_at = simulation.run(args.limit)
+            attempted_at = simulation.relay.attempted_at
+
+            print("%-12s %8.1f %12s %10d %12d" %
+                  (name,
+                   downtime,
+                   '%.2f' % (full_at - downtime)
+                        if full_at is not None
+                        else 'never',
+                   len(attempted_at),
+                   _get_peak(attempted_at)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+
+"""Keeps traffic flowing through a relay while it's restarted, in each of the
+ways that it can be:
+
+    kill       The relay is terminated, and a new one is started.
+    drain      The relay is told to drain (SIGUSR1), and a new one is started
+               once it has exited.
+    handoff    A new relay is started with the old one's handoff path, and
+               takes over its sockets and connections (see
+               relayserver.handoff).
+
+A relay and a host-process running the echo server are started on loopback.
+Stream clients stay connected, each sending a payload and waiting for it to
+come back, over and over (reconnecting if they're dropped), while churn
+clients connect, make one round trip, and disconnect. Part way through, the
+relay is restarted. The round trips made and failed, the streams that were
+dropped, and the longest time without a successful round trip are reported.
+"""
+
+import os
+import shutil
+import signal
+import socket
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser
+
+from loopback import start_relay, start_host_process, connect, recv_exactly
+
+_PAYLOAD = b'0123456789abcdef' * 64
+
+_MODES = ('kill', 'drain', 'handoff')
+
+
+class _Traffic(object):
+    def __init__(self, port):
+        self.__port = port
+        self.__locker = threading.Lock()
+        self.__stopped = False
+        self.__threads = []
+
+        self.succeeded_at = []
+        self.failed_count = 0
+        self.dropped_streams = 0
+
+    def __round_trip(self, s):
+        s.sendall(_PAYLOAD)
+        recv_exactly(s, len(_PAYLOAD))
+
+        with self.__locker:
+            self.succeeded_at.append(time.time())
+
+    def __fail(self, stream=False):
+        with self.__locker:
+            self.failed_count += 1
+
+            if stream is True:
+                self.dropped_streams += 1
+
+    def __stream(self):
+        while self.__stopped is False:
+            try:
+                s = socket.create_connection(('127.0.0.1', self.__port))
+            except socket.error:
+                self.__fail()
+                time.sleep(.05)
+                continue
+
+            s.settimeout(5)
+
+            try:
+                while self.__stopped is False:
+                    self.__round_trip(s)
+                    time.sleep(.01)
+            except Exception:
+                self.__fail(True)
+                time.sleep(.05)
+            finally:
+                s.close()
+
+    def __churn(self):
+        while self.__stopped is False:
+            try:
+                s = socket.create_connection(('127.0.0.1', self.__port))
+                s.settimeout(5)
+
+                try:
+                    self.__round_trip(s)
+                finally:
+                    s.close()
+            except Exception:
+                self.__fail()
+
+            time.sleep(.02)
+
+    def start(self, num_streams, num_churners):
+        for (target, count) in ((self.__stream, num_streams),
+                                (self.__churn, num_churners)):
+            for i in range(count):
+                thread = threading.Thread(target=target)
+                thread.start()
+
+                self.__threads.append(thread)
+
+    def stop(self):
+        self.__stopped = True
+
+        for thread in self.__threads:
+            thread.join()
+
+def _restart(mode, relay, base_port, relay_args, handoff_path):
+    if mode == 'kill':
+        relay.terminate()
+        relay.wait()
+    elif mode == 'drain':
+        relay.send_signal(signal.SIGUSR1)
+        relay.wait()
+    else:
+        # The old relay exits by itself, once it has handed over.
+        new_relay = start_relay(base_port,
+                                '--handoff-path', handoff_path,
+                                *relay_args)
+
+        relay.wait()
+        return new_relay
+
+    return start_relay(base_port, *relay_args)
+
+def _run(mode, base_port, args):
+    relay_args = ('--drain-timeout', str(args.drain_timeout))
+
+    directory = tempfile.mkdtemp()
+    handoff_path = os.path.join(directory, 'handoff')
+
+    if mode == 'handoff':
+        relay_args_first = ('--handoff-path', handoff_path) + relay_args
+    else:
+        relay_args_first = relay_args
+
+    relay = start_relay(base_port, *relay_args_first)
+    connect(base_port + 1).close()
+
+    host_process = start_host_process(base_port, args.connections)
+    traffic = _Traffic(base_port + 2)
+
+    try:
+        # Let the host-process fill its pool.
+        time.sleep(2)
+
+        traffic.start(args.streams, args.churners)
+        time.sleep(args.before)
+
+        restarted_at = time.time()
+        relay = _restart(mode, relay, base_port, relay_args, handoff_path)
+        restart_seconds = time.time() - restarted_at
+
+        time.sleep(args.after)
+    finally:
+        traffic.stop()
+
+        host_process.terminate()
+        host_process.wait()
+
+        relay.terminate()
+        relay.wait()
+
+        shutil.rmtree(directory)
+
+    succeeded_at = sorted(traffic.succeeded_at)
+    gaps = [later - earlier
+            for (earlier, later)
+            in zip(succeeded_at, succeeded_at[1:])]
+
+    return (len(succeeded_at),
+            traffic.failed_count,
+            traffic.dropped_streams,
+            max(gaps) if gaps else 0.0,
+            restart_seconds)
+
+def main():
+    parser = ArgumentParser(description="Keep traffic flowing through a "
+                                        "relay while it's restarted.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=19500,
+                        type=int,
+                        help="First of three consecutive ports to use (for "
+                             "each mode, the next three).")
+
+    parser.add_argument('-n', '--connections',
+                        default=40,
+                        type=int,
+                        help="Host-process connections.")
+
+    parser.add_argument('-s', '--streams',
+                        default=10,
+                        type=int,
+                        help="Clients that stay connected.")
+
+    parser.add_argument('-c', '--churners',
+                        default=4,
+                        type=int,
+                        help="Clients that connect for one round trip at a "
+                             "time.")
+
+    parser.add_argument('--before',
+                        default=2,
+                        type=float,
+                        help="Seconds of traffic before the restart.")
+
+    parser.add_argument('--after',
+                        default=4,
+                        type=float,
+                        help="Seconds of traffic after the restart.")
+
+    parser.add_argument('--drain-timeout',
+                        default=2,
+                        type=float,
+                        help="The relays' --drain-timeout (streams never "
+                             "finish by themselves).")
+
+    parser.add_argument('modes',
+                        nargs='*',
+                        default=list(_MODES),
+                        help="The ways to restart (%s)." %
+                             (', '.join(_MODES)))
+
+    args = parser.parse_args()
+
+    print("%-10s %12s %8s %10s %12s %12s" %
+          ('RESTART', 'ROUND-TRIPS', 'FAILED', 'DROPPED', 'MAX-GAP-MS',
+           'RESTART-MS'))
+
+    for (i, mode) in enumerate(args.modes):
+        (succeeded, failed, dropped, max_gap, restart_seconds) = \
+            _run(mode, args.base_port + i * 3, args)
+
+        print("%-10s %12d %8d %10d %12.1f %12.1f" %
+              (mode,
+               succeeded,
+               failed,
+               dropped,
+               max_gap * 1000,
+               restart_seconds * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/python
+
+"""Simulates how evenly each selection-policy spreads clients across several
+host-processes of different capacities (weights). Every host-process keeps a
+pool of the same number of connections (the host-process sizes its pool by
+how many are idle, not by its capacity), and all of one host-process's
+connections are queued before the next's (as when they start one after
+another). Clients arrive at random, at a rate that keeps the given fraction of
+all of the connections busy, and stay for a random time. A connection waits
+for another client as soon as its client leaves.
+
+A host-process's share is its clients over its fair share of them (by
+weight), so 1.0 is even. Whenever a client arrives, the largest share and the
+spread of the host-processes' loads (their clients over their weights, as a
+coefficient of variation) are sampled. The averages are reported, along with
+the largest share that any host-process got, the clients that found no
+connection waiting, and the time taken per client. The first tenth of the
+clients aren't sampled, while the load builds.
+"""
+
+import time
+
+from argparse import ArgumentParser
+from heapq import heappush, heappop
+from random import Random
+
+from relayserver.selection import POLICIES, TwoChoicesPolicy
+
+
+class _Connection(object):
+    __slots__ = ('session_id', 'host_process_id', 'weight')
+
+    def __init__(self, session_id, host_process_id, weight):
+        self.session_id = session_id
+        self.host_process_id = host_process_id
+        self.weight = weight
+
+
+def _simulate(policy, weights, pool_size, busy_fraction, num_clients,
+              mean_duration, random):
+    session_id = 0
+    for (host_process_id, weight) in enumerate(weights):
+        for i in range(pool_size):
+            session_id += 1
+            policy.add(_Connection(session_id, host_process_id, weight))
+
+    clients = [0] * len(weights)
+    total_weight = float(sum(weights))
+    arrival_rate = busy_fraction * pool_size * len(weights) / mean_duration
+
+    # (Ending time, session-ID, connection)
+    endings = []
+
+    (largest_total, spread_total, peak, rejected) = (0.0, 0.0, 0.0, 0)
+    samples = 0
+    warm_up = num_clients // 10
+
+    started_at = time.time()
+
+    now = 0.0
+    for i in range(num_clients):
+        now += random.expovariate(arrival_rate)
+
+        while endings and endings[0][0] <= now:
+            (ended_at, session_id, hp_connection) = heappop(endings)
+
+            clients[hp_connection.host_process_id] -= 1
+            policy.finished(hp_connection)
+            policy.add(hp_connection)
+
+        # Let it settle, first.
+        total_clients = sum(clients)
+        if i >= warm_up and total_clients > 0:
+            loads = [float(count) / weight
+                     for (count, weight)
+                     in zip(clients, weights)]
+
+            fair_load = total_clients / total_weight
+
+            largest = max(loads) / fair_load
+            largest_total += largest
+            peak = max(peak, largest)
+
+            mean = sum(loads) / len(loads)
+            variance = sum((load - mean) ** 2 for load in loads) / len(loads)
+            spread_total += variance ** .5 / mean
+
+            samples += 1
+
+        hp_connection = policy.select()
+        if hp_connection is None:
+            rejected += 1
+            continue
+
+        policy.started(hp_connection)
+        clients[hp_connection.host_process_id] += 1
+
+        heappush(endings, (now + random.expovariate(1.0 / mean_duration),
+                           hp_connection.session_id,
+                           hp_connection))
+
+    elapsed = time.time() - started_at
+
+    return (largest_total / samples,
+            peak,
+            spread_total / samples,
+            rejected,
+            elapsed / num_clients)
+
+def main():
+    parser = ArgumentParser(description="Simulate how the selection-policies "
+                                        "spread clients across "
+                                        "host-processes.")
+
+    parser.add_argument('-c', '--clients',
+                        default=200000,
+                        type=int,
+                        help="Clients to simulate per policy.")
+
+    parser.add_argument('-n', '--pool-size',
+                        default=100,
+                        type=int,
+                        help="Connections in each host-process's pool.")
+
+    parser.add_argument('-u', '--busy-fraction',
+                        default=.3,
+                        type=float,
+                        help="Fraction of all of the connections that are "
+                             "busy, on average.")
+
+    parser.add_argument('-s', '--seed',
+                        default=1,
+                        type=int,
+                        help="Random seed (the same for every policy).")
+
+    parser.add_argument('weights',
+                        nargs='*',
+                        default=[1, 1, 2, 4],
+                        type=int,
+                        help="The weight of each host-process.")
+
+    args = parser.parse_args()
+
+    print("%-14s %12s %10s %10s %10s %12s" %
+          ('POLICY', 'AVG-LARGEST', 'PEAK', 'SPREAD', 'REJECTED',
+           'USEC/CLIENT'))
+
+    for name in ('fifo', 'least-loaded', 'two-choices', 'weighted'):
+        random = Random(args.seed)
+
+        if name == 'two-choices':
+            policy = TwoChoicesPolicy(Random(args.seed))
+        else:
+            policy = POLICIES[name]()
+
+        (largest, peak, spread, rejected, elapsed) = \
+            _simulate(policy,
+                      args.weights,
+                      args.pool_size,
+                      args.busy_fraction,
+                      args.clients,
+                      1.0,
+                      random)
+
+        print("%-14s %12.3f %10.3f %10.3f %10d %12.2f" %
+              (name, largest, peak, spread, rejected, elapsed * 1000000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+
+"""Connection-rate benchmark for short-lived clients, with host-process
+connections reused across sessions and with a reconnect (and hello) after
+every client. For each, a relay and a host-process (running the configured
+real-server, which should be the echo server) with a fixed pool are started on
+loopback. Several client processes then connect, send a small payload, wait
+for it to come back, and disconnect, as fast as they can, for a fixed period.
+The completed connections per second, failures, and the latency (from
+connecting to receiving the echo) are reported.
+"""
+
+import socket
+import time
+
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from loopback import start_relay, start_host_process, connect, \
+                     get_percentile
+
+_PAYLOAD = b'ping'
+
+_MODES = (('recycle', ()),
+          ('reconnect', ('--no-recycle',)))
+
+def _drive(args):
+    (port, seconds) = args
+
+    latencies = []
+    failed = 0
+
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        start = time.time()
+
+        s = socket.create_connection(('127.0.0.1', port))
+        s.settimeout(30)
+
+        try:
+            s.sendall(_PAYLOAD)
+
+            received = b''
+            while len(received) < len(_PAYLOAD):
+                data = s.recv(len(_PAYLOAD) - len(received))
+                if not data:
+                    break
+
+                received += data
+        except socket.error:
+            received = b''
+        finally:
+            s.close()
+
+        if received == _PAYLOAD:
+            latencies.append(time.time() - start)
+        else:
+            failed += 1
+
+    return (latencies, failed)
+
+def _run(mode_args, base_port, num_connections, num_clients, seconds):
+    relay = start_relay(base_port, '--pending-timeout', '30')
+    connect(base_port + 1).close()
+
+    host_process = start_host_process(base_port,
+                                      num_connections,
+                                      '--min-connections',
+                                      str(num_connections),
+                                      '--max-connections',
+                                      str(num_connections),
+                                      *mode_args)
+
+    try:
+        # Let the host-process fill its pool.
+        time.sleep(3)
+
+        pool = Pool(num_clients)
+        try:
+            results = pool.map(_drive,
+                               [(base_port + 2, seconds)] * num_clients)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        host_process.terminate()
+        host_process.wait()
+
+        relay.terminate()
+        relay.wait()
+
+    latencies = []
+    failed = 0
+    for (client_latencies, client_failed) in results:
+        latencies += client_latencies
+        failed += client_failed
+
+    return (float(len(latencies)) / seconds,
+            failed,
+            get_percentile(latencies, .5),
+            get_percentile(latencies, .99))
+
+def main():
+    parser = ArgumentParser(description="Benchmark the connection-rate of "
+                                        "short-lived clients with and without "
+                                        "session recycling.")
+
+    parser.add_argument('-c', '--clients',
+                        default=4,
+                        type=int,
+                        help="Concurrent client processes.")
+
+    parser.add_argument('-n', '--num-connections',
+                        default=10,
+                        type=int,
+                        help="Host-process connections in the (fixed) pool.")
+
+    parser.add_argument('-s', '--seconds',
+                        default=10,
+                        type=int,
+                        help="How long to drive each mode.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=19600,
+                        type=int,
+                        help="First of three consecutive ports to use.")
+
+    args = parser.parse_args()
+
+    print("%-10s %10s %8s %10s %10s" %
+          ('MODE', 'CONNS/S', 'FAILED', 'P50-MS', 'P99-MS'))
+
+    for (i, (name, mode_args)) in enumerate(_MODES):
+        (rate, failed, p50, p99) = _run(mode_args,
+                                        args.base_port + i * 3,
+                                        args.num_connections,
+                                        args.clients,
+                                        args.seconds)
+
+        print("%-10s %10.1f %8d %10.2f %10.2f" %
+              (name, rate, failed, p50 * 1000, p99 * 1000))
+
+if __name__ == '__main__':
+    main()
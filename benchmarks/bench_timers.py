@@ -0,0 +1,146 @@
+#!/usr/bin/python
+
+"""Soaks the relay's timers, with the timers scheduled on the reactor one by
+one (as they were), and on a timing-wheel (see relayserver.timing_wheel).
+
+For each number of simulated connections, every connection is given an idle
+timer (of one to five minutes). Then, for the given number of seconds, the
+connections churn as fast as they can: a random connection's idle timer is
+cancelled and scheduled again (it has relayed something, or it has been
+replaced), and a delayed close (of half a second, so that they fire during
+the run) is scheduled for it. The CPU time that each step took (scheduling,
+cancelling, and the reactor's running of the timers, together), the steps
+made, the delayed closes that fired, and the number of calls that the reactor
+had scheduled once the idle timers had been are reported.
+"""
+
+import os
+import random
+
+from argparse import ArgumentParser
+from time import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks
+
+from relayserver.timing_wheel import TimingWheel
+
+_CLOSE_SECONDS = .5
+_BATCH = 100
+
+
+class _Connection(object):
+    def __init__(self, timers):
+        self.__timers = timers
+        self.idle_timer = None
+
+    def watch_idle(self):
+        self.idle_timer = self.__timers.callLater(random.uniform(60, 300),
+                                                  self.expired)
+
+    def expired(self):
+        raise Exception("Not expected within the run.")
+
+
+def _get_cpu_seconds():
+    (user, system) = os.times()[:2]
+    return user + system
+
+def _run(timers, num_connections, seconds):
+    """Fire with (CPU microseconds per step, steps, closes, reactor calls)
+    once the run is over.
+    """
+
+    connections = [_Connection(timers) for i in range(num_connections)]
+    for connection in connections:
+        connection.watch_idle()
+
+    reactor_calls = len(reactor.getDelayedCalls())
+
+    counts = { 'steps': 0, 'closes': 0 }
+
+    def close():
+        counts['closes'] += 1
+
+    finished = Deferred()
+    started_at = time()
+    cpu_started_at = _get_cpu_seconds()
+
+    def churn():
+        for i in range(_BATCH):
+            connection = random.choice(connections)
+
+            connection.idle_timer.cancel()
+            connection.watch_idle()
+
+            timers.callLater(_CLOSE_SECONDS, close)
+
+        counts['steps'] += _BATCH
+
+        if time() - started_at < seconds:
+            reactor.callLater(0, churn)
+            return
+
+        cpu_seconds = _get_cpu_seconds() - cpu_started_at
+
+        for connection in connections:
+            connection.idle_timer.cancel()
+
+        finished.callback((cpu_seconds / counts['steps'] * 1e6,
+                           counts['steps'],
+                           counts['closes'],
+                           reactor_calls))
+
+    reactor.callLater(0, churn)
+    return finished
+
+def main():
+    parser = ArgumentParser(description="Soak the relay's timers, on the "
+                                        "reactor and on a timing-wheel.")
+
+    parser.add_argument('-s', '--seconds',
+                        default=5,
+                        type=float,
+                        help="Seconds to churn for, for each run.")
+
+    parser.add_argument('connections',
+                        nargs='*',
+                        default=[1000, 10000, 100000],
+                        type=int,
+                        help="The numbers of connections to run with.")
+
+    args = parser.parse_args()
+
+    print("%-8s %12s %10s %10s %10s %14s" %
+          ('TIMERS', 'CONNECTIONS', 'US/STEP', 'STEPS', 'CLOSES',
+           'REACTOR-CALLS'))
+
+    @inlineCallbacks
+    def run_all():
+        try:
+            for num_connections in args.connections:
+                for (name, timers) in (('reactor', reactor),
+                                       ('wheel', TimingWheel())):
+                    (step_us, steps, closes, reactor_calls) = \
+                        yield _run(timers, num_connections, args.seconds)
+
+                    # Let the last of the closes fire.
+                    d = Deferred()
+                    reactor.callLater(_CLOSE_SECONDS * 2, d.callback, None)
+                    yield d
+
+                    print("%-8s %12d %10.2f %10d %10d %14d" %
+                          (name,
+                           num_connections,
+                           step_us,
+                           steps,
+                           closes,
+                           reactor_calls))
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(run_all)
+    reactor.run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+"""Load generator for the multi-worker relay. For each worker-count, a relay 
+and a host-process (running the configured real-server, which should be the 
+echo server) are started on loopback. Several client processes then connect,
+send a small payload, wait for it to come back, and disconnect, as fast as 
+they can, for a fixed period. The accept rate (completed round-trips per 
+second), rejections, and the pairing latency (from connecting to receiving 
+the echo) are reported.
+"""
+
+import socket
+import time
+
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from loopback import start_relay, start_host_process, connect, \
+                     get_percentile
+
+_PAYLOAD = b'ping'
+
+def _drive(args):
+    (port, seconds) = args
+
+    latencies = []
+    rejected = 0
+
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        start = time.time()
+
+        s = socket.create_connection(('127.0.0.1', port))
+        s.settimeout(5)
+
+        try:
+            s.sendall(_PAYLOAD)
+
+            received = b''
+            while len(received) < len(_PAYLOAD):
+                data = s.recv(len(_PAYLOAD) - len(received))
+                if not data:
+                    break
+
+                received += data
+        except socket.error:
+            received = b''
+        finally:
+            s.close()
+
+        if received == _PAYLOAD:
+            latencies.append(time.time() - start)
+        else:
+            rejected += 1
+
+    return (latencies, rejected)
+
+def _run(num_workers, base_port, num_connections, num_clients, seconds):
+    relay = start_relay(base_port, '-w', str(num_workers))
+    connect(base_port + 1).close()
+
+    host_process = start_host_process(base_port, num_connections)
+
+    try:
+        # Let the host-process fill its pool.
+        time.sleep(3)
+
+        pool = Pool(num_clients)
+        try:
+            results = pool.map(_drive, 
+                               [(base_port + 2, seconds)] * num_clients)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        host_process.terminate()
+        host_process.wait()
+
+        relay.terminate()
+        relay.wait()
+
+    latencies = []
+    rejected = 0
+    for (client_latencies, client_rejected) in results:
+        latencies += client_latencies
+        rejected += client_rejected
+
+    return (float(len(latencies)) / seconds, 
+            rejected, 
+            get_percentile(latencies, .5), 
+            get_percentile(latencies, .99))
+
+def main():
+    parser = ArgumentParser(description="Benchmark relay scaling across "
+                                        "workers.")
+
+    parser.add_argument('-c', '--clients', 
+                        default=8, 
+                        type=int, 
+                        help="Concurrent client processes.")
+
+    parser.add_argument('-n', '--num-connections', 
+                        default=1000, 
+                        type=int, 
+                        help="Host-process connections to maintain.")
+
+    parser.add_argument('-s', '--seconds', 
+                        default=5, 
+                        type=int, 
+                        help="How long to drive each worker-count.")
+
+    parser.add_argument('-b', '--base-port', 
+                        default=19200, 
+                        type=int, 
+                        help="First of three consecutive ports to use.")
+
+    parser.add_argument('workers', 
+                        nargs='*', 
+                        default=[1, 2, 4], 
+                        type=int, 
+                        help="Worker-counts to measure.")
+
+    args = parser.parse_args()
+
+    print("%-8s %12s %10s %10s %10s" % 
+          ('WORKERS', 'ACCEPTS/S', 'REJECTED', 'P50-MS', 'P99-MS'))
+
+    for (i, num_workers) in enumerate(args.workers):
+        (rate, rejected, p50, p99) = _run(num_workers, 
+                                          args.base_port + i * 3, 
+                                          args.num_connections, 
+                                          args.clients, 
+                                          args.seconds)
+
+        print("%-8d %12.1f %10d %10.2f %10.2f" % 
+              (num_workers, rate, rejected, p50 * 1000, p99 * 1000))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Helpers for driving a relay on loopback from a benchmark. The benchmark 
+plays the host-process and the clients itself, with plain sockets.
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from struct import pack, unpack
+
+from relayserver.message_types.hello_pb2 import HostProcessHelloResponse
+from relayserver.message_types import build_msg_data_hphello
+
+_BOOT_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                               '..', 
+                               'relayserver', 
+                               'boot')
+
+def _start_script(name, args, python=None, root=None):
+    """python and root are the interpreter and the tree (the directory that
+    holds the relayserver package) to run the script with. They default to
+    ours.
+    """
+
+    if root is None:
+        root = os.path.join(_BOOT_DIRECTORY, '..', '..')
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root
+
+    script = os.path.join(root, 'relayserver', 'boot', name)
+
+    return subprocess.Popen([python or sys.executable, script] + list(args), 
+                            env=env)
+
+def start_relay(base_port, *extra_args, **kwargs):
+    """Start a relay subprocess listening on three consecutive ports. See 
+    _start_script() for the keyword arguments.
+    """
+
+    args = [str(base_port), str(base_port + 1), str(base_port + 2)]
+
+    return _start_script('relay.py', args + list(extra_args), **kwargs)
+
+def start_host_process(base_port, num_connections, *extra_args, **kwargs):
+    """Start a host-process subprocess (with the configured real-server) 
+    against a relay started with start_relay().
+    """
+
+    args = ['localhost', 
+            str(base_port), 
+            str(base_port + 1), 
+            '-n', str(num_connections)]
+
+    return _start_script('host_process.py', args + list(extra_args), **kwargs)
+
+def connect(port):
+    deadline = time.time() + 10
+    while 1:
+        try:
+            return socket.create_connection(('127.0.0.1', port))
+        except socket.error:
+            if time.time() > deadline:
+                raise
+
+            time.sleep(.1)
+
+def recv_exactly(s, length):
+    parts = []
+    while length > 0:
+        data = s.recv(length)
+        if not data:
+            raise Exception("Connection dropped.")
+
+        parts.append(data)
+        length -= len(data)
+
+    return b''.join(parts)
+
+def greet(port, host_process_id=None):
+    """Open a host-process data connection and complete its handshake. 
+    Returns the socket and the session-ID that the relay gave it.
+    """
+
+    s = connect(port)
+
+    hello = build_msg_data_hphello(host_process_id=host_process_id)
+    hello_raw = hello.SerializeToString()
+    s.sendall(pack('>I', len(hello_raw)) + hello_raw)
+
+    (length,) = unpack('>I', recv_exactly(s, 4))
+
+    response = HostProcessHelloResponse()
+    response.ParseFromString(recv_exactly(s, length))
+
+    return (s, response.session_id)
+
+def say_hello(port):
+    """Open a host-process data connection and complete its handshake."""
+
+    return greet(port)[0]
+
+def get_cpu_seconds(pid):
+    with open('/proc/%d/stat' % (pid)) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+
+    # utime and stime are the 14th and 15th fields (the first two are gone).
+    ticks = int(fields[11]) + int(fields[12])
+
+    return float(ticks) / os.sysconf('SC_CLK_TCK')
+
+def get_rss_bytes(pid):
+    with open('/proc/%d/statm' % (pid)) as f:
+        pages = int(f.read().split()[1])
+
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+def get_percentile(values, fraction):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -0,0 +1,517 @@
+#!/usr/bin/python
+
+"""End-to-end benchmark suite for the relay and the host-process. For each
+workload, a relay and a host-process (running the configured real-server,
+which should be the echo server) are started on loopback, and client
+processes drive them:
+
+    churn      Clients connect, send a payload, wait for it to come back, and
+               disconnect, at a fixed rate (or as fast as they can).
+    streams    Many clients connect and stay connected. Each sends a payload,
+               and the next once it has come back, for each payload size.
+
+The results (latency, throughput, connections per second, the rejected-client
+rate, and the CPU and RSS of the relay and the host-process) are written as
+JSON. Given a baseline (the JSON of an earlier run), every result is compared
+to it, and the run fails if any is worse by more than the tolerance.
+"""
+
+import json
+import select
+import socket
+import sys
+import time
+
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from loopback import start_relay, start_host_process, connect, \
+                     get_cpu_seconds, get_rss_bytes, get_percentile
+
+# Results that are better when they're higher. The rest are better when
+# they're lower.
+_HIGHER_IS_BETTER = set(('connections_per_second',
+                         'round_trips_per_second',
+                         'megabytes_per_second'))
+
+# Counts that depend on the run's length, rather than on the relay.
+_NOT_COMPARED = set(('attempts', 'completed'))
+
+# Settings that don't affect the results.
+_NOT_CONFIG = set(('workloads', 'base_port', 'output', 'baseline',
+                   'tolerance'))
+
+def _get_payload(size):
+    return (b'0123456789abcdef' * (size // 16 + 1))[:size]
+
+def _round_trip(port, payload):
+    """Connect, send the payload, and wait for it to come back. Returns the
+    latency, or None if the client was turned away.
+    """
+
+    start = time.time()
+
+    try:
+        s = socket.create_connection(('127.0.0.1', port))
+    except socket.error:
+        return None
+
+    s.settimeout(30)
+
+    received = 0
+    try:
+        s.sendall(payload)
+
+        while received < len(payload):
+            data = s.recv(len(payload) - received)
+            if not data:
+                break
+
+            received += len(data)
+    except socket.error:
+        pass
+    finally:
+        s.close()
+
+    if received < len(payload):
+        return None
+
+    return time.time() - start
+
+def _drive_churn(args):
+    (port, payload_size, rate, seconds) = args
+
+    payload = _get_payload(payload_size)
+    interval = 1.0 / rate if rate > 0 else 0
+
+    latencies = []
+    attempts = 0
+
+    started_at = time.time()
+    deadline = started_at + seconds
+    while time.time() < deadline:
+        if interval > 0:
+            delay = started_at + attempts * interval - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        attempts += 1
+
+        latency = _round_trip(port, payload)
+        if latency is not None:
+            latencies.append(latency)
+
+    return (attempts, latencies)
+
+def _drive_streams(args):
+    (port, num_streams, payload_size, seconds) = args
+
+    payload = _get_payload(payload_size)
+
+    sockets = []
+    for i in range(num_streams):
+        s = socket.create_connection(('127.0.0.1', port))
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sockets.append(s)
+
+    # Prime each connection (so that it's assigned) before timing anything.
+    for s in sockets:
+        s.sendall(payload)
+
+    remaining = dict((s, len(payload)) for s in sockets)
+    sent_at = { }
+    latencies = []
+
+    def receive(s):
+        data = s.recv(65536)
+        if not data:
+            raise Exception("A stream was dropped.")
+
+        remaining[s] -= len(data)
+        if remaining[s] > 0:
+            return
+
+        latencies.append(time.time() - sent_at[s])
+
+        remaining[s] = len(payload)
+        sent_at[s] = time.time()
+        s.sendall(payload)
+
+    waiting = set(sockets)
+    while waiting:
+        (readable, w, x) = select.select(list(waiting), [], [], 30)
+        if not readable:
+            raise Exception("The streams stalled while priming.")
+
+        for s in readable:
+            data = s.recv(65536)
+            if not data:
+                raise Exception("A stream was dropped.")
+
+            remaining[s] -= len(data)
+            if remaining[s] <= 0:
+                waiting.discard(s)
+
+    for s in sockets:
+        remaining[s] = len(payload)
+        sent_at[s] = time.time()
+        s.sendall(payload)
+
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        (readable, w, x) = select.select(sockets, [], [], 1)
+        for s in readable:
+            receive(s)
+
+    for s in sockets:
+        s.close()
+
+    return latencies
+
+def _start(base_port, num_connections, relay_args, hp_args, relay_python=None,
+           relay_root=None):
+    relay = start_relay(base_port,
+                        '--pending-timeout',
+                        '30',
+                        *relay_args,
+                        python=relay_python,
+                        root=relay_root)
+    connect(base_port + 1).close()
+
+    host_process = start_host_process(base_port,
+                                      num_connections,
+                                      '--min-connections',
+                                      str(num_connections),
+                                      '--max-connections',
+                                      str(num_connections),
+                                      *hp_args)
+
+    # Let the host-process fill its pool.
+    time.sleep(3)
+
+    return (relay, host_process)
+
+def _stop(relay, host_process):
+    host_process.terminate()
+    host_process.wait()
+
+    relay.terminate()
+    relay.wait()
+
+def _measure(relay, host_process, drive, jobs, num_clients):
+    """Run the client jobs, and sample the servers' resources around them."""
+
+    relay_cpu = get_cpu_seconds(relay.pid)
+    hp_cpu = get_cpu_seconds(host_process.pid)
+    started_at = time.time()
+
+    pool = Pool(num_clients)
+    try:
+        results = pool.map(drive, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    elapsed = time.time() - started_at
+
+    resources = {
+        'relay_cpu_percent':
+            (get_cpu_seconds(relay.pid) - relay_cpu) * 100 / elapsed,
+        'hp_cpu_percent':
+            (get_cpu_seconds(host_process.pid) - hp_cpu) * 100 / elapsed,
+        'relay_rss_mb': get_rss_bytes(relay.pid) / 1048576.0,
+        'hp_rss_mb': get_rss_bytes(host_process.pid) / 1048576.0 }
+
+    return (results, resources)
+
+def _summarize_latencies(latencies):
+    return { 'latency_p50_ms': get_percentile(latencies, .5) * 1000,
+             'latency_p99_ms': get_percentile(latencies, .99) * 1000 }
+
+def run_churn(args, base_port):
+    (relay, host_process) = _start(base_port,
+                                   args.num_connections,
+                                   args.relay_args,
+                                   args.hp_args,
+                                   args.relay_python,
+                                   args.relay_root)
+
+    try:
+        job = (base_port + 2,
+               args.churn_payload_size,
+               float(args.churn_rate) / args.clients,
+               args.seconds)
+
+        (results, resources) = _measure(relay,
+                                        host_process,
+                                        _drive_churn,
+                                        [job] * args.clients,
+                                        args.clients)
+    finally:
+        _stop(relay, host_process)
+
+    attempts = sum(client_attempts for (client_attempts, l) in results)
+    latencies = sum((client_latencies for (a, client_latencies) in results),
+                    [])
+
+    result = { 'attempts': attempts,
+               'completed': len(latencies),
+               'connections_per_second': float(len(latencies)) / args.seconds,
+               'rejected_percent':
+                    (attempts - len(latencies)) * 100.0 / attempts
+                    if attempts > 0
+                    else 0.0 }
+
+    result.update(_summarize_latencies(latencies))
+    result.update(resources)
+
+    return result
+
+def run_streams(args, base_port, payload_size):
+    # Each stream holds a host-process connection for as long as it lasts.
+    num_connections = args.streams + args.num_connections
+
+    (relay, host_process) = _start(base_port,
+                                   num_connections,
+                                   args.relay_args,
+                                   args.hp_args,
+                                   args.relay_python,
+                                   args.relay_root)
+
+    try:
+        # Spread the streams over the client processes.
+        jobs = []
+        for i in range(args.clients):
+            num_streams = args.streams // args.clients + \
+                          (1 if i < args.streams % args.clients else 0)
+
+            if num_streams > 0:
+                jobs.append((base_port + 2,
+                             num_streams,
+                             payload_size,
+                             args.seconds))
+
+        (results, resources) = _measure(relay,
+                                        host_process,
+                                        _drive_streams,
+                                        jobs,
+                                        len(jobs))
+    finally:
+        _stop(relay, host_process)
+
+    latencies = sum(results, [])
+    round_trips_per_second = float(len(latencies)) / args.seconds
+
+    result = { 'completed': len(latencies),
+               'round_trips_per_second': round_trips_per_second,
+               # Both directions.
+               'megabytes_per_second':
+                    round_trips_per_second * payload_size * 2 / 1048576.0 }
+
+    result.update(_summarize_latencies(latencies))
+    result.update(resources)
+
+    return result
+
+def compare(results, baseline, tolerance):
+    """Compare every result to the baseline's. Returns a list of
+    (workload, name, baseline value, value, change, regressed) tuples, where
+    the change is a fraction of the baseline value.
+    """
+
+    comparisons = []
+    for (workload, workload_results) in sorted(results.items()):
+        baseline_results = baseline.get(workload)
+        if baseline_results is None:
+            continue
+
+        for (name, value) in sorted(workload_results.items()):
+            baseline_value = baseline_results.get(name)
+            if baseline_value is None or name in _NOT_COMPARED:
+                continue
+
+            if baseline_value == 0:
+                change = 0.0 if value == 0 else float('inf')
+            else:
+                change = float(value - baseline_value) / baseline_value
+
+            if name in _HIGHER_IS_BETTER:
+                regressed = change < -tolerance
+            else:
+                regressed = change > tolerance
+
+            comparisons.append((workload,
+                                name,
+                                baseline_value,
+                                value,
+                                change,
+                                regressed))
+
+    return comparisons
+
+def _print_comparisons(comparisons, f):
+    f.write("%-14s %-24s %12s %12s %9s\n" %
+            ('WORKLOAD', 'RESULT', 'BASELINE', 'NOW', 'CHANGE'))
+
+    for (workload, name, baseline_value, value, change, regressed) \
+            in comparisons:
+        f.write("%-14s %-24s %12.3f %12.3f %+8.1f%%%s\n" %
+                (workload,
+                 name,
+                 baseline_value,
+                 value,
+                 change * 100,
+                 '  REGRESSED' if regressed is True else ''))
+
+def main():
+    parser = ArgumentParser(description="Run the end-to-end benchmark "
+                                        "suite.")
+
+    parser.add_argument('-w', '--workload',
+                        dest='workloads',
+                        action='append',
+                        choices=('churn', 'streams'),
+                        help="Workload to run (may be repeated). Defaults "
+                             "to all of them.")
+
+    parser.add_argument('-c', '--clients',
+                        default=4,
+                        type=int,
+                        help="Concurrent client processes.")
+
+    parser.add_argument('-n', '--num-connections',
+                        default=20,
+                        type=int,
+                        help="Host-process connections in the (fixed) pool, "
+                             "beyond one for each stream.")
+
+    parser.add_argument('-s', '--seconds',
+                        default=5,
+                        type=int,
+                        help="How long to drive each workload.")
+
+    parser.add_argument('--churn-rate',
+                        default=0,
+                        type=int,
+                        help="Connections per second to open, across "
+                             "clients, for churn (0 opens them as fast as "
+                             "possible).")
+
+    parser.add_argument('--churn-payload-size',
+                        default=64,
+                        type=int,
+                        help="Bytes each churn client sends.")
+
+    parser.add_argument('--streams',
+                        default=100,
+                        type=int,
+                        help="Concurrent long-lived streams, across clients.")
+
+    parser.add_argument('--payload-size',
+                        dest='payload_sizes',
+                        action='append',
+                        type=int,
+                        help="Bytes per round-trip, for streams (may be "
+                             "repeated). Defaults to 64, 4096, and 65536.")
+
+    parser.add_argument('--relay-arg',
+                        dest='relay_args',
+                        action='append',
+                        default=[],
+                        help="Argument to pass to the relay (may be "
+                             "repeated).")
+
+    parser.add_argument('--hp-arg',
+                        dest='hp_args',
+                        action='append',
+                        default=[],
+                        help="Argument to pass to the host-process (may be "
+                             "repeated).")
+
+    parser.add_argument('--relay-python',
+                        help="Interpreter to run the relay with. Defaults "
+                             "to this one.")
+
+    parser.add_argument('--relay-root',
+                        help="Tree (the directory that holds the relayserver "
+                             "package) to run the relay from, as when it "
+                             "needs protobuf modules generated for another "
+                             "interpreter. Defaults to this one.")
+
+    parser.add_argument('-b', '--base-port',
+                        default=19900,
+                        type=int,
+                        help="First of three consecutive ports to use for "
+                             "the first workload (each uses the next three).")
+
+    parser.add_argument('-o', '--output',
+                        help="Write the results to this file, rather than "
+                             "to stdout.")
+
+    parser.add_argument('--baseline',
+                        help="Compare to the results in this file.")
+
+    parser.add_argument('-t', '--tolerance',
+                        default=10,
+                        type=float,
+                        help="Percent that a result may be worse than the "
+                             "baseline's before it's a regression.")
+
+    args = parser.parse_args()
+
+    workloads = args.workloads or ['churn', 'streams']
+    payload_sizes = args.payload_sizes or [64, 4096, 65536]
+
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    runs = []
+    if 'churn' in workloads:
+        runs.append(('churn', run_churn, ()))
+
+    if 'streams' in workloads:
+        for payload_size in payload_sizes:
+            runs.append(('streams-%d' % (payload_size),
+                         run_streams,
+                         (payload_size,)))
+
+    results = { }
+    for (i, (name, run, run_args)) in enumerate(runs):
+        sys.stderr.write("Running [%s].\n" % (name))
+        results[name] = run(args, args.base_port + i * 3, *run_args)
+
+    config = dict((name, value)
+                  for (name, value)
+                  in vars(args).items()
+                  if name not in _NOT_CONFIG)
+
+    report = { 'config': config,
+               'results': results }
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+    else:
+        json.dump(report, sys.stdout, indent=4, sort_keys=True)
+        sys.stdout.write("\n")
+
+    if baseline is not None:
+        for (name, value) in sorted(config.items()):
+            baseline_value = baseline['config'].get(name)
+            if baseline_value != value:
+                sys.stderr.write("The baseline was run with %s=%r, rather "
+                                 "than %r.\n" % (name, baseline_value, value))
+
+        comparisons = compare(results,
+                              baseline['results'],
+                              args.tolerance / 100.0)
+
+        _print_comparisons(comparisons, sys.stderr)
+
+        if any(regressed for (w, n, b, v, c, regressed) in comparisons):
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,9 @@
+"""The relay and the host-process on asyncio, rather than on Twisted, so that
+they can be embedded in an asyncio application (or run on uvloop). They speak
+the same protocol as the Twisted ones, and use the same framing
+(relayserver.frame_buffer), messages, and selection-policies, so either can
+be used with the other.
+
+This requires Python 3.7 or later (and protobuf modules generated for Python
+3; see artifacts/protobuf/build.sh).
+"""
@@ -0,0 +1,410 @@
+"""The host-process on asyncio. See relayserver.boot.host_process for the
+Twisted one, which this follows, except that the pool is a fixed number of
+slots (there's no multiplexing, either): each slot keeps one data connection
+open, reconnecting as soon as the relay has dropped one that served a client,
+and backing off (with jitter) while the relay can't be reached.
+"""
+
+import asyncio
+import signal
+
+from os import urandom
+from random import random
+
+from relayserver import event_log
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types.hello_pb2 import HostProcessHelloResponse
+from relayserver.message_types import build_msg_data_hphello, \
+                                      build_msg_cmd_sessionendack, \
+                                      build_msg_cmd_hello, \
+                                      build_msg_cmd_heartbeat, \
+                                      SESSION_END_TOKEN_LENGTH
+from relayserver.message_types.codec import get_protobuf_backend
+from relayserver.aio.protocol import FramingMixin, FramedProtocol, \
+                                     parse_or_raise
+from relayserver.frame_buffer import FrameBuffer
+from relayserver.real.session import SessionConnection
+
+from relayserver.config import EndpointServer
+
+_data_log = event_log.get_logger(event_log.DATA_PLANE)
+_control_log = event_log.get_logger(event_log.CONTROL_PLANE)
+_assignment_log = event_log.get_logger(event_log.ASSIGNMENT)
+
+# Seconds to wait before reconnecting after a failure, doubled after each
+# consecutive one up to the maximum (see ReconnectingClientFactory).
+_INITIAL_DELAY = 1.0
+_MAX_DELAY = 60.0
+
+
+class _Connector(object):
+    """Keeps a connection open to the relay, reconnecting whenever it's
+    lost.
+    """
+
+    def __init__(self, host, port, protocol_factory, name):
+        self.__host = host
+        self.__port = port
+        self.__protocol_factory = protocol_factory
+        self.__name = name
+
+        self.__delay = _INITIAL_DELAY
+        self.__stopped = False
+        self.__pending = None
+
+    def start(self):
+        self.__connect()
+
+    def stop(self):
+        self.__stopped = True
+
+        if self.__pending is not None:
+            self.__pending.cancel()
+            self.__pending = None
+
+    def reset_delay(self):
+        """The connection has been useful, so reconnect immediately when it's
+        lost.
+        """
+
+        self.__delay = _INITIAL_DELAY
+        self.__pending = None
+
+    def connection_lost(self, immediately=False):
+        if immediately is True:
+            self.__connect()
+        else:
+            self.__retry()
+
+    def __connect(self):
+        if self.__stopped is True:
+            return
+
+        loop = asyncio.get_event_loop()
+
+        self.__pending = asyncio.ensure_future(
+                            loop.create_connection(
+                                lambda: self.__protocol_factory(self),
+                                self.__host,
+                                self.__port))
+
+        self.__pending.add_done_callback(self.__connected)
+
+    def __connected(self, future):
+        if future.cancelled() is True:
+            return
+
+        e = future.exception()
+        if e is not None:
+            _data_log.sampled(event_log.INFO,
+                              "Could not connect %s: %s",
+                              self.__name, e)
+
+            self.__retry()
+
+    def __retry(self):
+        if self.__stopped is True:
+            return
+
+        # Jittered, so that the slots don't all come back at once.
+        delay = self.__delay * (.5 + random())
+        self.__delay = min(self.__delay * 2, _MAX_DELAY)
+
+        self.__pending = asyncio.get_event_loop().call_later(delay,
+                                                             self.__connect)
+
+
+class HostProcess(FramingMixin, asyncio.Protocol):
+    """A data connection to the relay. It says hello, and then forwards
+    everything to an EndpointServer.
+    """
+
+    transport = None
+
+    def __init__(self, pool, connector):
+        self.__pool = pool
+        self.__connector = connector
+
+        self.__session_id = None
+        self.__frames = FrameBuffer()
+
+        self.__session = SessionConnection(self)
+        self.__real_server = EndpointServer(self.__session)
+        self.__served = False
+
+        # Once the relay has announced the end of the session, the token that
+        # the session's data will end with, and the last bytes that we've
+        # received, while they could be the start of it.
+        self.__end_token = None
+        self.__held = b''
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+        _data_log.debug("We've successfully connected to the relay server. "
+                        "Sending hello.")
+
+        hello = build_msg_data_hphello(self.__pool.recycle_sessions,
+                                       False,
+                                       self.__pool.host_process_id,
+                                       self.__pool.weight)
+
+        self.write_message(hello)
+
+    def connection_lost(self, exc):
+        _data_log.debug("Host-process with session-no (%s) has had its "
+                        "connection dropped.", self.__session_id)
+
+        self.__real_server.shutdown()
+        self.__pool.connection_lost(self)
+
+        # A connection that served a client was dropped by the relay, as it
+        # should have been, so it's replaced right away.
+        self.__connector.connection_lost(self.__served)
+
+    def data_received(self, data):
+        if self.__session_id is None:
+            self.__frames.push(data)
+
+            message_raw = self.__frames.read_message()
+            if message_raw is None:
+                return
+
+            self.__handle_hello_response(message_raw)
+
+            # A client that was waiting on us will have had its data sent
+            # right behind the response.
+            for chunk in self.__frames.read_remaining_chunks():
+                self.__receive_data(chunk)
+        else:
+            self.__receive_data(data)
+
+    def __receive_data(self, data):
+        if self.__end_token is None:
+            self.__real_server.receive_data(data)
+            return
+
+        # The session is ending. Whatever comes after the token belongs to the
+        # next one.
+        data = self.__held + data
+
+        position = data.find(self.__end_token)
+        if position == -1:
+            held_from = max(0, len(data) - SESSION_END_TOKEN_LENGTH + 1)
+            self.__held = data[held_from:]
+
+            if held_from > 0:
+                self.__real_server.receive_data(data[:held_from])
+
+            return
+
+        if position > 0:
+            self.__real_server.receive_data(data[:position])
+
+        self.__session_ended()
+
+        remaining = data[position + SESSION_END_TOKEN_LENGTH:]
+        if remaining:
+            self.__receive_data(remaining)
+
+    def __handle_hello_response(self, message_raw):
+        response = parse_or_raise(message_raw, HostProcessHelloResponse)
+
+        self.__session_id = response.session_id
+
+        _data_log.debug("Received hello response: SESSION-NO=(%d) RHOST=[%s] "
+                        "RPORT=(%d)",
+                        self.__session_id, response.relay_host,
+                        response.relay_port)
+
+        self.__connector.reset_delay()
+        self.__pool.connection_configured(self)
+
+    def connection_assigned(self):
+        self.__served = True
+
+    def end_session(self, token, command_channel):
+        """See relayserver.boot.host_process.HostProcess.end_session()."""
+
+        self.__session.end()
+
+        self.__end_token = token
+        self.__held = b''
+        self.__served = False
+
+        # Nothing is written after this, until we're reassigned.
+        ack_token = urandom(SESSION_END_TOKEN_LENGTH)
+        self.transport.write(ack_token)
+
+        command_channel.acknowledge_session_end(self.__session_id, ack_token)
+
+    def __session_ended(self):
+        _assignment_log.debug("Session on host-process with session-no (%d) "
+                              "has ended. Recycling.", self.__session_id)
+
+        self.__real_server.shutdown()
+
+        self.__session = SessionConnection(self)
+        self.__real_server = EndpointServer(self.__session)
+
+        self.__end_token = None
+        self.__held = b''
+
+    @property
+    def session_id(self):
+        return self.__session_id
+
+
+class CommandListener(FramedProtocol):
+    """The relay's command-channel. See
+    relayserver.boot.host_process.CommandListener.
+    """
+
+    def __init__(self, pool, connector):
+        self.__pool = pool
+        self.__connector = connector
+
+        self.set_frame_handlers(
+            Command,
+            { Command.CONNECTION_OPEN: self.__handle_new_connection,
+              Command.SESSION_END: self.__handle_session_end,
+              Command.BATCH: self.__handle_batch,
+              Command.HEARTBEAT: self.__handle_heartbeat },
+            'message_type')
+
+    def connection_made(self, transport):
+        FramedProtocol.connection_made(self, transport)
+
+        _control_log.info("Connected command-listener.")
+
+        # Our hello isn't answered, so there's nothing to wait for at the top
+        # of a command connection.
+        self.__connector.reset_delay()
+        self.batch_writes()
+
+        # A relay with several host-processes sends us the announcements for
+        # the connections that give the same ID (and batches them, as we can
+        # take them).
+        self.write_message(build_msg_cmd_hello(self.__pool.host_process_id,
+                                               accepts_batches=True))
+
+    def connection_lost(self, exc):
+        FramedProtocol.connection_lost(self, exc)
+
+        _control_log.info("Command-listener dropped.")
+        self.__connector.connection_lost()
+
+    def __handle_new_connection(self, announcement):
+        self.__pool.connection_assigned(
+            announcement.open_properties.assigned_to_session)
+
+    def __handle_batch(self, announcement):
+        for session_id in announcement.batch.opened_sessions:
+            self.__pool.connection_assigned(session_id)
+
+    def __handle_heartbeat(self, announcement):
+        self.write_message(build_msg_cmd_heartbeat())
+
+    def __handle_session_end(self, announcement):
+        properties = announcement.session_end_properties
+
+        _control_log.sampled(event_log.DEBUG,
+                             "Received announcement of the end of the session "
+                             "on session-no (%d).", properties.session_id)
+
+        connection = self.__pool.get_connection(properties.session_id)
+        if connection is None:
+            _control_log.info("Session-no (%d) is not one of ours.",
+                              properties.session_id)
+            return
+
+        connection.end_session(properties.token, self)
+
+    def acknowledge_session_end(self, session_id, token):
+        self.write_message(build_msg_cmd_sessionendack(session_id, token))
+
+
+class HostProcessPool(object):
+    """A fixed number of data connections to the relay. POOL_LOW advisories
+    are ignored.
+    """
+
+    def __init__(self, host, dport, cport, size, recycle_sessions=True,
+                 host_process_id='', weight=1):
+        self.recycle_sessions = recycle_sessions
+        self.host_process_id = host_process_id
+        self.weight = weight
+
+        self.__connectors = \
+            [_Connector(host,
+                        dport,
+                        lambda connector: HostProcess(self, connector),
+                        'data connection')
+             for i
+             in range(size)]
+
+        self.__connectors.append(
+            _Connector(host,
+                       cport,
+                       lambda connector: CommandListener(self, connector),
+                       'command-listener'))
+
+        # Session-ID => protocol, for every configured connection.
+        self.__connections = { }
+
+    def start(self):
+        for connector in self.__connectors:
+            connector.start()
+
+    def stop(self):
+        for connector in self.__connectors:
+            connector.stop()
+
+        for connection in list(self.__connections.values()):
+            connection.transport.close()
+
+    def get_connection(self, session_id):
+        return self.__connections.get(session_id)
+
+    def connection_configured(self, protocol):
+        self.__connections[protocol.session_id] = protocol
+
+    def connection_lost(self, protocol):
+        if protocol.session_id is not None:
+            self.__connections.pop(protocol.session_id, None)
+
+    def connection_assigned(self, session_id):
+        connection = self.__connections.get(session_id)
+        if connection is not None:
+            connection.connection_assigned()
+
+def start_host_process(host, dport, cport, num_connections,
+                       recycle_sessions=True, host_process_id='', weight=1):
+    """Run the host-process on a new event loop until we're told to
+    stop.
+    """
+
+    _control_log.info("Using the [%s] protobuf backend.",
+                      get_protobuf_backend())
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    pool = HostProcessPool(host,
+                           dport,
+                           cport,
+                           num_connections,
+                           recycle_sessions,
+                           host_process_id,
+                           weight)
+
+    pool.start()
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, loop.stop)
+
+    try:
+        loop.run_forever()
+    finally:
+        pool.stop()
+        loop.close()
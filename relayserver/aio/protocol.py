@@ -0,0 +1,197 @@
+"""Framing for asyncio protocols. This does what BaseProtocol does for the
+Twisted ones: every message is prefixed with its length, and the messages
+received are parsed and dispatched by type.
+"""
+
+import asyncio
+
+from struct import Struct
+
+from google.protobuf.message import DecodeError
+
+from relayserver import event_log
+from relayserver.frame_buffer import FrameBuffer, SlabFrameBuffer
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types.codec import decode_fixed_command, \
+                                            DECODE_FIXED
+
+_PREFIX = Struct('>I')
+
+_control_log = event_log.get_logger(event_log.CONTROL_PLANE)
+
+
+def parse_or_raise(message_raw, type_):
+    if type_ is Command and DECODE_FIXED is True:
+        # See BaseProtocol.parse_or_raise().
+        message = decode_fixed_command(message_raw)
+        if message is not None:
+            return message
+
+    message = type_()
+
+    try:
+        message.ParseFromString(message_raw)
+    except DecodeError:
+        raise
+    else:
+        if message.IsInitialized() is False:
+            raise Exception("Message parse with type [%s] resulted in "
+                            "uninitialized message." % (type_))
+
+    return message
+
+
+class FramingMixin(object):
+    """Expects self.transport. Received data is either passed to
+    dispatch_frames() as bytes (nothing that will be reused), or read straight
+    into get_frame_buffer(), followed by a call to frames_read(), as
+    FramedProtocol does.
+    """
+
+    __frames = None
+    __framing = False
+
+    # Set when messages are gathered and written once per loop iteration.
+    __batching = False
+    __outgoing = None
+
+    def batch_writes(self):
+        """Gather the messages written during a loop iteration, and write them
+        together at the end of it. Only use this where nothing else is written
+        to the transport, as they would overtake the messages.
+        """
+
+        self.__batching = True
+        self.__outgoing = []
+
+    def write_message(self, message):
+        data = message.SerializeToString()
+        frame = _PREFIX.pack(len(data)) + data
+
+        if self.__batching is False:
+            self.transport.write(frame)
+            return
+
+        if not self.__outgoing:
+            asyncio.get_event_loop().call_soon(self.flush_messages)
+
+        self.__outgoing.append(frame)
+
+    def flush_messages(self):
+        """Write any messages that have been gathered, now."""
+
+        outgoing = self.__outgoing
+        if not outgoing:
+            return
+
+        self.__outgoing = []
+
+        if self.transport.is_closing() is False:
+            self.transport.writelines(outgoing)
+
+    def set_frame_handlers(self, type_, handlers, type_field=None):
+        """See BaseProtocol.set_frame_handlers()."""
+
+        self.__frames = None
+        self.__framing = True
+
+        self.__frame_type = type_
+        self.__frame_handlers = handlers
+        self.__frame_type_field = type_field
+
+    def stop_framing(self):
+        """Stop dispatching messages. Return whatever bytes were still
+        buffered.
+        """
+
+        self.__framing = False
+
+        if self.__frames is None:
+            return b''
+
+        return self.__frames.read_remaining()
+
+    def release_frames(self):
+        """The connection has been lost. Forget whatever was buffered."""
+
+        if self.__frames is not None:
+            self.__frames.release()
+
+    def dispatch_frames(self, data):
+        frames = self.__frames
+        if frames is None:
+            frames = self.__frames = FrameBuffer()
+
+        frames.push(data)
+        self.__dispatch_buffered_frames(frames)
+
+    def get_frame_buffer(self):
+        """Return a view of a slab to read into."""
+
+        frames = self.__frames
+        if frames is None:
+            frames = self.__frames = SlabFrameBuffer()
+
+        return frames.get_buffer()
+
+    def frames_read(self, nbytes):
+        """The given number of bytes have been read into the view that
+        get_frame_buffer() returned. Dispatch every message that is now
+        complete.
+        """
+
+        frames = self.__frames
+        frames.buffer_updated(nbytes)
+
+        try:
+            self.__dispatch_buffered_frames(frames)
+        finally:
+            # Nothing holds on to the messages once they've been handled.
+            frames.recycle()
+
+    def __dispatch_buffered_frames(self, frames):
+        while self.__framing is True:
+            message_raw = frames.read_message()
+            if message_raw is None:
+                break
+
+            message = parse_or_raise(message_raw, self.__frame_type)
+
+            if self.__frame_type_field is None:
+                key = None
+            else:
+                key = getattr(message, self.__frame_type_field)
+
+            try:
+                handler = self.__frame_handlers[key]
+            except KeyError:
+                _control_log.info("There is no handler for message [%s] with "
+                                  "type (%s). Ignoring.",
+                                  self.__frame_type.__name__, key)
+            else:
+                handler(message)
+
+    @property
+    def framing(self):
+        return self.__framing
+
+
+class FramedProtocol(FramingMixin, asyncio.BufferedProtocol):
+    """A connection that only carries framed messages. They're read straight
+    into slabs (see relayserver.slab_pool), and parsed in place.
+    """
+
+    transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def get_buffer(self, sizehint):
+        return self.get_frame_buffer()
+
+    def buffer_updated(self, nbytes):
+        # A bad message raises, and asyncio drops the connection.
+        self.frames_read(nbytes)
+
+    def connection_lost(self, exc):
+        self.release_frames()
@@ -0,0 +1,791 @@
+"""The relay on asyncio. See relayserver.main for the Twisted one, which this
+follows (less the worker-bus, the splice data-plane, multiplexing, and the
+metrics).
+
+The data connections read with buffered protocols. Once a connection is
+paired, it reads into a buffer of its own, and what's read is written straight
+from that buffer to its peer's transport, without a bytes object being made
+for it. Transports may hold on to what they can't send right away (rather than
+copy it), so a connection whose peer's transport is holding anything moves on
+to a new buffer. Until then, connections read into a buffer that they all
+share, and copy what they keep.
+"""
+
+import asyncio
+import signal
+
+from collections import OrderedDict
+from math import ceil
+from os import urandom
+
+from relayserver import event_log
+from relayserver.message_types.hello_pb2 import Hello
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types import build_msg_cmd_connopen, \
+                                      build_msg_cmd_conndrop, \
+                                      build_msg_cmd_poollow, \
+                                      build_msg_cmd_sessionend, \
+                                      build_msg_cmd_batch, \
+                                      build_msg_data_hphelloresponse, \
+                                      SESSION_END_TOKEN_LENGTH
+from relayserver.message_types.codec import get_protobuf_backend
+from relayserver.selection import create_policy
+from relayserver.aio.protocol import FramingMixin, FramedProtocol
+
+# How much each data connection reads at once.
+_READ_SIZE = 65536
+
+# What unpaired connections read into.
+_shared_view = memoryview(bytearray(_READ_SIZE))
+
+_data_log = event_log.get_logger(event_log.DATA_PLANE)
+_control_log = event_log.get_logger(event_log.CONTROL_PLANE)
+_assignment_log = event_log.get_logger(event_log.ASSIGNMENT)
+
+
+class _PairedProtocol(asyncio.BufferedProtocol):
+    """A data connection that's relayed to a peer once it's assigned one."""
+
+    transport = None
+    peer = None
+
+    def __init__(self, relay):
+        self.relay = relay
+        self.session_id = relay.next_session_id()
+
+        # Our own buffer, once we've been paired, and whichever buffer we've
+        # just given to the transport.
+        self.__view = None
+        self.__reading = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(self.relay.high_watermark,
+                                          self.relay.low_watermark)
+
+    def get_buffer(self, sizehint):
+        if self.peer is None:
+            self.__reading = _shared_view
+        else:
+            if self.__view is None:
+                self.__view = memoryview(bytearray(_READ_SIZE))
+
+            self.__reading = self.__view
+
+        return self.__reading
+
+    def buffer_updated(self, nbytes):
+        data = self.__reading[:nbytes]
+
+        peer = self.peer
+        if peer is None or self.__reading is _shared_view:
+            self.unpaired_data_received(data)
+            return
+
+        transport = peer.transport
+        transport.write(data)
+
+        if transport.get_write_buffer_size() > 0:
+            # It might be holding on to our buffer.
+            self.__view = None
+
+    def unpaired_data_received(self, data):
+        """Data was read while we had no peer. It's only valid until the
+        next read (by any connection).
+        """
+
+        raise NotImplementedError()
+
+    # Neither side may outrun the other: while our transport is full, our
+    # peer stops reading.
+
+    def pause_writing(self):
+        if self.peer is not None:
+            self.peer.transport.pause_reading()
+
+    def resume_writing(self):
+        if self.peer is not None:
+            self.peer.transport.resume_reading()
+
+    def resume_reading(self):
+        if self.transport.is_closing() is False and \
+           self.transport.is_reading() is False:
+            self.transport.resume_reading()
+
+
+class ClientServer(_PairedProtocol):
+    """A client's connection."""
+
+    def __init__(self, relay):
+        _PairedProtocol.__init__(self, relay)
+
+        # Data received while we wait to be assigned.
+        self.__pending_data = []
+        self.__pending_length = 0
+
+    def connection_made(self, transport):
+        _PairedProtocol.connection_made(self, transport)
+
+        _data_log.debug("Client with session-ID (%d) has connected.",
+                        self.session_id)
+
+        if self.relay.assign_new_client(self) is False:
+            transport.close()
+
+    def handle_assignment(self):
+        if self.__pending_data:
+            _data_log.debug("Forwarding (%d) bytes received from client with "
+                            "session-ID (%d) while it waited.",
+                            self.__pending_length, self.session_id)
+
+            self.peer.transport.writelines(self.__pending_data)
+
+            self.__pending_data = []
+            self.__pending_length = 0
+
+            self.resume_reading()
+
+    def unpaired_data_received(self, data):
+        # Hold on to it until we're assigned, but stop reading once we're
+        # holding as much as we'd buffer for a peer.
+        self.__pending_data.append(bytes(data))
+        self.__pending_length += len(data)
+
+        if self.__pending_length >= self.relay.high_watermark:
+            self.transport.pause_reading()
+
+    def connection_lost(self, exc):
+        self.relay.connection_lost_from_client(self)
+
+
+class HostProcessServer(FramingMixin, _PairedProtocol):
+    """A host-process's data connection."""
+
+    # See relayserver.main.HostProcessServer.
+    recycles = False
+    host_process_id = ''
+    weight = 1
+
+    def __init__(self, relay):
+        _PairedProtocol.__init__(self, relay)
+
+        self.set_frame_handlers(Hello, { None: self.__handle_hello })
+
+        # While a session is ending, the token that we'll mark the end of
+        # our side of it with, the last bytes that we've received, and the
+        # token that the host-process has said that they'll end with.
+        self.__ending = False
+        self.__token = None
+        self.__tail = b''
+        self.__end_token = None
+        self.__expiration = None
+
+    def unpaired_data_received(self, data):
+        if self.__ending is True:
+            # Whatever's left of the session. We only need to know what it
+            # ends with.
+            tail = self.__tail + bytes(data[-SESSION_END_TOKEN_LENGTH:])
+            self.__tail = tail[-SESSION_END_TOKEN_LENGTH:]
+
+            self.__check_session_ended()
+            return
+
+        if self.framing is False:
+            _data_log.sampled(event_log.DEBUG,
+                              "Dropping (%d) bytes received from unassigned "
+                              "host-process with session-ID (%d).",
+                              len(data), self.session_id)
+            return
+
+        # The frame-buffer holds on to what it's given.
+        self.dispatch_frames(bytes(data))
+
+    def __handle_hello(self, hello):
+        _control_log.debug("Host-process with session-ID (%d) has said hello.",
+                           self.session_id)
+
+        if hello.multiplex is True:
+            _control_log.info("Host-process with session-ID (%d) asked to "
+                              "multiplex, which isn't supported here. "
+                              "Dropping it.", self.session_id)
+
+            self.stop_framing()
+            self.transport.close()
+            return
+
+        self.recycles = hello.recycle_sessions
+        self.host_process_id = hello.host_process_id
+        self.weight = hello.weight
+
+        remaining = self.stop_framing()
+        if remaining:
+            _data_log.info("Dropping (%d) bytes received from host-process "
+                           "with session-ID (%d) behind its hello.",
+                           len(remaining), self.session_id)
+
+        (host, port) = self.transport.get_extra_info('sockname')[:2]
+        response = build_msg_data_hphelloresponse(self.session_id,
+                                                  host,
+                                                  self.relay.ports[2])
+
+        self.write_message(response)
+        self.relay.queue_new_hp(self)
+
+    def end_session(self):
+        """See relayserver.main.HostProcessServer.end_session()."""
+
+        token = urandom(SESSION_END_TOKEN_LENGTH)
+
+        self.__ending = True
+        self.__token = token
+        self.__tail = b''
+        self.__end_token = None
+        self.__expiration = \
+            asyncio.get_event_loop().call_later(self.relay.session_end_timeout,
+                                                self.transport.close)
+
+        # Reading might have been paused for the client.
+        self.resume_reading()
+
+        return token
+
+    def handle_session_end_ack(self, token):
+        self.transport.write(self.__token)
+        self.__token = None
+
+        self.__end_token = token
+        self.__check_session_ended()
+
+    def __check_session_ended(self):
+        if self.__end_token is None or self.__tail != self.__end_token:
+            return
+
+        self.__ending = False
+        self.__expiration.cancel()
+
+        _assignment_log.debug("Session on host-process with session-ID (%d) "
+                              "has ended. Recycling.", self.session_id)
+
+        self.relay.recycle_hp(self)
+
+    def connection_lost(self, exc):
+        self.release_frames()
+
+        if self.__expiration is not None:
+            self.__expiration.cancel()
+
+        self.relay.connection_lost_from_hp(self)
+
+
+class CommandServer(FramedProtocol):
+    """The host-process's command-channel."""
+
+    # The host-process that the channel belongs to, once it has said hello,
+    # and whether it accepts batched announcements (see
+    # relayserver.main.CommandServer).
+    host_process_id = ''
+    accepts_batches = False
+
+    # The channel that we took the place of, while we haven't said hello.
+    __displaced = None
+
+    def __init__(self, relay):
+        self.__relay = relay
+
+        # Announcements waiting to be batched (see
+        # relayserver.main.CommandServer).
+        self.__opened_sessions = []
+        self.__dropped_sessions = []
+
+        self.set_frame_handlers(
+            Command,
+            { Command.HELLO: self.__handle_hello,
+              Command.SESSION_END_ACK: self.__handle_session_end_ack },
+            'message_type')
+
+    def connection_made(self, transport):
+        FramedProtocol.connection_made(self, transport)
+
+        _control_log.info("Command channel connected.")
+
+        self.batch_writes()
+        self.__register('')
+
+    def connection_lost(self, exc):
+        FramedProtocol.connection_lost(self, exc)
+
+        _control_log.info("Command channel for host-process [%s] dropped.",
+                          self.host_process_id)
+
+        self.__unregister()
+
+    def __register(self, host_process_id):
+        self.__unregister()
+
+        self.host_process_id = host_process_id
+        self.__displaced = self.__relay.command_channel_connected(self)
+
+    def __unregister(self):
+        displaced = self.__displaced
+        self.__displaced = None
+
+        self.__relay.command_channel_lost(self, displaced)
+
+    def __handle_hello(self, command):
+        host_process_id = command.hello_properties.host_process_id
+
+        _control_log.info("Command channel belongs to host-process [%s].",
+                          host_process_id)
+
+        self.accepts_batches = command.hello_properties.accepts_batches
+
+        self.__register(host_process_id)
+
+    def announce_assignment(self, hp_connection):
+        self.write_command(build_msg_cmd_connopen(hp_connection.session_id))
+
+    def announce_drop(self, hp_connection):
+        self.write_command(build_msg_cmd_conndrop(hp_connection.session_id))
+
+    def advise_pool_low(self, idle_count, pending_count):
+        _control_log.sampled(event_log.INFO,
+                             "Advising that the host-process pool is low: "
+                             "(%d) waiting and (%d) clients pending.",
+                             idle_count, pending_count)
+
+        self.write_command(build_msg_cmd_poollow(idle_count, pending_count))
+
+    def announce_session_end(self, hp_connection, token):
+        self.write_command(build_msg_cmd_sessionend(hp_connection.session_id,
+                                                    token))
+
+    def write_command(self, command):
+        if self.__get_batch_size() > 1:
+            if command.message_type == Command.CONNECTION_OPEN:
+                self.__add_to_batch(self.__opened_sessions,
+                                    command.open_properties.\
+                                        assigned_to_session)
+                return
+
+            elif command.message_type == Command.CONNECTION_DROP:
+                self.__add_to_batch(self.__dropped_sessions,
+                                    command.drop_properties.session_id)
+                return
+
+            self.flush_batch()
+
+        self.write_message(command)
+
+    def __add_to_batch(self, sessions, session_id):
+        if not self.__opened_sessions and not self.__dropped_sessions:
+            asyncio.get_event_loop().call_soon(self.flush_batch)
+
+        sessions.append(session_id)
+
+        if len(self.__opened_sessions) + len(self.__dropped_sessions) >= \
+           self.__get_batch_size():
+            self.flush_batch()
+
+    def __get_batch_size(self):
+        return self.__relay.command_batch \
+               if self.accepts_batches is True \
+               else 1
+
+    def flush_batch(self):
+        if not self.__opened_sessions and not self.__dropped_sessions:
+            return
+
+        command = build_msg_cmd_batch(self.__opened_sessions,
+                                      self.__dropped_sessions)
+
+        self.__opened_sessions = []
+        self.__dropped_sessions = []
+
+        self.write_message(command)
+
+    def __handle_session_end_ack(self, command):
+        self.__relay.handle_session_end_ack(command.session_end_properties)
+
+
+class Relay(object):
+    """The assignment manager, and the listeners' settings. See
+    relayserver.main._AssignmentManager.
+    """
+
+    def __init__(self, high_watermark=65536, low_watermark=16384,
+                 pending_max=1000, pending_wait=10, pool_low=2,
+                 command_batch=100, selection_policy='fifo',
+                 session_end_timeout=5):
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.command_batch = command_batch
+        self.session_end_timeout = session_end_timeout
+
+        self.ports = None
+
+        self.__pending_limit = pending_max
+        self.__pending_timeout = pending_wait
+        self.__pool_low_mark = pool_low
+
+        self.__last_session_id = 0
+
+        # The HP connections waiting for clients.
+        self.__hp_waiting = create_policy(selection_policy)
+
+        # HP connections whose clients have dropped, while they're being
+        # recycled.
+        self.__hp_ending = { }
+
+        # Host-process ID => the HP connections (by session-ID) that are
+        # waiting for clients, but can't be assigned one until their
+        # host-process's command-channel connects.
+        self.__hp_parked = { }
+
+        # Clients waiting for an HP connection to become available, oldest
+        # first, with their expiration timer.
+        self.__pending_clients = OrderedDict()
+
+        # Host-process ID => its command-channel.
+        self.__command_channels = { }
+
+        self.__advisory_scheduled = False
+
+    def start(self, dport, cport, tport, host=None):
+        """Start listening. Returns a future for the three servers."""
+
+        loop = asyncio.get_event_loop()
+
+        self.ports = (dport, cport, tport)
+
+        servers = [loop.create_server(lambda: HostProcessServer(self),
+                                      host,
+                                      dport,
+                                      reuse_address=True),
+                   loop.create_server(lambda: CommandServer(self),
+                                      host,
+                                      cport,
+                                      reuse_address=True),
+                   loop.create_server(lambda: ClientServer(self),
+                                      host,
+                                      tport,
+                                      reuse_address=True)]
+
+        return asyncio.gather(*[asyncio.ensure_future(server)
+                                for server
+                                in servers])
+
+    def next_session_id(self):
+        self.__last_session_id += 1
+        return self.__last_session_id
+
+    def command_channel_connected(self, command_channel):
+        """Announce to the channel for its host-process from now on, and queue
+        the HP connections that were waiting for it. Return the channel that
+        it takes the place of, if any.
+        """
+
+        host_process_id = command_channel.host_process_id
+
+        displaced = self.__command_channels.get(host_process_id)
+        self.__command_channels[host_process_id] = command_channel
+
+        parked = self.__hp_parked.pop(host_process_id, None)
+        if parked is not None:
+            for hp_connection in parked.values():
+                self.queue_new_hp(hp_connection)
+
+        return displaced
+
+    def command_channel_lost(self, command_channel, displaced):
+        host_process_id = command_channel.host_process_id
+
+        if self.__command_channels.get(host_process_id) is not command_channel:
+            return
+
+        del self.__command_channels[host_process_id]
+
+        # If it took the place of a channel that's still connected, that one
+        # has it back.
+        if displaced is not None and \
+           displaced.host_process_id == host_process_id and \
+           displaced.transport.is_closing() is False:
+            self.__command_channels[host_process_id] = displaced
+
+    def __park(self, hp_connection):
+        _assignment_log.debug("Host-process with session-ID (%d) will wait "
+                              "for the command-channel of host-process [%s].",
+                              hp_connection.session_id,
+                              hp_connection.host_process_id)
+
+        parked = self.__hp_parked.setdefault(hp_connection.host_process_id,
+                                             OrderedDict())
+
+        parked[hp_connection.session_id] = hp_connection
+
+    def queue_new_hp(self, hp_connection):
+        if hp_connection.host_process_id not in self.__command_channels:
+            # Nobody could be told about its assignment.
+            self.__park(hp_connection)
+            return
+
+        if self.__pending_clients:
+            # Somebody is already waiting for it.
+            (session_id, (client_connection, expiration)) = \
+                self.__pending_clients.popitem(last=False)
+
+            expiration.cancel()
+
+            _assignment_log.debug("Client with session-ID (%d) was waiting "
+                                  "for a host-process connection.",
+                                  client_connection.session_id)
+
+            self.__assign(client_connection, hp_connection)
+        else:
+            self.__hp_waiting.add(hp_connection)
+            self.__check_pool()
+
+    def recycle_hp(self, hp_connection):
+        del self.__hp_ending[hp_connection.session_id]
+        self.queue_new_hp(hp_connection)
+
+    def handle_session_end_ack(self, properties):
+        hp_connection = self.__hp_ending.get(properties.session_id)
+        if hp_connection is None:
+            _control_log.info("Received acknowledgement for the end of a "
+                              "session on unknown HP session (%d).",
+                              properties.session_id)
+            return
+
+        hp_connection.handle_session_end_ack(properties.token)
+
+    def assign_new_client(self, client_connection):
+        if not self.__command_channels:
+            _assignment_log.info("We're denying new client with session-ID "
+                                 "(%d) because a host-process command-channel "
+                                 "is not connected.",
+                                 client_connection.session_id)
+            return False
+
+        hp_connection = self.__select()
+        if hp_connection is not None:
+            self.__assign(client_connection, hp_connection)
+            return True
+
+        if len(self.__pending_clients) >= self.__pending_limit:
+            _assignment_log.info("We're denying new client with session-ID "
+                                 "(%d) because there are no available "
+                                 "host-processes and (%d) clients are already "
+                                 "waiting.",
+                                 client_connection.session_id,
+                                 len(self.__pending_clients))
+            return False
+
+        # Hold the client until an HP connection becomes available.
+        expiration = asyncio.get_event_loop().call_later(
+                        self.__pending_timeout,
+                        self.__expire_pending_client,
+                        client_connection)
+
+        self.__pending_clients[client_connection.session_id] = \
+            (client_connection, expiration)
+
+        _assignment_log.debug("Client with session-ID (%d) will wait for an "
+                              "available host-process.",
+                              client_connection.session_id)
+
+        self.__check_pool()
+
+        return True
+
+    def __select(self):
+        """Dequeue an unassigned HP connection whose host-process's
+        command-channel is connected, or return None. Those whose
+        command-channels have gone are parked as they're found.
+        """
+
+        while 1:
+            hp_connection = self.__hp_waiting.select()
+            if hp_connection is None or \
+               hp_connection.host_process_id in self.__command_channels:
+                return hp_connection
+
+            self.__park(hp_connection)
+
+    def __expire_pending_client(self, client_connection):
+        del self.__pending_clients[client_connection.session_id]
+
+        _assignment_log.info("Client with session-ID (%d) has been dropped "
+                             "after waiting (%s) seconds for a host-process.",
+                             client_connection.session_id,
+                             self.__pending_timeout)
+
+        client_connection.transport.close()
+
+    def __assign(self, client_connection, hp_connection):
+        client_connection.peer = hp_connection
+        hp_connection.peer = client_connection
+
+        self.__hp_waiting.started(hp_connection)
+
+        _assignment_log.debug("Client with session-ID (%d) has been assigned "
+                              "to host-process with session-ID (%d).",
+                              client_connection.session_id,
+                              hp_connection.session_id)
+
+        self.__command_channels[hp_connection.host_process_id].\
+            announce_assignment(hp_connection)
+        self.__check_pool()
+
+        client_connection.handle_assignment()
+
+    def __check_pool(self):
+        """Advise the host-process to open more connections if we're running
+        short, once per loop iteration at most.
+        """
+
+        if len(self.__hp_waiting) >= self.__pool_low_mark or \
+           self.__advisory_scheduled is True:
+            return
+
+        self.__advisory_scheduled = True
+        asyncio.get_event_loop().call_soon(self.__advise_pool_low)
+
+    def __advise_pool_low(self):
+        self.__advisory_scheduled = False
+
+        idle_count = len(self.__hp_waiting)
+        if idle_count >= self.__pool_low_mark or \
+           not self.__command_channels:
+            return
+
+        # Every host-process is told, and asked for its share of the clients
+        # that are waiting.
+        command_channels = list(self.__command_channels.values())
+        pending_count = ceil(len(self.__pending_clients) /
+                             len(command_channels))
+
+        for command_channel in command_channels:
+            command_channel.advise_pool_low(idle_count, pending_count)
+
+    def __unbind(self, client_connection, hp_connection):
+        client_connection.peer = None
+        hp_connection.peer = None
+
+        # Either might have stopped reading for the other.
+        client_connection.resume_reading()
+        hp_connection.resume_reading()
+
+    def connection_lost_from_client(self, client_connection):
+        session_id = client_connection.session_id
+
+        if session_id in self.__pending_clients:
+            (client_connection, expiration) = \
+                self.__pending_clients.pop(session_id)
+
+            expiration.cancel()
+
+            _assignment_log.debug("Client with session-ID (%d) dropped while "
+                                  "waiting for a host-process.", session_id)
+            return
+
+        hp_connection = client_connection.peer
+        if hp_connection is None:
+            return
+
+        _assignment_log.debug("Client with session-ID (%d) mapped to "
+                              "host-process with session-ID (%d) has "
+                              "dropped.",
+                              session_id, hp_connection.session_id)
+
+        self.__unbind(client_connection, hp_connection)
+        self.__hp_waiting.finished(hp_connection)
+
+        command_channel = \
+            self.__command_channels.get(hp_connection.host_process_id)
+
+        if command_channel is not None and hp_connection.recycles is True:
+            # Reuse the HP connection once the host-process has acknowledged
+            # the end of the session.
+            self.__hp_ending[hp_connection.session_id] = hp_connection
+
+            token = hp_connection.end_session()
+            command_channel.announce_session_end(hp_connection, token)
+        else:
+            if command_channel is not None:
+                command_channel.announce_drop(hp_connection)
+
+            asyncio.get_event_loop().call_later(self.session_end_timeout,
+                                                hp_connection.transport.close)
+
+    def connection_lost_from_hp(self, hp_connection):
+        session_id = hp_connection.session_id
+
+        if session_id in self.__hp_waiting:
+            _assignment_log.debug("Unassigned host-process with session-ID "
+                                  "(%d) has dropped.", session_id)
+
+            self.__hp_waiting.remove(session_id)
+            self.__check_pool()
+
+        elif session_id in self.__hp_ending:
+            _assignment_log.info("Host-process with session-ID (%d) dropped "
+                                 "before its session ended.", session_id)
+
+            del self.__hp_ending[session_id]
+
+        elif session_id in self.__hp_parked.get(hp_connection.host_process_id,
+                                                { }):
+            _assignment_log.debug("Host-process with session-ID (%d) "
+                                  "dropped while waiting for its "
+                                  "command-channel.", session_id)
+
+            parked = self.__hp_parked[hp_connection.host_process_id]
+            del parked[session_id]
+
+            if not parked:
+                del self.__hp_parked[hp_connection.host_process_id]
+
+        elif hp_connection.peer is not None:
+            client_connection = hp_connection.peer
+
+            _assignment_log.debug("Host-process with session-ID (%d) mapped "
+                                  "to client with session-ID (%d) has "
+                                  "dropped.",
+                                  session_id, client_connection.session_id)
+
+            self.__unbind(client_connection, hp_connection)
+            self.__hp_waiting.finished(hp_connection)
+
+            client_connection.transport.close()
+
+def start_relay(dport, cport, tport, high_watermark=65536,
+                low_watermark=16384, pending_max=1000, pending_wait=10,
+                pool_low=2, command_batch=100, selection_policy='fifo'):
+    """Run the relay on a new event loop until we're told to stop."""
+
+    _control_log.info("Using the [%s] protobuf backend.",
+                      get_protobuf_backend())
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    relay = Relay(high_watermark,
+                  low_watermark,
+                  pending_max,
+                  pending_wait,
+                  pool_low,
+                  command_batch,
+                  selection_policy)
+
+    servers = loop.run_until_complete(relay.start(dport, cport, tport))
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, loop.stop)
+
+    try:
+        loop.run_forever()
+    finally:
+        for server in servers:
+            server.close()
+
+        loop.close()
@@ -1,4 +1,6 @@
 #!/bin/sh
 
-protoc --python_out=../../message_types *.proto
-
+# See gen_pb2.py for why protoc's own Python output isn't used.
+for proto in *.proto; do
+    python gen_pb2.py $proto > ../../message_types/${proto%.proto}_pb2.py
+done
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+
+"""Writes the Python module for the given .proto, from protoc's descriptor of
+it. The module works with any protobuf 3 runtime, on Python 2 and 3, and with
+any backend. Recent protoc's own output needs protobuf 3.20 (which there is no
+Python 2 build of), and older protoc's doesn't load on Python 3.
+
+    python gen_pb2.py command.proto > ../../message_types/command_pb2.py
+"""
+
+import os
+import subprocess
+import sys
+
+from google.protobuf.descriptor_pb2 import FileDescriptorSet
+
+
+def _get_literal(data):
+    """Return a bytes literal that reads the same on Python 2 and 3."""
+
+    characters = []
+    for byte in bytearray(data):
+        if byte == ord('\\') or byte == ord("'"):
+            characters.append('\\' + chr(byte))
+        elif 32 <= byte < 127:
+            characters.append(chr(byte))
+        else:
+            characters.append('\\x%02x' % (byte))
+
+    return "b'" + ''.join(characters) + "'"
+
+def _get_file_descriptor(proto_path):
+    (directory, name) = os.path.split(os.path.abspath(proto_path))
+
+    output = subprocess.check_output(['protoc',
+                                      '-I', directory,
+                                      '--descriptor_set_out=/dev/stdout',
+                                      name])
+
+    descriptors = FileDescriptorSet()
+    descriptors.ParseFromString(output)
+
+    return descriptors.file[0]
+
+def _write_message(lines, message, parent_variable, path):
+    """Write the lookups for the message and its nested types, and the
+    classes, depth-first.
+    """
+
+    variable = '_' + '_'.join(path).upper()
+
+    if parent_variable is None:
+        lines.append("%s = DESCRIPTOR.message_types_by_name['%s']" %
+                     (variable, message.name))
+    else:
+        lines.append("%s = %s.nested_types_by_name['%s']" %
+                     (variable, parent_variable, message.name))
+
+    for enum in message.enum_type:
+        lines.append("%s_%s = %s.enum_types_by_name['%s']" %
+                     (variable, enum.name.upper(), variable, enum.name))
+
+    nested = {}
+    for nested_message in message.nested_type:
+        nested[nested_message.name] = \
+            _write_message(lines,
+                           nested_message,
+                           variable,
+                           path + [nested_message.name])
+
+    class_lines = ["%s = _reflection.GeneratedProtocolMessageType("
+                   "'%s', (_message.Message,), {" % (message.name,
+                                                     message.name)]
+
+    for (name, nested_lines) in sorted(nested.items()):
+        class_lines.append("  '%s' : %s," % (name, nested_lines))
+
+    class_lines.append("  'DESCRIPTOR' : %s," % (variable))
+    class_lines.append("  '__module__' : __name__,")
+    class_lines.append("  })")
+
+    if parent_variable is None:
+        lines.extend(class_lines)
+        lines.append("_sym_db.RegisterMessage(%s)" % (message.name))
+        lines.append('')
+
+        return None
+
+    # Nested classes are built inline, within their parent's.
+    return '\n'.join(class_lines)
+
+def generate(proto_path):
+    file_descriptor = _get_file_descriptor(proto_path)
+
+    lines = ['# Generated from %s by gen_pb2.py.  DO NOT EDIT!' %
+                 (file_descriptor.name),
+             'from google.protobuf import descriptor_pool as _descriptor_pool',
+             'from google.protobuf import message as _message',
+             'from google.protobuf import reflection as _reflection',
+             'from google.protobuf import symbol_database as _symbol_database',
+             '',
+             '_sym_db = _symbol_database.Default()',
+             '',
+             '# Older runtimes don\'t return the file from AddSerializedFile().',
+             '_pool = _descriptor_pool.Default()',
+             '_pool.AddSerializedFile(',
+             '    %s)' % (_get_literal(file_descriptor.SerializeToString())),
+             '',
+             "DESCRIPTOR = _pool.FindFileByName('%s')" %
+                 (file_descriptor.name),
+             '']
+
+    for enum in file_descriptor.enum_type:
+        lines.append("_%s = DESCRIPTOR.enum_types_by_name['%s']" %
+                     (enum.name.upper(), enum.name))
+
+    for message in file_descriptor.message_type:
+        _write_message(lines, message, None, [message.name])
+
+    return '\n'.join(lines) + '\n'
+
+if __name__ == '__main__':
+    sys.stdout.write(generate(sys.argv[1]))
@@ -1,27 +1,87 @@
-from struct import pack
+from struct import Struct
 from google.protobuf.message import DecodeError
+from twisted.internet import reactor
 from twisted.internet.protocol import Protocol
 from twisted.python import log
 
+from relayserver import event_log, metrics
 from relayserver.utility import get_hex_dump
+from relayserver.frame_buffer import FrameBuffer, SlabFrameBuffer
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types.codec import decode_fixed_command, \
+                                            DECODE_FIXED
+
+_PREFIX = Struct('>I')
+
+_control_log = event_log.get_logger(event_log.CONTROL_PLANE)
+
+_frame_buffer_gauge = metrics.gauge(
+    'relay_frame_buffer_bytes',
+    "Bytes received on framed connections that don't complete a message, "
+    "yet.")
 
 class BaseProtocol(Protocol):
+    __frames = None
+    __framing = False
+
+    # What this connection contributes to the frame-buffer gauge.
+    __buffered = 0
+
+    # Set when messages are gathered and written once per reactor iteration.
+    __batching = False
+    __outgoing = None
+
+    def batch_writes(self):
+        """Gather the messages written during a reactor iteration, and write 
+        them together at the end of it. Only use this where nothing else is 
+        written to the transport, as they would overtake the messages.
+        """
+
+        self.__batching = True
+        self.__outgoing = []
+
     def write_message(self, message):
         data = message.SerializeToString()
-        message_len = len(data)
-        prefix = pack('>I', message_len)
-        
-        total_len = len(prefix) + message_len
-    
-        log.msg("Message type [%s] serialized into (%d) bytes and wrapped as "
-                "(%d) bytes." % 
-                (message.__class__.__name__, message_len, total_len))
-
-        self.transport.write(prefix)
-        self.transport.write(data)
+
+        # The prefix and the message go out as one string, in one write.
+        frame = _PREFIX.pack(len(data)) + data
+
+        if self.__batching is False:
+            self.transport.write(frame)
+            return
+
+        if not self.__outgoing:
+            reactor.callLater(0, self.flush_messages)
+
+        self.__outgoing.append(frame)
+
+    def flush_messages(self):
+        """Write any messages that have been gathered, now."""
+
+        outgoing = self.__outgoing
+        if not outgoing:
+            return
+
+        self.__outgoing = []
+        self.transport.writeSequence(outgoing)
+
+    @property
+    def gathered_count(self):
+        """The number of messages waiting to be written together."""
+
+        return len(self.__outgoing) if self.__outgoing is not None else 0
 
     def parse_or_raise(self, message_raw, type_):
-        log.msg("Parsing [%s] in (%d) bytes." % (type_.__name__, len(message_raw)))
+        _control_log.sampled(event_log.DEBUG, 
+                             "Parsing [%s] in (%d) bytes.", 
+                             type_.__name__, len(message_raw))
+
+        if type_ is Command and DECODE_FIXED is True:
+            # Most commands have a fixed shape, and don't need protobuf's 
+            # pure-Python parser (see relayserver.message_types.codec).
+            message = decode_fixed_command(message_raw)
+            if message is not None:
+                return message
 
         message = type_()
 
@@ -36,3 +96,131 @@ class BaseProtocol(Protocol):
 
         return message
 
+    def set_frame_handlers(self, type_, handlers, type_field=None):
+        """Start framing the data received on this connection. Every message
+        will be parsed as the given protobuf type and passed to a handler from
+        the given table. If a type-field is given, the table is keyed by the
+        value of that field. Otherwise, the table is expected to have a single
+        handler keyed by None.
+
+        If the transport reads into a buffer (see get_buffer()), the data is
+        framed in slabs. Otherwise, it's pushed to dispatch_frames().
+        """
+
+        self.__frames = None
+        self.__framing = True
+
+        self.__frame_type = type_
+        self.__frame_handlers = handlers
+        self.__frame_type_field = type_field
+
+    def stop_framing(self):
+        """Stop dispatching messages (a handler may call this when the
+        remaining data on the connection isn't framed). Return whatever bytes
+        were still buffered.
+        """
+
+        self.__framing = False
+
+        if self.__frames is None:
+            return b''
+
+        remaining = self.__frames.read_remaining()
+
+        self.__update_buffered()
+        return remaining
+
+    def release_frames(self):
+        """The connection has been lost. Forget whatever was buffered."""
+
+        if self.__frames is not None:
+            self.__frames.release()
+
+        _frame_buffer_gauge.dec(self.__buffered)
+        self.__buffered = 0
+
+    def __update_buffered(self):
+        buffered = len(self.__frames)
+
+        _frame_buffer_gauge.inc(buffered - self.__buffered)
+        self.__buffered = buffered
+
+    def dispatch_frames(self, data):
+        """Buffer the given data, and dispatch every message that is now
+        complete, in order.
+        """
+
+        frames = self.__frames
+        if frames is None:
+            frames = self.__frames = FrameBuffer()
+
+        frames.push(data)
+
+        try:
+            self.__dispatch_buffered_frames(frames)
+        finally:
+            self.__update_buffered()
+
+    def get_buffer(self, sizehint):
+        """Called by transports that read straight into a buffer (see
+        relayserver.flow_control), before each read. While we're framing, we
+        return a view of a slab to read into. Otherwise, we return None, and
+        the data is passed to dataReceived(), as usual.
+        """
+
+        if self.__framing is False:
+            return None
+
+        frames = self.__frames
+        if frames is None:
+            frames = self.__frames = SlabFrameBuffer()
+        elif isinstance(frames, FrameBuffer) is True:
+            # Data has already been pushed to dispatch_frames() (e.g. bytes
+            # that were handed over with the connection), so the rest has to
+            # follow it there.
+            return None
+
+        return frames.get_buffer()
+
+    def buffer_updated(self, nbytes):
+        """The given number of bytes have been read into the buffer that
+        get_buffer() returned. Dispatch every message that is now complete.
+        """
+
+        frames = self.__frames
+        frames.buffer_updated(nbytes)
+
+        try:
+            self.__dispatch_buffered_frames(frames)
+        except:
+            log.err()
+        finally:
+            # Nothing holds on to the messages once they've been handled.
+            frames.recycle()
+            self.__update_buffered()
+
+    def __dispatch_buffered_frames(self, frames):
+        while self.__framing is True:
+            message_raw = frames.read_message()
+            if message_raw is None:
+                break
+
+            message = self.parse_or_raise(message_raw, self.__frame_type)
+
+            if self.__frame_type_field is None:
+                key = None
+            else:
+                key = getattr(message, self.__frame_type_field)
+
+            try:
+                handler = self.__frame_handlers[key]
+            except KeyError:
+                _control_log.info("There is no handler for message [%s] with "
+                                  "type (%s). Ignoring.", 
+                                  self.__frame_type.__name__, key)
+            else:
+                handler(message)
+
+    @property
+    def framing(self):
+        return self.__framing
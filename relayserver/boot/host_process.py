@@ -1,22 +1,39 @@
 #!/usr/bin/python
 
 from argparse import ArgumentParser
-from sys import stdout
+from os import urandom, getpid
+from socket import gethostname
+from sys import stdout, version_info
 
 from twisted.internet import reactor
-from twisted.internet.protocol import ReconnectingClientFactory
+from twisted.internet.protocol import ClientFactory, \
+                                      ReconnectingClientFactory
 from twisted.python.log import startLogging
 from twisted.python import log
 
+from relayserver import event_log
 from relayserver.message_types.command_pb2 import Command
 from relayserver.message_types.hello_pb2 import HostProcessHelloResponse
-from relayserver.message_types import build_msg_data_hphello
+from relayserver.message_types import build_msg_data_hphello, \
+                                      build_msg_cmd_sessionendack, \
+                                      build_msg_cmd_hello, \
+                                      build_msg_cmd_heartbeat, \
+                                      SESSION_END_TOKEN_LENGTH
+from relayserver.message_types.codec import get_protobuf_backend
 from relayserver.base_protocol import BaseProtocol
 from relayserver.endpoint import EndpointBaseProtocol
-from relayserver.read_buffer import ReadBuffer
+from relayserver.flow_control import connect_tcp
+from relayserver.host_pool import HostProcessPool, DRAINING_MAX_DELAY
+from relayserver.reconnect import ReconnectScheduler
+from relayserver.multiplex import MuxConnection
+from relayserver.real.session import SessionConnection
 
 from relayserver.config import EndpointServer
 
+_data_log = event_log.get_logger(event_log.DATA_PLANE)
+_control_log = event_log.get_logger(event_log.CONTROL_PLANE)
+_assignment_log = event_log.get_logger(event_log.ASSIGNMENT)
+
 
 class HostProcess(EndpointBaseProtocol):
     """This is a connection to the relay server. It knows how to configure 
@@ -33,20 +50,37 @@ class HostProcess(EndpointBaseProtocol):
         self.__relay_host = None;
         self.__relay_port = None;
 
-        self.__buffer_cleared = False
-        self.__real_server = EndpointServer(self)
+        self.__session = SessionConnection(self)
+        self.__real_server = EndpointServer(self.__session)
+
+        # Once the relay has announced the end of the session, the token that
+        # the session's data will end with, and the last bytes that we've
+        # received, while they could be the start of it.
+        self.__end_token = None
+        self.__held = ''
+
+        # Set if the connection carries its clients as streams.
+        self.__mux = None
     
     def connectionLost(self, reason):
-        log.msg("Host-process with session-no (%d) has had its connection "
-                "dropped." % (self.__session_id))
+        _data_log.debug("Host-process with session-no (%s) has had its "
+                        "connection dropped.", self.__session_id)
 
         self.__real_server.shutdown()
+
+        if self.__mux is not None:
+            self.__mux.connection_lost()
+
+        self.__factory.pool.connection_lost(self)
     
     def connectionMade(self):
-        log.msg("We've successfully connected to the relay server. "
-                      "Sending hello.")
+        _data_log.debug("We've successfully connected to the relay server. "
+                        "Sending hello.")
                 
-        hello = build_msg_data_hphello()
+        hello = build_msg_data_hphello(self.__factory.recycle_sessions, 
+                                       self.__factory.multiplex, 
+                                       self.__factory.host_process_id, 
+                                       self.__factory.weight)
         self.write_message(hello)
 
     def __handle_configuration_data(self, data):
@@ -64,27 +98,110 @@ class HostProcess(EndpointBaseProtocol):
         self.__relay_host = response.relay_host;
         self.__relay_port = int(response.relay_port);
 
-        log.msg("Received hello response: SESSION-NO=(%d) RHOST=[%s] "
-                      "RPORT=(%d)" % 
-                      (self.__session_id, self.__relay_host, 
-                       self.__relay_port))
+        _data_log.debug("Received hello response: SESSION-NO=(%d) RHOST=[%s] "
+                        "RPORT=(%d)", 
+                        self.__session_id, self.__relay_host, 
+                        self.__relay_port)
 
         self.__configured = True
-        self.__factory.resetDelay()
-    
+        self.__factory.pool.connection_configured(self.__factory, self)
+
+        if self.__factory.multiplex is True:
+            self.__mux = MuxConnection(self.transport, self.__handle_new_stream)
+
+        # A client that was waiting on us will have had its data sent right
+        # behind the response, so it might have arrived in the same chunk (or
+        # in the chunks that completed the response).
+        for chunk in self.get_and_clear_chunks():
+            self.__receive_data(chunk)
+
     def dataReceived(self, data):
         try:
             if self.__configured is False:
                 self.__handle_configuration_data(data)
             else:
-                if self.__buffer_cleared is False:
-                    data = self.get_and_clear_buffer() + data
-                    self.__buffer_cleared = True
-
-                self.__real_server.receive_data(data)
+                self.__receive_data(data)
         except Exception as e:
             log.err()
 
+    def __receive_data(self, data):
+        if self.__mux is not None:
+            self.__mux.receive(data)
+            return
+
+        if self.__end_token is None:
+            self.__real_server.receive_data(data)
+            return
+
+        # The session is ending. Whatever comes after the token belongs to the 
+        # next one.
+        data = self.__held + data
+
+        position = data.find(self.__end_token)
+        if position == -1:
+            held_from = max(0, len(data) - SESSION_END_TOKEN_LENGTH + 1)
+            self.__held = data[held_from:]
+
+            if held_from > 0:
+                self.__real_server.receive_data(data[:held_from])
+
+            return
+
+        if position > 0:
+            self.__real_server.receive_data(data[:position])
+
+        self.__session_ended()
+
+        remaining = data[position + SESSION_END_TOKEN_LENGTH:]
+        if remaining:
+            self.__receive_data(remaining)
+
+    def __handle_new_stream(self, stream):
+        """The relay has assigned a client to us, as a stream."""
+
+        _data_log.debug("Stream (%d) opened on multiplexed host-process with "
+                        "session-no (%d).", 
+                        stream.stream_id, self.__session_id)
+
+        real_server = EndpointServer(stream)
+        stream.set_handlers(real_server.receive_data, real_server.shutdown)
+
+    def end_session(self, token, command_channel):
+        """The relay has announced the end of the session. We mark the end of 
+        our side of it with a token of our own, and acknowledge it over the 
+        given command-channel. The relay only then marks the end of its side 
+        with the given token, so, until then, nothing that we've received can 
+        be the token, and nothing has had to be held back from the 
+        real-server. The real-server still receives the rest of the session, 
+        but whatever it writes from now on is dropped.
+        """
+
+        self.__session.end()
+
+        self.__end_token = token
+        self.__held = ''
+
+        # Nothing is written after this, until we're reassigned.
+        ack_token = urandom(SESSION_END_TOKEN_LENGTH)
+        self.transport.write(ack_token)
+
+        command_channel.acknowledge_session_end(self.__session_id, ack_token)
+
+        # The relay may reassign us as soon as it has the acknowledgement.
+        self.__factory.pool.connection_configured(self.__factory, self)
+
+    def __session_ended(self):
+        _assignment_log.debug("Session on host-process with session-no (%d) "
+                              "has ended. Recycling.", self.__session_id)
+
+        self.__real_server.shutdown()
+
+        self.__session = SessionConnection(self)
+        self.__real_server = EndpointServer(self.__session)
+
+        self.__end_token = None
+        self.__held = ''
+
     @property
     def session_id(self):
         return self.__session_id
@@ -95,72 +212,168 @@ class CommandListener(BaseProtocol):
     as "announcements".
     """    
     
-    def __init__(self):
-        self.__buffer = ReadBuffer()
+    def __init__(self, pool, host_process_id):
+        self.__pool = pool
+        self.__host_process_id = host_process_id
+
+        self.set_frame_handlers(
+            Command, 
+            { Command.CONNECTION_OPEN: self.__handle_new_connection,
+              Command.CONNECTION_DROP: self.__handle_dropped_connection,
+              Command.POOL_LOW: self.__handle_pool_low,
+              Command.SESSION_END: self.__handle_session_end,
+              Command.BATCH: self.__handle_batch,
+              Command.DRAIN: self.__handle_drain, 
+              Command.HEARTBEAT: self.__handle_heartbeat }, 
+            'message_type')
     
     def connectionMade(self):
-        pass
+        # Acknowledgements are small, and many can be sent at once.
+        self.transport.setTcpNoDelay(True)
+        self.batch_writes()
 
-    def __handle_new_connection(self, properties):
+        # Tell the relay whose announcements we want (those for the 
+        # connections that give the same ID).
+        self.write_message(build_msg_cmd_hello(self.__host_process_id, 
+                                               accepts_batches=True))
+
+    def __handle_new_connection(self, announcement):
         """We're about to receive data from a new client."""
         
-        assigned_session_id = properties.assigned_to_session 
+        assigned_session_id = announcement.open_properties.assigned_to_session 
         
-        log.msg("Received announcement of assignment to session-no "
-                      "(%d)." % (assigned_session_id))
+        _control_log.sampled(event_log.DEBUG, 
+                             "Received announcement of assignment to "
+                             "session-no (%d).", assigned_session_id)
+
+        self.__pool.connection_assigned(assigned_session_id)
         
-    def __handle_dropped_connection(self, properties):
+    def __handle_dropped_connection(self, announcement):
         """The client assigned to us has dropped their connection. Ours will be
         dropped imminently."""
         
-        session_id = properties.session_id
+        session_id = announcement.drop_properties.session_id
 
-        log.msg("Received announcement of a connection drop for client "
-                      "with session-no (%d)." % (session_id))
+        _control_log.sampled(event_log.DEBUG, 
+                             "Received announcement of a connection drop for "
+                             "client with session-no (%d).", session_id)
 
-    def __handle_announcement(self, announcement):
-        log.msg("Receiving an announcement with message-type of (%d)." % 
-                      (announcement.message_type))
-        
-        if announcement.message_type == Command.CONNECTION_OPEN:
-            self.__handle_new_connection(announcement.open_properties)
-        elif announcement.message_type == Command.CONNECTION_DROP:
-            self.__handle_dropped_connection(announcement.drop_properties)
+    def __handle_batch(self, announcement):
+        """The relay has coalesced several assignments and drops."""
 
-    def dataReceived(self, data):
-        log.msg("(%d) bytes of data received on command-channel." % (len(data)))
-        
-        try:
-            self.__buffer.push(data)
+        batch = announcement.batch
+
+        _control_log.sampled(event_log.DEBUG, 
+                             "Received a batch of (%d) assignments and (%d) "
+                             "drops.", 
+                             len(batch.opened_sessions), 
+                             len(batch.dropped_sessions))
+
+        for session_id in batch.opened_sessions:
+            self.__pool.connection_assigned(session_id)
 
-            message_raw = self.__buffer.read_message()
-            if message_raw is None:
-                return
+    def __handle_pool_low(self, announcement):
+        """The relay is running short of our connections."""
 
-            log.msg("Message extracted from command-channel.")
+        properties = announcement.pool_low_properties
 
-            announcement = self.parse_or_raise(message_raw, Command)
-            self.__handle_announcement(announcement)            
+        _control_log.sampled(event_log.INFO, 
+                             "Received advisory that the pool is low: (%d) "
+                             "waiting and (%d) clients pending.", 
+                             properties.idle_count, properties.pending_count)
+
+        self.__pool.pool_low(properties.idle_count, properties.pending_count)
+
+    def __handle_drain(self, announcement):
+        """The relay has stopped accepting clients, and will exit once those
+        that it has are done. Whichever relay replaces it, we want to find it
+        promptly.
+        """
+
+        _control_log.info("Received announcement that the relay is "
+                          "draining.")
+
+        self.factory.relay_draining()
+
+    def __handle_heartbeat(self, announcement):
+        """The relay wants to know that we're still here."""
+
+        self.write_message(build_msg_cmd_heartbeat())
+
+    def __handle_session_end(self, announcement):
+        """The client assigned to us has dropped their connection. The 
+        connection will be reused, once we've acknowledged it."""
+
+        properties = announcement.session_end_properties
+
+        _control_log.sampled(event_log.DEBUG, 
+                             "Received announcement of the end of the session "
+                             "on session-no (%d).", properties.session_id)
+
+        connection = self.__pool.get_connection(properties.session_id)
+        if connection is None:
+            _control_log.info("Session-no (%d) is not one of ours.", 
+                              properties.session_id)
+            return
+
+        connection.end_session(properties.token, self)
+
+    def acknowledge_session_end(self, session_id, token):
+        command = build_msg_cmd_sessionendack(session_id, token)
+        self.write_message(command)
+
+    def dataReceived(self, data):
+        _control_log.sampled(event_log.DEBUG, 
+                             "(%d) bytes of data received on command-channel.", 
+                             len(data))
+        
+        try:
+            self.dispatch_frames(data)
         except:
             log.err()
 
 
-class HostProcessClientFactory(ReconnectingClientFactory):
+class HostProcessClientFactory(ClientFactory):
     """This class manages instance-creation for the outgoing host-process 
-    connections. It will reconnect if a connection is broken or times-out while 
-    trying to connect.
+    connections. The pool decides when it (re)connects (see 
+    relayserver.reconnect): whenever a connection is broken or times-out 
+    while trying to connect, we tell it.
     """
 
+    def __init__(self, pool, host, port, recycle_sessions, multiplex, 
+                 host_process_id, weight):
+        self.pool = pool
+        self.recycle_sessions = recycle_sessions
+        self.multiplex = multiplex
+        self.host_process_id = host_process_id
+        self.weight = weight
+
+        self.__host = host
+        self.__port = port
+        self.__connector = None
+
     def __repr__(self):
         return 'HostProcessClientFactory'
     
+    def connect(self):
+        if self.__connector is None:
+            self.__connector = connect_tcp(self.__host, self.__port, self)
+        else:
+            self.__connector.connect()
+
     def startedConnecting(self, connector):
-        log.msg("Started to connect.")
+        _data_log.debug("Started to connect.")
 
     def buildProtocol(self, addr):
-        log.msg("Connected host-process.")
+        _data_log.debug("Connected host-process.")
         return HostProcess(self)
 
+    def clientConnectionFailed(self, connector, reason):
+        self.pool.slot_disconnected(self)
+
+    def clientConnectionLost(self, connector, reason):
+        self.pool.slot_disconnected(self)
+
 
 class CommandListenerClientFactory(ReconnectingClientFactory):
     """This class manages instance-creation for the outgoing command
@@ -168,20 +381,36 @@ class CommandListenerClientFactory(ReconnectingClientFactory):
     trying to connect.
     """
 
+    def __init__(self, pool, host_process_id):
+        self.__pool = pool
+        self.__host_process_id = host_process_id
+
     def __repr__(self):
         return 'CommandListenerClientFactory'
 
     def startedConnecting(self, connector):
-        log.msg("Started to connect.")
+        _control_log.info("Started to connect.")
 
     def buildProtocol(self, addr):
-        log.msg("Connected command-listener.")
+        _control_log.info("Connected command-listener.")
         
-        # We don't have any obligatory communication that happens at the top of
-        # a command connection. Just mark it as successful, immediately.
+        # Our hello isn't answered, so there's nothing to wait for at the top 
+        # of a command connection. Just mark it as successful, immediately.
         self.resetDelay()
 
-        return CommandListener()
+        # Whether or not this is the relay that replaced one that was 
+        # draining, we can back off as usual, again.
+        self.maxDelay = self.__class__.maxDelay
+        self.__pool.relay_connected()
+
+        protocol = CommandListener(self.__pool, self.__host_process_id)
+        protocol.factory = self
+
+        return protocol
+
+    def relay_draining(self):
+        self.maxDelay = DRAINING_MAX_DELAY
+        self.__pool.relay_draining()
 
 def main():
     parser = ArgumentParser(description="Start the host process and establish "
@@ -196,7 +425,87 @@ def main():
                         nargs='?', 
                         default=10, 
                         type=int, 
-                        help="Number of connections to maintain.")
+                        help="Number of connections to open at startup.")
+
+    parser.add_argument('--min-connections', 
+                        default=1, 
+                        type=int, 
+                        help="The pool never shrinks below this many "
+                             "connections.")
+
+    parser.add_argument('--max-connections', 
+                        default=100, 
+                        type=int, 
+                        help="The pool never grows beyond this many "
+                             "connections.")
+
+    parser.add_argument('--target-idle', 
+                        default=5, 
+                        type=int, 
+                        help="Number of connections to keep waiting for "
+                             "clients, at least.")
+
+    parser.add_argument('--reconnect-rate', 
+                        default=100, 
+                        type=float, 
+                        help="Open at most this many connections a second "
+                             "(see relayserver.reconnect).")
+
+    parser.add_argument('--reconnect-max-delay', 
+                        default=10, 
+                        type=float, 
+                        help="While the relay is down, probe for it at least "
+                             "this often (in seconds).")
+
+    parser.add_argument('--no-recycle', 
+                        dest='recycle_sessions', 
+                        action='store_false', 
+                        help="Reconnect after every client, rather than "
+                             "reusing connections.")
+
+    parser.add_argument('--multiplex', 
+                        action='store_true', 
+                        help="Carry any number of clients over each "
+                             "connection, as streams. The pool is then fixed "
+                             "at --num-connections.")
+
+    parser.add_argument('--host-process-id', 
+                        default='%s:%d' % (gethostname(), getpid()), 
+                        help="Identifies this host-process to the relay, "
+                             "which groups its connections by it. Defaults "
+                             "to the hostname and process-ID.")
+
+    parser.add_argument('--weight', 
+                        default=1, 
+                        type=int, 
+                        help="This host-process's capacity, relative to "
+                             "other host-processes', for the relay's "
+                             "selection-policy.")
+
+    parser.add_argument('--core', 
+                        default='twisted', 
+                        choices=('twisted', 'asyncio'), 
+                        help="Run on Twisted, or on asyncio (Python 3 only; "
+                             "see relayserver.aio). The asyncio pool is "
+                             "fixed at --num-connections.")
+
+    parser.add_argument('--log-level', 
+                        dest='log_levels', 
+                        action='append', 
+                        default=[], 
+                        help="LEVEL, or CATEGORY=LEVEL (data, control, or "
+                             "assignment), for the events to log. May be "
+                             "repeated.")
+
+    parser.add_argument('--log-sample-rate', 
+                        default=10, 
+                        type=int, 
+                        help="Log at most this many of each per-chunk or "
+                             "per-message event per second (0 logs all).")
+
+    parser.add_argument('--log-file', 
+                        help="Write the log to this file, from a thread, "
+                             "rather than to Twisted's log.")
 
     parser.add_argument('dport', 
                         nargs='?', 
@@ -213,6 +522,11 @@ def main():
 
     args = parser.parse_args()
 
+    try:
+        args.log_levels = event_log.parse_levels(args.log_levels)
+    except ValueError as e:
+        parser.error(str(e))
+
     host = args.host
     num_connections = args.num_connections
     dport = args.dport
@@ -220,16 +534,66 @@ def main():
 
     #startLogging(stdout)
 
-    reactor.connectTCP(host, cport, CommandListenerClientFactory())
-
-    # Spawn a series of connections to wait for incoming requests. As these are
-    # "reconnecting" factories, they will all try to reconnect when their
-    # connections are dropped after each client has finished-up (or for any 
-    # other reason).
-    i = num_connections
-    while i > 0:
-        reactor.connectTCP(host, dport, HostProcessClientFactory())
-        i -= 1
+    event_log.configure(args.log_levels, args.log_sample_rate)
+
+    if args.core == 'asyncio':
+        if version_info < (3,):
+            parser.error("The asyncio core needs Python 3.")
+        elif args.multiplex is True:
+            parser.error("The asyncio core doesn't multiplex.")
+        elif args.log_file is not None:
+            parser.error("The asyncio core doesn't write a log file.")
+
+        from relayserver.aio.host_process import start_host_process
+
+        start_host_process(host, 
+                           dport, 
+                           cport, 
+                           num_connections, 
+                           args.recycle_sessions, 
+                           args.host_process_id, 
+                           args.weight)
+        return
+
+    if args.log_file is not None:
+        event_log.start_file_sink(args.log_file)
+
+    _control_log.info("Using the [%s] protobuf backend.", 
+                      get_protobuf_backend())
+
+    def create_slot():
+        return HostProcessClientFactory(pool, 
+                                        host, 
+                                        dport, 
+                                        args.recycle_sessions, 
+                                        args.multiplex, 
+                                        args.host_process_id, 
+                                        args.weight)
+
+    if args.multiplex is True:
+        (min_connections, max_connections) = (num_connections, num_connections)
+    else:
+        (min_connections, max_connections) = (args.min_connections, 
+                                              args.max_connections)
+
+    scheduler = ReconnectScheduler(args.reconnect_rate, 
+                                   max_delay=args.reconnect_max_delay)
+
+    pool = HostProcessPool(create_slot, 
+                           min_connections, 
+                           max_connections, 
+                           args.target_idle, 
+                           scheduler=scheduler)
+
+    connect_tcp(host, 
+                cport, 
+                CommandListenerClientFactory(pool, args.host_process_id))
+
+    # Spawn a series of connections to wait for incoming requests. The pool 
+    # reconnects each when its connection is dropped after its client has 
+    # finished-up (or for any other reason), and adds and retires them with 
+    # demand.
+    pool.start(num_connections)
 
     reactor.run()
 
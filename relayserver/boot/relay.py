@@ -1,6 +1,68 @@
 from argparse import ArgumentParser
+from sys import exit, version_info
 
-from relayserver.main import start_relay
+from relayserver import event_log
+from relayserver.selection import POLICIES
+from relayserver.workers import run_workers
+
+# The relay (and, with it, the reactor) is only imported once we know whether 
+# we're forking workers: each worker needs a reactor of its own.
+
+def _start_asyncio(args):
+    if args.uvloop is True:
+        import uvloop
+        uvloop.install()
+
+    from relayserver.aio.relay import start_relay
+
+    event_log.configure(args.log_levels, args.log_sample_rate)
+
+    start_relay(args.dport, 
+                args.cport, 
+                args.tport, 
+                args.high_watermark, 
+                args.low_watermark, 
+                args.pending_max, 
+                args.pending_timeout, 
+                args.pool_low, 
+                args.command_batch, 
+                args.selection_policy)
+
+def _start(args, bus=None):
+    from relayserver.main import start_relay
+
+    event_log.configure(args.log_levels, args.log_sample_rate)
+
+    if args.log_file is not None:
+        # Each worker writes a file of its own.
+        if bus is None:
+            event_log.start_file_sink(args.log_file)
+        else:
+            event_log.start_file_sink('%s.%d' % (args.log_file, bus.index))
+
+    start_relay(args.dport, 
+                args.cport, 
+                args.tport, 
+                args.data_plane, 
+                args.high_watermark, 
+                args.low_watermark, 
+                bus, 
+                args.pending_max, 
+                args.pending_timeout, 
+                args.pool_low, 
+                args.command_batch, 
+                args.metrics_port, 
+                args.selection_policy, 
+                args.handoff_path, 
+                args.drain_timeout, 
+                args.hp_idle_timeout, 
+                args.idle_timeout, 
+                args.heartbeat_interval)
+
+def _start_worker(args, index, bus_directory):
+    from relayserver.worker_bus import WorkerBus
+
+    _start(args, WorkerBus(index, args.workers, bus_directory))
 
 def main():
     parser = ArgumentParser(description='Start a protocol-agnostic relay '
@@ -25,9 +87,178 @@ def main():
                         type=int, 
                         help="Port for client data-channel connections.")
 
+    parser.add_argument('-p', '--data-plane', 
+                        default='twisted', 
+                        choices=('twisted', 'splice'), 
+                        help="How bytes are moved between assigned "
+                             "connections. \"splice\" keeps them in the "
+                             "kernel (Linux only).")
+
+    parser.add_argument('--high-watermark', 
+                        default=65536, 
+                        type=int, 
+                        help="Stop reading from a connection when this many "
+                             "bytes are waiting to be written to its peer.")
+
+    parser.add_argument('--low-watermark', 
+                        default=16384, 
+                        type=int, 
+                        help="Resume reading from a connection when the "
+                             "bytes waiting to be written to its peer have "
+                             "dropped to this many.")
+
+    parser.add_argument('--pending-max', 
+                        default=1000, 
+                        type=int, 
+                        help="Number of clients that may wait for a host-"
+                             "process connection before new ones are turned "
+                             "away.")
+
+    parser.add_argument('--pending-timeout', 
+                        default=10, 
+                        type=float, 
+                        help="Seconds that a client may wait for a host-"
+                             "process connection before it's dropped.")
+
+    parser.add_argument('--pool-low', 
+                        default=2, 
+                        type=int, 
+                        help="Advise the host-process to open more "
+                             "connections whenever fewer than this many are "
+                             "waiting.")
+
+    parser.add_argument('--command-batch', 
+                        default=100, 
+                        type=int, 
+                        help="Announce up to this many assignments and drops "
+                             "to the host-process in one command (1 sends "
+                             "each on its own, as it is for host-processes "
+                             "that don't say that they accept batches).")
+
+    parser.add_argument('--selection-policy', 
+                        default='fifo', 
+                        choices=sorted(POLICIES), 
+                        help="How to pick the waiting host-process "
+                             "connection that each new client is assigned "
+                             "to (see relayserver.selection).")
+
+    parser.add_argument('--metrics-port', 
+                        type=int, 
+                        help="Serve metrics over HTTP on this port (plus the "
+                             "worker's index, with workers).")
+
+    parser.add_argument('--handoff-path', 
+                        help="Take over the listening sockets and connections "
+                             "of the relay listening on this Unix socket (if "
+                             "there is one), and then listen on it for the "
+                             "relay that will replace us (see "
+                             "relayserver.handoff).")
+
+    parser.add_argument('--drain-timeout', 
+                        default=30, 
+                        type=float, 
+                        help="Once draining (on SIGUSR1, or once we've "
+                             "handed over), exit after at most this many "
+                             "seconds.")
+
+    parser.add_argument('--hp-idle-timeout', 
+                        default=300, 
+                        type=float, 
+                        help="Drop a host-process connection that has "
+                             "waited this many seconds to say hello, or for "
+                             "a client (0 never does; Twisted core only).")
+
+    parser.add_argument('--idle-timeout', 
+                        default=0, 
+                        type=float, 
+                        help="Drop a client that nothing has been relayed "
+                             "for, either way, for this many seconds (0 "
+                             "never does).")
+
+    parser.add_argument('--heartbeat-interval', 
+                        default=10, 
+                        type=float, 
+                        help="Send a heartbeat to each host-process this "
+                             "often, and drop its command-channel once it "
+                             "hasn't been heard from for three of them (0 "
+                             "sends none; Twisted core only).")
+
+    parser.add_argument('--log-level', 
+                        dest='log_levels', 
+                        action='append', 
+                        default=[], 
+                        help="LEVEL, or CATEGORY=LEVEL (data, control, or "
+                             "assignment), for the events to log. May be "
+                             "repeated.")
+
+    parser.add_argument('--log-sample-rate', 
+                        default=10, 
+                        type=int, 
+                        help="Log at most this many of each per-chunk or "
+                             "per-message event per second (0 logs all).")
+
+    parser.add_argument('--log-file', 
+                        help="Write the log to this file (suffixed with the "
+                             "worker's index, with workers), from a thread, "
+                             "rather than to Twisted's log.")
+
+    parser.add_argument('--core', 
+                        default='twisted', 
+                        choices=('twisted', 'asyncio'), 
+                        help="Run the relay on Twisted, or on asyncio "
+                             "(Python 3 only; see relayserver.aio).")
+
+    parser.add_argument('--uvloop', 
+                        action='store_true', 
+                        help="Run the asyncio core on uvloop.")
+
+    parser.add_argument('-w', '--workers', 
+                        default=1, 
+                        type=int, 
+                        help="Number of relay processes sharing the ports.")
+
     args = parser.parse_args()
 
-    start_relay(args.dport, args.cport, args.tport)
+    try:
+        args.log_levels = event_log.parse_levels(args.log_levels)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.core == 'asyncio':
+        # Only the relay itself has been ported.
+        if version_info < (3,):
+            parser.error("The asyncio core needs Python 3.")
+        elif args.workers > 1:
+            parser.error("The asyncio core doesn't run workers.")
+        elif args.data_plane != 'twisted':
+            parser.error("The asyncio core only has its own data-plane.")
+        elif args.metrics_port is not None:
+            parser.error("The asyncio core doesn't serve metrics.")
+        elif args.log_file is not None:
+            parser.error("The asyncio core doesn't write a log file.")
+        elif args.handoff_path is not None:
+            parser.error("The asyncio core doesn't hand over.")
+        elif args.idle_timeout > 0:
+            parser.error("The asyncio core doesn't time out idle clients.")
+
+        _start_asyncio(args)
+    elif args.uvloop is True:
+        parser.error("--uvloop only applies to the asyncio core.")
+    elif args.handoff_path is not None and args.workers > 1:
+        parser.error("Workers don't hand over.")
+    elif args.handoff_path is not None and args.data_plane != 'twisted':
+        # The data-pump's pipes can't be handed over.
+        parser.error("Only the \"twisted\" data-plane hands over.")
+    elif args.idle_timeout > 0 and args.data_plane != 'twisted':
+        # The bytes that the data-pump moves never pass us.
+        parser.error("Only the \"twisted\" data-plane times out idle "
+                     "clients.")
+    elif args.workers > 1:
+        exit(run_workers(args.workers, 
+                         lambda index, bus_directory: 
+                             _start_worker(args, index, bus_directory)))
+    else:
+        _start(args)
 
 if __name__ == '__main__':
     main()
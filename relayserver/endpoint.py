@@ -1,51 +1,36 @@
-from struct import unpack
-from threading import Lock
-
 from relayserver.base_protocol import BaseProtocol
+from relayserver.frame_buffer import FrameBuffer
 
 
 class EndpointBaseProtocol(BaseProtocol):
-    __locker = Lock()
+    """The data received before the connection is configured is kept in a 
+    FrameBuffer, so each chunk is queued rather than appended to what came 
+    before it, and they're only joined (once) if the initial message is split 
+    across them. Whatever follows the message is handed back as the chunks 
+    that it arrived in.
+    """
 
     def __init__(self):
-        self.__buffer = ""
+        self.__frames = FrameBuffer()
     
     def push_data(self, data):
         """Data has been received while we are still in an unconfigured state. 
         Push all data until we can see a complete message.
         """
-        
-        with self.__class__.__locker:
-            self.__buffer += data
+
+        self.__frames.push(data)
     
-    def get_and_clear_buffer(self):
-        """This is called every time we receive data, but it's only really of 
-        use immediately following being configured, just in case we pushed any 
-        data that came in right behind the initial message."""
-        
-        with self.__class__.__locker:
-            buffer_ = self.__buffer
-            self.__buffer = ""
+    def get_and_clear_chunks(self):
+        """Return whatever was pushed behind the initial message (a client's 
+        data can arrive right behind it), as a list of chunks. Only the chunk 
+        that the message ended in is copied (from where the message ended).
+        """
 
-        return buffer_
+        return self.__frames.read_remaining_chunks()
     
     def get_initial_message(self):
         """We expect exactly one message within the entire session. Return None 
         if not found.
         """
 
-        length_length = 4
-        current_bytes = len(self.__buffer)
-        if current_bytes < length_length:
-            return None
-
-        length_bytes = self.__buffer[0:length_length]
-        (length,) = unpack('>I', length_bytes)
-
-        if current_bytes < (length_length + length):
-            return None
-            
-        message = self.__buffer[length_length:(length_length + length)]
-        self.__buffer = self.__buffer[(length_length + length):]
-
-        return message
+        return self.__frames.read_message()
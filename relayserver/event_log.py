@@ -0,0 +1,290 @@
+"""Categorized logging for the relay and the host-process.
+
+Every event belongs to a category (the data-plane, the control-plane, or
+assignment) and has a level. An event is only formatted if its category's
+level lets it through, so the arguments are passed along with the format
+rather than formatted by the caller:
+
+    data_log.debug("Forwarding (%d) bytes.", len(data))
+
+Events that can happen for every chunk or every message are logged with
+sampled(), which lets through at most so many of each (by format) per second.
+The next one that gets through says how many were suppressed.
+
+Events go to Twisted's log (so startLogging() still works), unless a file sink
+has been started. The file sink only appends to a list on the reactor thread.
+Every so often, the list is handed to a thread of its own, which writes it.
+
+This doesn't import the reactor until a file sink is started, so it's safe to
+use before the relay forks its workers.
+"""
+
+from collections import deque
+from threading import Thread, Condition
+from time import time, strftime, localtime
+
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVELS = { 'debug': DEBUG,
+           'info': INFO,
+           'warning': WARNING,
+           'error': ERROR }
+
+_LEVEL_NAMES = dict((level, name.upper())
+                    for (name, level)
+                    in LEVELS.items())
+
+DATA_PLANE = 'data'
+CONTROL_PLANE = 'control'
+ASSIGNMENT = 'assignment'
+
+CATEGORIES = (DATA_PLANE, CONTROL_PLANE, ASSIGNMENT)
+
+# Sampled events that are let through, of each, per second. Zero lets all of
+# them through.
+sample_rate = 10
+
+_loggers = { }
+_sink = None
+
+
+class _Sample(object):
+    __slots__ = ('started_at', 'count', 'suppressed')
+
+    def __init__(self, started_at):
+        self.started_at = started_at
+        self.count = 0
+        self.suppressed = 0
+
+
+class Logger(object):
+    __slots__ = ('category', 'level', '__samples')
+
+    def __init__(self, category, level=INFO):
+        self.category = category
+        self.level = level
+
+        # Format => _Sample
+        self.__samples = { }
+
+    def is_enabled(self, level):
+        return level >= self.level
+
+    def debug(self, format_, *args):
+        if DEBUG >= self.level:
+            _emit(self.category, DEBUG, format_, args)
+
+    def info(self, format_, *args):
+        if INFO >= self.level:
+            _emit(self.category, INFO, format_, args)
+
+    def warning(self, format_, *args):
+        if WARNING >= self.level:
+            _emit(self.category, WARNING, format_, args)
+
+    def error(self, format_, *args):
+        if ERROR >= self.level:
+            _emit(self.category, ERROR, format_, args)
+
+    def sampled(self, level, format_, *args):
+        if level < self.level:
+            return
+
+        if sample_rate <= 0:
+            _emit(self.category, level, format_, args)
+            return
+
+        now = time()
+
+        sample = self.__samples.get(format_)
+        if sample is None or now - sample.started_at >= 1.0:
+            suppressed = sample.suppressed if sample is not None else 0
+
+            sample = _Sample(now)
+            self.__samples[format_] = sample
+        else:
+            suppressed = 0
+
+        if sample.count >= sample_rate:
+            sample.suppressed += 1
+            return
+
+        sample.count += 1
+
+        if suppressed > 0:
+            format_ += " (%d similar suppressed)"
+            args += (suppressed,)
+
+        _emit(self.category, level, format_, args)
+
+
+class _FileSink(object):
+    """Buffers lines on the reactor thread, and writes them from another."""
+
+    def __init__(self, filepath, interval, max_pending):
+        self.__file = open(filepath, 'a')
+        self.__max_pending = max_pending
+
+        # (timestamp, level, category, line) tuples.
+        self.__pending = []
+        self.__dropped = 0
+
+        self.__batches = deque()
+        self.__condition = Condition()
+        self.__stopped = False
+
+        self.__writer = Thread(target=self.__write_batches)
+        self.__writer.daemon = True
+
+        self.__flusher = LoopingCall(self.flush)
+        self.__interval = interval
+
+    def start(self):
+        self.__writer.start()
+        self.__flusher.start(self.__interval, now=False)
+
+    def stop(self):
+        if self.__flusher.running is True:
+            self.__flusher.stop()
+
+        self.flush()
+
+        with self.__condition:
+            self.__stopped = True
+            self.__condition.notify()
+
+        self.__writer.join()
+        self.__file.close()
+
+    def write(self, category, level, line):
+        if len(self.__pending) >= self.__max_pending:
+            self.__dropped += 1
+            return
+
+        self.__pending.append((time(), level, category, line))
+
+    def flush(self):
+        """Hand whatever has been buffered to the writer."""
+
+        if not self.__pending and self.__dropped == 0:
+            return
+
+        (batch, self.__pending) = (self.__pending, [])
+
+        if self.__dropped > 0:
+            batch.append((time(),
+                          WARNING,
+                          CONTROL_PLANE,
+                          "(%d) log events were dropped because the sink "
+                          "couldn't keep up." % (self.__dropped)))
+
+            self.__dropped = 0
+
+        with self.__condition:
+            self.__batches.append(batch)
+            self.__condition.notify()
+
+    def __write_batches(self):
+        while 1:
+            with self.__condition:
+                while not self.__batches and self.__stopped is False:
+                    self.__condition.wait()
+
+                if not self.__batches:
+                    return
+
+                batch = self.__batches.popleft()
+
+            lines = []
+            for (timestamp, level, category, line) in batch:
+                lines.append("%s.%03d %-7s [%s] %s\n" %
+                             (strftime('%Y-%m-%d %H:%M:%S',
+                                       localtime(timestamp)),
+                              int(timestamp * 1000) % 1000,
+                              _LEVEL_NAMES[level],
+                              category,
+                              line))
+
+            self.__file.write(''.join(lines))
+            self.__file.flush()
+
+
+def _emit(category, level, format_, args):
+    line = format_ % args if args else format_
+
+    if _sink is not None:
+        _sink.write(category, level, line)
+    else:
+        log.msg(line, category=category, level=level)
+
+def get_logger(category):
+    logger = _loggers.get(category)
+    if logger is None:
+        logger = Logger(category)
+        _loggers[category] = logger
+
+    return logger
+
+def parse_levels(specs):
+    """Parse "LEVEL" and "CATEGORY=LEVEL" strings into a dictionary of
+    category => level. A bare level applies to every category.
+    """
+
+    levels = { }
+    for spec in specs:
+        if '=' in spec:
+            (category, name) = spec.split('=', 1)
+            categories = (category,)
+        else:
+            name = spec
+            categories = CATEGORIES
+
+        if name not in LEVELS:
+            raise ValueError("Log-level [%s] is not valid." % (name))
+
+        for category in categories:
+            if category not in CATEGORIES:
+                raise ValueError("Log-category [%s] is not valid." %
+                                 (category))
+
+            levels[category] = LEVELS[name]
+
+    return levels
+
+def configure(levels=None, sample_rate_=None):
+    global sample_rate
+
+    if levels is not None:
+        for (category, level) in levels.items():
+            get_logger(category).level = level
+
+    if sample_rate_ is not None:
+        sample_rate = sample_rate_
+
+def start_file_sink(filepath, interval=.5, max_pending=100000):
+    """Write events to the given file, from a thread, rather than to Twisted's
+    log. Anything beyond max_pending events in an interval is dropped (and
+    counted).
+    """
+
+    from twisted.internet import reactor
+
+    global _sink
+
+    _sink = _FileSink(filepath, interval, max_pending)
+    _sink.start()
+
+    reactor.addSystemEventTrigger('before', 'shutdown', stop_file_sink)
+
+def stop_file_sink():
+    global _sink
+
+    if _sink is not None:
+        (sink, _sink) = (_sink, None)
+        sink.stop()
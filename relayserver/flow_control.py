@@ -0,0 +1,235 @@
+import socket
+
+from errno import EWOULDBLOCK
+
+from zope.interface import implementer
+
+from twisted.internet import reactor, tcp, main
+from twisted.internet.interfaces import IPushProducer
+
+from relayserver.utility import get_pending_write_length
+
+# Not exposed by the socket module under Python 2.
+_SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+
+class _BufferedReads(object):
+    """Reads straight into a buffer that the protocol provides, if it has
+    get_buffer() and buffer_updated() (as asyncio's buffered protocols do),
+    rather than having a string allocated for every read. get_buffer() may
+    return None, for the read to be passed to dataReceived(), as usual.
+    """
+
+    def doRead(self):
+        protocol = self.protocol
+
+        get_buffer = getattr(protocol, 'get_buffer', None)
+        buffer_ = get_buffer(self.bufferSize) \
+                    if get_buffer is not None \
+                    else None
+
+        if buffer_ is None:
+            return super(_BufferedReads, self).doRead()
+
+        try:
+            nbytes = self.socket.recv_into(buffer_)
+        except socket.error as se:
+            if se.args[0] == EWOULDBLOCK:
+                return
+            else:
+                return main.CONNECTION_LOST
+
+        if nbytes == 0:
+            return main.CONNECTION_DONE
+
+        protocol.buffer_updated(nbytes)
+
+
+class _BufferedClient(_BufferedReads, tcp.Client):
+    pass
+
+
+class _BufferedConnector(tcp.Connector):
+    def _makeTransport(self):
+        return _BufferedClient(self.host, 
+                               self.port, 
+                               self.bindAddress, 
+                               self, 
+                               self.reactor)
+
+
+class _WatermarkServer(_BufferedReads, tcp.Server):
+    """A server transport that bounds how much it buffers for writing. When 
+    more than the high watermark is waiting to be written, its producer is 
+    paused (this is Twisted's own behavior, with the high watermark as the 
+    buffer-size), so it holds no more than that and one read of its peer's. 
+    Twisted only resumes the producer once the buffer is empty, though, so we 
+    resume it as soon as the buffer has drained to the low watermark.
+    """
+
+    def __init__(self, *args, **kwargs):
+        tcp.Server.__init__(self, *args, **kwargs)
+
+        server = self.server
+
+        # When the relay is split across workers, session-numbers are 
+        # interleaved so that they're unique across all of them.
+        self.sessionno = self.sessionno * server.session_stride + \
+                         server.session_offset
+
+        if server.high_watermark is not None:
+            self.bufferSize = server.high_watermark
+
+        self.__low_watermark = server.low_watermark
+
+    def _isSendBufferFull(self):
+        # Twisted counts what it has already written from the front of its 
+        # buffer, too, and so would pause the producer early.
+        return get_pending_write_length(self) > self.bufferSize
+
+    def doWrite(self):
+        result = tcp.Server.doWrite(self)
+
+        if result is None and \
+           self.producer is not None and \
+           self.streamingProducer and \
+           self.producerPaused and \
+           get_pending_write_length(self) <= self.__low_watermark:
+            self.producerPaused = False
+            self.producer.resumeProducing()
+
+        return result
+
+
+class _WatermarkPort(tcp.Port):
+    transport = _WatermarkServer
+
+    def __init__(self, port, factory, high_watermark, low_watermark, 
+                 reuse_port, session_stride, session_offset, skt=None):
+        tcp.Port.__init__(self, port, factory, reactor=reactor)
+
+        # Twisted listens on this one, rather than binding a new one.
+        self._preexistingSocket = skt
+
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.session_stride = session_stride
+        self.session_offset = session_offset
+
+        self.__reuse_port = reuse_port
+
+    def createInternetSocket(self):
+        s = tcp.Port.createInternetSocket(self)
+
+        if self.__reuse_port is True:
+            s.setsockopt(socket.SOL_SOCKET, _SO_REUSEPORT, 1)
+
+        return s
+
+def listen_tcp(port, factory, high_watermark=None, low_watermark=0, 
+               reuse_port=False, session_stride=1, session_offset=0, 
+               skt=None):
+    """Equivalent to reactor.listenTCP(), but the accepted connections will 
+    buffer no more than the given watermarks allow when they're registered as
+    the consumers of a streaming producer, and they read straight into their 
+    protocols' buffers, if they provide them (see _BufferedReads). Several 
+    processes may listen on the same port if they all pass reuse_port (the 
+    kernel balances the accepted connections between them). If a listening 
+    socket is given (e.g. one that was handed over by another process), it's
+    adopted, rather than a new one being bound.
+    """
+
+    port_ = _WatermarkPort(port, 
+                           factory, 
+                           high_watermark, 
+                           low_watermark, 
+                           reuse_port, 
+                           session_stride, 
+                           session_offset, 
+                           skt)
+
+    port_.startListening()
+
+    return port_
+
+def adopt_connection(port, skt, protocol, sessionno):
+    """Take over a socket that was accepted elsewhere (e.g. by another 
+    process), as if the given port had accepted it, and connect the protocol 
+    to it. The connection keeps the given session-number.
+    """
+
+    transport = port.transport(skt, 
+                               protocol, 
+                               skt.getpeername(), 
+                               port, 
+                               sessionno, 
+                               reactor)
+
+    transport.sessionno = sessionno
+    protocol.makeConnection(transport)
+
+    return transport
+
+def release_descriptor(selectable):
+    """Stop watching a transport (or a listening port), and close our 
+    descriptor for its socket, without shutting the socket down, and without 
+    telling its protocol (or factory). This is for when another process has 
+    a descriptor of its own for the socket, and is carrying on with it.
+    """
+
+    selectable.stopReading()
+    selectable.stopWriting()
+    selectable.socket.close()
+
+def connect_tcp(host, port, factory, timeout=30, bind_address=None):
+    """Equivalent to reactor.connectTCP(), but the connection reads straight 
+    into the protocol's buffer, if it provides one (see _BufferedReads).
+    """
+
+    connector = _BufferedConnector(host, 
+                                   port, 
+                                   factory, 
+                                   timeout, 
+                                   bind_address, 
+                                   reactor)
+
+    connector.connect()
+
+    return connector
+
+@implementer(IPushProducer)
+class _PeerProducer(object):
+    """Pauses and resumes reading from a peer's transport. Twisted stops a 
+    transport's producer when the transport is lost, which, if we registered 
+    the peer's transport directly, would close the peer as well. What happens
+    to the peer is up to the relay, so stopping does nothing.
+    """
+
+    def __init__(self, transport):
+        self.__transport = transport
+
+    def pauseProducing(self):
+        self.__transport.pauseProducing()
+
+    def resumeProducing(self):
+        self.__transport.resumeProducing()
+
+    def stopProducing(self):
+        pass
+
+
+def bind_streams(connection1, connection2):
+    """Register each connection's transport as the streaming producer for the 
+    other's. Reading from one side is then paused whenever the other side 
+    can't keep up.
+    """
+
+    connection1.transport.registerProducer(
+        _PeerProducer(connection2.transport), True)
+
+    connection2.transport.registerProducer(
+        _PeerProducer(connection1.transport), True)
+
+def unbind_streams(connection1, connection2):
+    connection1.transport.unregisterProducer()
+    connection2.transport.unregisterProducer()
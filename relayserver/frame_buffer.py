@@ -0,0 +1,272 @@
+from struct import Struct
+
+from relayserver.slab_pool import default_pool
+
+_PREFIX = Struct('>I')
+_PREFIX_LENGTH = _PREFIX.size
+
+
+class FrameBuffer(object):
+    """This class receives incoming data and yields the messages framed within
+    it. A message is defined as a 32-bit integer size, followed by that number
+    of bytes.
+
+    We hold one contiguous buffer and an offset to its first unconsumed byte.
+    When nothing is left over from a previous push, the pushed chunk is simply
+    adopted as that buffer (no copy), and every message within it is sliced
+    straight out of it. Chunks that arrive behind an incomplete message are
+    only queued, and they're joined exactly once, when the queue holds enough
+    to complete that message. The length prefix is always read in place.
+
+    A byte is therefore copied at most a small, constant number of times,
+    however the messages happen to be split across chunks.
+
+    This is only ever touched from the reactor thread, so there is no locking.
+    """
+
+    def __init__(self):
+        self.__buffer = b''
+        self.__offset = 0
+
+        # Chunks received behind an incomplete message.
+        self.__parts = []
+        self.__parts_length = 0
+
+    def __len__(self):
+        return len(self.__buffer) - self.__offset + self.__parts_length
+
+    def push(self, data):
+        if not data:
+            return
+
+        if self.__offset == len(self.__buffer) and not self.__parts:
+            self.__buffer = data
+            self.__offset = 0
+        else:
+            self.__parts.append(data)
+            self.__parts_length += len(data)
+
+    def read_message(self):
+        """Return the next complete message, or None if we don't have [all of]
+        one, yet.
+        """
+
+        if self.__gather(_PREFIX_LENGTH) is False:
+            return None
+
+        (length,) = _PREFIX.unpack_from(self.__buffer, self.__offset)
+
+        if self.__gather(_PREFIX_LENGTH + length) is False:
+            return None
+
+        start = self.__offset + _PREFIX_LENGTH
+        end = start + length
+
+        message = self.__buffer[start:end]
+
+        if end == len(self.__buffer):
+            self.__buffer = b''
+            self.__offset = 0
+        else:
+            self.__offset = end
+
+        return message
+
+    def read_messages(self):
+        """Yield every complete message that is currently buffered."""
+
+        while 1:
+            message = self.read_message()
+            if message is None:
+                return
+
+            yield message
+
+    def read_remaining(self):
+        """Return and clear whatever bytes are still buffered."""
+
+        return b''.join(self.read_remaining_chunks())
+
+    def read_remaining_chunks(self):
+        """Return and clear whatever bytes are still buffered, as the chunks
+        that they were pushed in (the first might have been cut short), rather
+        than joining them. Only a chunk that's been cut short is copied.
+        """
+
+        chunks = self.__parts
+
+        buffer_ = self.__buffer
+        if self.__offset < len(buffer_):
+            chunks.insert(0, buffer_[self.__offset:] \
+                                if self.__offset > 0 \
+                                else buffer_)
+
+        self.__buffer = b''
+        self.__offset = 0
+
+        self.__parts = []
+        self.__parts_length = 0
+
+        return chunks
+
+    def release(self):
+        """Forget whatever's buffered."""
+
+        self.read_remaining()
+
+    def __gather(self, length):
+        """Make sure that the given number of bytes are contiguous in the
+        buffer, if we have them at all. Return False if we don't.
+        """
+
+        available = len(self.__buffer) - self.__offset
+        if available >= length:
+            return True
+
+        if available + self.__parts_length < length:
+            return False
+
+        parts = self.__parts
+        parts.insert(0, self.__buffer[self.__offset:])
+
+        self.__buffer = b''.join(parts)
+        self.__offset = 0
+
+        self.__parts = []
+        self.__parts_length = 0
+
+        return True
+
+
+class SlabFrameBuffer(object):
+    """Frames data that's read straight into it (with recv_into()), rather
+    than pushed. The data is read into a slab from a pool (see
+    relayserver.slab_pool), and every message is returned as a view of the
+    slab, to be parsed in place. The slab goes back to the pool whenever
+    everything in it has been read, so a connection only holds one while it
+    has an incomplete message.
+
+    When the slab fills up behind an incomplete message, what's left of the
+    message is moved to the front (a message that's bigger than a slab is
+    moved to a buffer of its own). Otherwise, nothing is copied.
+
+    Usage:
+
+        view = frames.get_buffer()
+        nbytes = skt.recv_into(view)
+        frames.buffer_updated(nbytes)
+
+        while 1:
+            message = frames.read_message()
+            ...
+
+        frames.recycle()
+    """
+
+    def __init__(self, pool=None):
+        self.__pool = pool if pool is not None else default_pool
+
+        self.__slab = None
+        self.__start = 0
+        self.__end = 0
+
+    def __len__(self):
+        return self.__end - self.__start
+
+    def get_buffer(self):
+        """Return a view to read into."""
+
+        if self.__slab is None:
+            self.__slab = self.__pool.acquire()
+        elif self.__end == len(self.__slab):
+            self.__reserve(self.__end - self.__start + 1)
+
+        return self.__slab[self.__end:]
+
+    def buffer_updated(self, nbytes):
+        """The given number of bytes have been read into the buffer."""
+
+        self.__end += nbytes
+
+    def read_message(self):
+        """Return the next complete message, or None if we don't have [all of]
+        one, yet. The message is a view of the slab, so it's only valid until
+        the next call to get_buffer() or recycle().
+        """
+
+        available = self.__end - self.__start
+        if available < _PREFIX_LENGTH:
+            return None
+
+        (length,) = _PREFIX.unpack_from(self.__slab, self.__start)
+
+        if available < _PREFIX_LENGTH + length:
+            # Make sure that the rest of it will fit.
+            self.__reserve(_PREFIX_LENGTH + length)
+            return None
+
+        start = self.__start + _PREFIX_LENGTH
+        end = start + length
+
+        self.__start = end
+
+        return self.__slab[start:end]
+
+    def read_messages(self):
+        """Yield every complete message that is currently buffered."""
+
+        while 1:
+            message = self.read_message()
+            if message is None:
+                return
+
+            yield message
+
+    def read_remaining(self):
+        """Return (as bytes) and clear whatever is still buffered."""
+
+        if self.__slab is None:
+            return b''
+
+        remaining = self.__slab[self.__start:self.__end].tobytes()
+
+        self.__start = self.__end
+        self.recycle()
+
+        return remaining
+
+    def recycle(self):
+        """Give the slab back if everything in it has been read."""
+
+        if self.__slab is not None and self.__start == self.__end:
+            self.release()
+
+    def release(self):
+        """Give the slab back, and forget whatever's buffered."""
+
+        if self.__slab is not None:
+            self.__pool.release(self.__slab)
+
+        self.__slab = None
+        self.__start = 0
+        self.__end = 0
+
+    def __reserve(self, length):
+        """Make sure that there's room for the given number of bytes from the
+        start of the incomplete message.
+        """
+
+        slab = self.__slab
+        if len(slab) - self.__start >= length:
+            return
+
+        pending = slab[self.__start:self.__end].tobytes()
+
+        if length > len(slab):
+            self.release()
+            self.__slab = slab = memoryview(bytearray(length))
+
+        slab[0:len(pending)] = pending
+
+        self.__start = 0
+        self.__end = len(pending)
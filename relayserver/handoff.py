@@ -0,0 +1,241 @@
+"""Hands a relay's listening sockets and connections over to the relay that's
+replacing it, over a Unix socket, so that restarting the relay doesn't drop
+anything: clients stay connected, and the host-process never knows.
+
+Every relay that's given a handoff path first tries to take over from the
+relay listening there (if there isn't one, it starts as usual), and then
+listens there itself, for the relay that will replace it. The relay being
+replaced waits for the sessions that are ending to end (a session can't be
+handed over half-way through; see SessionEndProperties), and then, all at
+once, passes the descriptor of each of its listening sockets and connections,
+with what the new relay needs to know about it (see HandoffMessage), and
+closes its own descriptors, without shutting the sockets down. The new relay
+adopts each as it arrives. Whatever can't be handed over (multiplexed
+connections, and sessions that didn't end in time), the old relay drains
+before it exits.
+
+The relay is expected to provide: quiesce() (returning a Deferred),
+hand_over() (returning (descriptor, message) pairs, in the order that they
+should be adopted), handed_over(), adopt_port(socket, message),
+adopt_connection(socket, message), and taken_over().
+"""
+
+import os
+import socket
+
+from collections import deque
+from zope.interface import implementer
+
+from twisted.internet import reactor
+from twisted.internet.interfaces import IFileDescriptorReceiver
+from twisted.internet.protocol import Factory, ClientFactory
+from twisted.python import log
+
+from relayserver.base_protocol import BaseProtocol
+from relayserver.flow_control import release_descriptor
+from relayserver.message_types.handoff_pb2 import HandoffMessage
+from relayserver.message_types import build_msg_handoff_request, \
+                                      build_msg_handoff_done
+
+
+@implementer(IFileDescriptorReceiver)
+class _HandoffProtocol(BaseProtocol):
+    """Either end of the connection between the two relays. Descriptors that
+    we receive are held until the message that they accompany arrives.
+    """
+
+    def __init__(self, handoff):
+        self.__handoff = handoff
+        self.__descriptors = deque()
+
+        self.set_frame_handlers(
+            HandoffMessage,
+            { HandoffMessage.REQUEST: self.__handle_request,
+              HandoffMessage.PORT: self.__handle_port,
+              HandoffMessage.CONNECTION: self.__handle_connection,
+              HandoffMessage.DONE: self.__handle_done },
+            'message_type')
+
+    def connectionMade(self):
+        self.__handoff.connection_made(self)
+
+    def connectionLost(self, reason):
+        self.release_frames()
+        self.__handoff.connection_lost(self)
+
+        while self.__descriptors:
+            os.close(self.__descriptors.popleft())
+
+    def fileDescriptorReceived(self, descriptor):
+        self.__descriptors.append(descriptor)
+
+    def dataReceived(self, data):
+        try:
+            self.dispatch_frames(data)
+        except:
+            log.err()
+
+    def __get_socket(self):
+        descriptor = self.__descriptors.popleft()
+
+        try:
+            return socket.fromfd(descriptor, 
+                                 socket.AF_INET, 
+                                 socket.SOCK_STREAM)
+        finally:
+            os.close(descriptor)
+
+    def __handle_request(self, message):
+        self.__handoff.handle_request(self)
+
+    def __handle_port(self, message):
+        self.__handoff.handle_port(self.__get_socket(), message)
+
+    def __handle_connection(self, message):
+        self.__handoff.handle_connection(self.__get_socket(), message)
+
+    def __handle_done(self, message):
+        self.__handoff.handle_done(self)
+
+
+class _HandoffFactory(Factory):
+    def __init__(self, handoff):
+        self.__handoff = handoff
+
+    def buildProtocol(self, addr):
+        return _HandoffProtocol(self.__handoff)
+
+
+class _HandoffClientFactory(ClientFactory):
+    def __init__(self, handoff):
+        self.__handoff = handoff
+
+    def buildProtocol(self, addr):
+        return _HandoffProtocol(self.__handoff)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.__handoff.connection_failed()
+
+
+class Handoff(object):
+    def __init__(self, path, relay):
+        self.__path = path
+        self.__relay = relay
+
+        self.__listener = None
+
+        # While we're taking over, the connection to the relay being replaced.
+        self.__taking_over = None
+
+        # Once we're handing over, the connection to the relay replacing us,
+        # and, once we've handed over, copies of the descriptors that we've
+        # passed, until it's done with them.
+        self.__handing_over = None
+        self.__handed_over = False
+        self.__descriptors = []
+
+    def start(self):
+        """Take over from the relay listening on the path, if there is one,
+        and then listen on it.
+        """
+
+        reactor.connectUNIX(self.__path, _HandoffClientFactory(self))
+
+    def __listen(self):
+        # Whatever is there is either stale, or the listening socket of the
+        # relay that we've replaced, which it has let go of.
+        if os.path.exists(self.__path):
+            os.unlink(self.__path)
+
+        self.__listener = reactor.listenUNIX(self.__path,
+                                             _HandoffFactory(self))
+
+    def connection_failed(self):
+        log.msg("There's no relay to take over from at [%s]." %
+                (self.__path))
+
+        self.__taken_over()
+
+    def connection_made(self, protocol):
+        if self.__listener is None:
+            # We've connected to the relay that we're replacing.
+            self.__taking_over = protocol
+            protocol.write_message(build_msg_handoff_request())
+
+    def connection_lost(self, protocol):
+        if protocol is self.__taking_over:
+            # The relay that we're replacing is gone, whether or not it
+            # finished. We take over whatever it gave us.
+            self.__taken_over()
+
+        elif protocol is self.__handing_over:
+            self.__handing_over = None
+
+            if self.__handed_over is False:
+                log.msg("The relay that was replacing us has gone. Carrying "
+                        "on.")
+                return
+
+            # The relay that's replacing us has its own descriptors, now.
+            while self.__descriptors:
+                os.close(self.__descriptors.pop())
+
+            self.__relay.handed_over()
+
+    def __taken_over(self):
+        self.__taking_over = None
+
+        self.__relay.taken_over()
+        self.__listen()
+
+    def handle_port(self, skt, message):
+        self.__relay.adopt_port(skt, message)
+
+    def handle_connection(self, skt, message):
+        self.__relay.adopt_connection(skt, message)
+
+    def handle_done(self, protocol):
+        log.msg("We've taken over from the relay at [%s]." % (self.__path))
+
+        protocol.transport.loseConnection()
+
+    def handle_request(self, protocol):
+        if self.__handing_over is not None:
+            log.msg("Another relay asked to take over while we're already "
+                    "handing over. Ignoring.")
+
+            protocol.transport.loseConnection()
+            return
+
+        log.msg("Handing over to the relay that's replacing us.")
+
+        self.__handing_over = protocol
+
+        d = self.__relay.quiesce()
+        d.addCallback(lambda result: self.__hand_over(protocol))
+        d.addErrback(log.err)
+
+    def __hand_over(self, protocol):
+        if protocol is not self.__handing_over:
+            # It went while we were waiting.
+            return
+
+        self.__handed_over = True
+
+        # Everything goes at once, so that nothing changes in between.
+        for (descriptor, message) in self.__relay.hand_over():
+            protocol.transport.sendFileDescriptor(descriptor)
+            protocol.write_message(message)
+
+            self.__descriptors.append(descriptor)
+
+        # The new relay listens on the path next, once we're done. We let go
+        # of it without removing it (Twisted would remove it whenever the
+        # reactor gets around to it, which might be after the new relay has
+        # bound it).
+        release_descriptor(self.__listener)
+        self.__listener = None
+
+        protocol.write_message(build_msg_handoff_done())
+
+        log.msg("Handed over (%d) descriptors." % (len(self.__descriptors)))
@@ -0,0 +1,209 @@
+"""Sizes the host-process's pool of data connections to the relay.
+
+Every connection in the pool is a slot: a factory that opens a data
+connection, waits for a client to be assigned to it, and then reconnects once
+the relay has dropped it. A slot is "idle" from when its connection has been
+configured until the relay announces that a client has been assigned to it.
+Slots don't connect by themselves: the pool's scheduler connects them (see
+relayserver.reconnect), so that they come back at a steady rate after the
+relay has dropped them all, and back off together (rather than each on its
+own) while the relay is down.
+
+The pool grows when too few slots are idle (given how quickly clients are
+currently being assigned) or when the relay advises that it's running low, and
+retires idle slots when there are more than it needs. Slots that are waiting
+to connect, or are connecting, count as available (so that we don't keep
+adding them while they connect).
+"""
+
+from math import ceil
+
+from twisted.internet.task import LoopingCall
+from twisted.python import log
+
+from relayserver.reconnect import ReconnectScheduler
+
+# The weight given to the latest interval in the assignment rate.
+_RATE_SMOOTHING = .5
+
+# While the relay is draining, slots probe for it at least this often (in
+# seconds), so that they find the relay that replaces it promptly.
+DRAINING_MAX_DELAY = 1.0
+
+
+class HostProcessPool(object):
+    def __init__(self, create_slot, minimum, maximum, target_idle,
+                 interval=1.0, scheduler=None):
+        """create_slot() is called for each new slot, and must return its
+        factory, whose connect() is called whenever the slot should connect.
+        The factories call back into connection_configured(),
+        connection_lost() and slot_disconnected(), and the command-channel
+        calls connection_assigned() and pool_low().
+        """
+
+        self.__create_slot = create_slot
+        self.__minimum = minimum
+        self.__maximum = maximum
+        self.__target_idle = target_idle
+        self.__interval = interval
+
+        self.__factories = set()
+
+        if scheduler is None:
+            scheduler = ReconnectScheduler()
+
+        self.__scheduler = scheduler
+        self.__max_delay = scheduler.max_delay
+
+        # The slots whose current connection has been configured.
+        self.__configured = set()
+
+        # Session-ID => protocol, for every configured connection, and 
+        # session-ID => (factory, protocol) for the idle ones.
+        self.__connections = { }
+        self.__idle = { }
+
+        # Assignments per second, and the assignments since the last check.
+        self.__rate = 0.0
+        self.__assigned_count = 0
+
+        self.__checker = LoopingCall(self.__check)
+
+    @property
+    def size(self):
+        return len(self.__factories)
+
+    @property
+    def idle_count(self):
+        return len(self.__idle)
+
+    def get_connection(self, session_id):
+        return self.__connections.get(session_id)
+
+    def start(self, initial):
+        self.grow(max(self.__minimum, initial))
+        self.__checker.start(self.__interval, now=False)
+
+    def stop(self):
+        if self.__checker.running is True:
+            self.__checker.stop()
+
+    def grow(self, count):
+        count = min(count, self.__maximum - len(self.__factories))
+        if count <= 0:
+            return
+
+        log.msg("Growing the host-process pool by (%d) from (%d)." %
+                (count, len(self.__factories)))
+
+        for i in range(count):
+            factory = self.__create_slot()
+
+            self.__factories.add(factory)
+            self.__scheduler.schedule(factory, factory.connect)
+
+    def shrink(self, count):
+        """Retire up to count idle slots."""
+
+        count = min(count, 
+                    len(self.__idle), 
+                    len(self.__factories) - self.__minimum)
+
+        if count <= 0:
+            return
+
+        log.msg("Shrinking the host-process pool by (%d) from (%d)." %
+                (count, len(self.__factories)))
+
+        for i in range(count):
+            (session_id, (factory, protocol)) = self.__idle.popitem()
+
+            self.__factories.discard(factory)
+            self.__configured.discard(factory)
+
+            self.__scheduler.cancel(factory)
+            protocol.transport.loseConnection()
+
+    def connection_configured(self, factory, protocol):
+        """The connection is ready for a client, whether it's new or has been
+        recycled.
+        """
+
+        self.__connections[protocol.session_id] = protocol
+
+        if factory in self.__factories:
+            self.__configured.add(factory)
+            self.__idle[protocol.session_id] = (factory, protocol)
+
+            # The relay is up, whoever else is waiting to connect to it.
+            self.__scheduler.handshake_succeeded(factory)
+
+    def connection_lost(self, protocol):
+        session_id = protocol.session_id
+        if session_id is not None:
+            self.__connections.pop(session_id, None)
+            self.__idle.pop(session_id, None)
+
+    def slot_disconnected(self, factory):
+        """The slot couldn't connect, or its connection has gone. It
+        reconnects, unless it has been retired. If its connection was never
+        configured, it counts as a failure.
+        """
+
+        if factory not in self.__factories:
+            return
+
+        failed = factory not in self.__configured
+        self.__configured.discard(factory)
+
+        self.__scheduler.schedule(factory, factory.connect, failed)
+
+    def connection_assigned(self, session_id):
+        self.__assigned_count += 1
+        self.__idle.pop(session_id, None)
+
+        # If we've just used the last of them, don't wait for the next check.
+        if not self.__idle:
+            self.grow(self.__target_idle - self.__scheduler.pending_count)
+
+    def pool_low(self, idle_count, pending_count):
+        """The relay has advised that it only has idle_count of our connections
+        waiting, and pending_count clients waiting for one.
+        """
+
+        available = len(self.__idle) + self.__scheduler.pending_count
+        self.grow(self.__target_idle + pending_count - available)
+
+    def relay_draining(self):
+        """The relay has announced that it's draining. It's about to be 
+        replaced, so our slots don't back off for long while it is.
+        """
+
+        self.__scheduler.max_delay = DRAINING_MAX_DELAY
+
+    def relay_connected(self):
+        """The command-channel has (re)connected to a relay, so it's up."""
+
+        self.__scheduler.max_delay = self.__max_delay
+        self.__scheduler.reset()
+
+    def __check(self):
+        assigned_count = self.__assigned_count
+        self.__assigned_count = 0
+
+        rate = assigned_count / self.__interval
+        self.__rate = _RATE_SMOOTHING * rate + \
+                      (1 - _RATE_SMOOTHING) * self.__rate
+
+        # Keep enough idle to take a whole interval's worth of assignments, as
+        # that's about how long it takes to replace one.
+        desired_idle = max(self.__target_idle,
+                           int(ceil(self.__rate * self.__interval)))
+
+        available = len(self.__idle) + self.__scheduler.pending_count
+        if available < desired_idle:
+            self.grow(desired_idle - available)
+        elif len(self.__idle) > desired_idle:
+            # Retire half of the surplus at a time, so that we don't give up 
+            # everything that we've grown in one quiet interval.
+            self.shrink(max(1, (len(self.__idle) - desired_idle) // 2))
@@ -3,24 +3,150 @@
 # See LICENSE for details.
 
 import sys
+import signal
 
+from os import urandom, dup
+from time import time
 from argparse import ArgumentParser
 from threading import Lock
+from math import ceil
 from collections import OrderedDict
 from twisted.internet import reactor, protocol
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ReactorNotRunning
+from twisted.internet.task import LoopingCall
 from twisted.python.log import startLogging
 from twisted.python import log
 
-from relayserver.read_buffer import ReadBuffer
 from relayserver.message_types.hello_pb2 import Hello
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types.handoff_pb2 import HandoffMessage
+from relayserver.message_types.codec import get_protobuf_backend
 from relayserver.message_types import build_msg_cmd_connopen,\
                                       build_msg_cmd_conndrop,\
-                                      build_msg_data_hphelloresponse
-
+                                      build_msg_cmd_poollow,\
+                                      build_msg_cmd_sessionend,\
+                                      build_msg_cmd_batch,\
+                                      build_msg_cmd_drain,\
+                                      build_msg_cmd_heartbeat,\
+                                      build_msg_data_hphelloresponse,\
+                                      build_msg_handoff_port,\
+                                      build_msg_handoff_connection,\
+                                      SESSION_END_TOKEN_LENGTH
+
+from relayserver import metrics, event_log
 from relayserver.base_protocol import BaseProtocol
+from relayserver.multiplex import MuxConnection, MuxStream
+from relayserver.splice_pump import SplicePump
+from relayserver.selection import FifoPolicy, create_policy
+from relayserver.metrics_server import start_metrics_server
+from relayserver.handoff import Handoff
+from relayserver.timing_wheel import TimingWheel
+from relayserver.utility import get_pending_write_length, take_pending_writes
+from relayserver.flow_control import listen_tcp, adopt_connection, \
+                                     bind_streams, unbind_streams, \
+                                     release_descriptor
 
 ports = None
 
+# The listening ports, by index (as in ports), and the metrics server's.
+_listeners = [None, None, None]
+_metrics_listener = None
+
+# The index that the metrics server's listening socket is handed over with.
+_METRICS_PORT_INDEX = 3
+
+# The optional kernel data-plane (see relayserver.splice_pump). When this is 
+# set, the bytes of assigned pairs are moved by it rather than by dataReceived.
+data_pump = None
+
+# When the relay is split across workers, this connects us to the others (see 
+# relayserver.worker_bus).
+worker_bus = None
+
+# When no host-process connection is waiting, new clients are held for up to 
+# this many seconds, and up to this many of them, before they're turned away.
+pending_limit = 1000
+pending_timeout = 10
+
+# The host-process is advised to open more connections whenever fewer than this
+# many are waiting.
+pool_low_mark = 2
+
+# How long a host-process connection is kept after its client drops. One that 
+# can be reused has this long to acknowledge the end of the session, first.
+session_end_timeout = 5
+
+# A host-process connection that has waited this many seconds to say hello, or
+# for a client, is dropped, so that the host-process replaces any that have 
+# silently gone (0 keeps them for as long as they're connected).
+hp_idle_timeout = 300
+
+# An assigned pair that nothing has been relayed over, either way, for this 
+# many seconds is dropped (0 keeps them).
+idle_timeout = 0
+
+# The command-channels that have said hello are sent a heartbeat this often 
+# (0 sends none), and one that we haven't heard from for this many of them is
+# dropped.
+heartbeat_interval = 10
+_MISSED_HEARTBEATS = 3
+
+# The timers above (and the delayed closes) are kept on a timing-wheel, rather 
+# than being scheduled on the reactor one by one.
+_timers = TimingWheel()
+
+# Assignments and drops are announced to the host-process in batches of up to
+# this many, at the end of each reactor iteration (or once there are this 
+# many). One (or less) announces each in a command of its own, as it is for 
+# host-processes that don't say that they accept batches.
+command_batch_size = 100
+
+# Set once we've stopped accepting clients, to exit once those that we have are
+# done (see drain()), or for at most this many seconds.
+draining = False
+drain_timeout = 30
+
+metrics.gauge_function(
+    'relay_timers',
+    "Timers waiting on the relay's timing-wheel.",
+    lambda: len(_timers))
+
+_pending_clients_gauge = metrics.gauge(
+    'relay_pending_clients',
+    "Clients waiting for a host-process connection.")
+
+_pending_wait_histogram = metrics.histogram(
+    'relay_pending_wait_seconds',
+    "How long clients waited for a host-process connection.",
+    (.001, .005, .01, .05, .1, .5, 1, 5, 10, 30))
+
+_pending_expired_counter = metrics.counter(
+    'relay_pending_expired_total',
+    "Clients dropped after waiting too long for a host-process connection.")
+
+_rejected_clients_counter = metrics.counter(
+    'relay_clients_rejected_total',
+    "Clients turned away because no command-channel was connected or too "
+    "many were already waiting.")
+
+_assignment_latency_histogram = metrics.histogram(
+    'relay_assignment_latency_seconds',
+    "How long clients took to be assigned, from connecting.",
+    (.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 10))
+
+# The bytes relayed from clients to host-processes, and back, by the reactor.
+# These are bumped for every chunk, so they're just a list (the data-pump 
+# keeps its own).
+_CLIENT_TO_HP = 0
+_HP_TO_CLIENT = 1
+
+_bytes_relayed = [0, 0]
+
+_data_log = event_log.get_logger(event_log.DATA_PLANE)
+_control_log = event_log.get_logger(event_log.CONTROL_PLANE)
+_assignment_log = event_log.get_logger(event_log.ASSIGNMENT)
+
 # TODO: As Twisted mostly runs synchronously, see if there's someway we can 
 #       spin-off write requests so that control can return to the reactor. 
 
@@ -29,19 +155,252 @@ class _AssignmentManager(object):
     # Lists of current connections.
     __client_list = OrderedDict()
     __hp_assigned_list = OrderedDict()
-    __hp_waiting_list = OrderedDict()
+
+    # The HP connections waiting for clients, held by the selection-policy 
+    # that picks which one each new client gets.
+    __hp_waiting = FifoPolicy()
+
+    # HP connections whose clients have dropped, while they're being recycled.
+    __hp_ending_list = OrderedDict()
+
+    # HP connections that carry any number of clients, as streams.
+    __hp_multiplexed_list = OrderedDict()
+
+    # HP connections that haven't said hello, yet.
+    __hp_greeting_list = OrderedDict()
+
+    # Host-process ID => the HP connections (by session-ID) that are waiting 
+    # for clients, but can't be assigned one until their host-process's 
+    # command-channel connects.
+    __hp_parked = {}
 
     # Forward and reverse maps expressing assignments.
     __map_client_to_hp = {}
     __map_hp_to_client = {}
 
+    # Clients waiting for an HP connection to become available, oldest first,
+    # with the time that they were queued and their expiration timer.
+    __pending_clients = OrderedDict()
+
+    __advisory_scheduled = False
+
     __locker = Lock()
 
+    def set_selection_policy(self, policy):
+        cls = self.__class__
+
+        with cls.__locker:
+            for hp_connection in cls.__hp_assigned_list.itervalues():
+                policy.started(hp_connection)
+
+            while cls.__hp_waiting:
+                policy.add(cls.__hp_waiting.pop())
+
+            cls.__hp_waiting = policy
+
+    def hp_connected(self, hp_connection):
+        cls = self.__class__
+
+        with cls.__locker:
+            cls.__hp_greeting_list[hp_connection.session_id] = hp_connection
+
     def queue_new_hp(self, hp_connection):
         cls = self.__class__
 
+        hp_connection.wait_for_client()
+
         with cls.__locker:
-            cls.__hp_waiting_list[hp_connection.session_id] = hp_connection
+            cls.__hp_greeting_list.pop(hp_connection.session_id, None)
+
+            if get_command_channel(hp_connection.host_process_id) is None:
+                # Nobody could be told about its assignment.
+                self.__park(hp_connection)
+                return
+
+            if cls.__pending_clients:
+                # Somebody is already waiting for it.
+                (session_id, (client_connection, queued_at, expiration)) = \
+                    cls.__pending_clients.popitem(last=False)
+
+                expiration.cancel()
+
+                _pending_clients_gauge.dec()
+                _pending_wait_histogram.observe(time() - queued_at)
+            else:
+                cls.__hp_waiting.add(hp_connection)
+                client_connection = None
+
+        if client_connection is not None:
+            _assignment_log.debug("Client with session-ID (%d) was waiting for "
+                                  "a host-process connection.", 
+                                  client_connection.session_id)
+
+            self.__assign(client_connection, hp_connection)
+        else:
+            self.__waiting_changed()
+
+    def queue_new_multiplexed_hp(self, hp_connection):
+        cls = self.__class__
+
+        # It carries its clients for as long as it's connected.
+        hp_connection.stop_waiting()
+
+        with cls.__locker:
+            del cls.__hp_greeting_list[hp_connection.session_id]
+
+            cls.__hp_multiplexed_list[hp_connection.session_id] = \
+                hp_connection
+
+            # It can take everybody that's waiting.
+            pending_clients = []
+            while cls.__pending_clients:
+                (session_id, (client_connection, queued_at, expiration)) = \
+                    cls.__pending_clients.popitem(last=False)
+
+                expiration.cancel()
+
+                _pending_clients_gauge.dec()
+                _pending_wait_histogram.observe(time() - queued_at)
+
+                pending_clients.append(client_connection)
+
+        for client_connection in pending_clients:
+            self.__assign_stream(client_connection, hp_connection)
+
+    def __park(self, hp_connection):
+        cls = self.__class__
+
+        _assignment_log.debug("Host-process with session-ID (%d) will wait "
+                              "for the command-channel of host-process [%s].", 
+                              hp_connection.session_id, 
+                              hp_connection.host_process_id)
+
+        parked = cls.__hp_parked.setdefault(hp_connection.host_process_id, 
+                                            OrderedDict())
+
+        parked[hp_connection.session_id] = hp_connection
+
+    def command_channel_connected(self, host_process_id):
+        """Queue the HP connections that were waiting for the host-process's 
+        command-channel.
+        """
+
+        cls = self.__class__
+
+        with cls.__locker:
+            parked = cls.__hp_parked.pop(host_process_id, None)
+
+        if parked is None:
+            return
+
+        for hp_connection in parked.itervalues():
+            self.queue_new_hp(hp_connection)
+
+    def get_waiting_count(self):
+        return len(self.__class__.__hp_waiting)
+
+    def get_assigned_count(self):
+        return len(self.__class__.__hp_assigned_list)
+
+    def get_ending_count(self):
+        return len(self.__class__.__hp_ending_list)
+
+    def get_stream_count(self):
+        return sum(hp_connection.stream_count 
+                   for hp_connection 
+                   in self.__class__.__hp_multiplexed_list.itervalues())
+
+    def is_idle(self):
+        """Return whether we have no clients (whether they're assigned or 
+        waiting) and no sessions that are ending.
+        """
+
+        cls = self.__class__
+
+        return not cls.__hp_assigned_list and \
+               not cls.__pending_clients and \
+               not cls.__hp_ending_list and \
+               self.get_stream_count() == 0
+
+    def lend_hp(self):
+        """Dequeue a waiting HP connection, so that it can be handed to 
+        another worker. Return None if there are none.
+        """
+
+        cls = self.__class__
+
+        with cls.__locker:
+            hp_connection = cls.__hp_waiting.pop()
+            if hp_connection is None:
+                return None
+
+        self.__waiting_changed()
+
+        return hp_connection
+
+    def __waiting_changed(self):
+        self.__check_pool()
+
+        if worker_bus is None:
+            return
+
+        worker_bus.status_changed()
+
+        if not self.__class__.__hp_waiting:
+            worker_bus.borrow()
+
+    def __check_pool(self):
+        """Advise the host-process to open more connections if we're running 
+        short. This is sent once per reactor iteration at most.
+        """
+
+        cls = self.__class__
+
+        # Multiplexed connections never run out, and, once we're draining, we 
+        # don't want any more.
+        if len(cls.__hp_waiting) >= pool_low_mark or \
+           cls.__hp_multiplexed_list or \
+           cls.__advisory_scheduled is True or \
+           draining is True:
+            return
+
+        cls.__advisory_scheduled = True
+        reactor.callLater(0, self.__advise_pool_low)
+
+    def __advise_pool_low(self):
+        cls = self.__class__
+        cls.__advisory_scheduled = False
+
+        idle_count = len(cls.__hp_waiting)
+        if idle_count >= pool_low_mark:
+            return
+
+        command_channels = get_command_channels()
+        if not command_channels:
+            return
+
+        # Each host-process is asked to make up its share of the clients that
+        # are waiting.
+        pending_count = int(ceil(len(cls.__pending_clients) / 
+                                 float(len(command_channels))))
+
+        for command_channel in command_channels:
+            command_channel.advise_pool_low(idle_count, pending_count)
+
+    def get_ending_hp(self, hp_session_id):
+        return self.__class__.__hp_ending_list.get(hp_session_id)
+
+    def recycle_hp(self, hp_connection):
+        """The session on the HP connection has ended cleanly, so it can wait 
+        for another client.
+        """
+
+        cls = self.__class__
+
+        with cls.__locker:
+            del cls.__hp_ending_list[hp_connection.session_id]
+
+        self.queue_new_hp(hp_connection)
 
     def get_assigned_hp(self, client_session_id):
         cls = self.__class__
@@ -65,32 +424,140 @@ class _AssignmentManager(object):
         cls = self.__class__
         
         with cls.__locker:
-            # Make sure the host-process is listening on the command-channel.
-            if CommandServer.get_command_channel() is None:
-                log.msg("We're denying new client with session-ID (%d) "
-                        "because a host-process command-channel is not "
-                        "connected (assuming no HP available)." % 
-                        (client_connection.session_id))
-                
+            # Make sure a host-process is listening on a command-channel.
+            if has_command_channel() is False:
+                _assignment_log.info("We're denying new client with session-ID "
+                                     "(%d) because no host-process "
+                                     "command-channel is connected "
+                                     "(assuming no HP available).", 
+                                     client_connection.session_id)
+
+                _rejected_clients_counter.inc()
                 return False
-    
+
+            # Prefer a stream on the least-loaded multiplexed connection.
+            if cls.__hp_multiplexed_list:
+                hp_connection = min(cls.__hp_multiplexed_list.itervalues(), 
+                                    key=lambda c: c.stream_count)
+            else:
+                hp_connection = None
+
+        if hp_connection is not None:
+            self.__assign_stream(client_connection, hp_connection)
+            return True
+
+        with cls.__locker:
             # Make sure there is at least one host-process connection waiting
             # to service a request.
 
-            if not cls.__hp_waiting_list:
-                log.msg("We're denying new client with session-ID (%d) "
-                        "because there are no available host-processes." % 
-                        (client_connection.session_id))
-                
-                return False
+            hp_connection = self.__select()
+            if hp_connection is None:
+                # Another worker may have some to spare.
+                if worker_bus is not None:
+                    worker_bus.borrow()
+
+                if len(cls.__pending_clients) >= pending_limit:
+                    _assignment_log.info("We're denying new client with "
+                                         "session-ID (%d) because there are no "
+                                         "available host-processes and (%d) "
+                                         "clients are already waiting.", 
+                                         client_connection.session_id, 
+                                         len(cls.__pending_clients))
+
+                    _rejected_clients_counter.inc()
+                    return False
+
+                # Hold the client until an HP connection becomes available.
+                expiration = _timers.callLater(pending_timeout, 
+                                               self.__expire_pending_client, 
+                                               client_connection)
+
+                cls.__pending_clients[client_connection.session_id] = \
+                    (client_connection, time(), expiration)
+
+                _pending_clients_gauge.inc()
+
+                _assignment_log.debug("Client with session-ID (%d) will wait "
+                                      "for an available host-process.", 
+                                      client_connection.session_id)
+
+                self.__check_pool()
+
+                return True
+
+        self.__assign(client_connection, hp_connection)
+
+        return True
+
+    def __select(self):
+        """Dequeue an unassigned HP connection whose host-process's 
+        command-channel is connected, or return None. Those whose 
+        command-channels have gone are parked as they're found.
+        """
+
+        cls = self.__class__
+
+        while 1:
+            hp_connection = cls.__hp_waiting.select()
+            if hp_connection is None or \
+               get_command_channel(hp_connection.host_process_id) is not None:
+                return hp_connection
+
+            self.__park(hp_connection)
 
-            # Dequeue an unassigned HP connection.
-            for available_hp_connection in cls.__hp_waiting_list.itervalues():
-                hp_connection = available_hp_connection
-                break
-            
-            del cls.__hp_waiting_list[hp_connection.session_id]
+    def __expire_pending_client(self, client_connection):
+        cls = self.__class__
+
+        with cls.__locker:
+            del cls.__pending_clients[client_connection.session_id]
+
+        _pending_clients_gauge.dec()
+        _pending_expired_counter.inc()
+
+        _assignment_log.info("Client with session-ID (%d) has been dropped "
+                             "after waiting (%s) seconds for a host-process.", 
+                             client_connection.session_id, pending_timeout)
+
+        client_connection.transport.loseConnection()
+
+    def __assign_stream(self, client_connection, hp_connection):
+        stream = hp_connection.open_stream(client_connection.session_id)
+        stream.set_handlers(client_connection.write_from_stream, 
+                            client_connection.transport.loseConnection)
+
+        client_connection.peer = stream
+        stream.peer = client_connection
+
+        bind_streams(client_connection, stream)
+
+        client_connection.watch_idle()
+
+        _assignment_log.debug("Client with session-ID (%d) has been assigned "
+                              "to a stream on multiplexed host-process with "
+                              "session-ID (%d).", 
+                              client_connection.session_id, 
+                              hp_connection.session_id)
+
+        client_connection.handle_assignment()
+
+    def stream_lost_from_client(self, client_connection):
+        stream = client_connection.peer
+
+        _assignment_log.debug("Client with session-ID (%d) on a multiplexed "
+                              "host-process has dropped.", 
+                              client_connection.session_id)
+
+        unbind_streams(client_connection, stream)
 
+        stream.peer = None
+        client_connection.peer = None
+
+        stream.close()
+
+    def __bind(self, client_connection, hp_connection):
+        cls = self.__class__
+
+        with cls.__locker:
             # Assign the HP connection.
             cls.__map_client_to_hp[client_connection.session_id] = \
                 hp_connection
@@ -101,12 +568,29 @@ class _AssignmentManager(object):
             cls.__hp_assigned_list[hp_connection.session_id] = \
                 hp_connection
 
+            cls.__hp_waiting.started(hp_connection)
+
             # Store the client connection.
             cls.__client_list[client_connection.session_id] = self
 
-            log.msg("Client with session-ID (%d) has been assigned to host-"
-                    "process with session-ID (%d)." % 
-                    (client_connection.session_id, hp_connection.session_id))
+            # Bind the two connections to each other, so that relaying data 
+            # doesn't have to come back here.
+            client_connection.peer = hp_connection
+            hp_connection.peer = client_connection
+
+            # Neither side may outrun the other.
+            bind_streams(client_connection, hp_connection)
+
+        hp_connection.stop_waiting()
+        client_connection.watch_idle()
+
+    def __assign(self, client_connection, hp_connection):
+        self.__bind(client_connection, hp_connection)
+
+        _assignment_log.debug("Client with session-ID (%d) has been assigned "
+                              "to host-process with session-ID (%d).", 
+                              client_connection.session_id, 
+                              hp_connection.session_id)
 
         # Now, announce the assignment on the command-channel, and respond 
         # to the client. Note that, although we don't guarantee the order,
@@ -115,45 +599,183 @@ class _AssignmentManager(object):
         # couple of trivial operations, if any, to prepare a session that
         # should already be ready to go.
 
-        # Emit an assignment message on the command-channel.
-        CommandServer.get_command_channel().announce_assignment(hp_connection)
+        # Emit an assignment message on the command-channel of the 
+        # host-process that the HP connection belongs to.
+        get_command_channel(hp_connection.host_process_id).\
+            announce_assignment(hp_connection)
 
-        return True
+        self.__waiting_changed()
+
+        client_connection.handle_assignment()
+
+    def adopt_pair(self, client_connection, hp_connection):
+        """Restore an assignment that was made by the relay that handed the 
+        pair over to us (see relayserver.handoff). The host-process already 
+        knows about it.
+        """
+
+        self.__bind(client_connection, hp_connection)
+
+        _assignment_log.debug("Adopted client with session-ID (%d), assigned "
+                              "to host-process with session-ID (%d).", 
+                              client_connection.session_id, 
+                              hp_connection.session_id)
+
+    def hand_over(self):
+        """Give up every connection that the relay replacing us can take on as
+        it is (see relayserver.handoff): the waiting HP connections, those that
+        haven't said hello, every assigned pair, and every waiting client. 
+        Return them as (connection, message) pairs, in the order that they 
+        should be adopted. Multiplexed connections (and their clients) and the 
+        sessions that are ending are left to us.
+        """
+
+        cls = self.__class__
+        handed_over = []
+
+        with cls.__locker:
+            while cls.__hp_waiting:
+                hp_connection = cls.__hp_waiting.pop()
+                handed_over.append((hp_connection, hp_connection.hand_over()))
+
+            for parked in cls.__hp_parked.itervalues():
+                for hp_connection in parked.itervalues():
+                    handed_over.append((hp_connection, 
+                                        hp_connection.hand_over()))
+
+            for hp_connection in cls.__hp_greeting_list.itervalues():
+                handed_over.append((hp_connection, hp_connection.hand_over()))
+
+            for (session_id, hp_connection) in \
+                    cls.__hp_assigned_list.iteritems():
+                client_connection = cls.__map_hp_to_client[session_id]
+
+                handed_over.append((hp_connection, hp_connection.hand_over()))
+                handed_over.append((client_connection, 
+                                    client_connection.hand_over()))
+
+            for (client_connection, queued_at, expiration) in \
+                    cls.__pending_clients.itervalues():
+                expiration.cancel()
+
+                _pending_clients_gauge.dec()
+
+                handed_over.append((client_connection, 
+                                    client_connection.hand_over(
+                                        time() - queued_at)))
+
+            cls.__hp_greeting_list.clear()
+            cls.__hp_parked.clear()
+            cls.__hp_assigned_list.clear()
+            cls.__client_list.clear()
+            cls.__map_client_to_hp.clear()
+            cls.__map_hp_to_client.clear()
+            cls.__pending_clients.clear()
+
+        return handed_over
 
     def connection_lost_from_client(self, session_id):
         cls = self.__class__
         
         with cls.__locker:
-            if session_id in cls.__map_client_to_hp:
+            if session_id in cls.__pending_clients:
+                # The client gave up before it was assigned.
+
+                (client_connection, queued_at, expiration) = \
+                    cls.__pending_clients.pop(session_id)
+
+                expiration.cancel()
+
+                _pending_clients_gauge.dec()
+
+                _assignment_log.debug("Client with session-ID (%d) dropped "
+                                      "while waiting for a host-process.", 
+                                      session_id)
+
+            elif session_id in cls.__map_client_to_hp:
                 # A client connection dropped. This connection will only exist 
                 # under assignment.
     
                 mapped_hp = cls.__map_client_to_hp[session_id]
                 
-                log.msg("Client with session-ID (%d) mapped to host-process "
-                        "with session-ID (%d) has dropped." % 
-                        (session_id, mapped_hp.session_id))
+                _assignment_log.debug("Client with session-ID (%d) mapped to "
+                                      "host-process with session-ID (%d) has "
+                                      "dropped.", 
+                                      session_id, mapped_hp.session_id)
     
                 del cls.__map_client_to_hp[session_id]
                 del cls.__map_hp_to_client[mapped_hp.session_id]
                 del cls.__client_list[session_id]
                 del cls.__hp_assigned_list[mapped_hp.session_id]
+
+                cls.__hp_waiting.finished(mapped_hp)
+
+                # Unbind the pair.
+                unbind_streams(mapped_hp, mapped_hp.peer)
+
+                mapped_hp.peer.peer = None
+                mapped_hp.peer = None
     
-                command_channel = CommandServer.get_command_channel()
-                if command_channel is not None:
-                    command_channel.announce_drop(mapped_hp)
+                command_channel = \
+                    get_command_channel(mapped_hp.host_process_id)
+                if command_channel is not None and mapped_hp.recycles is True:
+                    # Reuse the HP connection once the host-process has 
+                    # acknowledged the end of the session.
+                    cls.__hp_ending_list[mapped_hp.session_id] = mapped_hp
+
+                    token = mapped_hp.end_session()
+                    command_channel.announce_session_end(mapped_hp, token)
+                else:
+                    if command_channel is not None:
+                        command_channel.announce_drop(mapped_hp)
     
-                reactor.callLater(5, mapped_hp.transport.loseConnection)
+                    _timers.callLater(session_end_timeout, 
+                                      mapped_hp.transport.loseConnection)
 
     def connection_lost_from_hp(self, session_id):
         cls = self.__class__
         
         with cls.__locker:
-            if session_id in cls.__hp_waiting_list:
-                log.msg("Unassigned host-process with session-ID (%d) has "
-                        "dropped." % (session_id))
+            if session_id in cls.__hp_greeting_list:
+                _assignment_log.debug("Host-process with session-ID (%d) "
+                                      "dropped before it said hello.", 
+                                      session_id)
+
+                del cls.__hp_greeting_list[session_id]
+
+            elif session_id in cls.__hp_waiting:
+                _assignment_log.debug("Unassigned host-process with session-ID "
+                                      "(%d) has dropped.", session_id)
     
-                del cls.__hp_waiting_list[session_id]
+                cls.__hp_waiting.remove(session_id)
+
+                self.__waiting_changed()
+
+            elif any(session_id in parked 
+                     for parked 
+                     in cls.__hp_parked.itervalues()):
+                _assignment_log.debug("Host-process with session-ID (%d) "
+                                      "dropped while waiting for its "
+                                      "command-channel.", session_id)
+
+                for (host_process_id, parked) in cls.__hp_parked.items():
+                    if parked.pop(session_id, None) is not None and \
+                       not parked:
+                        del cls.__hp_parked[host_process_id]
+
+            elif session_id in cls.__hp_multiplexed_list:
+                # Its streams have been closed, and their clients dropped.
+                _assignment_log.info("Multiplexed host-process with session-ID "
+                                     "(%d) has dropped.", session_id)
+
+                del cls.__hp_multiplexed_list[session_id]
+
+            elif session_id in cls.__hp_ending_list:
+                _assignment_log.info("Host-process with session-ID (%d) "
+                                     "dropped before its session ended.", 
+                                     session_id)
+
+                del cls.__hp_ending_list[session_id]
                 
             elif session_id in cls.__map_hp_to_client:
                 # An HP connection dropped. We've stated elsewhere that if this
@@ -162,26 +784,138 @@ class _AssignmentManager(object):
     
                 mapped_client = cls.__map_hp_to_client[session_id]
     
-                log.msg("Host-process with session-ID (%d) mapped to client "
-                        "with session-ID (%d) has dropped." % 
-                        (session_id, mapped_client.session_id))
+                _assignment_log.debug("Host-process with session-ID (%d) "
+                                      "mapped to client with session-ID (%d) "
+                                      "has dropped.", 
+                                      session_id, mapped_client.session_id)
     
                 del cls.__map_client_to_hp[mapped_client.session_id]
                 del cls.__map_hp_to_client[session_id]
                 del cls.__client_list[mapped_client.session_id]
-                del cls.__hp_assigned_list[session_id]
+
+                hp_connection = cls.__hp_assigned_list.pop(session_id)
+                cls.__hp_waiting.finished(hp_connection)
+
+                # Unbind the pair.
+                unbind_streams(mapped_client, mapped_client.peer)
+
+                mapped_client.peer.peer = None
+                mapped_client.peer = None
     
                 mapped_client.transport.loseConnection()
 
 _assignments = _AssignmentManager()
 
+metrics.gauge_function(
+    'relay_hp_waiting',
+    "Host-process connections waiting for a client.",
+    _assignments.get_waiting_count)
+
+metrics.gauge_function(
+    'relay_hp_assigned',
+    "Host-process connections assigned to a client.",
+    _assignments.get_assigned_count)
+
+metrics.gauge_function(
+    'relay_hp_ending',
+    "Host-process connections whose sessions are ending, to be reused.",
+    _assignments.get_ending_count)
+
+metrics.gauge_function(
+    'relay_streams_assigned',
+    "Clients assigned to streams on multiplexed host-process connections.",
+    _assignments.get_stream_count)
+
+def _get_bytes_relayed(direction):
+    count = _bytes_relayed[direction]
+    if data_pump is not None:
+        count += data_pump.bytes_moved[direction]
+
+    return count
+
+metrics.counter_function(
+    'relay_client_bytes_total',
+    "Bytes relayed from clients to host-processes.",
+    lambda: _get_bytes_relayed(_CLIENT_TO_HP))
+
+metrics.counter_function(
+    'relay_hp_bytes_total',
+    "Bytes relayed from host-processes to clients.",
+    lambda: _get_bytes_relayed(_HP_TO_CLIENT))
+
 
 class TrivialClientServer(BaseProtocol):
     """Handles operations for the client data channel."""
 
+    # The assigned host-process connection (bound by the assignment manager).
+    peer = None
+
+    # Set if another relay accepted the client (and might have assigned it), 
+    # and handed it over to us (see relayserver.handoff).
+    handed_over = False
+
+    def __init__(self):
+        # Data received while we wait to be assigned.
+        self.__pending_data = []
+        self.__pending_length = 0
+
+        self.__connected_at = None
+
+        # While we're assigned (and idle_timeout is set), when we were last 
+        # relayed for, and the timer that checks.
+        self.__active_at = None
+        self.__idle_timer = None
+
     def connectionMade(self):
-        log.msg("Client with session-ID (%d) has connected." % 
-                (self.session_id))
+        _data_log.debug("Client with session-ID (%d) has connected.", 
+                        self.session_id)
+
+        self.__connected_at = time()
+
+        if self.handed_over is True:
+            return
+
+        try:
+            if _assignments.assign_new_client(self) is False:
+                self.transport.loseConnection()
+        except:
+            log.err()
+
+    def hand_over(self, waited=None):
+        """Describe the connection to the relay that's taking it over. If we 
+        haven't been assigned, we've waited the given number of seconds.
+        """
+
+        self.__stop_idle()
+
+        message = build_msg_handoff_connection(
+                    HandoffMessage.CLIENT, 
+                    self.session_id, 
+                    b''.join(self.__pending_data), 
+                    take_pending_writes(self.transport))
+
+        if self.peer is not None:
+            message.peer_session_id = self.peer.session_id
+        else:
+            message.waited = waited
+
+        return message
+
+    def take_over(self, message, hp_connection=None):
+        """We've been handed over by another relay (see hand_over()). If we 
+        were assigned, the given HP connection has been adopted as our peer.
+        Otherwise, we carry on waiting for one.
+        """
+
+        if hp_connection is not None:
+            _assignments.adopt_pair(self, hp_connection)
+            return
+
+        self.__connected_at = time() - message.waited
+
+        # Whatever we'd received while we waited is held again.
+        if message.received:
+            self.dataReceived(message.received)
 
         try:
             if _assignments.assign_new_client(self) is False:
@@ -189,16 +923,106 @@ class TrivialClientServer(BaseProtocol):
         except:
             log.err()
 
+    def handle_assignment(self):
+        """Called by the assignment manager once we have a peer, whether that
+        was immediately or after waiting.
+        """
+
+        _assignment_latency_histogram.observe(time() - self.__connected_at)
+
+        if self.__pending_data:
+            _data_log.debug("Forwarding (%d) bytes received from client with "
+                            "session-ID (%d) while it waited.", 
+                            self.__pending_length, self.session_id)
+
+            self.peer.transport.writeSequence(self.__pending_data)
+
+            self.__pending_data = []
+            self.__pending_length = 0
+
+            self.transport.resumeProducing()
+
+        if data_pump is not None and isinstance(self.peer, MuxStream) is False:
+            if data_pump.add_pair(self.transport, 
+                                  self.peer.transport, 
+                                  self.peer.recycles) is False:
+                _data_log.info("Client with session-ID (%d) could not be "
+                               "handed to the data-pump. Relaying it directly.", 
+                               self.session_id)
+
+    def watch_idle(self):
+        """We've been assigned. If nothing is relayed for us, either way, for 
+        idle_timeout seconds, we're dropped (and our peer with us).
+        """
+
+        if idle_timeout <= 0:
+            return
+
+        self.__active_at = time()
+        self.__idle_timer = _timers.callLater(idle_timeout, self.__check_idle)
+
+    def mark_active(self):
+        """Something has been relayed for us."""
+
+        if self.__idle_timer is not None:
+            self.__active_at = time()
+
+    def __check_idle(self):
+        idle = time() - self.__active_at
+        if idle < idle_timeout:
+            self.__idle_timer = _timers.callLater(idle_timeout - idle, 
+                                                  self.__check_idle)
+            return
+
+        self.__idle_timer = None
+
+        _assignment_log.info("Client with session-ID (%d) has been idle for "
+                             "(%d) seconds. Dropping it.", 
+                             self.session_id, idle)
+
+        self.transport.loseConnection()
+
+    def __stop_idle(self):
+        if self.__idle_timer is not None:
+            self.__idle_timer.cancel()
+            self.__idle_timer = None
+
     def dataReceived(self, data):
+        _bytes_relayed[_CLIENT_TO_HP] += len(data)
+
         try:
-            hp_connection = _assignments.get_assigned_hp(self.session_id)
-            hp_connection.transport.write(data)
+            peer = self.peer
+            if peer is not None:
+                self.mark_active()
+                peer.transport.write(data)
+                return
+
+            # Hold on to it until we're assigned, but stop reading once we're 
+            # holding as much as we'd buffer for a peer.
+            self.__pending_data.append(data)
+            self.__pending_length += len(data)
+
+            if self.__pending_length >= self.transport.bufferSize:
+                self.transport.pauseProducing()
         except:
             log.err()
 
+    def write_from_stream(self, data):
+        """Data has arrived for us on our stream."""
+
+        _bytes_relayed[_HP_TO_CLIENT] += len(data)
+
+        self.mark_active()
+        self.transport.write(data)
+
     def connectionLost(self, reason):
+        self.__stop_idle()
+
         try:
-            _assignments.connection_lost_from_client(self.session_id)
+            if isinstance(self.peer, MuxStream) is True:
+                _assignments.stream_lost_from_client(self)
+            else:
+                _assignments.connection_lost_from_client(self.session_id)
         except:
             log.err()
 
@@ -210,57 +1034,254 @@ class TrivialClientServer(BaseProtocol):
 class HostProcessServer(BaseProtocol):
     """Handles operations for the host-process data channel."""
 
+    # The assigned client connection (bound by the assignment manager).
+    peer = None
+
+    # Whether the host-process can reuse the connection for another client.
+    recycles = False
+
+    # The host-process that the connection belongs to, and its weight (see 
+    # relayserver.selection).
+    host_process_id = ''
+    weight = 1
+
     def __init__(self):
-        self.__buffer = ReadBuffer()
+        self.set_frame_handlers(Hello, { None: self.__handle_hostprocess_hello })
+
+        # While a session is ending, the token that we'll mark the end of 
+        # our side of it with, the last bytes that we've received, and the 
+        # token that the host-process has said that they'll end with.
+        self.__ending = False
+        self.__token = None
+        self.__tail = ''
+        self.__end_token = None
+        self.__expiration = None
+
+        # Set if the host-process asked for the connection to be multiplexed.
+        self.__mux = None
+
+        # Set while we wait to say hello, or for a client (see 
+        # hp_idle_timeout).
+        self.__idle_timer = None
 
     def dataReceived(self, data):
         cls = self.__class__
 
         try:
-            client = _assignments.get_client_for_hp(self.session_id)
-            if client is not None:
-                client.transport.write(data)
+            peer = self.peer
+            if peer is not None:
+                _bytes_relayed[_HP_TO_CLIENT] += len(data)
+
+                peer.mark_active()
+                peer.transport.write(data)
                 return
-        
-            self.__buffer.push(data)
-    
-            message_raw = self.__buffer.read_message()
-            if message_raw is None:
+
+            if self.__mux is not None:
+                self.__mux.receive(data)
                 return
-    
-            hello = self.parse_or_raise(message_raw, Hello)
-            self.__handle_hostprocess_hello()
+
+            if self.__ending is True:
+                # Whatever's left of the session. We only need to know what it
+                # ends with.
+                self.__tail = (self.__tail + data)[-SESSION_END_TOKEN_LENGTH:]
+                self.__check_session_ended()
+                return
+
+            if self.framing is False:
+                _data_log.sampled(event_log.DEBUG, 
+                                  "Dropping (%d) bytes received from "
+                                  "unassigned host-process with session-ID "
+                                  "(%d).", len(data), self.session_id)
+                return
+
+            self.dispatch_frames(data)
         except:
             log.err()
 
     def connectionMade(self):
-        log.msg("A data connection has been established with connection "
-                "having session-ID (%d), but it will need to say hello." % 
-                (self.session_id))
+        _data_log.debug("A data connection has been established with "
+                        "connection having session-ID (%d), but it will need "
+                        "to say hello.", self.session_id)
+
+        if self.framing is True:
+            self.wait_for_client()
+            _assignments.hp_connected(self)
 
     def connectionLost(self, reason):
+        self.stop_waiting()
+        self.release_frames()
+
         try:
+            if self.__mux is not None:
+                self.__mux.connection_lost()
+
             _assignments.connection_lost_from_hp(self.session_id)
         except:
             log.err()
+
+    def open_stream(self, stream_id):
+        return self.__mux.open_stream(stream_id)
+
+    def wait_for_client(self):
+        """We're waiting to say hello, for a client, or for our host-process's 
+        command-channel. If we're still waiting after hp_idle_timeout 
+        seconds, we're dropped.
+        """
+
+        self.stop_waiting()
+
+        if hp_idle_timeout > 0:
+            self.__idle_timer = _timers.callLater(hp_idle_timeout, 
+                                                  self.__idle_expired)
+
+    def stop_waiting(self):
+        if self.__idle_timer is not None:
+            self.__idle_timer.cancel()
+            self.__idle_timer = None
+
+    def __idle_expired(self):
+        self.__idle_timer = None
+
+        _assignment_log.info("Host-process with session-ID (%d) has waited "
+                             "(%s) seconds without a client. Dropping it.", 
+                             self.session_id, hp_idle_timeout)
+
+        self.transport.loseConnection()
+
+    def hand_over(self):
+        """Describe the connection to the relay that's taking it over. It 
+        mustn't be multiplexed, or ending its session.
+        """
+
+        self.stop_waiting()
+
+        said_hello = self.framing is False
+        received = self.stop_framing() if said_hello is False else b''
+
+        message = build_msg_handoff_connection(
+                    HandoffMessage.HOST_PROCESS, 
+                    self.session_id, 
+                    received, 
+                    take_pending_writes(self.transport))
+
+        if said_hello is True:
+            message.said_hello = True
+            message.recycle_sessions = self.recycles
+            message.host_process_id = self.host_process_id
+            message.weight = self.weight
+
+        if self.peer is not None:
+            message.peer_session_id = self.peer.session_id
+
+        return message
+
+    def take_over(self, message):
+        """We've been handed over by another relay (see hand_over()). If we 
+        said hello, we'll have stopped framing before we were connected. If 
+        we're assigned, our client follows us, and it will pair us up.
+        """
+
+        if message.said_hello is False:
+            # Whatever of the hello we'd received is handled again.
+            if message.received:
+                self.dataReceived(message.received)
+
+            return
+
+        self.recycles = message.recycle_sessions
+        self.host_process_id = message.host_process_id
+        self.weight = message.weight
+
+        if message.HasField('peer_session_id') is False:
+            _assignments.queue_new_hp(self)
+
+    @property
+    def stream_count(self):
+        return self.__mux.stream_count
+
+    def end_session(self):
+        """Our client has dropped. Return the token to announce. It marks the 
+        end of the client's data, but it's only written once the host-process 
+        has acknowledged it (so, by then, it knows to look for it, and hold 
+        back what might be it from its real-server). If the host-process 
+        doesn't acknowledge it in time, we drop the connection.
+        """
+
+        token = urandom(SESSION_END_TOKEN_LENGTH)
+
+        self.__ending = True
+        self.__token = token
+        self.__tail = ''
+        self.__end_token = None
+        self.__expiration = _timers.callLater(session_end_timeout, 
+                                              self.transport.loseConnection)
+
+        # Reading might have been paused for the client (or stopped for the 
+        # data-pump).
+        self.transport.resumeProducing()
+
+        return token
+
+    def handle_session_end_ack(self, token):
+        """The host-process has ended its side of the session, and will have 
+        written the given token behind the last of its data. Whatever it 
+        receives behind ours belongs to its next client.
+        """
+
+        self.transport.write(self.__token)
+        self.__token = None
+
+        self.__end_token = token
+        self.__check_session_ended()
+
+    def __check_session_ended(self):
+        if self.__end_token is None or self.__tail != self.__end_token:
+            return
+
+        self.__ending = False
+        self.__expiration.cancel()
+
+        _assignment_log.debug("Session on host-process with session-ID (%d) "
+                              "has ended. Recycling.", self.session_id)
+
+        _assignments.recycle_hp(self)
         
-    def __handle_hostprocess_hello(self):
+    def __handle_hostprocess_hello(self, hello):
         """Handle a host-process hello."""
 
         cls = self.__class__
 
         try:
-            log.msg("Host-process with session-ID (%d) has said hello." % 
-                    (self.session_id))
-    
-            _assignments.queue_new_hp(self)
-    
+            _control_log.debug("Host-process with session-ID (%d) has said "
+                               "hello.", self.session_id)
+
+            self.recycles = hello.recycle_sessions
+            self.host_process_id = hello.host_process_id
+            self.weight = hello.weight
+
+            if hello.multiplex is True:
+                self.__mux = MuxConnection(self.transport)
+
+            # Nothing else on this connection is framed.
+            remaining = self.stop_framing()
+            if remaining:
+                _data_log.info("Dropping (%d) bytes received from host-process "
+                               "with session-ID (%d) behind its hello.", 
+                               len(remaining), self.session_id)
+
             host_info = self.transport.getHost()
             response = build_msg_data_hphelloresponse(self.session_id, 
                                                       host_info.host, 
                                                       ports[2])
     
             self.write_message(response)
+
+            # The response has to go out first, as a waiting client might be 
+            # assigned (and its data forwarded) immediately.
+            if self.__mux is not None:
+                _assignments.queue_new_multiplexed_hp(self)
+            else:
+                _assignments.queue_new_hp(self)
         except:
             log.err()
 
@@ -270,49 +1291,653 @@ class HostProcessServer(BaseProtocol):
     
 
 class CommandServer(BaseProtocol):
-    """Handles operations for host-process command-channel."""
+    """Handles operations for a host-process's command-channel."""
+
+    # Host-process ID => its command-channel. A channel belongs to the 
+    # host-process whose connections don't give an ID until it says hello.
+    __command_channels = {}
 
-    __command_channel = None
+    # The host-process that the channel belongs to, and whether it has said 
+    # that it accepts batched announcements (older host-processes don't).
+    host_process_id = ''
+    accepts_batches = False
+
+    # The channel that we took the place of, while we haven't said hello.
+    __displaced = None
+
+    # Once we've said hello, the timer for the next heartbeat, and when we 
+    # were last heard from.
+    __heartbeat = None
+    __heard_at = None
 
     def __init__(self):
-        self.__buffer = ReadBuffer()
+        # The host-process only sends us its hello, heartbeats and 
+        # acknowledgements. Anything else that arrives is just drained and 
+        # logged.
+        self.set_frame_handlers(
+            Command, 
+            { Command.HELLO: self.__handle_hello, 
+              Command.HEARTBEAT: self.__handle_heartbeat, 
+              Command.SESSION_END_ACK: self.__handle_session_end_ack }, 
+            'message_type')
+
+        # The sessions to announce as opened and dropped in the next batch.
+        self.__opened_sessions = []
+        self.__dropped_sessions = []
 
     def dataReceived(self, data):
-        self.__buffer.push(data)
+        self.__heard_at = time()
 
-        message_raw = self.__buffer.read_message()
-        if message_raw is None:
-            return
+        try:
+            self.dispatch_frames(data)
+        except:
+            log.err()
 
-        # We don't actually expect any data to be sent to us. Do not take any 
-        # further action, here.
+    def buffer_updated(self, nbytes):
+        # Most of what we receive is read into a buffer, instead.
+        self.__heard_at = time()
+        BaseProtocol.buffer_updated(self, nbytes)
 
     def connectionLost(self, reason):
-        log.msg("Command channel dropped.")
-        self.__class__.__command_channel = None
+        _control_log.info("Command channel for host-process [%s] dropped.", 
+                          self.host_process_id)
+
+        self.__stop_heartbeat()
+        self.__unregister()
+        self.release_frames()
+
+        if worker_bus is not None:
+            worker_bus.status_changed()
         
     def connectionMade(self):
-        log.msg("Command channel connected.")
-        self.__class__.__command_channel = self
-        
+        _control_log.info("Command channel connected.")
+
+        # Commands are small, and many can be announced at once.
+        self.transport.setTcpNoDelay(True)
+        self.batch_writes()
+
+        self.__register('')
+
+    def __register(self, host_process_id):
+        cls = self.__class__
+
+        self.__unregister()
+
+        self.host_process_id = host_process_id
+        self.__displaced = cls.__command_channels.get(host_process_id)
+
+        cls.__command_channels[host_process_id] = self
+
+        _assignments.command_channel_connected(host_process_id)
+
+        if worker_bus is not None:
+            worker_bus.status_changed()
+
+    def __unregister(self):
+        cls = self.__class__
+
+        if cls.__command_channels.get(self.host_process_id) is not self:
+            return
+
+        del cls.__command_channels[self.host_process_id]
+
+        # If we took the place of a channel that's still connected (we 
+        # hadn't said hello, yet, or it has gone quiet), it has it back.
+        displaced = self.__displaced
+        self.__displaced = None
+
+        if displaced is not None and \
+           displaced.host_process_id == self.host_process_id and \
+           displaced.transport.connected:
+            cls.__command_channels[self.host_process_id] = displaced
+
+    def __handle_hello(self, command):
+        host_process_id = command.hello_properties.host_process_id
+
+        _control_log.info("Command channel belongs to host-process [%s].", 
+                          host_process_id)
+
+        self.accepts_batches = command.hello_properties.accepts_batches
+
+        self.__register(host_process_id)
+        self.__start_heartbeat()
+
+    def __start_heartbeat(self):
+        """The host-process answers heartbeats (older ones don't say hello, 
+        and wouldn't).
+        """
+
+        if heartbeat_interval <= 0 or self.__heartbeat is not None:
+            return
+
+        self.__heard_at = time()
+        self.__heartbeat = _timers.callLater(heartbeat_interval, self.__beat)
+
+    def __stop_heartbeat(self):
+        if self.__heartbeat is not None:
+            self.__heartbeat.cancel()
+            self.__heartbeat = None
+
+    def __beat(self):
+        silent = time() - self.__heard_at
+        if silent >= heartbeat_interval * _MISSED_HEARTBEATS:
+            self.__heartbeat = None
+
+            _control_log.info("Command channel for host-process [%s] hasn't "
+                              "been heard from for (%d) seconds. Dropping "
+                              "it.", self.host_process_id, silent)
+
+            # It's likely to be half-open, so there's no flushing it.
+            self.transport.abortConnection()
+            return
+
+        self.write_command(build_msg_cmd_heartbeat())
+        self.__heartbeat = _timers.callLater(heartbeat_interval, self.__beat)
+
+    def __handle_heartbeat(self, command):
+        """The host-process has answered a heartbeat. Hearing from it at all 
+        is what counts (see buffer_updated()).
+        """
+
+    @classmethod
+    def get_command_channel(cls, host_process_id=''):
+        return cls.__command_channels.get(host_process_id)
+
     @classmethod
-    def get_command_channel(cls):
-        return cls.__command_channel
+    def get_command_channels(cls):
+        return cls.__command_channels.values()
 
     def announce_assignment(self, hp_connection):
-        log.msg("Announcing assignment of new client to HP session "
-                      "(%d)." % (hp_connection.session_id))
+        _control_log.sampled(event_log.DEBUG, 
+                             "Announcing assignment of new client to HP "
+                             "session (%d).", hp_connection.session_id)
         
-        command = build_msg_cmd_connopen(hp_connection.session_id)
-        self.write_message(command)
+        if self.__get_batch_size() > 1:
+            self.__add_to_batch(self.__opened_sessions, 
+                                hp_connection.session_id)
+        else:
+            command = build_msg_cmd_connopen(hp_connection.session_id)
+            self.write_message(command)
                 
     def announce_drop(self, hp_connection):
-        log.msg("Announcing drop of client assigned to HP session "
-                      "(%d)." % (hp_connection.session_id))
+        _control_log.sampled(event_log.DEBUG, 
+                             "Announcing drop of client assigned to HP session "
+                             "(%d).", hp_connection.session_id)
+
+        if self.__get_batch_size() > 1:
+            self.__add_to_batch(self.__dropped_sessions, 
+                                hp_connection.session_id)
+        else:
+            command = build_msg_cmd_conndrop(hp_connection.session_id)
+            self.write_message(command)
+
+    def announce_drain(self):
+        _control_log.info("Announcing that we're draining.")
+
+        command = build_msg_cmd_drain()
+        self.write_command(command)
+
+    def hand_over(self):
+        """Describe the connection to the relay that's taking it over, and 
+        stop using it. Any announcements that are waiting to be batched are 
+        flushed to it first.
+        """
+
+        self.flush_batch()
+        self.flush_messages()
+
+        self.__stop_heartbeat()
+        self.__unregister()
+
+        message = build_msg_handoff_connection(
+                    HandoffMessage.COMMAND_CHANNEL, 
+                    self.session_id, 
+                    self.stop_framing(), 
+                    take_pending_writes(self.transport))
+
+        if self.host_process_id:
+            message.host_process_id = self.host_process_id
+
+        message.accepts_batches = self.accepts_batches
+
+        return message
+
+    def take_over(self, message):
+        """We've been handed over by another relay (see hand_over())."""
+
+        self.accepts_batches = message.accepts_batches
+
+        if message.host_process_id:
+            self.__register(message.host_process_id)
+            self.__start_heartbeat()
+
+        # Whatever of a command we'd received is handled again.
+        if message.received:
+            self.dataReceived(message.received)
+
+    @property
+    def session_id(self):
+        return self.transport.sessionno
+
+    def advise_pool_low(self, idle_count, pending_count):
+        _control_log.sampled(event_log.INFO, 
+                             "Advising that the host-process pool is low: "
+                             "(%d) waiting and (%d) clients pending.", 
+                             idle_count, pending_count)
+
+        command = build_msg_cmd_poollow(idle_count, pending_count)
+        self.write_command(command)
+
+    def announce_session_end(self, hp_connection, token):
+        _control_log.sampled(event_log.DEBUG, 
+                             "Announcing end of session on HP session (%d).", 
+                             hp_connection.session_id)
+
+        command = build_msg_cmd_sessionend(hp_connection.session_id, token)
+        self.write_command(command)
+
+    def write_command(self, command):
+        """Write the given command, or add it to the next batch. Whatever 
+        can't be batched is written in order, behind the batch so far.
+        """
+
+        if self.__get_batch_size() > 1:
+            if command.message_type == Command.CONNECTION_OPEN:
+                self.__add_to_batch(self.__opened_sessions, 
+                                    command.open_properties.\
+                                        assigned_to_session)
+                return
+
+            elif command.message_type == Command.CONNECTION_DROP:
+                self.__add_to_batch(self.__dropped_sessions, 
+                                    command.drop_properties.session_id)
+                return
+
+            self.flush_batch()
 
-        command = build_msg_cmd_conndrop(hp_connection.session_id)
         self.write_message(command)
 
+    def __add_to_batch(self, sessions, session_id):
+        if not self.__opened_sessions and not self.__dropped_sessions:
+            reactor.callLater(0, self.flush_batch)
+
+        sessions.append(session_id)
+
+        if len(self.__opened_sessions) + len(self.__dropped_sessions) >= \
+           self.__get_batch_size():
+            self.flush_batch()
+
+    def __get_batch_size(self):
+        return command_batch_size if self.accepts_batches is True else 1
+
+    @property
+    def queue_length(self):
+        """The commands that have yet to be written to the transport 
+        (announcements that are waiting to be batched count individually).
+        """
+
+        return len(self.__opened_sessions) + \
+               len(self.__dropped_sessions) + \
+               self.gathered_count
+
+    def flush_batch(self):
+        if not self.__opened_sessions and not self.__dropped_sessions:
+            return
+
+        command = build_msg_cmd_batch(self.__opened_sessions, 
+                                      self.__dropped_sessions)
+
+        self.__opened_sessions = []
+        self.__dropped_sessions = []
+
+        self.write_message(command)
+
+    def __handle_session_end_ack(self, command):
+        handle_session_end_ack(command, True)
+
+
+def handle_session_end_ack(command, forward):
+    """The host-process has acknowledged the end of a session. If the HP 
+    connection belongs to another worker, pass it on (if forward is True).
+    """
+
+    properties = command.session_end_properties
+
+    hp_connection = _assignments.get_ending_hp(properties.session_id)
+    if hp_connection is not None:
+        hp_connection.handle_session_end_ack(properties.token)
+    elif forward is True and worker_bus is not None:
+        worker_bus.forward_command(command)
+    elif worker_bus is None:
+        _control_log.info("Received acknowledgement for the end of a session "
+                          "on unknown HP session (%d).", properties.session_id)
+
+def _get_command_queue_length():
+    return sum(command_channel.queue_length 
+               for command_channel 
+               in CommandServer.get_command_channels())
+
+def _get_command_write_buffer_length():
+    return sum(get_pending_write_length(command_channel.transport) 
+               for command_channel 
+               in CommandServer.get_command_channels())
+
+metrics.gauge_function(
+    'relay_command_queue_length',
+    "Commands waiting to be written to the command-channels.",
+    _get_command_queue_length)
+
+metrics.gauge_function(
+    'relay_command_write_buffer_bytes',
+    "Bytes written to the command-channels that haven't been sent, yet.",
+    _get_command_write_buffer_length)
+
+def get_command_channel(host_process_id=''):
+    """Return the command-channel of the given host-process, or None if it 
+    hasn't got one. When the relay is split across workers, the channel may 
+    be attached to another worker, in which case we return a stand-in that 
+    forwards to it.
+    """
+
+    command_channel = CommandServer.get_command_channel(host_process_id)
+    if command_channel is None and worker_bus is not None:
+        command_channel = \
+            worker_bus.get_remote_command_channel(host_process_id)
+
+    return command_channel
+
+def get_command_channels():
+    """Return the command-channel of every host-process (see 
+    get_command_channel()).
+    """
+
+    command_channels = list(CommandServer.get_command_channels())
+    if worker_bus is not None:
+        command_channels += worker_bus.get_remote_command_channels()
+
+    return command_channels
+
+def has_command_channel():
+    if CommandServer.get_command_channels():
+        return True
+
+    return worker_bus is not None and \
+           bool(worker_bus.get_remote_command_channels())
+
+
+class _WorkerShard(object):
+    """What the worker-bus sees of this worker."""
+
+    def __init__(self, hp_port):
+        self.__hp_port = hp_port
+
+    def get_idle_count(self):
+        return _assignments.get_waiting_count()
+
+    def get_command_channel_ids(self):
+        return [command_channel.host_process_id 
+                for command_channel 
+                in CommandServer.get_command_channels()]
+
+    def lend_hp(self):
+        return _assignments.lend_hp()
+
+    def release_hp(self, hp_connection):
+        """The HP connection now belongs to another worker. Forget it, and 
+        close our descriptor for its socket without shutting the socket down.
+        """
+
+        hp_connection.stop_waiting()
+        hp_connection.release_frames()
+
+        release_descriptor(hp_connection.transport)
+
+    def adopt_hp(self, skt, session_id, recycles, host_process_id, weight):
+        hp_connection = HostProcessServer()
+
+        # It has already said hello to the worker that lent it to us.
+        hp_connection.stop_framing()
+        hp_connection.recycles = recycles
+        hp_connection.host_process_id = host_process_id
+        hp_connection.weight = weight
+
+        adopt_connection(self.__hp_port, skt, hp_connection, session_id)
+        _assignments.queue_new_hp(hp_connection)
+
+        _assignment_log.debug("Adopted host-process connection with session-ID "
+                              "(%d).", session_id)
+
+    def write_command(self, host_process_id, command_raw):
+        command_channel = CommandServer.get_command_channel(host_process_id)
+        if command_channel is None:
+            _control_log.info("Dropping a forwarded announcement because the "
+                              "command-channel of host-process [%s] is no "
+                              "longer connected.", host_process_id)
+            return
+
+        command = command_channel.parse_or_raise(command_raw, Command)
+        command_channel.write_command(command)
+
+    def command_channel_connected(self, host_process_id):
+        """The host-process's command-channel is attached to another 
+        worker.
+        """
+
+        _assignments.command_channel_connected(host_process_id)
+
+    def handle_command(self, command):
+        """A command received by the worker with the command-channel."""
+
+        if command.message_type == Command.SESSION_END_ACK:
+            handle_session_end_ack(command, False)
+
+
+def drain():
+    """Stop accepting clients, tell the host-processes (so that they 
+    reconnect promptly to whichever relay replaces us), and exit once the 
+    clients that we have are done.
+    """
+
+    global draining
+
+    if draining is True:
+        return
+
+    _control_log.info("Draining: no more clients will be accepted.")
+
+    draining = True
+    _listeners[2].stopListening()
+
+    for command_channel in CommandServer.get_command_channels():
+        command_channel.announce_drain()
+
+    _exit_when_idle()
+
+_drain_checker = None
+
+def _exit_when_idle():
+    """Stop the reactor once we have no clients, or once drain_timeout has 
+    passed.
+    """
+
+    global _drain_checker
+
+    if _drain_checker is not None:
+        return
+
+    deadline = time() + drain_timeout
+
+    def check():
+        if _assignments.is_idle() is True:
+            _control_log.info("Drained.")
+        elif time() >= deadline:
+            _control_log.info("Giving up on draining after (%d) seconds.", 
+                              drain_timeout)
+        else:
+            return
+
+        _drain_checker.stop()
+
+        try:
+            reactor.stop()
+        except ReactorNotRunning:
+            # We were already shutting down.
+            pass
+
+    _drain_checker = LoopingCall(check)
+    _drain_checker.start(.1)
+
+
+class _HandoffRelay(object):
+    """What the handoff (see relayserver.handoff) sees of this relay, whether 
+    we're handing over or taking over. listen(index, skt=None) listens on one
+    of our ports, and serve_metrics(skt=None) serves metrics, adopting the 
+    given listening socket, if there is one.
+    """
+
+    def __init__(self, listen, serve_metrics):
+        self.__listen = listen
+        self.__serve_metrics = serve_metrics
+
+        # Adopted HP connections whose clients haven't been adopted, yet.
+        self.__unpaired = {}
+
+    def quiesce(self):
+        """Return a Deferred that fires once no sessions are ending, or once 
+        they've had as long as they'd be given to.
+        """
+
+        d = Deferred()
+        deadline = time() + session_end_timeout
+
+        def check():
+            if _assignments.get_ending_count() > 0 and time() < deadline:
+                return
+
+            checker.stop()
+            d.callback(None)
+
+        checker = LoopingCall(check)
+        checker.start(.01)
+
+        return d
+
+    def hand_over(self):
+        handed_over = []
+
+        def add(selectable, message):
+            descriptor = dup(selectable.fileno())
+            release_descriptor(selectable)
+
+            handed_over.append((descriptor, message))
+
+        def add_port(index):
+            listener = _listeners[index]
+
+            # The client port is already closing if we're draining.
+            if listener is not None and not listener.disconnecting:
+                add(listener, 
+                    build_msg_handoff_port(index, listener.sessionno))
+
+        # The command-channels come first, as clients are turned away until 
+        # there is one, and a host-process's connections wait for its own.
+        add_port(1)
+
+        for command_channel in list(CommandServer.get_command_channels()):
+            add(command_channel.transport, command_channel.hand_over())
+
+        add_port(0)
+        add_port(2)
+
+        for (connection, message) in _assignments.hand_over():
+            add(connection.transport, message)
+
+        if _metrics_listener is not None:
+            add(_metrics_listener, 
+                build_msg_handoff_port(_METRICS_PORT_INDEX, 0))
+
+        return handed_over
+
+    def handed_over(self):
+        """Whatever we couldn't hand over is drained."""
+
+        global draining
+
+        draining = True
+        _exit_when_idle()
+
+    def adopt_port(self, skt, message):
+        if message.port_index == _METRICS_PORT_INDEX:
+            self.__serve_metrics(skt)
+            return
+
+        listener = self.__listen(message.port_index, skt)
+        listener.sessionno = message.next_session
+
+    def adopt_connection(self, skt, message):
+        if message.role == HandoffMessage.COMMAND_CHANNEL:
+            (index, connection) = (1, CommandServer())
+        elif message.role == HandoffMessage.HOST_PROCESS:
+            (index, connection) = (0, HostProcessServer())
+
+            # Like a lent connection (see _WorkerShard), there's nothing more 
+            # to frame once it has said hello.
+            if message.said_hello is True:
+                connection.stop_framing()
+        else:
+            (index, connection) = (2, TrivialClientServer())
+            connection.handed_over = True
+
+        # The port wasn't handed over if the other relay was draining.
+        if _listeners[index] is None:
+            self.__listen(index)
+
+        adopt_connection(_listeners[index], 
+                         skt, 
+                         connection, 
+                         message.session_id)
+
+        # Whatever the other relay hadn't sent goes out before anything of 
+        # ours.
+        if message.unsent:
+            connection.transport.write(message.unsent)
+
+        if message.role != HandoffMessage.CLIENT:
+            if message.role == HandoffMessage.HOST_PROCESS and \
+               message.HasField('peer_session_id') is True:
+                self.__unpaired[message.session_id] = connection
+
+            connection.take_over(message)
+            return
+
+        hp_connection = None
+        if message.HasField('peer_session_id') is True:
+            hp_connection = self.__unpaired.pop(message.peer_session_id, None)
+            if hp_connection is None:
+                _control_log.info("The host-process connection assigned to "
+                                  "adopted client with session-ID (%d) "
+                                  "wasn't handed over. Dropping.", 
+                                  message.session_id)
+
+                connection.transport.loseConnection()
+                return
+
+        connection.take_over(message, hp_connection)
+
+    def taken_over(self):
+        # HP connections whose clients never arrived can't be used again.
+        for hp_connection in self.__unpaired.itervalues():
+            hp_connection.transport.loseConnection()
+
+        self.__unpaired.clear()
+
+        for index in range(len(_listeners)):
+            if _listeners[index] is None:
+                self.__listen(index)
+
+        if _metrics_listener is None:
+            self.__serve_metrics()
+
 
 class _GeneralFactory(protocol.ServerFactory):
     def __init__(self, description):
@@ -324,10 +1949,45 @@ class _GeneralFactory(protocol.ServerFactory):
     def __repr__(self):
         return ("GeneralFactory(%s)" % (self.__description))
 
-def start_relay(dport, cport, tport):
+def start_relay(dport, cport, tport, data_plane='twisted', 
+                high_watermark=65536, low_watermark=16384, bus=None, 
+                pending_max=1000, pending_wait=10, pool_low=2, 
+                command_batch=100, metrics_port=None, 
+                selection_policy='fifo', handoff_path=None, drain_wait=30, 
+                hp_idle_wait=300, idle_wait=0, heartbeat=10):
     global ports
+    global data_pump
+    global worker_bus
+    global pending_limit
+    global pending_timeout
+    global pool_low_mark
+    global command_batch_size
+    global drain_timeout
+    global hp_idle_timeout
+    global idle_timeout
+    global heartbeat_interval
 
     ports = (dport, cport, tport)
+    worker_bus = bus
+    pending_limit = pending_max
+    pending_timeout = pending_wait
+    pool_low_mark = pool_low
+    command_batch_size = command_batch
+    drain_timeout = drain_wait
+    hp_idle_timeout = hp_idle_wait
+    idle_timeout = idle_wait
+    heartbeat_interval = heartbeat
+
+    _control_log.info("Using the [%s] protobuf backend.", 
+                      get_protobuf_backend())
+
+    _assignments.set_selection_policy(create_policy(selection_policy))
+
+    if data_plane == 'splice':
+        data_pump = SplicePump()
+        data_pump.start()
+
+        reactor.addSystemEventTrigger('before', 'shutdown', data_pump.stop)
 
     #startLogging(sys.stdout)
 
@@ -343,8 +2003,66 @@ def start_relay(dport, cport, tport):
     trivialFactory.protocol = TrivialClientServer
     trivialFactory.connections = {}
 
-    reactor.listenTCP(ports[0], relayFactory)
-    reactor.listenTCP(ports[1], commandFactory)
-    reactor.listenTCP(ports[2], trivialFactory)
+    factories = (relayFactory, commandFactory, trivialFactory)
+
+    if worker_bus is None:
+        (reuse_port, session_stride, session_offset) = (False, 1, 0)
+    else:
+        (reuse_port, session_stride, session_offset) = \
+            (True, worker_bus.count, worker_bus.index)
+
+    # Each worker serves its own metrics.
+    if metrics_port is not None and worker_bus is not None:
+        metrics_port += worker_bus.index
+
+    def listen(index, skt=None):
+        if index == 1:
+            listener = listen_tcp(ports[1], 
+                                  commandFactory, 
+                                  reuse_port=reuse_port, 
+                                  skt=skt)
+        else:
+            listener = listen_tcp(ports[index], 
+                                  factories[index], 
+                                  high_watermark, 
+                                  low_watermark, 
+                                  reuse_port, 
+                                  session_stride, 
+                                  session_offset, 
+                                  skt)
+
+        _listeners[index] = listener
+        return listener
+
+    def serve_metrics(skt=None):
+        global _metrics_listener
+
+        if metrics_port is None:
+            if skt is not None:
+                skt.close()
+
+            return
+
+        _metrics_listener = start_metrics_server(metrics_port, skt=skt)
+
+    if handoff_path is None:
+        for index in range(len(_listeners)):
+            listen(index)
+    else:
+        # We take over from the relay that's there, if there is one.
+        handoff = Handoff(handoff_path, 
+                          _HandoffRelay(listen, serve_metrics))
+        handoff.start()
+
+    if worker_bus is not None:
+        worker_bus.start(_WorkerShard(_listeners[0]))
+    else:
+        # Workers are just terminated, so only a single relay drains.
+        signal.signal(signal.SIGUSR1, 
+                      lambda signum, frame: reactor.callFromThread(drain))
+
+    if handoff_path is None:
+        serve_metrics()
+
     reactor.run()
 
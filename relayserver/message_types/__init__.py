@@ -1,22 +1,66 @@
 from relayserver.message_types.command_pb2 import Command
 from relayserver.message_types.hello_pb2 import HostProcessHelloResponse, Hello
+from relayserver.message_types.bus_pb2 import BusMessage
+from relayserver.message_types.handoff_pb2 import HandoffMessage
+from relayserver.message_types.codec import encode_connopen, \
+                                            encode_conndrop, \
+                                            encode_sessionend, \
+                                            encode_heartbeat, \
+                                            encode_drain
+
+# The length of the tokens that mark the end of a session's data (see 
+# SessionEndProperties).
+SESSION_END_TOKEN_LENGTH = 16
+
+# The commands that are sent for every client are pre-encoded (see 
+# relayserver.message_types.codec).
 
 def build_msg_cmd_connopen(assigned_hp_session):
-        
+    return encode_connopen(assigned_hp_session)
+
+def build_msg_cmd_conndrop(assigned_hp_session):
+    return encode_conndrop(assigned_hp_session)
+
+def build_msg_cmd_poollow(idle_count, pending_count):
+
     command = Command()
     command.version = 1
-    command.message_type = Command.CONNECTION_OPEN
-    command.open_properties.assigned_to_session = assigned_hp_session
+    command.message_type = Command.POOL_LOW
+    command.pool_low_properties.idle_count = idle_count
+    command.pool_low_properties.pending_count = pending_count
 
     return command
 
-def build_msg_cmd_conndrop(assigned_hp_session):
-                
+def build_msg_cmd_sessionend(session_id, token):
+    return encode_sessionend(Command.SESSION_END, session_id, token)
+
+def build_msg_cmd_sessionendack(session_id, token):
+    return encode_sessionend(Command.SESSION_END_ACK, session_id, token)
+
+def build_msg_cmd_batch(opened_sessions, dropped_sessions):
+
+    command = Command()
+    command.version = 1
+    command.message_type = Command.BATCH
+    command.batch.opened_sessions.extend(opened_sessions)
+    command.batch.dropped_sessions.extend(dropped_sessions)
+
+    return command
+
+def build_msg_cmd_drain():
+    return encode_drain()
+
+def build_msg_cmd_heartbeat():
+    return encode_heartbeat()
+
+def build_msg_cmd_hello(host_process_id, accepts_batches=False):
+
     command = Command()
     command.version = 1
-    command.message_type = Command.CONNECTION_DROP
-    command.drop_properties.session_id = assigned_hp_session
-    
+    command.message_type = Command.HELLO
+    command.hello_properties.host_process_id = host_process_id
+    command.hello_properties.accepts_batches = accepts_batches
+
     return command
 
 def build_msg_data_hphelloresponse(session_id, relay_host, relay_port):
@@ -28,8 +72,125 @@ def build_msg_data_hphelloresponse(session_id, relay_host, relay_port):
 
     return response
 
-def build_msg_data_hphello():
+def build_msg_data_hphello(recycle_sessions=False, multiplex=False, 
+                           host_process_id=None, weight=1):
     hello = Hello()
     hello.version = 1
 
+    if recycle_sessions is True:
+        hello.recycle_sessions = True
+
+    if multiplex is True:
+        hello.multiplex = True
+
+    if host_process_id is not None:
+        hello.host_process_id = host_process_id
+
+    if weight != 1:
+        hello.weight = weight
+
     return hello
+
+def build_msg_bus_status(worker, idle_count, command_channels):
+    message = BusMessage()
+    message.version = 1
+    message.message_type = BusMessage.STATUS
+    message.worker = worker
+    message.idle_count = idle_count
+    message.command_channels.extend(command_channels)
+
+    return message
+
+def build_msg_bus_borrow(worker):
+    message = BusMessage()
+    message.version = 1
+    message.message_type = BusMessage.BORROW
+    message.worker = worker
+
+    return message
+
+def build_msg_bus_lend(worker, session_id=None, recycle_sessions=False, 
+                       host_process_id='', weight=1, family=None):
+    message = BusMessage()
+    message.version = 1
+    message.message_type = BusMessage.LEND
+    message.worker = worker
+
+    if session_id is not None:
+        message.session_id = session_id
+        message.recycle_sessions = recycle_sessions
+        message.host_process_id = host_process_id
+        message.weight = weight
+
+        if family is not None:
+            message.family = family
+
+    return message
+
+def build_msg_bus_adopted(worker, session_id):
+    message = BusMessage()
+    message.version = 1
+    message.message_type = BusMessage.ADOPTED
+    message.worker = worker
+    message.session_id = session_id
+
+    return message
+
+def build_msg_bus_announce(worker, command, host_process_id=''):
+    message = BusMessage()
+    message.version = 1
+    message.message_type = BusMessage.ANNOUNCE
+    message.worker = worker
+    message.command = command.SerializeToString()
+
+    if host_process_id:
+        message.host_process_id = host_process_id
+
+    return message
+
+def build_msg_bus_command(worker, command):
+    message = BusMessage()
+    message.version = 1
+    message.message_type = BusMessage.COMMAND
+    message.worker = worker
+    message.command = command.SerializeToString()
+
+    return message
+
+def build_msg_handoff_request():
+    message = HandoffMessage()
+    message.version = 1
+    message.message_type = HandoffMessage.REQUEST
+
+    return message
+
+def build_msg_handoff_port(port_index, next_session):
+    message = HandoffMessage()
+    message.version = 1
+    message.message_type = HandoffMessage.PORT
+    message.port_index = port_index
+    message.next_session = next_session
+
+    return message
+
+def build_msg_handoff_connection(role, session_id, received=b'', unsent=b''):
+    message = HandoffMessage()
+    message.version = 1
+    message.message_type = HandoffMessage.CONNECTION
+    message.role = role
+    message.session_id = session_id
+
+    if received:
+        message.received = received
+
+    if unsent:
+        message.unsent = unsent
+
+    return message
+
+def build_msg_handoff_done():
+    message = HandoffMessage()
+    message.version = 1
+    message.message_type = HandoffMessage.DONE
+
+    return message
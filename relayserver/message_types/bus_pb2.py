@@ -0,0 +1,23 @@
+# Generated from bus.proto by gen_pb2.py.  DO NOT EDIT!
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import message as _message
+from google.protobuf import reflection as _reflection
+from google.protobuf import symbol_database as _symbol_database
+
+_sym_db = _symbol_database.Default()
+
+# Older runtimes don't return the file from AddSerializedFile().
+_pool = _descriptor_pool.Default()
+_pool.AddSerializedFile(
+    b'\x0a\x09bus.proto\x12\x05relay"\xe5\x03\x0a\x0aBusMessage\x12\x18\x0a\x07version\x18\x01 \x02(\x05R\x07version\x12@\x0a\x0cmessage_type\x18\x02 \x02(\x0e2\x1d.relay.BusMessage.MessageTypeR\x0bmessageType\x12\x16\x0a\x06worker\x18\x03 \x02(\x05R\x06worker\x12\x1d\x0a\x0aidle_count\x18\x04 \x01(\x05R\x09idleCount\x12)\x0a\x10command_channels\x18\x0b \x03(\x09R\x0fcommandChannels\x12\x1d\x0a\x0asession_id\x18\x06 \x01(\x05R\x09sessionId\x12)\x0a\x10recycle_sessions\x18\x08 \x01(\x08R\x0frecycleSessions\x12&\x0a\x0fhost_process_id\x18\x09 \x01(\x09R\x0dhostProcessId\x12\x19\x0a\x06weight\x18\x0a \x01(\x05:\x011R\x06weight\x12\x19\x0a\x06family\x18\x0c \x01(\x05:\x012R\x06family\x12\x18\x0a\x07command\x18\x07 \x01(\x0cR\x07command"W\x0a\x0bMessageType\x12\x0a\x0a\x06STATUS\x10\x00\x12\x0a\x0a\x06BORROW\x10\x01\x12\x08\x0a\x04LEND\x10\x02\x12\x0b\x0a\x07ADOPTED\x10\x03\x12\x0c\x0a\x08ANNOUNCE\x10\x04\x12\x0b\x0a\x07COMMAND\x10\x05')
+
+DESCRIPTOR = _pool.FindFileByName('bus.proto')
+
+_BUSMESSAGE = DESCRIPTOR.message_types_by_name['BusMessage']
+_BUSMESSAGE_MESSAGETYPE = _BUSMESSAGE.enum_types_by_name['MessageType']
+BusMessage = _reflection.GeneratedProtocolMessageType('BusMessage', (_message.Message,), {
+  'DESCRIPTOR' : _BUSMESSAGE,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(BusMessage)
+
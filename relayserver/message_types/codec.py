@@ -0,0 +1,289 @@
+"""The commands that are announced for every client (CONNECTION_OPEN,
+CONNECTION_DROP, SESSION_END and its acknowledgement) and HEARTBEAT and DRAIN
+have a fixed shape. Only a session-ID (and a token) changes from one to the
+next. Rather than building and serializing a Command for each of them, we keep
+them pre-encoded, and patch the varint session-ID (and its length) in. On the
+receiving side, a command in one of these shapes can be decoded directly, and
+anything else is left to protobuf.
+
+Either way, the command is a FixedCommand, which looks like a Command, as far
+as we use one (the type, its properties, and SerializeToString()). The bytes
+are exactly what protobuf would have written for the same command.
+
+How much this saves depends on the protobuf backend (get_protobuf_backend()).
+The templates are always at least as quick as building a Command. The decoder
+is Python, though, and only beats protobuf's parser when that's Python too, so
+it's only used then (see DECODE_FIXED).
+"""
+
+from collections import namedtuple
+
+from relayserver.message_types.command_pb2 import Command
+
+# The fields of the properties that we decode (see command.proto).
+ClientConnectionOpenProperties = \
+    namedtuple('ClientConnectionOpenProperties', ('assigned_to_session',))
+
+ClientConnectionDropProperties = \
+    namedtuple('ClientConnectionDropProperties', ('session_id',))
+
+SessionEndProperties = \
+    namedtuple('SessionEndProperties', ('session_id', 'token'))
+
+# Every byte, as a string of its own.
+_BYTES = [bytes(bytearray([i])) for i in range(256)]
+
+# Tag bytes: version (1), message_type (2), the properties (3, 4 and 6, each
+# length-delimited), and the properties' own session_id (1) and token (2).
+_VERSION_1 = b'\x08\x01'
+_MESSAGE_TYPE_TAG = 0x10
+_OPEN_PROPERTIES_TAG = 0x1a
+_DROP_PROPERTIES_TAG = 0x22
+_SESSION_END_PROPERTIES_TAG = 0x32
+_SESSION_ID_TAG = 0x08
+_TOKEN_TAG = 0x12
+
+# The longest varint that a non-negative int32 takes.
+_MAX_INT32_VARINT_LENGTH = 5
+
+
+class FixedCommand(object):
+    """A command in one of the fixed shapes. Only the properties of its type
+    are set.
+    """
+
+    version = 1
+
+    open_properties = None
+    drop_properties = None
+    session_end_properties = None
+
+    def __init__(self, message_type, encoded):
+        self.message_type = message_type
+        self.__encoded = encoded
+
+    def SerializeToString(self):
+        return self.__encoded
+
+    def IsInitialized(self):
+        return True
+
+
+def get_protobuf_backend():
+    """Return the protobuf implementation that's in use ('python', 'cpp' or
+    'upb').
+    """
+
+    try:
+        from google.protobuf.internal import api_implementation
+    except ImportError:
+        return 'unknown'
+
+    return api_implementation.Type()
+
+# Whether the framed protocols decode the fixed shapes themselves (see
+# relayserver.base_protocol).
+DECODE_FIXED = get_protobuf_backend() == 'python'
+
+def _encode_varint(value):
+    # Session-IDs mostly take one to three bytes.
+    if 0 <= value < 0x80:
+        return _BYTES[value]
+    elif 0 < value < 0x4000:
+        return _BYTES[(value & 0x7f) | 0x80] + _BYTES[value >> 7]
+    elif 0 < value < 0x200000:
+        return _BYTES[(value & 0x7f) | 0x80] + \
+               _BYTES[((value >> 7) & 0x7f) | 0x80] + \
+               _BYTES[value >> 14]
+
+    if value < 0:
+        # As protobuf does, a negative int32 takes ten bytes.
+        value += 1 << 64
+
+    encoded = bytearray()
+    while value >= 0x80:
+        encoded.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    encoded.append(value)
+    return bytes(encoded)
+
+def _get_prefix(message_type):
+    return _VERSION_1 + _BYTES[_MESSAGE_TYPE_TAG] + _BYTES[message_type]
+
+# The templates for the commands that carry a session-ID, by the length of
+# its varint. Each is only missing the varint.
+def _build_session_templates(message_type, properties_tag):
+    return [None] + \
+           [_get_prefix(message_type) +
+            _BYTES[properties_tag] +
+            _BYTES[1 + length] +
+            _BYTES[_SESSION_ID_TAG]
+            for length
+            in range(1, 11)]
+
+_OPEN_TEMPLATES = _build_session_templates(Command.CONNECTION_OPEN,
+                                           _OPEN_PROPERTIES_TAG)
+
+_DROP_TEMPLATES = _build_session_templates(Command.CONNECTION_DROP,
+                                           _DROP_PROPERTIES_TAG)
+
+_SESSION_END_PREFIXES = \
+    dict((message_type,
+          _get_prefix(message_type) + _BYTES[_SESSION_END_PROPERTIES_TAG])
+         for message_type
+         in (Command.SESSION_END, Command.SESSION_END_ACK))
+
+_HEARTBEAT = FixedCommand(Command.HEARTBEAT, _get_prefix(Command.HEARTBEAT))
+_DRAIN = FixedCommand(Command.DRAIN, _get_prefix(Command.DRAIN))
+
+def encode_connopen(session_id):
+    varint = _encode_varint(session_id)
+
+    command = FixedCommand(Command.CONNECTION_OPEN,
+                           _OPEN_TEMPLATES[len(varint)] + varint)
+
+    command.open_properties = ClientConnectionOpenProperties(session_id)
+    return command
+
+def encode_conndrop(session_id):
+    varint = _encode_varint(session_id)
+
+    command = FixedCommand(Command.CONNECTION_DROP,
+                           _DROP_TEMPLATES[len(varint)] + varint)
+
+    command.drop_properties = ClientConnectionDropProperties(session_id)
+    return command
+
+def encode_sessionend(message_type, session_id, token):
+    """For SESSION_END and SESSION_END_ACK. The length of the properties
+    depends on the token, too.
+    """
+
+    varint = _encode_varint(session_id)
+    token_length = _encode_varint(len(token))
+
+    # The two tags, and the session-ID and token.
+    length = 2 + len(varint) + len(token_length) + len(token)
+
+    command = FixedCommand(message_type,
+                           b''.join((_SESSION_END_PREFIXES[message_type],
+                                     _encode_varint(length),
+                                     _BYTES[_SESSION_ID_TAG],
+                                     varint,
+                                     _BYTES[_TOKEN_TAG],
+                                     token_length,
+                                     token)))
+
+    command.session_end_properties = SessionEndProperties(session_id, token)
+    return command
+
+def encode_heartbeat():
+    return _HEARTBEAT
+
+def encode_drain():
+    return _DRAIN
+
+def _decode_session_id(data, position, end):
+    """Return the non-negative int32 that's encoded at the given position, and
+    the position after it, or (None, None) if there isn't one before the end.
+    """
+
+    value = 0
+    shift = 0
+
+    limit = min(end, position + _MAX_INT32_VARINT_LENGTH)
+    while position < limit:
+        byte = data[position]
+        position += 1
+
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            if value > 0x7fffffff:
+                return (None, None)
+
+            return (value, position)
+
+        shift += 7
+
+    return (None, None)
+
+def decode_fixed_command(message_raw):
+    """Decode the given command if it's in one of the fixed shapes. Otherwise,
+    return None (and it's for protobuf to parse).
+    """
+
+    # Indexing gives us integers, whatever we were given.
+    data = bytearray(message_raw)
+    length = len(data)
+
+    if length < 4 or \
+       data[0] != 0x08 or \
+       data[1] != 0x01 or \
+       data[2] != _MESSAGE_TYPE_TAG:
+        return None
+
+    message_type = data[3]
+
+    if length == 4:
+        if message_type == Command.HEARTBEAT:
+            return _HEARTBEAT
+        elif message_type == Command.DRAIN:
+            return _DRAIN
+
+        return None
+
+    # The properties have to take up the rest of the message, and start with
+    # the session-ID.
+    if length < 8 or \
+       data[5] != length - 6 or \
+       data[6] != _SESSION_ID_TAG:
+        return None
+
+    tag = data[4]
+
+    if message_type == Command.CONNECTION_OPEN:
+        if tag != _OPEN_PROPERTIES_TAG:
+            return None
+
+        (session_id, position) = _decode_session_id(data, 7, length)
+        if position != length:
+            return None
+
+        command = FixedCommand(message_type, bytes(data))
+        command.open_properties = ClientConnectionOpenProperties(session_id)
+
+        return command
+
+    elif message_type == Command.CONNECTION_DROP:
+        if tag != _DROP_PROPERTIES_TAG:
+            return None
+
+        (session_id, position) = _decode_session_id(data, 7, length)
+        if position != length:
+            return None
+
+        command = FixedCommand(message_type, bytes(data))
+        command.drop_properties = ClientConnectionDropProperties(session_id)
+
+        return command
+
+    elif message_type == Command.SESSION_END or \
+         message_type == Command.SESSION_END_ACK:
+        if tag != _SESSION_END_PROPERTIES_TAG:
+            return None
+
+        (session_id, position) = _decode_session_id(data, 7, length)
+        if position is None or \
+           position + 2 > length or \
+           data[position] != _TOKEN_TAG or \
+           position + 2 + data[position + 1] != length:
+            return None
+
+        command = FixedCommand(message_type, bytes(data))
+        command.session_end_properties = \
+            SessionEndProperties(session_id, bytes(data[position + 2:]))
+
+        return command
+
+    return None
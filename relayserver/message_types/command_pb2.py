@@ -1,171 +1,65 @@
-# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# Generated from command.proto by gen_pb2.py.  DO NOT EDIT!
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import message as _message
+from google.protobuf import reflection as _reflection
+from google.protobuf import symbol_database as _symbol_database
+
+_sym_db = _symbol_database.Default()
+
+# Older runtimes don't return the file from AddSerializedFile().
+_pool = _descriptor_pool.Default()
+_pool.AddSerializedFile(
+    b'\x0a\x0dcommand.proto\x12\x05relay"P\x0a\x1eClientConnectionOpenProperties\x12.\x0a\x13assigned_to_session\x18\x01 \x02(\x05R\x11assignedToSession"?\x0a\x1eClientConnectionDropProperties\x12\x1d\x0a\x0asession_id\x18\x01 \x02(\x05R\x09sessionId"W\x0a\x11PoolLowProperties\x12\x1d\x0a\x0aidle_count\x18\x01 \x02(\x05R\x09idleCount\x12#\x0a\x0dpending_count\x18\x02 \x02(\x05R\x0cpendingCount"K\x0a\x14SessionEndProperties\x12\x1d\x0a\x0asession_id\x18\x01 \x02(\x05R\x09sessionId\x12\x14\x0a\x05token\x18\x02 \x02(\x0cR\x05token"b\x0a\x0cCommandBatch\x12\'\x0a\x0fopened_sessions\x18\x01 \x03(\x05R\x0eopenedSessions\x12)\x0a\x10dropped_sessions\x18\x02 \x03(\x05R\x0fdroppedSessions"i\x0a\x16CommandHelloProperties\x12&\x0a\x0fhost_process_id\x18\x01 \x02(\x09R\x0dhostProcessId\x12\'\x0a\x0faccepts_batches\x18\x02 \x01(\x08R\x0eacceptsBatches"\xb2\x05\x0a\x07Command\x12\x18\x0a\x07version\x18\x01 \x02(\x05R\x07version\x12=\x0a\x0cmessage_type\x18\x02 \x02(\x0e2\x1a.relay.Command.MessageTypeR\x0bmessageType\x12N\x0a\x0fopen_properties\x18\x03 \x01(\x0b2%.relay.ClientConnectionOpenPropertiesR\x0eopenProperties\x12N\x0a\x0fdrop_properties\x18\x04 \x01(\x0b2%.relay.ClientConnectionDropPropertiesR\x0edropProperties\x12H\x0a\x13pool_low_properties\x18\x05 \x01(\x0b2\x18.relay.PoolLowPropertiesR\x11poolLowProperties\x12Q\x0a\x16session_end_properties\x18\x06 \x01(\x0b2\x1b.relay.SessionEndPropertiesR\x14sessionEndProperties\x12)\x0a\x05batch\x18\x07 \x01(\x0b2\x13.relay.CommandBatchR\x05batch\x12H\x0a\x10hello_properties\x18\x08 \x01(\x0b2\x1d.relay.CommandHelloPropertiesR\x0fhelloProperties"\x9b\x01\x0a\x0bMessageType\x12\x13\x0a\x0fCONNECTION_OPEN\x10\x00\x12\x13\x0a\x0fCONNECTION_DROP\x10\x01\x12\x0c\x0a\x08POOL_LOW\x10\x02\x12\x0f\x0a\x0bSESSION_END\x10\x03\x12\x13\x0a\x0fSESSION_END_ACK\x10\x04\x12\x09\x0a\x05BATCH\x10\x05\x12\x09\x0a\x05DRAIN\x10\x06\x12\x09\x0a\x05HELLO\x10\x07\x12\x0d\x0a\x09HEARTBEAT\x10\x08')
+
+DESCRIPTOR = _pool.FindFileByName('command.proto')
+
+_CLIENTCONNECTIONOPENPROPERTIES = DESCRIPTOR.message_types_by_name['ClientConnectionOpenProperties']
+ClientConnectionOpenProperties = _reflection.GeneratedProtocolMessageType('ClientConnectionOpenProperties', (_message.Message,), {
+  'DESCRIPTOR' : _CLIENTCONNECTIONOPENPROPERTIES,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(ClientConnectionOpenProperties)
+
+_CLIENTCONNECTIONDROPPROPERTIES = DESCRIPTOR.message_types_by_name['ClientConnectionDropProperties']
+ClientConnectionDropProperties = _reflection.GeneratedProtocolMessageType('ClientConnectionDropProperties', (_message.Message,), {
+  'DESCRIPTOR' : _CLIENTCONNECTIONDROPPROPERTIES,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(ClientConnectionDropProperties)
+
+_POOLLOWPROPERTIES = DESCRIPTOR.message_types_by_name['PoolLowProperties']
+PoolLowProperties = _reflection.GeneratedProtocolMessageType('PoolLowProperties', (_message.Message,), {
+  'DESCRIPTOR' : _POOLLOWPROPERTIES,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(PoolLowProperties)
+
+_SESSIONENDPROPERTIES = DESCRIPTOR.message_types_by_name['SessionEndProperties']
+SessionEndProperties = _reflection.GeneratedProtocolMessageType('SessionEndProperties', (_message.Message,), {
+  'DESCRIPTOR' : _SESSIONENDPROPERTIES,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(SessionEndProperties)
+
+_COMMANDBATCH = DESCRIPTOR.message_types_by_name['CommandBatch']
+CommandBatch = _reflection.GeneratedProtocolMessageType('CommandBatch', (_message.Message,), {
+  'DESCRIPTOR' : _COMMANDBATCH,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(CommandBatch)
+
+_COMMANDHELLOPROPERTIES = DESCRIPTOR.message_types_by_name['CommandHelloProperties']
+CommandHelloProperties = _reflection.GeneratedProtocolMessageType('CommandHelloProperties', (_message.Message,), {
+  'DESCRIPTOR' : _COMMANDHELLOPROPERTIES,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(CommandHelloProperties)
+
+_COMMAND = DESCRIPTOR.message_types_by_name['Command']
+_COMMAND_MESSAGETYPE = _COMMAND.enum_types_by_name['MessageType']
+Command = _reflection.GeneratedProtocolMessageType('Command', (_message.Message,), {
+  'DESCRIPTOR' : _COMMAND,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(Command)
 
-from google.protobuf import descriptor
-from google.protobuf import message
-from google.protobuf import reflection
-from google.protobuf import descriptor_pb2
-# @@protoc_insertion_point(imports)
-
-
-
-DESCRIPTOR = descriptor.FileDescriptor(
-  name='command.proto',
-  package='relay',
-  serialized_pb='\n\rcommand.proto\x12\x05relay\"=\n\x1e\x43lientConnectionOpenProperties\x12\x1b\n\x13\x61ssigned_to_session\x18\x01 \x02(\x05\"4\n\x1e\x43lientConnectionDropProperties\x12\x12\n\nsession_id\x18\x01 \x02(\x05\"\x85\x02\n\x07\x43ommand\x12\x0f\n\x07version\x18\x01 \x02(\x05\x12\x30\n\x0cmessage_type\x18\x02 \x02(\x0e\x32\x1a.relay.Command.MessageType\x12>\n\x0fopen_properties\x18\x03 \x01(\x0b\x32%.relay.ClientConnectionOpenProperties\x12>\n\x0f\x64rop_properties\x18\x04 \x01(\x0b\x32%.relay.ClientConnectionDropProperties\"7\n\x0bMessageType\x12\x13\n\x0f\x43ONNECTION_OPEN\x10\x00\x12\x13\n\x0f\x43ONNECTION_DROP\x10\x01')
-
-
-
-_COMMAND_MESSAGETYPE = descriptor.EnumDescriptor(
-  name='MessageType',
-  full_name='relay.Command.MessageType',
-  filename=None,
-  file=DESCRIPTOR,
-  values=[
-    descriptor.EnumValueDescriptor(
-      name='CONNECTION_OPEN', index=0, number=0,
-      options=None,
-      type=None),
-    descriptor.EnumValueDescriptor(
-      name='CONNECTION_DROP', index=1, number=1,
-      options=None,
-      type=None),
-  ],
-  containing_type=None,
-  options=None,
-  serialized_start=348,
-  serialized_end=403,
-)
-
-
-_CLIENTCONNECTIONOPENPROPERTIES = descriptor.Descriptor(
-  name='ClientConnectionOpenProperties',
-  full_name='relay.ClientConnectionOpenProperties',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  fields=[
-    descriptor.FieldDescriptor(
-      name='assigned_to_session', full_name='relay.ClientConnectionOpenProperties.assigned_to_session', index=0,
-      number=1, type=5, cpp_type=1, label=2,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  options=None,
-  is_extendable=False,
-  extension_ranges=[],
-  serialized_start=24,
-  serialized_end=85,
-)
-
-
-_CLIENTCONNECTIONDROPPROPERTIES = descriptor.Descriptor(
-  name='ClientConnectionDropProperties',
-  full_name='relay.ClientConnectionDropProperties',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  fields=[
-    descriptor.FieldDescriptor(
-      name='session_id', full_name='relay.ClientConnectionDropProperties.session_id', index=0,
-      number=1, type=5, cpp_type=1, label=2,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  options=None,
-  is_extendable=False,
-  extension_ranges=[],
-  serialized_start=87,
-  serialized_end=139,
-)
-
-
-_COMMAND = descriptor.Descriptor(
-  name='Command',
-  full_name='relay.Command',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  fields=[
-    descriptor.FieldDescriptor(
-      name='version', full_name='relay.Command.version', index=0,
-      number=1, type=5, cpp_type=1, label=2,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-    descriptor.FieldDescriptor(
-      name='message_type', full_name='relay.Command.message_type', index=1,
-      number=2, type=14, cpp_type=8, label=2,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-    descriptor.FieldDescriptor(
-      name='open_properties', full_name='relay.Command.open_properties', index=2,
-      number=3, type=11, cpp_type=10, label=1,
-      has_default_value=False, default_value=None,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-    descriptor.FieldDescriptor(
-      name='drop_properties', full_name='relay.Command.drop_properties', index=3,
-      number=4, type=11, cpp_type=10, label=1,
-      has_default_value=False, default_value=None,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-    _COMMAND_MESSAGETYPE,
-  ],
-  options=None,
-  is_extendable=False,
-  extension_ranges=[],
-  serialized_start=142,
-  serialized_end=403,
-)
-
-_COMMAND.fields_by_name['message_type'].enum_type = _COMMAND_MESSAGETYPE
-_COMMAND.fields_by_name['open_properties'].message_type = _CLIENTCONNECTIONOPENPROPERTIES
-_COMMAND.fields_by_name['drop_properties'].message_type = _CLIENTCONNECTIONDROPPROPERTIES
-_COMMAND_MESSAGETYPE.containing_type = _COMMAND;
-DESCRIPTOR.message_types_by_name['ClientConnectionOpenProperties'] = _CLIENTCONNECTIONOPENPROPERTIES
-DESCRIPTOR.message_types_by_name['ClientConnectionDropProperties'] = _CLIENTCONNECTIONDROPPROPERTIES
-DESCRIPTOR.message_types_by_name['Command'] = _COMMAND
-
-class ClientConnectionOpenProperties(message.Message):
-  __metaclass__ = reflection.GeneratedProtocolMessageType
-  DESCRIPTOR = _CLIENTCONNECTIONOPENPROPERTIES
-  
-  # @@protoc_insertion_point(class_scope:relay.ClientConnectionOpenProperties)
-
-class ClientConnectionDropProperties(message.Message):
-  __metaclass__ = reflection.GeneratedProtocolMessageType
-  DESCRIPTOR = _CLIENTCONNECTIONDROPPROPERTIES
-  
-  # @@protoc_insertion_point(class_scope:relay.ClientConnectionDropProperties)
-
-class Command(message.Message):
-  __metaclass__ = reflection.GeneratedProtocolMessageType
-  DESCRIPTOR = _COMMAND
-  
-  # @@protoc_insertion_point(class_scope:relay.Command)
-
-# @@protoc_insertion_point(module_scope)
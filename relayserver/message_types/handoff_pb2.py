@@ -0,0 +1,24 @@
+# Generated from handoff.proto by gen_pb2.py.  DO NOT EDIT!
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import message as _message
+from google.protobuf import reflection as _reflection
+from google.protobuf import symbol_database as _symbol_database
+
+_sym_db = _symbol_database.Default()
+
+# Older runtimes don't return the file from AddSerializedFile().
+_pool = _descriptor_pool.Default()
+_pool.AddSerializedFile(
+    b'\x0a\x0dhandoff.proto\x12\x05relay"\xa6\x05\x0a\x0eHandoffMessage\x12\x18\x0a\x07version\x18\x01 \x02(\x05R\x07version\x12D\x0a\x0cmessage_type\x18\x02 \x02(\x0e2!.relay.HandoffMessage.MessageTypeR\x0bmessageType\x12\x1d\x0a\x0aport_index\x18\x03 \x01(\x05R\x09portIndex\x12!\x0a\x0cnext_session\x18\x04 \x01(\x05R\x0bnextSession\x12.\x0a\x04role\x18\x05 \x01(\x0e2\x1a.relay.HandoffMessage.RoleR\x04role\x12\x1d\x0a\x0asession_id\x18\x06 \x01(\x05R\x09sessionId\x12\x1a\x0a\x08received\x18\x07 \x01(\x0cR\x08received\x12\x16\x0a\x06unsent\x18\x08 \x01(\x0cR\x06unsent\x12\x1d\x0a\x0asaid_hello\x18\x09 \x01(\x08R\x09saidHello\x12)\x0a\x10recycle_sessions\x18\x0a \x01(\x08R\x0frecycleSessions\x12&\x0a\x0fhost_process_id\x18\x0b \x01(\x09R\x0dhostProcessId\x12\x19\x0a\x06weight\x18\x0c \x01(\x05:\x011R\x06weight\x12&\x0a\x0fpeer_session_id\x18\x0d \x01(\x05R\x0dpeerSessionId\x12\x16\x0a\x06waited\x18\x0e \x01(\x01R\x06waited\x12\'\x0a\x0faccepts_batches\x18\x0f \x01(\x08R\x0eacceptsBatches">\x0a\x0bMessageType\x12\x0b\x0a\x07REQUEST\x10\x00\x12\x08\x0a\x04PORT\x10\x01\x12\x0e\x0a\x0aCONNECTION\x10\x02\x12\x08\x0a\x04DONE\x10\x03"9\x0a\x04Role\x12\x0a\x0a\x06CLIENT\x10\x00\x12\x10\x0a\x0cHOST_PROCESS\x10\x01\x12\x13\x0a\x0fCOMMAND_CHANNEL\x10\x02')
+
+DESCRIPTOR = _pool.FindFileByName('handoff.proto')
+
+_HANDOFFMESSAGE = DESCRIPTOR.message_types_by_name['HandoffMessage']
+_HANDOFFMESSAGE_MESSAGETYPE = _HANDOFFMESSAGE.enum_types_by_name['MessageType']
+_HANDOFFMESSAGE_ROLE = _HANDOFFMESSAGE.enum_types_by_name['Role']
+HandoffMessage = _reflection.GeneratedProtocolMessageType('HandoffMessage', (_message.Message,), {
+  'DESCRIPTOR' : _HANDOFFMESSAGE,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(HandoffMessage)
+
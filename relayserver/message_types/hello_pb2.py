@@ -1,103 +1,29 @@
-# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# Generated from hello.proto by gen_pb2.py.  DO NOT EDIT!
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import message as _message
+from google.protobuf import reflection as _reflection
+from google.protobuf import symbol_database as _symbol_database
+
+_sym_db = _symbol_database.Default()
+
+# Older runtimes don't return the file from AddSerializedFile().
+_pool = _descriptor_pool.Default()
+_pool.AddSerializedFile(
+    b'\x0a\x0bhello.proto\x12\x05relay"\xad\x01\x0a\x05Hello\x12\x18\x0a\x07version\x18\x01 \x02(\x05R\x07version\x12)\x0a\x10recycle_sessions\x18\x02 \x01(\x08R\x0frecycleSessions\x12\x1c\x0a\x09multiplex\x18\x03 \x01(\x08R\x09multiplex\x12&\x0a\x0fhost_process_id\x18\x04 \x01(\x09R\x0dhostProcessId\x12\x19\x0a\x06weight\x18\x05 \x01(\x05:\x011R\x06weight"w\x0a\x18HostProcessHelloResponse\x12\x1d\x0a\x0asession_id\x18\x01 \x02(\x05R\x09sessionId\x12\x1d\x0a\x0arelay_host\x18\x02 \x02(\x09R\x09relayHost\x12\x1d\x0a\x0arelay_port\x18\x03 \x02(\x09R\x09relayPort')
+
+DESCRIPTOR = _pool.FindFileByName('hello.proto')
+
+_HELLO = DESCRIPTOR.message_types_by_name['Hello']
+Hello = _reflection.GeneratedProtocolMessageType('Hello', (_message.Message,), {
+  'DESCRIPTOR' : _HELLO,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(Hello)
+
+_HOSTPROCESSHELLORESPONSE = DESCRIPTOR.message_types_by_name['HostProcessHelloResponse']
+HostProcessHelloResponse = _reflection.GeneratedProtocolMessageType('HostProcessHelloResponse', (_message.Message,), {
+  'DESCRIPTOR' : _HOSTPROCESSHELLORESPONSE,
+  '__module__' : __name__,
+  })
+_sym_db.RegisterMessage(HostProcessHelloResponse)
 
-from google.protobuf import descriptor
-from google.protobuf import message
-from google.protobuf import reflection
-from google.protobuf import descriptor_pb2
-# @@protoc_insertion_point(imports)
-
-
-
-DESCRIPTOR = descriptor.FileDescriptor(
-  name='hello.proto',
-  package='relay',
-  serialized_pb='\n\x0bhello.proto\x12\x05relay\"\x18\n\x05Hello\x12\x0f\n\x07version\x18\x01 \x02(\x05\"V\n\x18HostProcessHelloResponse\x12\x12\n\nsession_id\x18\x01 \x02(\x05\x12\x12\n\nrelay_host\x18\x02 \x02(\t\x12\x12\n\nrelay_port\x18\x03 \x02(\t')
-
-
-
-
-_HELLO = descriptor.Descriptor(
-  name='Hello',
-  full_name='relay.Hello',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  fields=[
-    descriptor.FieldDescriptor(
-      name='version', full_name='relay.Hello.version', index=0,
-      number=1, type=5, cpp_type=1, label=2,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  options=None,
-  is_extendable=False,
-  extension_ranges=[],
-  serialized_start=22,
-  serialized_end=46,
-)
-
-
-_HOSTPROCESSHELLORESPONSE = descriptor.Descriptor(
-  name='HostProcessHelloResponse',
-  full_name='relay.HostProcessHelloResponse',
-  filename=None,
-  file=DESCRIPTOR,
-  containing_type=None,
-  fields=[
-    descriptor.FieldDescriptor(
-      name='session_id', full_name='relay.HostProcessHelloResponse.session_id', index=0,
-      number=1, type=5, cpp_type=1, label=2,
-      has_default_value=False, default_value=0,
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-    descriptor.FieldDescriptor(
-      name='relay_host', full_name='relay.HostProcessHelloResponse.relay_host', index=1,
-      number=2, type=9, cpp_type=9, label=2,
-      has_default_value=False, default_value=unicode("", "utf-8"),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-    descriptor.FieldDescriptor(
-      name='relay_port', full_name='relay.HostProcessHelloResponse.relay_port', index=2,
-      number=3, type=9, cpp_type=9, label=2,
-      has_default_value=False, default_value=unicode("", "utf-8"),
-      message_type=None, enum_type=None, containing_type=None,
-      is_extension=False, extension_scope=None,
-      options=None),
-  ],
-  extensions=[
-  ],
-  nested_types=[],
-  enum_types=[
-  ],
-  options=None,
-  is_extendable=False,
-  extension_ranges=[],
-  serialized_start=48,
-  serialized_end=134,
-)
-
-DESCRIPTOR.message_types_by_name['Hello'] = _HELLO
-DESCRIPTOR.message_types_by_name['HostProcessHelloResponse'] = _HOSTPROCESSHELLORESPONSE
-
-class Hello(message.Message):
-  __metaclass__ = reflection.GeneratedProtocolMessageType
-  DESCRIPTOR = _HELLO
-  
-  # @@protoc_insertion_point(class_scope:relay.Hello)
-
-class HostProcessHelloResponse(message.Message):
-  __metaclass__ = reflection.GeneratedProtocolMessageType
-  DESCRIPTOR = _HOSTPROCESSHELLORESPONSE
-  
-  # @@protoc_insertion_point(class_scope:relay.HostProcessHelloResponse)
-
-# @@protoc_insertion_point(module_scope)
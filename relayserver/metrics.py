@@ -0,0 +1,148 @@
+"""Process-wide metrics. Metrics are created once, at import-time, by the
+modules that update them, and they're rendered in the Prometheus text
+exposition format.
+
+Updating a metric is a plain attribute update, with no locking, so each one
+should only be updated from one thread. Values that are already kept 
+elsewhere are better exposed as function metrics, which are only read when 
+they're rendered.
+"""
+
+from bisect import bisect_left
+
+_registry = []
+
+
+class Counter(object):
+    __slots__ = ('name', 'help', 'value')
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_):
+        self.name = name
+        self.help = help_
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def get_samples(self):
+        return [(self.name, self.value)]
+
+
+class Gauge(object):
+    __slots__ = ('name', 'help', 'value')
+
+    type_name = 'gauge'
+
+    def __init__(self, name, help_):
+        self.name = name
+        self.help = help_
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def get_samples(self):
+        return [(self.name, self.value)]
+
+
+class Histogram(object):
+    """Counts observations into fixed buckets. Each bucket only counts its
+    own observations, and they're accumulated when rendered.
+    """
+
+    __slots__ = ('name', 'help', 'buckets', 'counts', 'sum', 'count')
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_, buckets):
+        self.name = name
+        self.help = help_
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_samples(self):
+        samples = []
+        cumulative = 0
+        for (bound, count) in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            samples.append(('%s_bucket{le="%s"}' % (self.name, bound),
+                            cumulative))
+
+        samples.append(('%s_sum' % (self.name), self.sum))
+        samples.append(('%s_count' % (self.name), self.count))
+
+        return samples
+
+
+class _FunctionMetric(object):
+    """A metric whose value is read from a function when it's rendered."""
+
+    __slots__ = ('name', 'help', 'function')
+
+    def __init__(self, name, help_, function):
+        self.name = name
+        self.help = help_
+        self.function = function
+
+    def get_samples(self):
+        return [(self.name, self.function())]
+
+
+class CounterFunction(_FunctionMetric):
+    __slots__ = ()
+
+    type_name = 'counter'
+
+
+class GaugeFunction(_FunctionMetric):
+    __slots__ = ()
+
+    type_name = 'gauge'
+
+
+def _register(metric):
+    _registry.append(metric)
+    return metric
+
+def counter(name, help_):
+    return _register(Counter(name, help_))
+
+def gauge(name, help_):
+    return _register(Gauge(name, help_))
+
+def histogram(name, help_, buckets):
+    return _register(Histogram(name, help_, buckets))
+
+def counter_function(name, help_, function):
+    return _register(CounterFunction(name, help_, function))
+
+def gauge_function(name, help_, function):
+    return _register(GaugeFunction(name, help_, function))
+
+def render():
+    """Return every metric in the Prometheus text exposition format."""
+
+    lines = []
+    for metric in _registry:
+        lines.append('# HELP %s %s' % (metric.name, metric.help))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type_name))
+
+        for (name, value) in metric.get_samples():
+            lines.append('%s %s' % (name, value))
+
+    return '\n'.join(lines) + '\n'
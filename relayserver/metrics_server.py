@@ -0,0 +1,93 @@
+"""Serves the metrics over HTTP, and measures how late the reactor runs
+timers (how long callbacks are held up by whatever else the reactor is doing).
+"""
+
+from time import time
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+from relayserver import metrics, event_log
+
+# How often the reactor's lag is sampled.
+lag_interval = .25
+
+_control_log = event_log.get_logger(event_log.CONTROL_PLANE)
+
+_reactor_lag_histogram = metrics.histogram(
+    'relay_reactor_lag_seconds',
+    "How late timed calls ran, as sampled.",
+    (.001, .005, .01, .05, .1, .5, 1, 5))
+
+_reactor_lag_gauge = metrics.gauge(
+    'relay_reactor_lag_last_seconds',
+    "How late the most recent sampled timed call ran.")
+
+
+class _MetricsResource(Resource):
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        return metrics.render()
+
+
+class _QuietSite(Site):
+    """Doesn't log every scrape."""
+
+    def log(self, request):
+        pass
+
+
+class _LagMonitor(object):
+    """Schedules a call every so often, and records how late it ran."""
+
+    def __init__(self, interval):
+        self.__interval = interval
+        self.__expected_at = None
+        self.__call = None
+
+    def start(self):
+        self.__schedule()
+
+    def stop(self):
+        if self.__call is not None and self.__call.active():
+            self.__call.cancel()
+
+        self.__call = None
+
+    def __schedule(self):
+        self.__expected_at = time() + self.__interval
+        self.__call = reactor.callLater(self.__interval, self.__sample)
+
+    def __sample(self):
+        lag = max(0, time() - self.__expected_at)
+
+        _reactor_lag_histogram.observe(lag)
+        _reactor_lag_gauge.set(lag)
+
+        self.__schedule()
+
+def start_metrics_server(port, interface='', skt=None):
+    """Return the listening port. If a listening socket is given (e.g. one 
+    that was handed over by another process), it's adopted, rather than a new
+    one being bound.
+    """
+
+    site = _QuietSite(_MetricsResource())
+
+    if skt is None:
+        listener = reactor.listenTCP(port, site, interface=interface)
+    else:
+        listener = reactor.adoptStreamPort(skt.fileno(), skt.family, site)
+        skt.close()
+
+    monitor = _LagMonitor(lag_interval)
+    monitor.start()
+
+    reactor.addSystemEventTrigger('before', 'shutdown', monitor.stop)
+
+    _control_log.info("Serving metrics on port (%d).", port)
+
+    return listener
@@ -0,0 +1,296 @@
+"""Carries many client sessions over one host-process data connection.
+
+A host-process that asks for it (see Hello.multiplex) gets no client of its
+own on the connection. Instead, every client that the relay assigns to it is
+a stream, and the connection carries frames for all of them:
+
+    [length: 32-bit][stream-ID: 32-bit][type: 8-bit][payload]
+
+where the length counts everything after itself (so the frames can be read
+with a FrameBuffer). The relay opens a stream (the stream-ID is the client's
+session-ID), either side can close it, and DATA frames carry its bytes in
+either direction.
+
+Each direction of each stream has a window: the sender may only have so many
+bytes unacknowledged, and the receiver gives them back (in WINDOW frames) as
+it delivers them. A receiver that can't deliver (because the client isn't
+reading) stops giving them back, and the sender stops reading from its side,
+so one slow stream never holds up the others.
+
+Both ends are the same MuxConnection. Only the relay opens streams, and the
+host-process is told about each one that is opened for it.
+"""
+
+from collections import deque
+from struct import Struct
+
+from zope.interface import implementer
+
+from twisted.internet.interfaces import IPushProducer
+from twisted.python import log
+
+from relayserver.frame_buffer import FrameBuffer
+
+FRAME_OPEN = 0
+FRAME_DATA = 1
+FRAME_CLOSE = 2
+FRAME_WINDOW = 3
+
+# The number of bytes that may be in flight, per direction, per stream.
+INITIAL_WINDOW = 262144
+
+# Bytes are given back once this many have been delivered, rather than for
+# every frame.
+_WINDOW_UPDATE_THRESHOLD = INITIAL_WINDOW // 4
+
+_MAX_PAYLOAD = 65536
+
+_PREFIX = Struct('>IIB')
+_HEADER = Struct('>IB')
+_HEADER_LENGTH = _HEADER.size
+_WINDOW = Struct('>I')
+
+
+@implementer(IPushProducer)
+class MuxStream(object):
+    """One client's session on a multiplexed connection. It stands in for
+    both the peer connection and its transport (it can be written to, and it
+    can produce for, and be produced for by, another transport).
+    """
+
+    def __init__(self, connection, stream_id):
+        self.__connection = connection
+        self.__stream_id = stream_id
+
+        # The assigned client connection (on the relay).
+        self.peer = None
+
+        self.__data_handler = None
+        self.__close_handler = None
+
+        self.__closed = False
+
+        # Sending: what we may still send, what we couldn't, and who to pause
+        # while we can't.
+        self.__send_window = INITIAL_WINDOW
+        self.__queued = deque()
+        self.__producer = None
+        self.__producer_paused = False
+
+        # Receiving: what we've delivered but not yet given back, and whether
+        # we're holding it back.
+        self.__delivered = 0
+        self.__paused = False
+
+    @property
+    def stream_id(self):
+        return self.__stream_id
+
+    @property
+    def session_id(self):
+        return self.__stream_id
+
+    @property
+    def transport(self):
+        return self
+
+    @property
+    def closed(self):
+        return self.__closed
+
+    def set_handlers(self, data_handler, close_handler):
+        """The data handler is called with the bytes that arrive on the
+        stream, and the close handler when the other side closes it (or the
+        connection is lost).
+        """
+
+        self.__data_handler = data_handler
+        self.__close_handler = close_handler
+
+    def write(self, data):
+        if self.__closed is True or not data:
+            return
+
+        if self.__queued:
+            self.__queued.append(data)
+        else:
+            self.__send(data)
+
+    def writeSequence(self, data):
+        for chunk in data:
+            self.write(chunk)
+
+    def loseConnection(self):
+        self.close()
+
+    def close(self):
+        if self.__closed is True:
+            return
+
+        self.__closed = True
+        self.__queued.clear()
+
+        self.__connection.close_stream(self.__stream_id)
+
+    def registerProducer(self, producer, streaming):
+        self.__producer = producer
+        self.__producer_paused = False
+
+    def unregisterProducer(self):
+        self.__producer = None
+
+    def pauseProducing(self):
+        """Whatever we're delivering to can't keep up. Hold on to the window
+        until it can.
+        """
+
+        self.__paused = True
+
+    def resumeProducing(self):
+        self.__paused = False
+        self.__give_window()
+
+    def stopProducing(self):
+        pass
+
+    def handle_data(self, data):
+        self.__data_handler(data)
+
+        self.__delivered += len(data)
+        if self.__paused is False:
+            self.__give_window()
+
+    def handle_window(self, increment):
+        self.__send_window += increment
+
+        while self.__queued and self.__send_window > 0:
+            self.__send(self.__queued.popleft())
+
+        if not self.__queued and \
+           self.__producer is not None and \
+           self.__producer_paused is True:
+            self.__producer_paused = False
+            self.__producer.resumeProducing()
+
+    def handle_close(self):
+        if self.__closed is True:
+            return
+
+        self.__closed = True
+        self.__queued.clear()
+
+        if self.__close_handler is not None:
+            self.__close_handler()
+
+    def __send(self, data):
+        """Send as much as the window allows, and queue the rest."""
+
+        while data and self.__send_window > 0:
+            length = min(len(data), self.__send_window, _MAX_PAYLOAD)
+
+            if length == len(data):
+                chunk = data
+                data = b''
+            else:
+                chunk = data[:length]
+                data = data[length:]
+
+            self.__connection.send_frame(self.__stream_id, FRAME_DATA, chunk)
+            self.__send_window -= length
+
+        if data:
+            self.__queued.appendleft(data)
+
+            if self.__producer is not None and \
+               self.__producer_paused is False:
+                self.__producer_paused = True
+                self.__producer.pauseProducing()
+
+    def __give_window(self):
+        if self.__closed is True or \
+           self.__delivered < _WINDOW_UPDATE_THRESHOLD:
+            return
+
+        self.__connection.send_frame(self.__stream_id,
+                                     FRAME_WINDOW,
+                                     _WINDOW.pack(self.__delivered))
+
+        self.__delivered = 0
+
+
+class MuxConnection(object):
+    """Our end of a multiplexed connection. The stream handler is called with
+    each stream that the other side opens.
+    """
+
+    def __init__(self, transport, stream_handler=None):
+        self.__transport = transport
+        self.__stream_handler = stream_handler
+
+        self.__frames = FrameBuffer()
+        self.__streams = { }
+
+    @property
+    def stream_count(self):
+        return len(self.__streams)
+
+    def open_stream(self, stream_id):
+        stream = MuxStream(self, stream_id)
+        self.__streams[stream_id] = stream
+
+        self.send_frame(stream_id, FRAME_OPEN)
+
+        return stream
+
+    def close_stream(self, stream_id):
+        if self.__streams.pop(stream_id, None) is not None:
+            self.send_frame(stream_id, FRAME_CLOSE)
+
+    def send_frame(self, stream_id, type_, payload=b''):
+        prefix = _PREFIX.pack(_HEADER_LENGTH + len(payload), stream_id, type_)
+
+        if payload:
+            self.__transport.writeSequence((prefix, payload))
+        else:
+            self.__transport.write(prefix)
+
+    def receive(self, data):
+        self.__frames.push(data)
+
+        for frame in self.__frames.read_messages():
+            (stream_id, type_) = _HEADER.unpack_from(frame)
+
+            if type_ == FRAME_DATA:
+                stream = self.__streams.get(stream_id)
+                if stream is not None:
+                    stream.handle_data(frame[_HEADER_LENGTH:])
+
+            elif type_ == FRAME_WINDOW:
+                stream = self.__streams.get(stream_id)
+                if stream is not None:
+                    (increment,) = _WINDOW.unpack_from(frame, _HEADER_LENGTH)
+                    stream.handle_window(increment)
+
+            elif type_ == FRAME_OPEN:
+                stream = MuxStream(self, stream_id)
+                self.__streams[stream_id] = stream
+
+                self.__stream_handler(stream)
+
+            elif type_ == FRAME_CLOSE:
+                stream = self.__streams.pop(stream_id, None)
+                if stream is not None:
+                    stream.handle_close()
+
+            else:
+                log.msg("Dropping multiplexed frame of unknown type (%d) for "
+                        "stream (%d)." % (type_, stream_id))
+
+    def connection_lost(self):
+        """Close every stream (without telling the other side)."""
+
+        streams = list(self.__streams.values())
+        self.__streams.clear()
+
+        for stream in streams:
+            stream.handle_close()
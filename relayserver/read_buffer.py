@@ -41,6 +41,10 @@ class ReadBuffer(object):
             (four_bytes, last_buffer_index, updates1) = result
             (length,) = unpack('>I', four_bytes)
 
+            # The prefix hasn't been removed from the buffers, yet.
+            if length > self.__length - len(four_bytes):
+                return None
+
             result = self.__passive_read(length, last_buffer_index)
             if result is None:
                 return None
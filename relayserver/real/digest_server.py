@@ -0,0 +1,34 @@
+from hashlib import pbkdf2_hmac
+from binascii import hexlify
+
+from relayserver.real.ireal_server import IRealServer
+
+
+class DigestServer(IRealServer):
+    """A CPU-bound example. Each line that's received is stretched into a key
+    (PBKDF2, with a fixed salt), which is written back as a line of hex. It's
+    meant to be run off the reactor (see relayserver.real.executor).
+    """
+
+    ROUNDS = 10000
+    SALT = b'relayserver'
+
+    def __init__(self, connection):
+        self.__connection = connection
+        self.__partial = b''
+
+    def receive_data(self, proxied_data):
+        lines = (self.__partial + proxied_data).split(b'\n')
+        self.__partial = lines.pop()
+
+        if not lines:
+            return
+
+        digests = [hexlify(pbkdf2_hmac('sha256', line, self.SALT, self.ROUNDS))
+                   for line
+                   in lines]
+
+        self.__connection.transport.write(b'\n'.join(digests) + b'\n')
+
+    def shutdown(self):
+        pass
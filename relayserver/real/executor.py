@@ -0,0 +1,361 @@
+"""Runs a real-server off the reactor, so that one that does CPU work or
+blocking I/O doesn't stall every other connection in the host-process. In
+config.py:
+
+    from relayserver.real.executor import off_reactor, ProcessExecutor
+    from relayserver.real.digest_server import DigestServer
+
+    EndpointServer = off_reactor(DigestServer, ProcessExecutor())
+
+Each session's server receives its data in the order that it arrived: a
+session has at most one call to the executor at a time, and whatever arrives
+while it's running is passed to the next call, together. The server is
+constructed with a stand-in for the connection, which collects what it writes,
+to be written to the real connection on the reactor once the call returns.
+With a process pool, the server is sent to a process with its data, and
+comes back with what it wrote (so it has to be picklable, and can't share
+anything with the host-process). A call that fails (as does one that can't be
+pickled, or whose process dies) is logged, and the server carries on as it
+was before the call. Once more than the high watermark of data has been
+received and not processed, the connection is paused, until no more than the
+low watermark is left.
+
+This is for the Twisted host-process.
+"""
+
+import errno
+import os
+import signal
+
+from itertools import count
+from multiprocessing import Pool, cpu_count
+from pickle import dumps, loads, HIGHEST_PROTOCOL
+from traceback import format_exc
+
+try:
+    from multiprocessing import SimpleQueue
+except ImportError:
+    # Python 2.
+    from multiprocessing.queues import SimpleQueue
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, fail
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+from twisted.python import log
+
+from relayserver.real.ireal_server import IRealServer
+
+
+class ThreadExecutor(object):
+    """Calls functions on a pool of threads."""
+
+    def __init__(self, size=4):
+        self.__pool = ThreadPool(size, size, 'ThreadExecutor')
+
+        reactor.callWhenRunning(self.__pool.start)
+        reactor.addSystemEventTrigger('during', 'shutdown', self.__pool.stop)
+
+    def submit(self, function, *args):
+        """Return a Deferred that fires, on the reactor, with the result."""
+
+        return deferToThreadPool(reactor, self.__pool, function, *args)
+
+
+# Where a pool process says which call it has started, and in which process.
+_started = None
+
+def _start_process(started):
+    global _started
+    _started = started
+
+    # A process that's forked once the reactor is running has its handler,
+    # and the pool stops its processes with SIGTERM.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+def _call(call_id, pickled):
+    """Runs in a pool process. The pool calls us back only for what it can
+    pickle (and we'd never hear of the rest), so the call and its result are
+    pickled by us. Exceptions don't pickle reliably, so a failure comes back
+    as its traceback.
+    """
+
+    _started.put((call_id, os.getpid()))
+
+    try:
+        (function, args) = loads(pickled)
+        return (True, dumps(function(*args), HIGHEST_PROTOCOL))
+    except Exception:
+        return (False, format_exc())
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno == errno.ESRCH:
+            return False
+
+        raise
+
+    return True
+
+class ProcessExecutor(object):
+    """Calls functions in a pool of processes. The functions, their arguments
+    and their results have to be picklable. A call fails if any of them isn't,
+    or if its process dies (which is checked for every check_interval
+    seconds, while there are calls).
+    """
+
+    def __init__(self, size=None, check_interval=1):
+        self.__check_interval = check_interval
+
+        # The processes are forked now, before the reactor has started.
+        self.__started = SimpleQueue()
+        self.__pool = Pool(size or cpu_count(),
+                           _start_process,
+                           (self.__started,))
+
+        # The Deferred for each call that hasn't finished, and the process
+        # that it was started in (once we know).
+        self.__calls = {}
+        self.__call_ids = count()
+
+        self.__checker = LoopingCall(self.__check)
+
+        self.__trigger = reactor.addSystemEventTrigger('during',
+                                                       'shutdown',
+                                                       self.__stop)
+
+    def submit(self, function, *args):
+        """Return a Deferred that fires, on the reactor, with the result."""
+
+        try:
+            pickled = dumps((function, args), HIGHEST_PROTOCOL)
+        except Exception:
+            return fail()
+
+        call_id = next(self.__call_ids)
+
+        d = Deferred()
+        self.__calls[call_id] = [d, None]
+
+        def finished(outcome):
+            reactor.callFromThread(self.__finished, call_id, outcome)
+
+        self.__pool.apply_async(_call, (call_id, pickled), callback=finished)
+
+        if self.__checker.running is False:
+            self.__checker.start(self.__check_interval, now=False)
+
+        return d
+
+    def stop(self):
+        """Stop the processes now, rather than when the reactor stops. The
+        calls that haven't finished fail.
+        """
+
+        reactor.removeSystemEventTrigger(self.__trigger)
+        self.__stop()
+
+        calls = list(self.__calls.values())
+        self.__calls.clear()
+
+        for (d, pid) in calls:
+            d.errback(Exception("The pool was stopped."))
+
+    def __stop(self):
+        # When the reactor stops, nothing waits for the calls that haven't
+        # finished.
+        if self.__checker.running is True:
+            self.__checker.stop()
+
+        self.__pool.terminate()
+        self.__pool.join()
+
+    def __finished(self, call_id, outcome):
+        call = self.__calls.pop(call_id, None)
+        if call is None:
+            # It has already failed.
+            return
+
+        d = call[0]
+        (succeeded, result) = outcome
+
+        if succeeded is True:
+            try:
+                result = loads(result)
+            except Exception:
+                d.errback()
+            else:
+                d.callback(result)
+        else:
+            d.errback(Exception("Call failed in a pool process:\n%s" %
+                                (result)))
+
+    def __check(self):
+        """Fail the calls whose processes have died."""
+
+        while self.__started.empty() is False:
+            (call_id, pid) = self.__started.get()
+
+            call = self.__calls.get(call_id)
+            if call is not None:
+                call[1] = pid
+
+        for (call_id, (d, pid)) in list(self.__calls.items()):
+            if pid is not None and _is_running(pid) is False:
+                del self.__calls[call_id]
+                d.errback(Exception("The pool process that the call was "
+                                    "running in (%d) died." % (pid)))
+
+        if not self.__calls:
+            self.__checker.stop()
+
+
+class _Session(object):
+    """The server, and a stand-in for its connection (and the connection's
+    transport), which keeps whatever the server writes. It's what travels to
+    the executor and back.
+    """
+
+    def __init__(self, server_class):
+        self.__written = []
+        self.server = server_class(self)
+
+    @property
+    def transport(self):
+        return self
+
+    def write(self, data):
+        self.__written.append(data)
+
+    def writeSequence(self, data):
+        self.__written.extend(data)
+
+    def take_written(self):
+        written = self.__written
+        self.__written = []
+
+        return written
+
+def _receive(session, data):
+    session.server.receive_data(data)
+    return (session, session.take_written())
+
+def _shutdown(session):
+    session.server.shutdown()
+
+
+class ExecutorServer(IRealServer):
+    """Passes the data for a session to a server of the given class, on the
+    given executor (see off_reactor()).
+    """
+
+    def __init__(self, connection, server_class, executor, high_watermark,
+                 low_watermark):
+        self.__connection = connection
+        self.__executor = executor
+        self.__high_watermark = high_watermark
+        self.__low_watermark = low_watermark
+
+        self.__session = _Session(server_class)
+
+        # Data that has arrived while a call was running, and the bytes that
+        # haven't been processed (whether or not a call has them).
+        self.__queued = []
+        self.__unprocessed = 0
+
+        self.__running = False
+        self.__paused = False
+        self.__shut_down = False
+
+    def receive_data(self, proxied_data):
+        if self.__shut_down is True:
+            return
+
+        self.__queued.append(proxied_data)
+        self.__unprocessed += len(proxied_data)
+
+        if self.__running is False:
+            self.__submit()
+        elif self.__paused is False and \
+             self.__unprocessed > self.__high_watermark:
+            self.__paused = True
+            self.__connection.transport.pauseProducing()
+
+    def shutdown(self):
+        """Nothing that the server writes from now on is sent. It's shut down
+        on the executor once it has processed whatever it's processing.
+        """
+
+        self.__shut_down = True
+        self.__queued = []
+
+        if self.__paused is True:
+            # The connection may be recycled for another session.
+            self.__paused = False
+            self.__connection.transport.resumeProducing()
+
+        if self.__running is False:
+            self.__executor.submit(_shutdown, self.__session).\
+                addErrback(log.err)
+
+    def __submit(self):
+        data = b''.join(self.__queued)
+        self.__queued = []
+        self.__running = True
+
+        d = self.__executor.submit(_receive, self.__session, data)
+        d.addCallbacks(self.__processed,
+                       self.__failed,
+                       callbackArgs=(len(data),),
+                       errbackArgs=(len(data),))
+
+    def __processed(self, result, length):
+        # A process pool gives us back a copy.
+        (self.__session, written) = result
+
+        if self.__shut_down is False and written:
+            self.__connection.transport.writeSequence(written)
+
+        self.__next(length)
+
+    def __failed(self, reason, length):
+        # With a process pool, the server keeps the state that it had before
+        # the call.
+        log.err(reason)
+        self.__next(length)
+
+    def __next(self, length):
+        self.__running = False
+        self.__unprocessed -= length
+
+        if self.__shut_down is True:
+            self.__executor.submit(_shutdown, self.__session).\
+                addErrback(log.err)
+            return
+
+        if self.__paused is True and \
+           self.__unprocessed <= self.__low_watermark:
+            self.__paused = False
+            self.__connection.transport.resumeProducing()
+
+        if self.__queued:
+            self.__submit()
+
+def off_reactor(server_class, executor, high_watermark=65536,
+                low_watermark=16384):
+    """Return a factory for real-servers (to be aliased as EndpointServer in
+    config.py) that run the given class on the given executor (a
+    ThreadExecutor or a ProcessExecutor).
+    """
+
+    def create(connection):
+        return ExecutorServer(connection,
+                              server_class,
+                              executor,
+                              high_watermark,
+                              low_watermark)
+
+    return create
@@ -0,0 +1,39 @@
+"""What the host-processes (relayserver.boot.host_process and
+relayserver.aio.host_process) give a real-server as its connection, for a
+recycled connection's sessions.
+"""
+
+
+class SessionConnection(object):
+    """Stands in for the host-process's data connection (and the connection's
+    transport) for one session. Once the session is ending, whatever the
+    server writes is dropped: its client has gone, and nothing may follow the
+    token that marks the end of our side of the session. Anything else (such
+    as flow-control) goes to the connection's transport.
+    """
+
+    def __init__(self, connection):
+        self.__connection = connection
+        self.__ended = False
+
+    @property
+    def transport(self):
+        return self
+
+    def end(self):
+        self.__ended = True
+
+    def write(self, data):
+        if self.__ended is False:
+            self.__connection.transport.write(data)
+
+    def writeSequence(self, data):
+        if self.__ended is False:
+            self.__connection.transport.writeSequence(data)
+
+    def writelines(self, data):
+        if self.__ended is False:
+            self.__connection.transport.writelines(data)
+
+    def __getattr__(self, name):
+        return getattr(self.__connection.transport, name)
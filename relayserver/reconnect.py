@@ -0,0 +1,156 @@
+"""Schedules the (re)connections of the host-process's pool of data connections
+to the relay, in one place, rather than letting each slot back off on its own.
+
+Slots ask to connect with schedule(), whether it's their first connection, or
+they've lost one. While the relay is healthy, they connect in the order that
+they asked, at most `rate` a second, so that a pool that loses every
+connection at once doesn't come back all at once. Once a slot fails (it
+couldn't connect, or it lost its connection before its hello was answered),
+the relay is assumed to be down: the slots that are waiting are held, and just
+one of them connects at a time, as a probe, after a delay that grows with each
+probe that fails (with jitter, so that many host-processes don't probe in
+step). As soon as any slot's handshake succeeds (see handshake_succeeded()),
+the delay is reset and every slot that's waiting is released at once (at the
+rate).
+"""
+
+from collections import OrderedDict
+from random import random
+
+from twisted.internet import reactor
+
+
+class ReconnectScheduler(object):
+    def __init__(self, rate=100, initial_delay=.5, max_delay=10, factor=2,
+                 jitter=.5, clock=None):
+        """The delays are in seconds. Each probe's delay is jittered by up to
+        the given fraction, either way. clock defaults to the reactor.
+        """
+
+        self.rate = rate
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.factor = factor
+        self.jitter = jitter
+
+        self.__clock = reactor if clock is None else clock
+
+        # Slot => its attempt, for the slots that are waiting, in the order
+        # that they first asked.
+        self.__attempts = OrderedDict()
+
+        # The slots that have connected, or are connecting, whose handshakes
+        # haven't succeeded, yet.
+        self.__connecting = set()
+
+        # While the relay is down, the delay before the next probe, and the
+        # slot that's probing, if one is.
+        self.__delay = None
+        self.__probe = None
+
+        self.__next_at = 0
+        self.__timer = None
+
+    @property
+    def pending_count(self):
+        """The slots that are waiting to connect, or haven't finished
+        connecting.
+        """
+
+        return len(self.__attempts) + len(self.__connecting)
+
+    @property
+    def backing_off(self):
+        return self.__delay is not None
+
+    def schedule(self, slot, attempt, failed=False):
+        """The slot wants to connect, by calling attempt(). If it failed, it
+        either couldn't connect, or it lost its connection before its
+        handshake succeeded.
+        """
+
+        self.__connecting.discard(slot)
+
+        if failed is True:
+            self.__failed(slot)
+
+        self.__attempts[slot] = attempt
+        self.__reschedule()
+
+    def cancel(self, slot):
+        """Forget the slot, whether it's waiting or connecting."""
+
+        self.__attempts.pop(slot, None)
+        self.__connecting.discard(slot)
+
+        if slot is self.__probe:
+            # Another slot will have to probe.
+            self.__probe = None
+            self.__reschedule()
+
+    def handshake_succeeded(self, slot=None):
+        """The relay is up. Every slot that's waiting can connect."""
+
+        if slot is not None:
+            self.__connecting.discard(slot)
+
+        self.reset()
+
+    def reset(self):
+        """Stop backing off, if we are."""
+
+        if self.__delay is None:
+            return
+
+        self.__delay = None
+        self.__probe = None
+
+        self.__next_at = self.__clock.seconds()
+        self.__reschedule()
+
+    def __failed(self, slot):
+        now = self.__clock.seconds()
+
+        if self.__delay is None:
+            self.__delay = self.initial_delay
+        elif slot is self.__probe:
+            self.__delay = min(self.__delay * self.factor, self.max_delay)
+        else:
+            # Slots that were already connecting when the relay went down
+            # fail as well, but only the probe tells us anything new.
+            return
+
+        self.__probe = None
+
+        jitter = self.jitter * (2 * random() - 1)
+        self.__next_at = now + self.__delay * (1 + jitter)
+
+    def __reschedule(self):
+        if self.__timer is not None and self.__timer.active():
+            self.__timer.cancel()
+
+        self.__timer = None
+
+        if not self.__attempts or self.__probe is not None:
+            return
+
+        delay = max(0, self.__next_at - self.__clock.seconds())
+        self.__timer = self.__clock.callLater(delay, self.__attempt)
+
+    def __attempt(self):
+        self.__timer = None
+
+        if not self.__attempts:
+            return
+
+        (slot, attempt) = self.__attempts.popitem(last=False)
+        self.__connecting.add(slot)
+
+        if self.__delay is not None:
+            self.__probe = slot
+        else:
+            self.__next_at = self.__clock.seconds() + 1.0 / self.rate
+
+        attempt()
+
+        self.__reschedule()
@@ -0,0 +1,399 @@
+"""Policies for picking which waiting host-process connection a new client is
+assigned to.
+
+A policy holds the waiting connections. Each connection belongs to a
+host-process (by the ID that it gave in its hello, which is shared by all of
+its connections) and has the host-process's weight: its capacity relative to
+the others'. The assignment manager tells the policy when a connection starts
+and finishes serving a client, so that it can track the load on each
+host-process (its clients over its weight):
+
+    add()       A connection is waiting.
+    remove()    A waiting connection has gone (it dropped, or was lent to
+                another worker).
+    select()    Take a waiting connection for a client.
+    pop()       Take a waiting connection for something other than a client.
+    started()   A connection has been assigned a client (whether or not it
+                came from select(): a connection can go straight to a client
+                that was waiting for one).
+    finished()  A connection's client has gone.
+
+Each built-in policy picks in constant or logarithmic time. Policies that need
+to find the host-process with the smallest something keep a heap of
+host-processes that's updated lazily: a host-process is pushed again whenever
+its key changes, and stale entries are discarded as they surface.
+"""
+
+from collections import OrderedDict
+from heapq import heappush, heappop, heapify
+from random import Random
+
+
+class SelectionPolicy(object):
+    def __len__(self):
+        raise NotImplementedError()
+
+    def __contains__(self, session_id):
+        raise NotImplementedError()
+
+    def add(self, hp_connection):
+        raise NotImplementedError()
+
+    def remove(self, session_id):
+        """Remove and return the waiting connection, or return None if it's
+        not waiting.
+        """
+
+        raise NotImplementedError()
+
+    def select(self):
+        """Remove and return the connection to assign to a client, or return
+        None if none are waiting.
+        """
+
+        raise NotImplementedError()
+
+    def pop(self):
+        """Remove and return whichever waiting connection is cheapest to give
+        up, or return None if none are waiting.
+        """
+
+        return self.select()
+
+    def started(self, hp_connection):
+        pass
+
+    def finished(self, hp_connection):
+        pass
+
+
+class FifoPolicy(SelectionPolicy):
+    """Assigns the connection that has waited the longest, regardless of its
+    host-process.
+    """
+
+    def __init__(self):
+        self.__waiting = OrderedDict()
+
+    def __len__(self):
+        return len(self.__waiting)
+
+    def __contains__(self, session_id):
+        return session_id in self.__waiting
+
+    def add(self, hp_connection):
+        self.__waiting[hp_connection.session_id] = hp_connection
+
+    def remove(self, session_id):
+        return self.__waiting.pop(session_id, None)
+
+    def select(self):
+        if not self.__waiting:
+            return None
+
+        (session_id, hp_connection) = self.__waiting.popitem(last=False)
+        return hp_connection
+
+
+class _HostProcess(object):
+    __slots__ = ('id', 'waiting', 'clients', 'weight', 'pass_', 'seq', 'index')
+
+    def __init__(self, host_process_id, weight):
+        self.id = host_process_id
+
+        # Session-ID => connection, longest-waiting first.
+        self.waiting = OrderedDict()
+
+        # Connections currently serving clients.
+        self.clients = 0
+
+        self.weight = max(1, weight)
+
+        # Used by the policies (see below).
+        self.pass_ = 0.0
+        self.seq = None
+        self.index = None
+
+
+class _GroupedPolicy(SelectionPolicy):
+    """Groups the waiting connections by host-process. Subclasses pick the
+    host-process, and its longest-waiting connection is taken.
+    """
+
+    def __init__(self):
+        # Host-process ID => _HostProcess, for every host-process with waiting
+        # or busy connections.
+        self.__host_processes = { }
+
+        # Session-ID => _HostProcess, for every waiting connection.
+        self.__waiting = { }
+
+    def __len__(self):
+        return len(self.__waiting)
+
+    def __contains__(self, session_id):
+        return session_id in self.__waiting
+
+    def __get_host_process(self, hp_connection):
+        host_process = self.__host_processes.get(hp_connection.host_process_id)
+        if host_process is None:
+            host_process = _HostProcess(hp_connection.host_process_id,
+                                        hp_connection.weight)
+
+            self.__host_processes[host_process.id] = host_process
+
+        return host_process
+
+    def __forget_if_idle(self, host_process):
+        if not host_process.waiting and host_process.clients == 0:
+            del self.__host_processes[host_process.id]
+
+    def __take(self):
+        host_process = self._pick()
+
+        (session_id, hp_connection) = \
+            host_process.waiting.popitem(last=False)
+
+        del self.__waiting[session_id]
+
+        if not host_process.waiting:
+            self._unavailable(host_process)
+
+        return (host_process, hp_connection)
+
+    def _get_load(self, host_process):
+        return float(host_process.clients) / host_process.weight
+
+    def add(self, hp_connection):
+        host_process = self.__get_host_process(hp_connection)
+
+        host_process.waiting[hp_connection.session_id] = hp_connection
+        self.__waiting[hp_connection.session_id] = host_process
+
+        if len(host_process.waiting) == 1:
+            self._available(host_process)
+
+    def remove(self, session_id):
+        host_process = self.__waiting.pop(session_id, None)
+        if host_process is None:
+            return None
+
+        hp_connection = host_process.waiting.pop(session_id)
+
+        if not host_process.waiting:
+            self._unavailable(host_process)
+            self.__forget_if_idle(host_process)
+
+        return hp_connection
+
+    def select(self):
+        if not self.__waiting:
+            return None
+
+        # We'll hear about it, in started().
+        (host_process, hp_connection) = self.__take()
+        return hp_connection
+
+    def pop(self):
+        if not self.__waiting:
+            return None
+
+        (host_process, hp_connection) = self.__take()
+        self.__forget_if_idle(host_process)
+
+        return hp_connection
+
+    def started(self, hp_connection):
+        host_process = self.__get_host_process(hp_connection)
+        host_process.clients += 1
+
+        self._load_changed(host_process)
+
+    def finished(self, hp_connection):
+        host_process = self.__host_processes.get(hp_connection.host_process_id)
+        if host_process is None:
+            return
+
+        host_process.clients -= 1
+
+        self._load_changed(host_process)
+        self.__forget_if_idle(host_process)
+
+    def _pick(self):
+        """Return the host-process to take a connection from. At least one has
+        a connection waiting.
+        """
+
+        raise NotImplementedError()
+
+    def _available(self, host_process):
+        """The host-process has a connection waiting, now."""
+
+        raise NotImplementedError()
+
+    def _unavailable(self, host_process):
+        """The host-process has no connections waiting, now."""
+
+        raise NotImplementedError()
+
+    def _load_changed(self, host_process):
+        pass
+
+
+class _HostProcessHeap(object):
+    """Host-processes by a key that changes. Only the latest entry pushed for
+    each host-process is current.
+    """
+
+    def __init__(self):
+        self.__heap = []
+        self.__next_seq = 0
+        self.__current_count = 0
+
+    def push(self, host_process, key):
+        if host_process.seq is None:
+            self.__current_count += 1
+
+        host_process.seq = self.__next_seq
+        self.__next_seq += 1
+
+        heappush(self.__heap, (key, host_process.seq, host_process))
+
+        # Don't let the stale entries pile up.
+        if len(self.__heap) > self.__current_count * 2 + 16:
+            self.__heap = [entry
+                           for entry
+                           in self.__heap
+                           if entry[2].seq == entry[1]]
+
+            heapify(self.__heap)
+
+    def discard(self, host_process):
+        if host_process.seq is not None:
+            host_process.seq = None
+            self.__current_count -= 1
+
+    def peek(self):
+        heap = self.__heap
+        while heap:
+            (key, seq, host_process) = heap[0]
+            if host_process.seq == seq:
+                return host_process
+
+            heappop(heap)
+
+        return None
+
+
+class LeastLoadedPolicy(_GroupedPolicy):
+    """Assigns a connection from the least-loaded host-process (the one that
+    has been at that load the longest, on a tie).
+    """
+
+    def __init__(self):
+        super(LeastLoadedPolicy, self).__init__()
+        self.__heap = _HostProcessHeap()
+
+    def _pick(self):
+        return self.__heap.peek()
+
+    def _available(self, host_process):
+        self.__heap.push(host_process, self._get_load(host_process))
+
+    def _unavailable(self, host_process):
+        self.__heap.discard(host_process)
+
+    def _load_changed(self, host_process):
+        if host_process.waiting:
+            self.__heap.push(host_process, self._get_load(host_process))
+
+
+class TwoChoicesPolicy(_GroupedPolicy):
+    """Picks two host-processes with connections waiting, at random, and
+    assigns a connection from the less-loaded of them. That's nearly as even
+    as always taking the least-loaded, without having to keep them in order.
+    """
+
+    def __init__(self, random=None):
+        super(TwoChoicesPolicy, self).__init__()
+
+        self.__random = random if random is not None else Random()
+
+        # The host-processes with connections waiting, in no order.
+        self.__available = []
+
+    def _pick(self):
+        available = self.__available
+        if len(available) == 1:
+            return available[0]
+
+        # Two different ones.
+        i = self.__random.randrange(len(available))
+        j = self.__random.randrange(len(available) - 1)
+        if j >= i:
+            j += 1
+
+        (first, second) = (available[i], available[j])
+        return first \
+                if self._get_load(first) <= self._get_load(second) \
+                else second
+
+    def _available(self, host_process):
+        host_process.index = len(self.__available)
+        self.__available.append(host_process)
+
+    def _unavailable(self, host_process):
+        # Move the last one into its place.
+        last = self.__available.pop()
+        if last is not host_process:
+            last.index = host_process.index
+            self.__available[last.index] = last
+
+        host_process.index = None
+
+
+class WeightedRoundRobinPolicy(_GroupedPolicy):
+    """Takes connections from the host-processes in turn, in proportion to
+    their weights, regardless of their clients (stride scheduling). A
+    host-process that runs out of waiting connections rejoins at the current
+    position, rather than catching up on the turns that it missed.
+    """
+
+    def __init__(self):
+        super(WeightedRoundRobinPolicy, self).__init__()
+
+        self.__heap = _HostProcessHeap()
+        self.__position = 0.0
+
+    def _pick(self):
+        host_process = self.__heap.peek()
+
+        self.__position = host_process.pass_
+        host_process.pass_ += 1.0 / host_process.weight
+
+        # It's pushed again for its new turn (unless it runs out).
+        if len(host_process.waiting) > 1:
+            self.__heap.push(host_process, host_process.pass_)
+
+        return host_process
+
+    def _available(self, host_process):
+        host_process.pass_ = max(host_process.pass_, self.__position)
+        self.__heap.push(host_process, host_process.pass_)
+
+    def _unavailable(self, host_process):
+        self.__heap.discard(host_process)
+
+
+POLICIES = { 'fifo': FifoPolicy,
+             'least-loaded': LeastLoadedPolicy,
+             'two-choices': TwoChoicesPolicy,
+             'weighted': WeightedRoundRobinPolicy }
+
+def create_policy(name):
+    try:
+        policy_class = POLICIES[name]
+    except KeyError:
+        raise ValueError("Selection-policy [%s] is not valid." % (name))
+
+    return policy_class()
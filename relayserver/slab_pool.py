@@ -0,0 +1,72 @@
+"""A free list of fixed-size receive buffers (slabs). Connections that read
+with recv_into() borrow a slab while they have data buffered in it, and give
+it back as soon as they don't, so that a slab is allocated once and reused for
+many reads (across connections), rather than a string being allocated for
+every read.
+
+Slabs are handed out as memoryviews over bytearrays, which can be read into,
+sliced, and parsed in place without copying.
+
+This is only ever touched from the reactor thread, so there is no locking.
+"""
+
+from relayserver import metrics
+
+# Framed messages (commands, hellos) are small. Anything that doesn't fit gets
+# a buffer of its own (see SlabFrameBuffer).
+DEFAULT_SLAB_SIZE = 16384
+
+# The most slabs that are kept for reuse. Beyond that, returned slabs are
+# dropped.
+DEFAULT_MAX_FREE = 1024
+
+_allocated_counter = metrics.counter(
+    'relay_slabs_allocated_total',
+    "Receive slabs allocated because none were free.")
+
+_reused_counter = metrics.counter(
+    'relay_slabs_reused_total',
+    "Receive slabs taken from the free list.")
+
+
+class SlabPool(object):
+    def __init__(self, slab_size=DEFAULT_SLAB_SIZE, max_free=DEFAULT_MAX_FREE):
+        self.slab_size = slab_size
+        self.__max_free = max_free
+
+        self.__free = []
+
+        self.allocated_count = 0
+        self.reused_count = 0
+
+    def __len__(self):
+        return len(self.__free)
+
+    def acquire(self):
+        """Return a slab. It isn't zeroed."""
+
+        if self.__free:
+            self.reused_count += 1
+            _reused_counter.inc()
+
+            return self.__free.pop()
+
+        self.allocated_count += 1
+        _allocated_counter.inc()
+
+        return memoryview(bytearray(self.slab_size))
+
+    def release(self, slab):
+        """Return a slab for reuse. Nothing may be holding on to it, or to any
+        slice of it.
+        """
+
+        if len(slab) == self.slab_size and len(self.__free) < self.__max_free:
+            self.__free.append(slab)
+
+default_pool = SlabPool()
+
+metrics.gauge_function(
+    'relay_slabs_free',
+    "Receive slabs waiting to be reused.",
+    default_pool.__len__)
@@ -0,0 +1,422 @@
+"""An optional, Linux-only data-plane for assigned client/host-process pairs.
+
+Once a pair has been assigned, the relay has nothing left to do with the bytes
+but move them. Rather than reading every chunk into Python and writing it back
+out, the pump hands both sockets to a worker thread that moves the bytes from
+one socket to the other through a pipe with splice(2), so that they never leave
+the kernel. Twisted stops reading both connections at hand-off, and is only
+told about the pair again once the pump is done with it.
+
+Each direction ends on its own. When one side stops sending, its peer is told
+(its socket is shut down for writing), and the other direction carries on
+until its own side stops sending too. Only then (or once either side has
+failed) is the pair handed back, through the side that stopped first. A
+recycled host-process connection outlives its client, so a client that stops
+sending ends the pair at once.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+
+from collections import deque
+from threading import Thread, Lock
+
+from twisted.internet import reactor
+from twisted.python import log
+
+from relayserver.utility import get_pending_write_length
+
+_SPLICE_F_MOVE = 1
+_SPLICE_F_NONBLOCK = 2
+
+# The default capacity of a pipe.
+_CHUNK_SIZE = 65536
+
+_POLL_HANGUP = select.EPOLLHUP | select.EPOLLERR \
+                if hasattr(select, 'epoll') \
+                else 0
+
+def _load_splice():
+    if hasattr(select, 'epoll') is False:
+        return None
+
+    path = ctypes.util.find_library('c')
+    if path is None:
+        return None
+
+    libc = ctypes.CDLL(path, use_errno=True)
+
+    try:
+        splice = libc.splice
+    except AttributeError:
+        return None
+
+    splice.argtypes = [ctypes.c_int, ctypes.c_void_p,
+                       ctypes.c_int, ctypes.c_void_p,
+                       ctypes.c_size_t, ctypes.c_uint]
+
+    splice.restype = ctypes.c_ssize_t
+
+    return splice
+
+_splice = _load_splice()
+
+def is_supported():
+    return _splice is not None
+
+def _splice_or_raise(fd_in, fd_out, length):
+    """Return the number of bytes moved (0 at EOF), or None if the call would
+    have blocked.
+    """
+
+    count = _splice(fd_in, None, fd_out, None, length,
+                    _SPLICE_F_MOVE | _SPLICE_F_NONBLOCK)
+
+    if count >= 0:
+        return count
+
+    error = ctypes.get_errno()
+    if error in (errno.EAGAIN, errno.EINTR):
+        return None
+
+    raise OSError(error, os.strerror(error))
+
+
+def _shutdown_writes(fd, family):
+    # The socket object has a descriptor of its own, but shutting it down
+    # shuts the socket down.
+    skt = socket.fromfd(fd, family, socket.SOCK_STREAM)
+
+    try:
+        skt.shutdown(socket.SHUT_WR)
+    except socket.error:
+        pass
+    finally:
+        skt.close()
+
+
+class _Direction(object):
+    """Bytes moving from one socket to the other through a pipe. If
+    passes_eof is True, the sink is shut down for writing once the source
+    has hung up.
+    """
+
+    def __init__(self, source_fd, sink_fd, passes_eof):
+        self.source_fd = source_fd
+        self.sink_fd = sink_fd
+        self.passes_eof = passes_eof
+
+        (self.pipe_r, self.pipe_w) = os.pipe()
+
+        # The number of bytes that are sitting in the pipe.
+        self.pending = 0
+
+        # Set once nothing more will be read from the source (it has stopped
+        # sending, or either side has failed).
+        self.finished = False
+
+    def close(self):
+        os.close(self.pipe_r)
+        os.close(self.pipe_w)
+
+
+class _Pair(object):
+    """The client's bytes go to the host-process, and back. A host-process
+    connection that is recycled outlives its client, so the client hanging up
+    isn't passed on to it: the pair is finished with, and the relay ends the
+    session instead.
+    """
+
+    def __init__(self, client_transport, hp_transport, hp_recycles):
+        self.transports = { }
+
+        # We keep our own descriptors so that Twisted closing its own can never
+        # leave us holding a number that has since been reused.
+        client_fd = os.dup(client_transport.fileno())
+        hp_fd = os.dup(hp_transport.fileno())
+
+        self.transports[client_fd] = client_transport
+        self.transports[hp_fd] = hp_transport
+
+        self.families = { client_fd: client_transport.socket.family,
+                          hp_fd: hp_transport.socket.family }
+
+        self.directions = (_Direction(client_fd, hp_fd, not hp_recycles),
+                           _Direction(hp_fd, client_fd, True))
+
+        # The side that hung up (or failed) first. The pair is handed back to
+        # Twisted (through that side) once neither direction has anything
+        # more to move.
+        self.hung_up_fd = None
+
+        self.registered = set()
+
+    def finish(self, direction):
+        """The direction's source has stopped sending."""
+
+        direction.finished = True
+
+        if self.hung_up_fd is None:
+            self.hung_up_fd = direction.source_fd
+
+    def end(self, fd):
+        """Nothing more is read from either side, as the descriptor has
+        failed (or its side ending ends the pair).
+        """
+
+        if self.hung_up_fd is None:
+            self.hung_up_fd = fd
+
+        for direction in self.directions:
+            direction.finished = True
+
+    def is_finished(self):
+        return all(direction.finished is True and direction.pending == 0
+                   for direction
+                   in self.directions)
+
+    def get_mask(self, fd):
+        """Return the events that we're waiting for on the descriptor, or None
+        if we aren't waiting for any (hang-ups are always reported).
+        """
+
+        mask = 0
+        for direction in self.directions:
+            if direction.source_fd == fd and direction.pending == 0 and \
+               direction.finished is False:
+                mask |= select.EPOLLIN
+
+            if direction.sink_fd == fd and direction.pending > 0:
+                mask |= select.EPOLLOUT
+
+        # Until a side hangs up, we want to hear that either has (and once
+        # it has, only what we're still waiting for).
+        if mask == 0 and self.hung_up_fd is not None:
+            return None
+
+        return mask | _POLL_HANGUP
+
+    def close(self):
+        for direction in self.directions:
+            direction.close()
+
+        for fd in self.transports.keys():
+            os.close(fd)
+
+
+class SplicePump(object):
+    """Moves the bytes of assigned pairs on a single worker thread, with one
+    epoll set for all of them.
+    """
+
+    def __init__(self):
+        if is_supported() is False:
+            raise Exception("splice() is not available on this system.")
+
+        self.__epoll = select.epoll()
+        self.__pairs_by_fd = { }
+
+        # Pairs are added and removed by the reactor thread, but only ever
+        # touched by the worker thread. The reactor queues the request and
+        # then wakes the worker up.
+        self.__requests = deque()
+        self.__locker = Lock()
+
+        (self.__wakeup_r, self.__wakeup_w) = os.pipe()
+        self.__epoll.register(self.__wakeup_r, select.EPOLLIN)
+
+        self.__running = False
+        self.__thread = None
+
+        # The bytes moved from clients to host-processes, and back. Only the
+        # worker thread updates these.
+        self.__moved = [0, 0]
+
+    @property
+    def bytes_moved(self):
+        return tuple(self.__moved)
+
+    def start(self):
+        self.__running = True
+
+        self.__thread = Thread(target=self.__run, name='SplicePump')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__running = False
+        self.__wake()
+
+        if self.__thread is not None:
+            self.__thread.join()
+
+    def add_pair(self, client_transport, hp_transport, hp_recycles=False):
+        """Take over moving the data between the two connections. Return False
+        if the pair can't be handed-off, in which case the caller keeps relaying
+        it itself. If hp_recycles is True, the host-process connection is never
+        shut down for writing (see _Pair).
+        """
+
+        # We can't start writing to a socket behind Twisted's back until it
+        # has flushed whatever it's holding.
+        if get_pending_write_length(client_transport) > 0 or \
+           get_pending_write_length(hp_transport) > 0:
+            return False
+
+        client_transport.stopReading()
+        hp_transport.stopReading()
+
+        # Twisted mustn't resume reading either of them for flow-control.
+        client_transport.unregisterProducer()
+        hp_transport.unregisterProducer()
+
+        pair = _Pair(client_transport, hp_transport, hp_recycles)
+
+        with self.__locker:
+            self.__requests.append(pair)
+
+        self.__wake()
+
+        return True
+
+    def __wake(self):
+        os.write(self.__wakeup_w, b'x')
+
+    def __run(self):
+        while self.__running is True:
+            try:
+                events = self.__epoll.poll(1)
+            except IOError as e:
+                if e.errno == errno.EINTR:
+                    continue
+
+                raise
+
+            for (fd, mask) in events:
+                if fd == self.__wakeup_r:
+                    self.__handle_requests()
+                    continue
+
+                pair = self.__pairs_by_fd.get(fd)
+                if pair is None:
+                    continue
+
+                try:
+                    self.__pump(pair)
+                except:
+                    log.err()
+                    pair.end(fd)
+
+                    for direction in pair.directions:
+                        direction.pending = 0
+
+                if pair.is_finished() is True:
+                    self.__drop(pair)
+                else:
+                    self.__update_masks(pair)
+
+        for pair in set(self.__pairs_by_fd.values()):
+            pair.close()
+
+    def __handle_requests(self):
+        os.read(self.__wakeup_r, 4096)
+
+        with self.__locker:
+            requests = list(self.__requests)
+            self.__requests.clear()
+
+        for pair in requests:
+            for fd in pair.transports:
+                self.__pairs_by_fd[fd] = pair
+
+            self.__update_masks(pair)
+
+    def __update_masks(self, pair):
+        for fd in pair.transports:
+            mask = pair.get_mask(fd)
+
+            if mask is None:
+                if fd in pair.registered:
+                    self.__epoll.unregister(fd)
+                    pair.registered.remove(fd)
+            elif fd in pair.registered:
+                self.__epoll.modify(fd, mask)
+            else:
+                self.__epoll.register(fd, mask)
+                pair.registered.add(fd)
+
+    def __pump(self, pair):
+        """Move whatever can be moved, in both directions."""
+
+        for (i, direction) in enumerate(pair.directions):
+            self.__pump_direction(pair, i, direction)
+
+    def __pump_direction(self, pair, i, direction):
+        if direction.pending == 0 and direction.finished is False:
+            try:
+                count = _splice_or_raise(direction.source_fd,
+                                         direction.pipe_w,
+                                         _CHUNK_SIZE)
+            except OSError as e:
+                log.msg("Splice-pump failed to read: %s" % (e))
+                pair.end(direction.source_fd)
+                return
+
+            if count == 0:
+                # Nothing is waiting to go the same way (we only read into an
+                # empty pipe), so the sink can be told right away. The other
+                # direction carries on.
+                if direction.passes_eof is True:
+                    _shutdown_writes(direction.sink_fd,
+                                     pair.families[direction.sink_fd])
+                    pair.finish(direction)
+                else:
+                    pair.end(direction.source_fd)
+            elif count is not None:
+                direction.pending = count
+                self.__moved[i] += count
+
+        while direction.pending > 0:
+            try:
+                count = _splice_or_raise(direction.pipe_r,
+                                         direction.sink_fd,
+                                         direction.pending)
+            except OSError as e:
+                # Whatever is in the pipe has nowhere to go.
+                log.msg("Splice-pump failed to write: %s" % (e))
+                pair.end(direction.sink_fd)
+
+                self.__discard(direction)
+                return
+
+            if count is None:
+                break
+
+            direction.pending -= count
+
+    def __discard(self, direction):
+        while direction.pending > 0:
+            direction.pending -= len(os.read(direction.pipe_r,
+                                             direction.pending))
+
+    def __drop(self, pair):
+        """The pair is finished with: both sides have stopped sending (or
+        one has failed), and what was on its way has been delivered. Have
+        Twisted close the side that hung up first. The relay then takes care
+        of the other side in the usual way.
+        """
+
+        for fd in pair.registered:
+            self.__epoll.unregister(fd)
+
+        for fd in pair.transports:
+            del self.__pairs_by_fd[fd]
+
+        transport = pair.transports[pair.hung_up_fd]
+        pair.close()
+
+        reactor.callFromThread(transport.loseConnection)
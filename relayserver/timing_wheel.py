@@ -0,0 +1,275 @@
+"""A hierarchical timing wheel, for the relay's many long, coarse timers (the
+delayed closes of dropped pairs, idle timeouts, and heartbeats), which are
+mostly cancelled before they're due.
+
+Time is counted in ticks (of `resolution` seconds). The first wheel has a slot
+for each of the next 256 ticks, and each wheel after it has 64 slots, each of
+which spans a whole turn of the wheel before it. A timer is dropped into the
+slot for the tick that it's due in, on the first wheel that reaches that far,
+and is cascaded down to the wheel before once that wheel has turned to it
+(see the Linux kernel's original timer wheel). Scheduling and cancelling are
+O(1), whatever the number of timers, and the reactor has a single timer of
+its own, for the next tick that has anything to do, while there are any.
+
+Timers fire up to a tick late, never early, and those that are due in the
+same tick fire in the order that they were due in (and then scheduled in).
+"""
+
+from itertools import count
+
+from twisted.internet import reactor
+from twisted.python import log
+
+# The bits of a tick that index the first wheel, and each wheel after it.
+_FIRST_BITS = 8
+_NEXT_BITS = 6
+_WHEEL_COUNT = 4
+
+
+class _Timer(object):
+    """Like Twisted's IDelayedCall, as far as we use it."""
+
+    def __init__(self, wheel, due_at, due_tick, sequence, f, args, kwargs):
+        self.due_at = due_at
+        self.due_tick = due_tick
+        self.sequence = sequence
+
+        self.__wheel = wheel
+        self.__f = f
+        self.__args = args
+        self.__kwargs = kwargs
+
+        # The set that the timer is in, while it's active.
+        self.slot = None
+
+    def active(self):
+        return self.slot is not None
+
+    def cancel(self):
+        if self.slot is not None:
+            self.__wheel.remove(self)
+
+    def call(self):
+        self.__f(*self.__args, **self.__kwargs)
+
+
+def _get_order(timer):
+    return (timer.due_at, timer.sequence)
+
+
+class TimingWheel(object):
+    def __init__(self, resolution=.1, clock=None):
+        """clock defaults to the reactor."""
+
+        self.resolution = resolution
+
+        self.__clock = reactor if clock is None else clock
+        self.__started_at = self.__clock.seconds()
+
+        self.__wheels = [[set() for i in range(1 << _FIRST_BITS)]]
+        for i in range(_WHEEL_COUNT - 1):
+            self.__wheels.append([set() for i in range(1 << _NEXT_BITS)])
+
+        # The next tick to run, and the timers that are waiting.
+        self.__tick = 0
+        self.__count = 0
+
+        self.__sequence = count()
+
+        # The reactor's call, and the tick that it's for.
+        self.__call = None
+        self.__call_tick = None
+
+    def seconds(self):
+        return self.__clock.seconds()
+
+    def __len__(self):
+        return self.__count
+
+    def callLater(self, delay, f, *args, **kwargs):
+        """Call f after at least the given number of seconds. Returns a timer
+        that can be cancelled.
+        """
+
+        if self.__count == 0:
+            # Nothing needs the ticks that have passed while we were empty.
+            self.__tick = self.__get_elapsed_ticks() + 1
+
+        due_at = self.__clock.seconds() + delay
+        due_tick = -int(-(due_at - self.__started_at) // self.resolution)
+
+        timer = _Timer(self,
+                       due_at,
+                       due_tick,
+                       next(self.__sequence),
+                       f,
+                       args,
+                       kwargs)
+
+        self.__add(timer)
+
+        self.__count += 1
+
+        if self.__call is None:
+            self.__schedule()
+        elif due_tick < self.__call_tick and self.__call.active():
+            # It's due before the tick that we're waiting for.
+            self.__call.cancel()
+            self.__schedule()
+
+        return timer
+
+    def remove(self, timer):
+        timer.slot.discard(timer)
+        timer.slot = None
+
+        self.__count -= 1
+
+        if self.__count == 0 and \
+           self.__call is not None and \
+           self.__call.active():
+            self.__call.cancel()
+            self.__call = None
+
+    def __get_elapsed_ticks(self):
+        elapsed = self.__clock.seconds() - self.__started_at
+        return int(elapsed // self.resolution)
+
+    def __add(self, timer):
+        ticks = timer.due_tick - self.__tick
+
+        if ticks < 0:
+            # It's overdue, so it goes in the next tick that we run.
+            (wheel, index) = (0, self.__tick & ((1 << _FIRST_BITS) - 1))
+        else:
+            bits = _FIRST_BITS
+            wheel = 0
+
+            while ticks >= (1 << bits) and wheel < _WHEEL_COUNT - 1:
+                bits += _NEXT_BITS
+                wheel += 1
+
+            if ticks >= (1 << bits):
+                # Further than the last wheel reaches. It'll be put back
+                # until it's in reach.
+                due_tick = self.__tick + (1 << bits) - 1
+            else:
+                due_tick = timer.due_tick
+
+            if wheel == 0:
+                index = due_tick & ((1 << _FIRST_BITS) - 1)
+            else:
+                shift = _FIRST_BITS + (wheel - 1) * _NEXT_BITS
+                index = (due_tick >> shift) & ((1 << _NEXT_BITS) - 1)
+
+        slot = self.__wheels[wheel][index]
+        slot.add(timer)
+
+        timer.slot = slot
+
+    def __cascade(self, wheel, index):
+        """Move the timers in the given slot to the wheels before it. Returns
+        the index, which is 0 when this wheel has turned all the way around
+        as well.
+        """
+
+        slot = self.__wheels[wheel][index]
+        self.__wheels[wheel][index] = set()
+
+        for timer in slot:
+            self.__add(timer)
+
+        return index
+
+    def __run_tick(self):
+        tick = self.__tick
+        index = tick & ((1 << _FIRST_BITS) - 1)
+
+        wheel = 1
+        while index == 0 and wheel < _WHEEL_COUNT:
+            shift = _FIRST_BITS + (wheel - 1) * _NEXT_BITS
+            index = self.__cascade(wheel,
+                                   (tick >> shift) & ((1 << _NEXT_BITS) - 1))
+
+            wheel += 1
+
+        self.__tick += 1
+
+        first = self.__wheels[0]
+
+        slot_index = tick & ((1 << _FIRST_BITS) - 1)
+        slot = first[slot_index]
+        first[slot_index] = set()
+
+        # The timers that we call can cancel the others, so each is taken off
+        # the wheel only as it's called.
+        for timer in sorted(slot, key=_get_order):
+            if timer.slot is not slot:
+                continue
+
+            self.remove(timer)
+
+            try:
+                timer.call()
+            except:
+                log.err()
+
+    def __get_next_tick(self):
+        """The next tick that has anything to do: the first that a slot with
+        timers in it comes round in, on the first wheel, or is cascaded in,
+        on the others.
+        """
+
+        next_tick = None
+
+        bits = _FIRST_BITS
+        shift = 0
+
+        for slots in self.__wheels:
+            # The first tick (from ours) that starts a turn of this wheel's
+            # current slot.
+            span = 1 << shift
+            start = -(-self.__tick // span) * span
+
+            index = (start >> shift) & ((1 << bits) - 1)
+
+            for i in range(1 << bits):
+                tick = start + (i << shift)
+                if next_tick is not None and tick >= next_tick:
+                    break
+
+                if slots[(index + i) & ((1 << bits) - 1)]:
+                    next_tick = tick
+                    break
+
+            shift += bits
+            bits = _NEXT_BITS
+
+        return next_tick
+
+    def __get_due_at(self, tick):
+        return self.__started_at + tick * self.resolution
+
+    def __schedule(self):
+        self.__call_tick = self.__get_next_tick()
+
+        delay = self.__get_due_at(self.__call_tick) - self.__clock.seconds()
+        self.__call = self.__clock.callLater(max(0, delay), self.__run)
+
+    def __run(self):
+        # Until we're done, the timers that are scheduled by the ones that we
+        # call don't schedule another run. The ticks in between those that
+        # have anything to do are skipped.
+        now = self.__clock.seconds()
+        while self.__count > 0:
+            tick = self.__get_next_tick()
+            if self.__get_due_at(tick) > now:
+                break
+
+            self.__tick = tick
+            self.__run_tick()
+
+        self.__call = None
+
+        if self.__count > 0:
+            self.__schedule()
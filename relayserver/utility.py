@@ -7,3 +7,27 @@ def get_hex_dump(buffer_):
         i += 1
 
     return ' '.join(dump)
+
+def get_pending_write_length(transport):
+    """Return the number of bytes that a Twisted transport has yet to write.
+    Twisted doesn't expose this, so we have to look at its buffers.
+    """
+
+    return len(getattr(transport, 'dataBuffer', b'')) - \
+           getattr(transport, 'offset', 0) + \
+           getattr(transport, '_tempDataLen', 0)
+
+def take_pending_writes(transport):
+    """Return and clear the bytes that a Twisted transport has yet to write 
+    (see get_pending_write_length()).
+    """
+
+    data = bytes(transport.dataBuffer[transport.offset:]) + \
+           b''.join(transport._tempDataBuffer)
+
+    transport.dataBuffer = b''
+    transport.offset = 0
+    transport._tempDataBuffer = []
+    transport._tempDataLen = 0
+
+    return data
@@ -0,0 +1,373 @@
+import os
+import socket
+
+from collections import deque
+from zope.interface import implementer
+
+from twisted.internet import reactor
+from twisted.internet.interfaces import IFileDescriptorReceiver
+from twisted.internet.protocol import Factory, ReconnectingClientFactory
+from twisted.python import log
+
+from relayserver.base_protocol import BaseProtocol
+from relayserver.message_types.bus_pb2 import BusMessage
+from relayserver.message_types.command_pb2 import Command
+from relayserver.message_types import build_msg_bus_status, \
+                                      build_msg_bus_borrow, \
+                                      build_msg_bus_lend, \
+                                      build_msg_bus_adopted, \
+                                      build_msg_bus_announce, \
+                                      build_msg_bus_command, \
+                                      build_msg_cmd_connopen, \
+                                      build_msg_cmd_conndrop, \
+                                      build_msg_cmd_poollow, \
+                                      build_msg_cmd_sessionend
+
+
+def get_bus_path(directory, index):
+    return os.path.join(directory, 'worker-%d.sock' % (index))
+
+
+@implementer(IFileDescriptorReceiver)
+class _BusProtocol(BaseProtocol):
+    """One end of the connection between two workers. Descriptors that we
+    receive are held until the message that they accompany arrives.
+    """
+
+    def __init__(self, bus):
+        self.__bus = bus
+        self.__descriptors = deque()
+
+        self.set_frame_handlers(
+            BusMessage,
+            { BusMessage.STATUS: self.__handle_status,
+              BusMessage.BORROW: self.__handle_borrow,
+              BusMessage.LEND: self.__handle_lend,
+              BusMessage.ADOPTED: self.__handle_adopted,
+              BusMessage.ANNOUNCE: self.__handle_announce,
+              BusMessage.COMMAND: self.__handle_command },
+            'message_type')
+
+    def connectionMade(self):
+        self.__bus.send_status(self)
+
+    def connectionLost(self, reason):
+        self.release_frames()
+        self.__bus.remove_peer(self)
+
+        while self.__descriptors:
+            os.close(self.__descriptors.popleft())
+
+    def fileDescriptorReceived(self, descriptor):
+        self.__descriptors.append(descriptor)
+
+    def dataReceived(self, data):
+        try:
+            self.dispatch_frames(data)
+        except:
+            log.err()
+
+    def __handle_status(self, message):
+        self.__bus.handle_status(self, message)
+
+    def __handle_borrow(self, message):
+        self.__bus.handle_borrow(self, message)
+
+    def __handle_lend(self, message):
+        descriptor = self.__descriptors.popleft() \
+                        if message.HasField('session_id') \
+                        else None
+
+        self.__bus.handle_lend(self, message, descriptor)
+
+    def __handle_adopted(self, message):
+        self.__bus.handle_adopted(self, message)
+
+    def __handle_announce(self, message):
+        self.__bus.handle_announce(message)
+
+    def __handle_command(self, message):
+        command = self.parse_or_raise(message.command, Command)
+        self.__bus.handle_command(command)
+
+
+class _BusServerFactory(Factory):
+    def __init__(self, bus):
+        self.__bus = bus
+
+    def buildProtocol(self, addr):
+        return _BusProtocol(self.__bus)
+
+
+class _BusClientFactory(ReconnectingClientFactory):
+    """The peers are all started at the same time, so the one that we're
+    connecting to might not be listening yet.
+    """
+
+    maxDelay = 1
+
+    def __init__(self, bus):
+        self.__bus = bus
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return _BusProtocol(self.__bus)
+
+
+class _RemoteCommandChannel(object):
+    """Stands in for a host-process's command-channel when it's attached to 
+    another worker. Announcements are forwarded to that worker to be written.
+    """
+
+    def __init__(self, bus, peer, host_process_id):
+        self.__bus = bus
+        self.__peer = peer
+        self.__host_process_id = host_process_id
+
+    def __announce(self, command):
+        self.__peer.write_message(
+            build_msg_bus_announce(self.__bus.index,
+                                   command,
+                                   self.__host_process_id))
+
+    def announce_assignment(self, hp_connection):
+        self.__announce(build_msg_cmd_connopen(hp_connection.session_id))
+
+    def announce_drop(self, hp_connection):
+        self.__announce(build_msg_cmd_conndrop(hp_connection.session_id))
+
+    def advise_pool_low(self, idle_count, pending_count):
+        self.__announce(build_msg_cmd_poollow(idle_count, pending_count))
+
+    def announce_session_end(self, hp_connection, token):
+        self.__announce(build_msg_cmd_sessionend(hp_connection.session_id, 
+                                                 token))
+
+
+class WorkerBus(object):
+    """Connects one worker of a multi-worker relay to all of the others, over
+    Unix sockets. Each worker owns a shard of the waiting host-process
+    connections. Workers publish how many they have waiting, and a worker
+    that runs dry borrows one from the worker that has the most: the
+    connection's descriptor is passed over, and it's adopted as-is (the
+    host-process never knows). Announcements are forwarded to whichever worker
+    has the command-channel of the host-process that they concern, and the
+    commands that a worker receives are passed to all of the others.
+
+    The shard is the worker's own relay, and is expected to provide:
+    get_idle_count(), get_command_channel_ids(), lend_hp(), release_hp(hp),
+    adopt_hp(socket, session_id, recycles, host_process_id, weight),
+    write_command(host_process_id, command_raw), handle_command(command), and
+    command_channel_connected(host_process_id).
+    """
+
+    def __init__(self, index, count, directory):
+        self.__index = index
+        self.__count = count
+        self.__directory = directory
+
+        self.__shard = None
+
+        # Peer index => protocol, and peer index => (idle, the IDs of the 
+        # host-processes whose command-channels it has).
+        self.__peers = { }
+        self.__peer_status = { }
+
+        # Peer => session-ID => the descriptor that we've lent it, until it's
+        # adopted.
+        self.__lent = { }
+
+        self.__borrowing = False
+        self.__status_scheduled = False
+
+    @property
+    def index(self):
+        return self.__index
+
+    @property
+    def count(self):
+        return self.__count
+
+    def start(self, shard):
+        self.__shard = shard
+
+        reactor.listenUNIX(get_bus_path(self.__directory, self.__index),
+                           _BusServerFactory(self))
+
+        # Every pair of workers shares one connection, made by the higher
+        # index.
+        for index in range(self.__index):
+            reactor.connectUNIX(get_bus_path(self.__directory, index),
+                                _BusClientFactory(self))
+
+    def status_changed(self):
+        """Publish our status to the peers, once per reactor iteration at
+        most.
+        """
+
+        if self.__status_scheduled is True:
+            return
+
+        self.__status_scheduled = True
+        reactor.callLater(0, self.__broadcast_status)
+
+    def __broadcast_status(self):
+        self.__status_scheduled = False
+
+        for peer in self.__peers.values():
+            self.send_status(peer)
+
+    def send_status(self, peer):
+        message = build_msg_bus_status(self.__index,
+                                       self.__shard.get_idle_count(),
+                                       self.__shard.get_command_channel_ids())
+
+        peer.write_message(message)
+
+    def remove_peer(self, peer):
+        # It won't be adopting what we've lent it.
+        for descriptor in self.__lent.pop(peer, { }).values():
+            os.close(descriptor)
+
+        for (index, registered_peer) in list(self.__peers.items()):
+            if registered_peer is peer:
+                del self.__peers[index]
+                del self.__peer_status[index]
+
+                log.msg("Worker (%d) has left the bus." % (index))
+
+                # Anything that we were waiting on from it isn't coming.
+                self.__borrowing = False
+
+    def get_remote_command_channel(self, host_process_id):
+        for (index, (idle_count, command_channels)) in \
+                self.__peer_status.items():
+            if host_process_id in command_channels:
+                return _RemoteCommandChannel(self, 
+                                             self.__peers[index], 
+                                             host_process_id)
+
+        return None
+
+    def get_remote_command_channels(self):
+        """Return a stand-in for every command-channel that's attached to 
+        another worker.
+        """
+
+        return [_RemoteCommandChannel(self, self.__peers[index], 
+                                      host_process_id)
+                for (index, (idle_count, command_channels))
+                in self.__peer_status.items()
+                for host_process_id
+                in command_channels]
+
+    def borrow(self):
+        """Ask the peer with the most waiting host-process connections to lend
+        us one. We only borrow from peers that would still have one left.
+        """
+
+        if self.__borrowing is True:
+            return
+
+        candidates = [(idle_count, index)
+                      for (index, (idle_count, command_channels))
+                      in self.__peer_status.items()
+                      if idle_count >= 2]
+
+        if not candidates:
+            return
+
+        (idle_count, index) = max(candidates)
+
+        log.msg("Worker (%d) is borrowing a host-process connection from "
+                "worker (%d), which has (%d) waiting." %
+                (self.__index, index, idle_count))
+
+        self.__borrowing = True
+        self.__peers[index].write_message(build_msg_bus_borrow(self.__index))
+
+    def handle_status(self, peer, message):
+        if message.worker not in self.__peers:
+            log.msg("Worker (%d) has joined the bus." % (message.worker))
+            self.__peers[message.worker] = peer
+
+        command_channels = frozenset(message.command_channels)
+
+        (idle_count, known) = \
+            self.__peer_status.get(message.worker, (0, frozenset()))
+
+        self.__peer_status[message.worker] = \
+            (message.idle_count, command_channels)
+
+        # Our connections that were waiting for these can be assigned, now.
+        for host_process_id in command_channels - known:
+            self.__shard.command_channel_connected(host_process_id)
+
+    def handle_borrow(self, peer, message):
+        hp_connection = self.__shard.lend_hp()
+        if hp_connection is None:
+            peer.write_message(build_msg_bus_lend(self.__index))
+            return
+
+        session_id = hp_connection.session_id
+
+        # We hang on to a copy of the descriptor until the peer confirms that
+        # it has its own.
+        descriptor = os.dup(hp_connection.transport.fileno())
+        self.__lent.setdefault(peer, { })[session_id] = descriptor
+
+        peer.transport.sendFileDescriptor(descriptor)
+        peer.write_message(
+            build_msg_bus_lend(self.__index, 
+                               session_id, 
+                               hp_connection.recycles, 
+                               hp_connection.host_process_id, 
+                               hp_connection.weight, 
+                               hp_connection.transport.socket.family))
+
+        self.__shard.release_hp(hp_connection)
+
+        log.msg("Worker (%d) lent host-process connection with session-ID "
+                "(%d) to worker (%d)." %
+                (self.__index, session_id, message.worker))
+
+    def handle_lend(self, peer, message, descriptor):
+        self.__borrowing = False
+
+        if descriptor is None:
+            log.msg("Worker (%d) declined to lend a host-process connection." %
+                    (message.worker))
+            return
+
+        try:
+            skt = socket.fromfd(descriptor, message.family, socket.SOCK_STREAM)
+        finally:
+            os.close(descriptor)
+
+        self.__shard.adopt_hp(skt, 
+                              message.session_id, 
+                              message.recycle_sessions, 
+                              message.host_process_id, 
+                              message.weight)
+
+        peer.write_message(build_msg_bus_adopted(self.__index,
+                                                 message.session_id))
+
+    def handle_adopted(self, peer, message):
+        # We may have already closed it, if the peer had left.
+        descriptor = self.__lent.get(peer, { }).pop(message.session_id, None)
+        if descriptor is not None:
+            os.close(descriptor)
+
+    def handle_announce(self, message):
+        self.__shard.write_command(message.host_process_id, message.command)
+
+    def forward_command(self, command):
+        """Pass a command from the command-channel to all of the peers."""
+
+        message = build_msg_bus_command(self.__index, command)
+        for peer in self.__peers.values():
+            peer.write_message(message)
+
+    def handle_command(self, command):
+        self.__shard.handle_command(command)
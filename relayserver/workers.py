@@ -0,0 +1,89 @@
+"""Runs the relay as several worker processes. Each worker runs its own
+reactor, listens on the same ports (the kernel balances the connections
+between them), and joins the others on a control-bus (see
+relayserver.worker_bus).
+
+Nothing here may install the reactor: every worker has to create its own,
+after it's been forked.
+"""
+
+import errno
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import traceback
+
+
+def _run_worker(target, index, bus_directory):
+    """Run the worker, and return its exit-status. A worker must never return
+    into the code that forked it, however it fails.
+    """
+
+    try:
+        target(index, bus_directory)
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return e.code or 0
+
+        sys.stderr.write('%s\n' % (e.code,))
+        return 1
+    except:
+        sys.stderr.write("Worker (%d) failed:\n" % (index))
+        traceback.print_exc()
+        return 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+    return 0
+
+def run_workers(num_workers, target):
+    """Fork the workers, and wait for all of them to exit. Each one calls
+    target(index, bus_directory). SIGINT and SIGTERM are passed on to them.
+    Return 1 if any of them failed, or 0.
+    """
+
+    bus_directory = tempfile.mkdtemp(prefix='relayserver-bus-')
+    pids = []
+    failed = False
+
+    for index in range(num_workers):
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                status = _run_worker(target, index, bus_directory)
+            finally:
+                os._exit(status)
+
+        pids.append(pid)
+
+    def terminate(signum, frame):
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    signal.signal(signal.SIGINT, terminate)
+    signal.signal(signal.SIGTERM, terminate)
+
+    while pids:
+        try:
+            (pid, status) = os.wait()
+        except OSError as e:
+            if e.errno == errno.EINTR:
+                continue
+
+            raise
+
+        pids.remove(pid)
+
+        if os.WIFEXITED(status) is False or os.WEXITSTATUS(status) != 0:
+            failed = True
+
+    shutil.rmtree(bus_directory, ignore_errors=True)
+
+    return 1 if failed is True else 0
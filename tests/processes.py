@@ -0,0 +1,183 @@
+"""Runs the relay and host-processes as they're booted (from
+relayserver/boot), for the tests that need the real thing.
+"""
+
+import errno
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from twisted.trial import unittest
+
+import relayserver
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(relayserver.__file__)))
+_BOOT = os.path.join(_ROOT, 'relayserver', 'boot')
+
+# How long anything may take to come up, or go away.
+TIMEOUT = 10
+
+MESSAGE = b'x' * 1000
+
+
+def get_free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+
+    return port
+
+def wait(condition, timeout=TIMEOUT):
+    deadline = time.time() + timeout
+    while condition() is False:
+        if time.time() >= deadline:
+            return False
+
+        time.sleep(.05)
+
+    return True
+
+def _retry(call, *args):
+    """Make the call again for as long as it's interrupted, as it is when a
+    process that we started exits (and the reactor's SIGCHLD handler runs).
+    """
+
+    while True:
+        try:
+            return call(*args)
+        except socket.error as e:
+            if e.errno != errno.EINTR:
+                raise
+
+
+class Client(object):
+    """A client of the relay, whose every message should be echoed back."""
+
+    def __init__(self, port):
+        self.__socket = socket.create_connection(('127.0.0.1', port), 3)
+        self.__socket.settimeout(3)
+
+    def echo(self, message=MESSAGE):
+        self.__socket.sendall(message)
+
+        received = b''
+        while len(received) < len(message):
+            data = _retry(self.__socket.recv, len(message) - len(received))
+            if not data:
+                return False
+
+            received += data
+
+        return received == message
+
+    def is_dropped(self, timeout=1):
+        """Whether the relay drops us within the given time."""
+
+        self.__socket.settimeout(timeout)
+
+        try:
+            return _retry(self.__socket.recv, 1) == b''
+        except socket.timeout:
+            return False
+        except socket.error:
+            return True
+        finally:
+            self.__socket.settimeout(3)
+
+    def close(self):
+        self.__socket.close()
+
+def try_echo(port):
+    try:
+        client = Client(port)
+    except socket.error:
+        return False
+
+    try:
+        return client.echo()
+    except socket.error:
+        return False
+    finally:
+        client.close()
+
+
+class ProcessTestCase(unittest.TestCase):
+    """Starts the relay and host-processes on free ports, logging to the
+    test's directory, and kills whatever is still running afterwards.
+    """
+
+    if sys.version_info >= (3,):
+        skip = "The Twisted relay needs Python 2."
+
+    def setUp(self):
+        (self.dport, self.cport, self.tport) = \
+            [get_free_port() for i in range(3)]
+
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+
+    def get_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def start(self, script, *args):
+        environment = dict(os.environ)
+        environment['PYTHONPATH'] = _ROOT
+
+        log = open(self.get_path('%s.out' % (script)), 'ab')
+        self.addCleanup(log.close)
+
+        process = subprocess.Popen([sys.executable,
+                                    os.path.join(_BOOT, script + '.py')] +
+                                   [str(arg) for arg in args],
+                                   stdout=log,
+                                   stderr=subprocess.STDOUT,
+                                   env=environment)
+
+        self.addCleanup(self.__kill, process)
+
+        return process
+
+    def __kill(self, process):
+        if process.poll() is None:
+            process.kill()
+
+        process.wait()
+
+    def stop(self, process):
+        """Stop the process the way that an operator would (so that its log
+        is written out).
+        """
+
+        process.send_signal(signal.SIGTERM)
+        self.assertTrue(wait(lambda: process.poll() is not None))
+
+    def start_relay(self, *args):
+        return self.start('relay',
+                          self.dport,
+                          self.cport,
+                          self.tport,
+                          *args)
+
+    def start_host_process(self, *args):
+        process = self.start('host_process',
+                             'localhost',
+                             self.dport,
+                             self.cport,
+                             *args)
+
+        # Clients are denied until the command-channel has connected.
+        self.assertTrue(wait(lambda: try_echo(self.tport)))
+
+        return process
+
+    def stream(self, client, seconds):
+        """Echo through the client, continuously, for the given time."""
+
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            self.assertTrue(client.echo())
+            time.sleep(.01)
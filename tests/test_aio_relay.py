@@ -0,0 +1,157 @@
+import sys
+
+from twisted.trial import unittest
+
+if sys.version_info >= (3,):
+    import asyncio
+
+    from relayserver.aio.relay import Relay
+
+
+class _Transport(object):
+    def __init__(self):
+        self.closed = False
+
+    def is_closing(self):
+        return self.closed
+
+    def close(self):
+        self.closed = True
+
+
+class _CommandChannel(object):
+    def __init__(self, host_process_id):
+        self.host_process_id = host_process_id
+        self.transport = _Transport()
+
+        self.assigned = []
+        self.pool_low = []
+
+    def announce_assignment(self, hp_connection):
+        self.assigned.append(hp_connection.session_id)
+
+    def advise_pool_low(self, idle_count, pending_count):
+        self.pool_low.append((idle_count, pending_count))
+
+
+class _Connection(object):
+    """A client's, or a host-process's data connection."""
+
+    peer = None
+    recycles = False
+    weight = 1
+
+    def __init__(self, session_id, host_process_id=''):
+        self.session_id = session_id
+        self.host_process_id = host_process_id
+        self.transport = _Transport()
+
+    def handle_assignment(self):
+        pass
+
+
+class CommandChannelRoutingTest(unittest.TestCase):
+    """The asyncio relay announces each assignment to the command-channel of
+    the host-process that the connection belongs to.
+    """
+
+    if sys.version_info < (3,):
+        skip = "The asyncio core needs Python 3."
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.relay = Relay(pool_low=0)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def __connect_channel(self, host_process_id):
+        command_channel = _CommandChannel(host_process_id)
+        self.relay.command_channel_connected(command_channel)
+
+        return command_channel
+
+    def test_announced_to_own_channel(self):
+        channel_a = self.__connect_channel('A')
+        channel_b = self.__connect_channel('B')
+
+        self.relay.queue_new_hp(_Connection(1, 'A'))
+        self.relay.queue_new_hp(_Connection(2, 'B'))
+
+        for session_id in (3, 4):
+            client = _Connection(session_id)
+            self.assertTrue(self.relay.assign_new_client(client))
+
+        self.assertEqual(channel_a.assigned, [1])
+        self.assertEqual(channel_b.assigned, [2])
+
+    def test_parked_until_channel_connects(self):
+        channel_b = self.__connect_channel('B')
+
+        hp_connection = _Connection(1, 'A')
+        self.relay.queue_new_hp(hp_connection)
+
+        # Nobody could be told about an assignment to it, yet.
+        client = _Connection(2)
+        self.assertTrue(self.relay.assign_new_client(client))
+        self.assertIs(client.peer, None)
+
+        channel_a = self.__connect_channel('A')
+
+        self.assertIs(client.peer, hp_connection)
+        self.assertEqual(channel_a.assigned, [1])
+        self.assertEqual(channel_b.assigned, [])
+
+    def test_channel_lost(self):
+        channel_a = self.__connect_channel('A')
+        channel_b = self.__connect_channel('B')
+
+        self.relay.queue_new_hp(_Connection(1, 'A'))
+        self.relay.queue_new_hp(_Connection(2, 'B'))
+
+        self.relay.command_channel_lost(channel_a, None)
+
+        client = _Connection(3)
+        self.assertTrue(self.relay.assign_new_client(client))
+
+        self.assertEqual(client.peer.session_id, 2)
+        self.assertEqual(channel_b.assigned, [2])
+
+        # A's connection was set aside, rather than assigned.
+        channel_a = self.__connect_channel('A')
+
+        client = _Connection(4)
+        self.assertTrue(self.relay.assign_new_client(client))
+        self.assertEqual(channel_a.assigned, [1])
+
+    def test_displaced_channel_restored(self):
+        """A channel that hasn't said hello takes the place of an older one,
+        which has it back once the newer one goes.
+        """
+
+        older = self.__connect_channel('')
+        newer = self.__connect_channel('')
+
+        self.relay.command_channel_lost(newer, older)
+        self.relay.queue_new_hp(_Connection(1))
+
+        self.assertTrue(self.relay.assign_new_client(_Connection(2)))
+        self.assertEqual(older.assigned, [1])
+
+    def test_pool_low_shared(self):
+        self.relay = Relay(pool_low=1)
+
+        channel_a = self.__connect_channel('A')
+        channel_b = self.__connect_channel('B')
+
+        for session_id in range(1, 4):
+            self.relay.assign_new_client(_Connection(session_id))
+
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+        # Three clients are waiting, and each host-process is asked for two.
+        self.assertEqual(channel_a.pool_low, [(0, 2)])
+        self.assertEqual(channel_b.pool_low, [(0, 2)])
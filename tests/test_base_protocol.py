@@ -0,0 +1,235 @@
+from struct import pack
+
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from relayserver import base_protocol
+from relayserver.base_protocol import BaseProtocol
+from relayserver.message_types import build_msg_cmd_connopen, \
+                                      build_msg_cmd_conndrop
+from relayserver.message_types.command_pb2 import Command
+
+
+def _frame(command):
+    data = command.SerializeToString()
+    return pack('>I', len(data)) + data
+
+def _get_frames(count):
+    """Assignments for sessions 1 to count, with a message of another type in
+    the middle.
+    """
+
+    frames = [_frame(build_msg_cmd_connopen(session_id))
+              for session_id
+              in range(1, count + 1)]
+
+    frames.insert(count // 2, _frame(build_msg_cmd_conndrop(3)))
+    return frames
+
+
+class _Receiver(BaseProtocol):
+    def __init__(self):
+        self.opened = []
+        self.dropped = []
+
+        self.set_frame_handlers(
+            Command,
+            { Command.CONNECTION_OPEN: self.__handle_open,
+              Command.CONNECTION_DROP: self.__handle_drop },
+            'message_type')
+
+    def __handle_open(self, command):
+        self.opened.append(command.open_properties.assigned_to_session)
+
+    def __handle_drop(self, command):
+        self.dropped.append(command.drop_properties.session_id)
+
+    def read_into(self, data):
+        """Read the given data as a transport with flow-control would: into
+        the buffers that we give it, as much as fits each time.
+        """
+
+        while data:
+            view = self.get_buffer(len(data))
+            nbytes = min(len(view), len(data))
+
+            view[:nbytes] = data[:nbytes]
+            data = data[nbytes:]
+
+            self.buffer_updated(nbytes)
+
+
+class DispatchFramesTest(unittest.TestCase):
+    """BaseProtocol.dispatch_frames(), for data that's pushed."""
+
+    def test_coalesced(self):
+        receiver = _Receiver()
+        receiver.dispatch_frames(b''.join(_get_frames(50)))
+
+        self.assertEqual(receiver.opened, list(range(1, 51)))
+        self.assertEqual(receiver.dropped, [3])
+
+    def test_split_across_reads(self):
+        receiver = _Receiver()
+        data = b''.join(_get_frames(20))
+
+        for i in range(len(data)):
+            receiver.dispatch_frames(data[i:i + 1])
+
+        self.assertEqual(receiver.opened, list(range(1, 21)))
+        self.assertEqual(receiver.dropped, [3])
+
+    def test_partial_prefix(self):
+        receiver = _Receiver()
+        frames = _get_frames(2)
+
+        # The first frame, and two bytes of the second one's prefix.
+        receiver.dispatch_frames(frames[0] + frames[1][:2])
+        self.assertEqual(receiver.opened, [1])
+
+        receiver.dispatch_frames(frames[1][2:] + frames[2])
+        self.assertEqual(receiver.opened, [1, 2])
+        self.assertEqual(receiver.dropped, [3])
+
+    def test_stop_framing(self):
+        """The handler can stop the framing, and whatever follows is given
+        back rather than parsed.
+        """
+
+        receiver = _Receiver()
+        remaining = []
+
+        def handle_open(command):
+            remaining.append(receiver.stop_framing())
+
+        receiver.set_frame_handlers(
+            Command,
+            { Command.CONNECTION_OPEN: handle_open },
+            'message_type')
+
+        receiver.dispatch_frames(_frame(build_msg_cmd_connopen(1)) +
+                                 _frame(build_msg_cmd_connopen(2)) +
+                                 b'unframed')
+
+        self.assertFalse(receiver.framing)
+        self.assertEqual(remaining,
+                         [_frame(build_msg_cmd_connopen(2)) + b'unframed'])
+
+
+class BufferUpdatedTest(unittest.TestCase):
+    """BaseProtocol.get_buffer() and buffer_updated(), for data that's read
+    into slabs.
+    """
+
+    def test_coalesced(self):
+        receiver = _Receiver()
+        receiver.read_into(b''.join(_get_frames(50)))
+
+        self.assertEqual(receiver.opened, list(range(1, 51)))
+        self.assertEqual(receiver.dropped, [3])
+
+    def test_more_than_a_slab(self):
+        receiver = _Receiver()
+        receiver.read_into(b''.join(_get_frames(5000)))
+
+        self.assertEqual(receiver.opened, list(range(1, 5001)))
+
+    def test_split_across_reads(self):
+        receiver = _Receiver()
+        data = b''.join(_get_frames(20))
+
+        for i in range(len(data)):
+            receiver.read_into(data[i:i + 1])
+
+        self.assertEqual(receiver.opened, list(range(1, 21)))
+        self.assertEqual(receiver.dropped, [3])
+
+    def test_partial_prefix(self):
+        receiver = _Receiver()
+        frames = _get_frames(2)
+
+        receiver.read_into(frames[0] + frames[1][:3])
+        self.assertEqual(receiver.opened, [1])
+
+        receiver.read_into(frames[1][3:] + frames[2])
+        self.assertEqual(receiver.opened, [1, 2])
+        self.assertEqual(receiver.dropped, [3])
+
+
+class _Transport(object):
+    """Records each call that writes, with what it wrote."""
+
+    def __init__(self):
+        self.calls = []
+
+    def write(self, data):
+        self.calls.append(('write', data))
+
+    def writeSequence(self, data):
+        self.calls.append(('writeSequence', list(data)))
+
+
+class WriteMessageTest(unittest.TestCase):
+    """BaseProtocol.write_message(), one at a time and batched."""
+
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(base_protocol, 'reactor', self.clock)
+
+        self.protocol = BaseProtocol()
+        self.protocol.transport = _Transport()
+
+    def write(self, count):
+        for session_id in range(1, count + 1):
+            self.protocol.write_message(build_msg_cmd_connopen(session_id))
+
+        return [_frame(build_msg_cmd_connopen(session_id))
+                for session_id
+                in range(1, count + 1)]
+
+    def test_single_writes(self):
+        """Each message goes out with its prefix, in one write."""
+
+        frames = self.write(3)
+
+        self.assertEqual(self.protocol.transport.calls,
+                         [('write', frame) for frame in frames])
+        self.assertEqual(self.protocol.gathered_count, 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_batched(self):
+        """The messages of a reactor iteration go out together at its end."""
+
+        self.protocol.batch_writes()
+        frames = self.write(3)
+
+        self.assertEqual(self.protocol.transport.calls, [])
+        self.assertEqual(self.protocol.gathered_count, 3)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+        self.clock.advance(0)
+
+        self.assertEqual(self.protocol.transport.calls,
+                         [('writeSequence', frames)])
+        self.assertEqual(self.protocol.gathered_count, 0)
+
+        # The next iteration's are gathered again.
+        more = self.write(1)
+        self.clock.advance(0)
+
+        self.assertEqual(self.protocol.transport.calls[1:],
+                         [('writeSequence', more)])
+
+    def test_flushed(self):
+        """Gathered messages can be written straight away, and aren't written
+        again at the end of the iteration.
+        """
+
+        self.protocol.batch_writes()
+        frames = self.write(2)
+
+        self.protocol.flush_messages()
+        self.clock.advance(0)
+
+        self.assertEqual(self.protocol.transport.calls,
+                         [('writeSequence', frames)])
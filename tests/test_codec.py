@@ -0,0 +1,164 @@
+from twisted.trial import unittest
+
+from relayserver.message_types.codec import encode_connopen, \
+                                            encode_conndrop, \
+                                            encode_sessionend, \
+                                            encode_heartbeat, \
+                                            encode_drain, \
+                                            decode_fixed_command
+from relayserver.message_types.command_pb2 import Command
+
+# Either side of each varint length, and the ends of int32.
+_SESSION_IDS = (0, 1, 127, 128, 16383, 16384, 2097151, 2097152, 268435455,
+                268435456, 2147483647, -1, -2147483648)
+
+_TOKENS = (b'', b'\x00', b'0123456789abcdef', b'\xff' * 127, b'\x80' * 128)
+
+
+def _build(message_type):
+    command = Command()
+    command.version = 1
+    command.message_type = message_type
+
+    return command
+
+def _build_connopen(session_id):
+    command = _build(Command.CONNECTION_OPEN)
+    command.open_properties.assigned_to_session = session_id
+
+    return command
+
+def _build_conndrop(session_id):
+    command = _build(Command.CONNECTION_DROP)
+    command.drop_properties.session_id = session_id
+
+    return command
+
+def _build_sessionend(message_type, session_id, token):
+    command = _build(message_type)
+    command.session_end_properties.session_id = session_id
+    command.session_end_properties.token = token
+
+    return command
+
+
+class EncodeTest(unittest.TestCase):
+    """The templates write exactly what protobuf would."""
+
+    def test_connopen(self):
+        for session_id in _SESSION_IDS:
+            self.assertEqual(
+                encode_connopen(session_id).SerializeToString(),
+                _build_connopen(session_id).SerializeToString())
+
+    def test_conndrop(self):
+        for session_id in _SESSION_IDS:
+            self.assertEqual(
+                encode_conndrop(session_id).SerializeToString(),
+                _build_conndrop(session_id).SerializeToString())
+
+    def test_sessionend(self):
+        for message_type in (Command.SESSION_END, Command.SESSION_END_ACK):
+            for session_id in _SESSION_IDS:
+                for token in _TOKENS:
+                    self.assertEqual(
+                        encode_sessionend(message_type, session_id, token).\
+                            SerializeToString(),
+                        _build_sessionend(message_type, session_id, token).\
+                            SerializeToString())
+
+    def test_heartbeat(self):
+        self.assertEqual(encode_heartbeat().SerializeToString(),
+                         _build(Command.HEARTBEAT).SerializeToString())
+
+    def test_drain(self):
+        self.assertEqual(encode_drain().SerializeToString(),
+                         _build(Command.DRAIN).SerializeToString())
+
+    def test_parsed(self):
+        """Protobuf reads back what we wrote."""
+
+        command = Command()
+        command.ParseFromString(
+            encode_sessionend(Command.SESSION_END, 2147483647, b'token').\
+                SerializeToString())
+
+        self.assertEqual(command.message_type, Command.SESSION_END)
+        self.assertEqual(command.session_end_properties.session_id,
+                         2147483647)
+        self.assertEqual(command.session_end_properties.token, b'token')
+
+
+class DecodeTest(unittest.TestCase):
+    def test_connopen(self):
+        for session_id in _SESSION_IDS:
+            data = _build_connopen(session_id).SerializeToString()
+            command = decode_fixed_command(data)
+
+            if session_id < 0:
+                # Left to protobuf.
+                self.assertIs(command, None)
+                continue
+
+            self.assertEqual(command.message_type, Command.CONNECTION_OPEN)
+            self.assertEqual(command.open_properties.assigned_to_session,
+                             session_id)
+            self.assertEqual(command.SerializeToString(), data)
+
+    def test_conndrop(self):
+        for session_id in _SESSION_IDS:
+            data = _build_conndrop(session_id).SerializeToString()
+            command = decode_fixed_command(data)
+
+            if session_id < 0:
+                self.assertIs(command, None)
+                continue
+
+            self.assertEqual(command.message_type, Command.CONNECTION_DROP)
+            self.assertEqual(command.drop_properties.session_id, session_id)
+
+    def test_sessionend(self):
+        for session_id in (0, 128, 2147483647):
+            for token in (b'', b'0123456789abcdef'):
+                data = _build_sessionend(Command.SESSION_END_ACK,
+                                         session_id,
+                                         token).SerializeToString()
+
+                command = decode_fixed_command(data)
+
+                self.assertEqual(command.message_type,
+                                 Command.SESSION_END_ACK)
+                self.assertEqual(command.session_end_properties,
+                                 (session_id, token))
+
+    def test_heartbeat(self):
+        command = decode_fixed_command(
+            _build(Command.HEARTBEAT).SerializeToString())
+
+        self.assertEqual(command.message_type, Command.HEARTBEAT)
+
+    def test_other_shapes(self):
+        """Anything that isn't in one of the fixed shapes is left to
+        protobuf.
+        """
+
+        command = _build_connopen(1)
+        command.drop_properties.session_id = 2
+
+        self.assertIs(decode_fixed_command(command.SerializeToString()), None)
+
+        command = Command()
+        command.version = 2
+        command.message_type = Command.HEARTBEAT
+
+        self.assertIs(decode_fixed_command(command.SerializeToString()), None)
+
+        command = _build(Command.POOL_LOW)
+        command.pool_low_properties.idle_count = 1
+        command.pool_low_properties.pending_count = 2
+
+        self.assertIs(decode_fixed_command(command.SerializeToString()), None)
+
+        # Cut short.
+        data = _build_connopen(16384).SerializeToString()
+        self.assertIs(decode_fixed_command(data[:-1]), None)
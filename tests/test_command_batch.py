@@ -0,0 +1,186 @@
+import sys
+
+from struct import unpack
+
+from twisted.internet import reactor
+from twisted.internet.task import deferLater
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from relayserver.message_types import build_msg_cmd_hello, Command
+
+if sys.version_info >= (3,):
+    import asyncio
+
+    from relayserver.aio.relay import CommandServer as AsyncioCommandServer, \
+                                      Relay
+else:
+    from relayserver import main
+
+
+def _frame(command):
+    data = command.SerializeToString()
+    return bytes(bytearray([0, 0, 0, len(data)])) + data
+
+def _parse(written):
+    commands = []
+    while written:
+        (length,) = unpack('>I', written[:4])
+
+        command = Command()
+        command.ParseFromString(written[4:4 + length])
+        commands.append(command)
+
+        written = written[4 + length:]
+
+    return commands
+
+
+class _Connection(object):
+    def __init__(self, session_id):
+        self.session_id = session_id
+
+
+class _CommandBatchTests(object):
+    """The relay only batches announcements for a host-process that has said
+    that it accepts batches. Older host-processes don't know the command.
+    """
+
+    def announce(self):
+        self.connect()
+        self.clear_written()
+
+        for session_id in (1, 2):
+            self.channel.announce_assignment(_Connection(session_id))
+
+        return self.flush()
+
+    def get_announced(self):
+        """Return the sessions announced one by one, and those in batches."""
+
+        single = []
+        batched = []
+
+        for command in _parse(self.get_written()):
+            if command.message_type == Command.CONNECTION_OPEN:
+                single.append(command.open_properties.assigned_to_session)
+            elif command.message_type == Command.BATCH:
+                batched.extend(command.batch.opened_sessions)
+
+        return (single, batched)
+
+    def test_no_hello(self):
+        d = self.announce()
+        d.addCallback(lambda ignored: self.assertEqual(self.get_announced(),
+                                                       ([1, 2], [])))
+
+        return d
+
+    def test_hello(self):
+        self.hello = build_msg_cmd_hello('A')
+
+        d = self.announce()
+        d.addCallback(lambda ignored: self.assertEqual(self.get_announced(),
+                                                       ([1, 2], [])))
+
+        return d
+
+    def test_hello_accepting_batches(self):
+        self.hello = build_msg_cmd_hello('A', accepts_batches=True)
+
+        d = self.announce()
+        d.addCallback(lambda ignored: self.assertEqual(self.get_announced(),
+                                                       ([], [1, 2])))
+
+        return d
+
+
+class _Transport(StringTransport):
+    def setTcpNoDelay(self, enabled):
+        pass
+
+
+class TwistedCommandBatchTest(_CommandBatchTests, unittest.TestCase):
+    if sys.version_info >= (3,):
+        skip = "The Twisted relay needs Python 2."
+
+    hello = None
+
+    def connect(self):
+        # Heartbeats don't come into it.
+        self.patch(main, 'heartbeat_interval', 0)
+
+        self.transport = _Transport()
+
+        self.channel = main.CommandServer()
+        self.channel.makeConnection(self.transport)
+
+        if self.hello is not None:
+            self.channel.dataReceived(_frame(self.hello))
+
+        self.addCleanup(self.channel.connectionLost, None)
+
+    def flush(self):
+        # The batch is flushed at the end of the reactor iteration, and then
+        # the gathered messages at the end of the next.
+        d = deferLater(reactor, 0, lambda: None)
+        d.addCallback(lambda ignored: deferLater(reactor, 0, lambda: None))
+
+        return d
+
+    def get_written(self):
+        return self.transport.value()
+
+    def clear_written(self):
+        self.transport.clear()
+
+
+class _AsyncioTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def writelines(self, data):
+        self.written.extend(bytes(chunk) for chunk in data)
+
+
+class AsyncioCommandBatchTest(_CommandBatchTests, unittest.TestCase):
+    if sys.version_info < (3,):
+        skip = "The asyncio core needs Python 3."
+
+    hello = None
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def connect(self):
+        self.transport = _AsyncioTransport()
+
+        self.channel = AsyncioCommandServer(Relay(pool_low=0))
+        self.channel.connection_made(self.transport)
+
+        if self.hello is not None:
+            self.channel.dispatch_frames(_frame(self.hello))
+
+    def flush(self):
+        # The batch is flushed first, and then the gathered messages.
+        for i in range(2):
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+        return deferLater(reactor, 0, lambda: None)
+
+    def get_written(self):
+        return b''.join(self.transport.written)
+
+    def clear_written(self):
+        self.transport.written = []
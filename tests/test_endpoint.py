@@ -0,0 +1,79 @@
+from struct import pack
+from time import time
+
+from twisted.trial import unittest
+
+from relayserver.endpoint import EndpointBaseProtocol
+
+_CHUNK_SIZE = 65536
+
+
+def _get_chunks(message_length, trailing):
+    """An initial message of the given length, followed by the given data, in
+    the chunks that it would be received in.
+    """
+
+    stream = pack('>I', message_length) + b'm' * message_length + trailing
+    return [stream[i:i + _CHUNK_SIZE]
+            for i
+            in range(0, len(stream), _CHUNK_SIZE)]
+
+def _handshake(chunks):
+    """Push the chunks until the initial message is complete. Return the
+    message, and whatever was left over.
+    """
+
+    endpoint = EndpointBaseProtocol()
+
+    for (i, chunk) in enumerate(chunks):
+        endpoint.push_data(chunk)
+
+        message = endpoint.get_initial_message()
+        if message is not None:
+            return (message, endpoint.get_and_clear_chunks() + chunks[i + 1:])
+
+    return (None, [])
+
+
+class HandshakeTest(unittest.TestCase):
+    """EndpointBaseProtocol, for an initial message that is received in many
+    chunks.
+    """
+
+    def test_split_message(self):
+        trailing = b'early data' * 10000
+
+        (message, remaining) = _handshake(_get_chunks(3 * 1024 * 1024,
+                                                      trailing))
+
+        self.assertEqual(message, b'm' * 3 * 1024 * 1024)
+        self.assertEqual(b''.join(remaining), trailing)
+
+    def test_incomplete(self):
+        (message, remaining) = _handshake(_get_chunks(1024 * 1024, b'')[:-1])
+        self.assertIs(message, None)
+
+    def test_linear(self):
+        """Taking the message costs about as much as copying it a few times.
+        Appending each chunk to what came before instead (as the buffer once
+        did) costs over a hundred times as much, for 16MB in 64KB chunks.
+        """
+
+        chunks = _get_chunks(16 * 1024 * 1024, b'')
+
+        def get_time(function):
+            times = []
+            for i in range(3):
+                started_at = time()
+                function()
+                times.append(time() - started_at)
+
+            return min(times)
+
+        # The first large allocations are slower, whatever the buffer.
+        _handshake(chunks)
+
+        handshake_time = get_time(lambda: _handshake(chunks))
+        copy_time = get_time(lambda: b''.join(chunks))
+
+        self.assertTrue(handshake_time < copy_time * 30)
@@ -0,0 +1,139 @@
+from twisted.trial import unittest
+
+from relayserver import event_log
+from relayserver.event_log import Logger, DEBUG, INFO, WARNING
+
+
+class _Log(object):
+    def __init__(self):
+        self.lines = []
+
+    def msg(self, line, **kwargs):
+        self.lines.append(line)
+
+
+class _Argument(object):
+    """Counts the times that it's formatted."""
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return 'argument'
+
+
+class LoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.log = _Log()
+        self.patch(event_log, 'log', self.log)
+
+        self.now = 0.0
+        self.patch(event_log, 'time', lambda: self.now)
+
+        self.patch(event_log, 'sample_rate', 3)
+
+        self.logger = Logger(event_log.DATA_PLANE, INFO)
+
+    def test_levels(self):
+        self.logger.debug("Debug.")
+        self.logger.info("Info.")
+        self.logger.warning("Warning.")
+
+        self.assertEqual(self.log.lines, ["Info.", "Warning."])
+
+    def test_lazy(self):
+        """Arguments are only formatted for events that get through."""
+
+        argument = _Argument()
+
+        self.logger.debug("Debug (%s).", argument)
+        self.logger.sampled(DEBUG, "Sampled (%s).", argument)
+        self.assertEqual(argument.formatted, 0)
+
+        self.logger.info("Info (%s).", argument)
+        self.assertEqual(argument.formatted, 1)
+        self.assertEqual(self.log.lines, ["Info (argument)."])
+
+    def test_sampled(self):
+        argument = _Argument()
+
+        for i in range(5):
+            self.logger.sampled(INFO, "Event (%s).", argument)
+
+        self.assertEqual(len(self.log.lines), 3)
+        self.assertEqual(argument.formatted, 3)
+
+        # The next second's first says how many were suppressed.
+        self.now = 1.0
+        self.logger.sampled(INFO, "Event (%s).", argument)
+        self.logger.sampled(INFO, "Event (%s).", argument)
+
+        self.assertEqual(self.log.lines[3:],
+                         ["Event (argument). (2 similar suppressed)",
+                          "Event (argument)."])
+
+    def test_sampled_by_format(self):
+        for i in range(5):
+            self.logger.sampled(INFO, "First.")
+            self.logger.sampled(WARNING, "Second.")
+
+        self.assertEqual(self.log.lines.count("First."), 3)
+        self.assertEqual(self.log.lines.count("Second."), 3)
+
+    def test_sampled_below_level(self):
+        """Events below the level don't count towards the sample."""
+
+        self.logger.level = WARNING
+        for i in range(5):
+            self.logger.sampled(INFO, "Event.")
+
+        self.logger.level = INFO
+        for i in range(3):
+            self.logger.sampled(INFO, "Event.")
+
+        self.assertEqual(self.log.lines, ["Event."] * 3)
+
+    def test_unsampled(self):
+        self.patch(event_log, 'sample_rate', 0)
+
+        for i in range(5):
+            self.logger.sampled(INFO, "Event.")
+
+        self.assertEqual(len(self.log.lines), 5)
+
+
+class ParseLevelsTest(unittest.TestCase):
+    def test_levels(self):
+        levels = event_log.parse_levels(['warning', 'data=debug'])
+
+        self.assertEqual(levels, { event_log.DATA_PLANE: DEBUG,
+                                   event_log.CONTROL_PLANE: WARNING,
+                                   event_log.ASSIGNMENT: WARNING })
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, event_log.parse_levels, ['verbose'])
+        self.assertRaises(ValueError, event_log.parse_levels, ['disk=info'])
+
+
+class FileSinkTest(unittest.TestCase):
+    def test_written(self):
+        path = self.mktemp()
+
+        sink = event_log._FileSink(path, interval=.1, max_pending=2)
+        sink.start()
+
+        for i in range(4):
+            sink.write(event_log.ASSIGNMENT, INFO, "Event (%d)." % (i))
+
+        sink.stop()
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[0].endswith(" INFO    [assignment] Event (0)."))
+        self.assertTrue(lines[1].endswith("Event (1)."))
+        self.assertTrue(lines[2].endswith("(2) log events were dropped "
+                                          "because the sink couldn't keep "
+                                          "up."))
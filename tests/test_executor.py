@@ -0,0 +1,230 @@
+import os
+import time
+
+from twisted.internet.defer import Deferred
+from twisted.trial import unittest
+
+from relayserver.real.executor import off_reactor, ProcessExecutor
+from relayserver.real.ireal_server import IRealServer
+
+
+class _Connection(object):
+    """Stands in for the host-process connection, and its transport."""
+
+    def __init__(self):
+        self.written = []
+        self.paused = False
+
+    @property
+    def transport(self):
+        return self
+
+    def writeSequence(self, data):
+        self.written.extend(data)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class _Executor(object):
+    """Runs each call when it's told to."""
+
+    def __init__(self):
+        self.calls = []
+
+    def submit(self, function, *args):
+        d = Deferred()
+        self.calls.append((function, args, d))
+
+        return d
+
+    def run(self):
+        (function, args, d) = self.calls.pop(0)
+        d.callback(function(*args))
+
+    def fail(self):
+        (function, args, d) = self.calls.pop(0)
+        d.errback(Exception("Failed."))
+
+
+class _Server(IRealServer):
+    """Writes back what it receives, in capitals."""
+
+    servers = []
+
+    def __init__(self, connection):
+        self.__connection = connection
+
+        self.received = []
+        self.shut_down = False
+
+        self.servers.append(self)
+
+    def receive_data(self, proxied_data):
+        self.received.append(proxied_data)
+        self.__connection.transport.write(proxied_data.upper())
+
+    def shutdown(self):
+        self.shut_down = True
+
+
+class ExecutorServerTest(unittest.TestCase):
+    def setUp(self):
+        _Server.servers = []
+
+        self.connection = _Connection()
+        self.executor = _Executor()
+
+        create = off_reactor(_Server,
+                             self.executor,
+                             high_watermark=10,
+                             low_watermark=4)
+
+        self.server = create(self.connection)
+
+    def test_in_order(self):
+        """A session has one call at a time, and what arrives while it's
+        running goes to the next.
+        """
+
+        for data in (b'a', b'b', b'c'):
+            self.server.receive_data(data)
+
+        self.assertEqual(len(self.executor.calls), 1)
+
+        self.executor.run()
+        self.assertEqual(len(self.executor.calls), 1)
+
+        self.server.receive_data(b'd')
+        self.executor.run()
+        self.executor.run()
+
+        [server] = _Server.servers
+        self.assertEqual(server.received, [b'a', b'bc', b'd'])
+        self.assertEqual(self.connection.written, [b'A', b'BC', b'D'])
+        self.assertEqual(self.executor.calls, [])
+
+    def test_watermarks(self):
+        self.server.receive_data(b'x' * 6)
+        self.assertFalse(self.connection.paused)
+
+        self.server.receive_data(b'x' * 6)
+        self.assertTrue(self.connection.paused)
+
+        # Only the first call has finished.
+        self.executor.run()
+        self.assertTrue(self.connection.paused)
+
+        self.executor.run()
+        self.assertFalse(self.connection.paused)
+
+    def test_failure(self):
+        """A failed call is logged, and the session carries on."""
+
+        self.server.receive_data(b'a')
+        self.server.receive_data(b'b')
+
+        self.executor.fail()
+        self.assertEqual(len(self.flushLoggedErrors()), 1)
+
+        self.executor.run()
+
+        self.assertEqual(self.connection.written, [b'B'])
+        self.assertEqual(self.executor.calls, [])
+
+    def test_shutdown_while_running(self):
+        """The server is shut down once its call has finished, and what it
+        wrote in that call is dropped.
+        """
+
+        self.server.receive_data(b'x' * 6)
+        self.server.receive_data(b'x' * 6)
+        self.assertTrue(self.connection.paused)
+
+        self.server.shutdown()
+
+        # The connection may be recycled.
+        self.assertFalse(self.connection.paused)
+
+        self.server.receive_data(b'next session')
+
+        [server] = _Server.servers
+        self.assertFalse(server.shut_down)
+
+        self.executor.run()
+        self.assertEqual(len(self.executor.calls), 1)
+
+        self.executor.run()
+
+        self.assertTrue(server.shut_down)
+        self.assertEqual(server.received, [b'x' * 6])
+        self.assertEqual(self.connection.written, [])
+        self.assertEqual(self.executor.calls, [])
+
+
+def _double(value):
+    return value * 2
+
+def _raise():
+    raise ValueError("Raised in the pool.")
+
+def _get_unpicklable():
+    return lambda: None
+
+def _die():
+    os._exit(1)
+
+
+class ProcessExecutorTest(unittest.TestCase):
+    timeout = 30
+
+    def setUp(self):
+        self.executor = ProcessExecutor(1, check_interval=.1)
+
+    def tearDown(self):
+        if self.executor is not None:
+            self.executor.stop()
+
+    def test_call(self):
+        d = self.executor.submit(_double, 21)
+        d.addCallback(self.assertEqual, 42)
+
+        return d
+
+    def test_raises(self):
+        d = self.assertFailure(self.executor.submit(_raise), Exception)
+        d.addCallback(lambda e: self.assertIn("Raised in the pool.", str(e)))
+
+        return d
+
+    def test_unpicklable_call(self):
+        return self.assertFailure(self.executor.submit(_double, lambda: 0),
+                                  Exception)
+
+    def test_unpicklable_result(self):
+        return self.assertFailure(self.executor.submit(_get_unpicklable),
+                                  Exception)
+
+    def test_process_died(self):
+        """A call whose process dies fails, and the pool carries on with
+        another.
+        """
+
+        d = self.assertFailure(self.executor.submit(_die), Exception)
+        d.addCallback(lambda e: self.executor.submit(_double, 1))
+        d.addCallback(self.assertEqual, 2)
+
+        return d
+
+    def test_stop(self):
+        """Calls that are running when the pool is stopped fail."""
+
+        d = self.executor.submit(time.sleep, 10)
+
+        (executor, self.executor) = (self.executor, None)
+        executor.stop()
+
+        return self.assertFailure(d, Exception)
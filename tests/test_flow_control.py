@@ -0,0 +1,221 @@
+import socket
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, gatherResults
+from twisted.internet.protocol import Protocol, ServerFactory, ClientFactory
+from twisted.internet.task import deferLater
+from twisted.trial import unittest
+
+from relayserver.flow_control import listen_tcp, bind_streams
+from relayserver.utility import get_pending_write_length
+
+_HIGH_WATERMARK = 65536
+_LOW_WATERMARK = 16384
+
+# The kernel's buffers are kept small, so that it's the transports that do
+# the buffering.
+_SOCKET_BUFFER_SIZE = 16384
+
+_DATA_LENGTH = 4 * 1024 * 1024
+
+
+class _Relayed(Protocol):
+    """A server-side connection. Once it's bound to its peer, whatever it
+    receives is written to the peer.
+    """
+
+    peer = None
+
+    def __init__(self, test):
+        self.__test = test
+        self.lost = Deferred()
+
+    def connectionMade(self):
+        self.transport.socket.setsockopt(socket.SOL_SOCKET,
+                                         socket.SO_SNDBUF,
+                                         _SOCKET_BUFFER_SIZE)
+
+        self.__test.accepted(self)
+
+    def dataReceived(self, data):
+        self.peer.transport.write(data)
+        self.__test.written(self.peer)
+
+    def connectionLost(self, reason):
+        self.lost.callback(None)
+
+
+class _Writer(Protocol):
+    """Writes everything at once."""
+
+    def __init__(self):
+        self.lost = Deferred()
+
+    def connectionMade(self):
+        self.transport.write(b'x' * _DATA_LENGTH)
+
+    def connectionLost(self, reason):
+        self.lost.callback(None)
+
+
+class _Reader(Protocol):
+    """Doesn't read until it's resumed."""
+
+    def __init__(self):
+        self.received = 0
+        self.finished = Deferred()
+        self.lost = Deferred()
+
+    def connectionMade(self):
+        self.transport.socket.setsockopt(socket.SOL_SOCKET,
+                                         socket.SO_RCVBUF,
+                                         _SOCKET_BUFFER_SIZE)
+
+        self.transport.pauseProducing()
+
+    def dataReceived(self, data):
+        self.received += len(data)
+        if self.received == _DATA_LENGTH:
+            self.finished.callback(None)
+
+    def connectionLost(self, reason):
+        self.lost.callback(None)
+
+
+class WatermarkTest(unittest.TestCase):
+    """A relayed pair whose reader has stopped reading, while the writer
+    writes as fast as it can.
+    """
+
+    timeout = 30
+
+    def setUp(self):
+        self.relayed = []
+        self.__accepted = Deferred()
+
+        # What the reading side's transport was holding whenever the writing
+        # side was paused or resumed, and the most that it has held.
+        self.paused_at = []
+        self.resumed_at = []
+        self.max_pending = 0
+
+        self.clients = []
+
+        factory = ServerFactory()
+        factory.buildProtocol = lambda address: _Relayed(self)
+
+        self.port = listen_tcp(0,
+                               factory,
+                               high_watermark=_HIGH_WATERMARK,
+                               low_watermark=_LOW_WATERMARK)
+
+    def accepted(self, relayed):
+        self.relayed.append(relayed)
+
+        (accepted, self.__accepted) = (self.__accepted, Deferred())
+        accepted.callback(relayed)
+
+    def written(self, relayed):
+        self.max_pending = max(self.max_pending,
+                               get_pending_write_length(relayed.transport))
+
+    def __connect(self, protocol):
+        factory = ClientFactory()
+        factory.buildProtocol = lambda address: protocol
+
+        reactor.connectTCP('127.0.0.1', self.port.getHost().port, factory)
+
+        return self.__accepted
+
+    def __watch(self, writing, reading):
+        """Record what the reading side holds whenever the writing side's
+        transport is paused or resumed.
+        """
+
+        transport = writing.transport
+        (pause, resume) = (transport.pauseProducing, transport.resumeProducing)
+
+        def pause_producing():
+            self.paused_at.append(get_pending_write_length(reading.transport))
+            pause()
+
+        def resume_producing():
+            self.resumed_at.append(get_pending_write_length(reading.transport))
+            resume()
+
+        transport.pauseProducing = pause_producing
+        transport.resumeProducing = resume_producing
+
+    def __wait_for_pause(self, count=1):
+        if len(self.paused_at) >= count:
+            return
+
+        return deferLater(reactor, .01, self.__wait_for_pause, count)
+
+    def test_watermarks(self):
+        reader = _Reader()
+        writer = _Writer()
+
+        self.clients = [reader, writer]
+
+        d = self.__connect(reader)
+
+        def reader_accepted(reading):
+            self.reading = reading
+            return self.__connect(writer)
+
+        def writer_accepted(writing):
+            self.__watch(writing, self.reading)
+            bind_streams(writing, self.reading)
+
+            # The data only starts moving once the pair has been bound.
+            writing.peer = self.reading
+            return self.__wait_for_pause()
+
+        def paused(ignored):
+            # The writing side is paused once the reading side holds more
+            # than the high watermark, and it stays paused while the reader
+            # isn't reading.
+            self.assertTrue(self.paused_at[0] > _HIGH_WATERMARK)
+            return deferLater(reactor, .2, stalled)
+
+        def stalled():
+            self.assertEqual(self.resumed_at, [])
+            self.assertEqual(len(self.paused_at), 1)
+
+            reader.transport.resumeProducing()
+            return reader.finished
+
+        def finished(ignored):
+            # Every resumption came once the reading side was down to the low
+            # watermark (rather than once it was empty, as Twisted would have
+            # it). It never held more than the high watermark, plus what was
+            # read in one go (a transport reads up to its buffer-size).
+            self.assertTrue(self.resumed_at)
+            self.assertTrue(all(pending <= _LOW_WATERMARK
+                                for pending
+                                in self.resumed_at))
+
+            self.assertTrue(all(pending > _HIGH_WATERMARK
+                                for pending
+                                in self.paused_at))
+
+            self.assertTrue(self.max_pending <=
+                            _HIGH_WATERMARK + self.reading.transport.bufferSize)
+
+        d.addCallback(reader_accepted)
+        d.addCallback(writer_accepted)
+        d.addCallback(paused)
+        d.addCallback(finished)
+
+        return d
+
+    def tearDown(self):
+        lost = [protocol.lost for protocol in self.relayed + self.clients]
+
+        for protocol in self.relayed:
+            protocol.transport.loseConnection()
+
+        lost.append(self.port.stopListening())
+
+        return gatherResults(lost)
@@ -0,0 +1,179 @@
+from itertools import count
+
+from twisted.internet.task import Clock, LoopingCall
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from relayserver import host_pool
+from relayserver.host_pool import HostProcessPool
+from relayserver.reconnect import ReconnectScheduler
+
+
+class _Protocol(object):
+    def __init__(self, slot, session_id):
+        self.slot = slot
+        self.session_id = session_id
+        self.transport = StringTransport()
+
+
+class _Slot(object):
+    """Connects, and is configured, as soon as it's told to."""
+
+    def __init__(self, test):
+        self.__test = test
+
+    def connect(self):
+        protocol = _Protocol(self, next(self.__test.session_ids))
+
+        self.__test.protocols.append(protocol)
+        self.__test.pool.connection_configured(self, protocol)
+
+
+class HostProcessPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+        def create_looping_call(f):
+            call = LoopingCall(f)
+            call.clock = self.clock
+
+            return call
+
+        self.patch(host_pool, 'LoopingCall', create_looping_call)
+
+        scheduler = ReconnectScheduler(rate=1000, jitter=0, clock=self.clock)
+
+        self.pool = HostProcessPool(lambda: _Slot(self),
+                                    minimum=2,
+                                    maximum=10,
+                                    target_idle=2,
+                                    scheduler=scheduler)
+
+        self.session_ids = count(1)
+        self.protocols = []
+
+    def tearDown(self):
+        self.pool.stop()
+
+    def connect(self):
+        """Let every slot that's waiting connect."""
+
+        self.clock.pump([0] + [.001] * 20)
+
+    def assign(self, count, end=False):
+        """Assign clients to count idle connections. If end is set, their
+        sessions end, and the relay drops them.
+        """
+
+        idle = [protocol
+                for protocol
+                in self.protocols
+                if not protocol.transport.disconnecting]
+
+        for protocol in idle[-count:]:
+            self.pool.connection_assigned(protocol.session_id)
+            protocol.transport.loseConnection()
+
+            if end is True:
+                self.pool.connection_lost(protocol)
+                self.pool.slot_disconnected(protocol.slot)
+
+    def check(self):
+        self.clock.advance(1)
+        self.connect()
+
+    def test_start(self):
+        self.pool.start(3)
+        self.connect()
+
+        self.assertEqual(self.pool.size, 3)
+        self.assertEqual(self.pool.idle_count, 3)
+
+    def test_start_below_minimum(self):
+        self.pool.start(0)
+        self.connect()
+
+        self.assertEqual(self.pool.size, 2)
+
+    def test_last_idle_assigned(self):
+        """Using up the last idle slot grows the pool straight away."""
+
+        self.pool.start(2)
+        self.connect()
+
+        self.assign(1)
+        self.connect()
+        self.assertEqual(self.pool.size, 2)
+
+        self.assign(1)
+        self.connect()
+        self.assertEqual(self.pool.size, 4)
+        self.assertEqual(self.pool.idle_count, 2)
+
+    def test_pool_low(self):
+        self.pool.start(2)
+        self.connect()
+
+        # Two idle of the target, and three clients waiting.
+        self.pool.pool_low(0, 3)
+        self.connect()
+
+        self.assertEqual(self.pool.size, 5)
+
+    def test_maximum(self):
+        self.pool.start(2)
+        self.connect()
+
+        self.pool.pool_low(0, 100)
+        self.connect()
+
+        self.assertEqual(self.pool.size, 10)
+
+    def test_rate(self):
+        """The idle slots kept follow how quickly they're being assigned."""
+
+        self.pool.start(2)
+        self.connect()
+
+        # Eight assignments in an interval make for a rate of four, once
+        # smoothed.
+        for i in range(8):
+            self.assign(1, end=True)
+            self.connect()
+
+        self.assertEqual(self.pool.size, 2)
+
+        self.check()
+        self.assertEqual(self.pool.size, 4)
+        self.assertEqual(self.pool.idle_count, 4)
+
+        # Then, with nothing assigned, the rate halves each interval, and the
+        # surplus is retired.
+        self.check()
+        self.assertEqual(self.pool.size, 3)
+
+        self.check()
+        self.assertEqual(self.pool.size, 2)
+
+    def test_shrink(self):
+        """The surplus is retired by half at a time, down to the minimum."""
+
+        self.pool.start(10)
+        self.connect()
+
+        sizes = []
+        for i in range(5):
+            self.check()
+            sizes.append(self.pool.size)
+
+        self.assertEqual(sizes, [6, 4, 3, 2, 2])
+
+        # The retired slots' connections were closed, and they don't
+        # reconnect.
+        closed = [protocol
+                  for protocol
+                  in self.protocols
+                  if protocol.transport.disconnecting]
+
+        self.assertEqual(len(closed), 8)
+        self.assertEqual(len(self.protocols), 10)
@@ -0,0 +1,302 @@
+import sys
+
+from struct import pack
+
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from relayserver.message_types import build_msg_data_hphelloresponse, \
+                                      SESSION_END_TOKEN_LENGTH
+from relayserver.boot import host_process
+
+if sys.version_info >= (3,):
+    from relayserver.aio import host_process as aio_host_process
+
+_SESSION_ID = 7
+_TOKEN = b'0123456789abcdef'
+
+_EARLY_DATA_LENGTH = 4 * 1024 * 1024
+
+assert len(_TOKEN) == SESSION_END_TOKEN_LENGTH
+
+
+def _get_hello_response():
+    data = build_msg_data_hphelloresponse(_SESSION_ID, 'localhost', 8000).\
+            SerializeToString()
+
+    return pack('>I', len(data)) + data
+
+def _split(data, size):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+class _RealServer(object):
+    """Echoes what it receives, and keeps it."""
+
+    def __init__(self, connection, servers):
+        self.connection = connection
+        self.received = []
+        self.shut_down = False
+
+        servers.append(self)
+
+    def receive_data(self, proxied_data):
+        self.received.append(proxied_data)
+        self.connection.transport.write(proxied_data)
+
+    def shutdown(self):
+        self.shut_down = True
+
+
+class _Factory(object):
+    recycle_sessions = True
+    multiplex = False
+    host_process_id = ''
+    weight = 1
+
+    def __init__(self, pool):
+        self.pool = pool
+
+
+class _Pool(object):
+    # The asyncio host-process has no factory, and asks its pool.
+    recycle_sessions = True
+    host_process_id = ''
+    weight = 1
+
+    def __init__(self):
+        self.configured = 0
+
+    def connection_configured(self, *args):
+        self.configured += 1
+
+    def connection_lost(self, protocol):
+        pass
+
+
+class _CommandChannel(object):
+    def __init__(self):
+        self.acknowledged = []
+
+    def acknowledge_session_end(self, session_id, token):
+        self.acknowledged.append((session_id, token))
+
+
+class _HostProcessTests(object):
+    """A host-process data connection, whose real-servers are kept."""
+
+    def setUp(self):
+        self.servers = []
+        self.patch(self.module,
+                   'EndpointServer',
+                   lambda connection: _RealServer(connection, self.servers))
+
+        self.pool = _Pool()
+        self.command_channel = _CommandChannel()
+
+        # Our hello.
+        self.connect()
+        self.clear_written()
+
+
+class _EarlyDataTests(_HostProcessTests):
+    """A client's data that arrives right behind the hello response reaches
+    the real-server intact, and without being copied more than once.
+    """
+
+    def __handshake(self, chunk_size):
+        data = b''.join(bytes(bytearray([i % 256])) * 1024
+                        for i
+                        in range(_EARLY_DATA_LENGTH // 1024))
+
+        # The response is split across the first two chunks.
+        stream = _get_hello_response() + data
+        chunks = [stream[:3]] + _split(stream[3:], chunk_size)
+
+        for chunk in chunks:
+            self.receive(chunk)
+
+        self.assertEqual(self.pool.configured, 1)
+
+        [server] = self.servers
+        self.assertEqual(b''.join(server.received), data)
+        self.assertEqual(self.get_written(), data)
+
+        return (chunks, server.received)
+
+    def test_chunked(self):
+        (chunks, received) = self.__handshake(65536)
+
+        # Only the chunk that the response ended in was cut.
+        self.assertEqual(len(received), len(chunks) - 1)
+        self.assertTrue(all(received_chunk is chunk
+                            for (received_chunk, chunk)
+                            in zip(received[1:], chunks[2:])))
+
+    def test_coalesced(self):
+        """The response and the data arrive together (as when a connection
+        is handed over).
+        """
+
+        (chunks, received) = self.__handshake(_EARLY_DATA_LENGTH * 2)
+        self.assertEqual(len(received), 1)
+
+
+class _RecycledSessionTests(_HostProcessTests):
+    """A recycled connection's real-servers each receive exactly their own
+    client's bytes, however the relay's token arrives.
+    """
+
+    def setUp(self):
+        _HostProcessTests.setUp(self)
+        self.receive(_get_hello_response())
+
+        self.assertEqual(self.pool.configured, 1)
+
+    def __end_session(self, before, after, next_session, chunk_size):
+        """The relay announces the end of the session once it has written
+        before, and after has yet to arrive.
+        """
+
+        for chunk in _split(before, chunk_size):
+            self.receive(chunk)
+
+        self.protocol.end_session(_TOKEN, self.command_channel)
+
+        [(session_id, ack_token)] = self.command_channel.acknowledged
+        self.assertEqual(session_id, _SESSION_ID)
+
+        for chunk in _split(after + _TOKEN + next_session, chunk_size):
+            self.receive(chunk)
+
+        (first, second) = self.servers[-2:]
+
+        self.assertEqual(b''.join(first.received), before + after)
+        self.assertTrue(first.shut_down)
+
+        self.assertEqual(b''.join(second.received), next_session)
+        self.assertFalse(second.shut_down)
+
+        # The first server's echo of what arrived once the session was ending
+        # wasn't written.
+        self.assertEqual(self.get_written(),
+                         before + ack_token + next_session)
+
+    def test_token_split(self):
+        self.__end_session(b'first client ' * 100,
+                           b'still in flight ' * 50,
+                           b'second client ' * 100,
+                           7)
+
+    def test_token_coalesced(self):
+        self.__end_session(b'first client ' * 100,
+                           b'',
+                           b'second client',
+                           65536)
+
+    def test_ends_like_token(self):
+        """The session's last bytes look like the start of the token, and
+        are held back until they can't be.
+        """
+
+        self.__end_session(b'first client',
+                           _TOKEN[:5] + b'x' + _TOKEN[:15],
+                           b'second client',
+                           3)
+
+    def test_nothing_held_while_active(self):
+        self.receive(b'first client' + _TOKEN[:15])
+
+        self.assertEqual(b''.join(self.servers[0].received),
+                         b'first client' + _TOKEN[:15])
+
+
+class _TwistedCore(object):
+    if sys.version_info >= (3,):
+        skip = "The Twisted host-process needs Python 2."
+
+    module = host_process
+
+    def connect(self):
+        factory = _Factory(self.pool)
+
+        self.transport = StringTransport()
+
+        self.protocol = host_process.HostProcess(factory)
+        self.protocol.makeConnection(self.transport)
+
+    def receive(self, data):
+        self.protocol.dataReceived(data)
+
+    def get_written(self):
+        return self.transport.value()
+
+    def clear_written(self):
+        self.transport.clear()
+
+
+class TwistedEarlyDataTest(_TwistedCore, _EarlyDataTests, unittest.TestCase):
+    pass
+
+
+class TwistedRecycledSessionTest(_TwistedCore,
+                                 _RecycledSessionTests,
+                                 unittest.TestCase):
+    def test_available_once_acknowledged(self):
+        """The relay may reassign the connection as soon as it has our
+        acknowledgement, before its token has arrived.
+        """
+
+        self.protocol.end_session(_TOKEN, self.command_channel)
+        self.assertEqual(self.pool.configured, 2)
+
+
+class _AsyncioTransport(object):
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def writelines(self, data):
+        self.written.extend(bytes(chunk) for chunk in data)
+
+
+class _Connector(object):
+    def reset_delay(self):
+        pass
+
+    def connection_lost(self, immediately=False):
+        pass
+
+
+class _AsyncioCore(object):
+    if sys.version_info < (3,):
+        skip = "The asyncio core needs Python 3."
+    else:
+        module = aio_host_process
+
+    def connect(self):
+        self.transport = _AsyncioTransport()
+
+        self.protocol = aio_host_process.HostProcess(self.pool, _Connector())
+        self.protocol.connection_made(self.transport)
+
+    def receive(self, data):
+        self.protocol.data_received(data)
+
+    def get_written(self):
+        return b''.join(self.transport.written)
+
+    def clear_written(self):
+        self.transport.written = []
+
+
+class AsyncioEarlyDataTest(_AsyncioCore, _EarlyDataTests, unittest.TestCase):
+    pass
+
+
+class AsyncioRecycledSessionTest(_AsyncioCore,
+                                 _RecycledSessionTests,
+                                 unittest.TestCase):
+    pass
@@ -0,0 +1,133 @@
+"""Runs several host-processes against one relay (as they're booted), and
+checks that each is told about its own connections, and only those.
+"""
+
+import os
+import re
+import signal
+
+from tests.processes import ProcessTestCase, Client, wait, try_echo
+
+_SLOTS = 3
+
+
+class HostProcessesTest(ProcessTestCase):
+    def setUp(self):
+        ProcessTestCase.setUp(self)
+
+        # Assignments are announced one by one, so that each shows up in the
+        # host-process's log.
+        self.relay = self.start_relay('--command-batch', 1)
+
+        self.host_processes = {}
+
+    def start_host_process(self, host_process_id):
+        log_path = self.get_path('%s.log' % (host_process_id))
+
+        process = ProcessTestCase.start_host_process(self,
+                                                     '--host-process-id',
+                                                     host_process_id,
+                                                     '-n', _SLOTS,
+                                                     '--min-connections',
+                                                     _SLOTS,
+                                                     '--max-connections',
+                                                     _SLOTS,
+                                                     '--log-level', 'debug',
+                                                     '--log-sample-rate', 0,
+                                                     '--log-file', log_path)
+
+        self.host_processes[host_process_id] = process
+
+        # Every one of its connections is waiting at the relay.
+        self.assertTrue(wait(lambda: len(self.read_log(host_process_id)[0])
+                                     == _SLOTS))
+
+    def read_log(self, host_process_id):
+        """Return the session-numbers of the host-process's connections,
+        those of the assignments that were announced to it, and the
+        announcements that it couldn't use.
+        """
+
+        log_path = self.get_path('%s.log' % (host_process_id))
+
+        # It's created once there's something to write.
+        if os.path.exists(log_path) is False:
+            return (set(), [], [])
+
+        with open(log_path) as f:
+            log = f.read()
+
+        return (set(re.findall(r'SESSION-NO=\((\d+)\)', log)),
+                re.findall(r'assignment to session-no \((\d+)\)', log),
+                re.findall(r'Session-no \((\d+)\) is not one of ours', log))
+
+    def hold_clients(self, count):
+        clients = [Client(self.tport) for i in range(count)]
+        for client in clients:
+            self.assertTrue(client.echo())
+
+        return clients
+
+    def test_routing(self):
+        """Several rounds of clients keep every connection of both busy (and
+        recycled). Each host-process only hears of its own connections'
+        assignments and session-ends.
+        """
+
+        self.start_host_process('A')
+        self.start_host_process('B')
+
+        for i in range(5):
+            clients = self.hold_clients(_SLOTS * 2)
+            for client in clients:
+                self.assertTrue(client.echo())
+                client.close()
+
+        for process in self.host_processes.values():
+            self.stop(process)
+
+        announced = 0
+        for host_process_id in ('A', 'B'):
+            (own, assigned, foreign) = self.read_log(host_process_id)
+
+            self.assertEqual(len(own), _SLOTS)
+            self.assertTrue(assigned)
+            self.assertTrue(set(assigned) <= own)
+            self.assertEqual(foreign, [])
+
+            announced += len(assigned)
+
+        self.assertTrue(announced >= 5 * _SLOTS * 2)
+
+    def test_host_process_lost(self):
+        """A host-process goes away while all of its connections are
+        assigned. Only their clients are dropped, and the other host-process
+        carries on serving.
+        """
+
+        self.start_host_process('A')
+        self.start_host_process('B')
+
+        clients = self.hold_clients(_SLOTS * 2)
+
+        self.host_processes['A'].send_signal(signal.SIGKILL)
+
+        dropped = [client for client in clients if client.is_dropped()]
+        self.assertEqual(len(dropped), _SLOTS)
+
+        survivors = [client for client in clients if client not in dropped]
+        for client in survivors:
+            self.assertTrue(client.echo())
+            client.close()
+
+        # New clients are served, by B alone.
+        for i in range(_SLOTS * 3):
+            self.assertTrue(try_echo(self.tport))
+
+        self.stop(self.host_processes['B'])
+
+        (own, assigned, foreign) = self.read_log('B')
+        self.assertTrue(set(assigned) <= own)
+        self.assertEqual(foreign, [])
+
+        self.assertIs(self.relay.poll(), None)
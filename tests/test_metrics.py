@@ -0,0 +1,61 @@
+from twisted.trial import unittest
+
+from relayserver import metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        # Only ours are rendered.
+        self.patch(metrics, '_registry', [])
+
+    def test_render(self):
+        counter = metrics.counter('test_events_total', "Events.")
+        gauge = metrics.gauge('test_connections', "Connections.")
+        metrics.gauge_function('test_waiting', "Waiting.", lambda: 7)
+
+        counter.inc()
+        counter.inc(2)
+        gauge.inc(5)
+        gauge.dec()
+
+        self.assertEqual(metrics.render(),
+                         "# HELP test_events_total Events.\n"
+                         "# TYPE test_events_total counter\n"
+                         "test_events_total 3\n"
+                         "# HELP test_connections Connections.\n"
+                         "# TYPE test_connections gauge\n"
+                         "test_connections 4\n"
+                         "# HELP test_waiting Waiting.\n"
+                         "# TYPE test_waiting gauge\n"
+                         "test_waiting 7\n")
+
+    def test_histogram(self):
+        """Each bucket counts every observation up to and including its
+        bound.
+        """
+
+        histogram = metrics.histogram('test_wait_seconds',
+                                      "Waits.",
+                                      (.5, 1, 8))
+
+        for value in (.25, .5, 1, 4, 64):
+            histogram.observe(value)
+
+        self.assertEqual(metrics.render(),
+                         "# HELP test_wait_seconds Waits.\n"
+                         "# TYPE test_wait_seconds histogram\n"
+                         "test_wait_seconds_bucket{le=\"0.5\"} 2\n"
+                         "test_wait_seconds_bucket{le=\"1\"} 3\n"
+                         "test_wait_seconds_bucket{le=\"8\"} 4\n"
+                         "test_wait_seconds_bucket{le=\"+Inf\"} 5\n"
+                         "test_wait_seconds_sum 69.75\n"
+                         "test_wait_seconds_count 5\n")
+
+    def test_empty_histogram(self):
+        metrics.histogram('test_wait_seconds', "Waits.", (1,))
+
+        self.assertEqual(metrics.render().splitlines()[2:],
+                         ["test_wait_seconds_bucket{le=\"1\"} 0",
+                          "test_wait_seconds_bucket{le=\"+Inf\"} 0",
+                          "test_wait_seconds_sum 0.0",
+                          "test_wait_seconds_count 0"])
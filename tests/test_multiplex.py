@@ -0,0 +1,177 @@
+from twisted.trial import unittest
+
+from relayserver.multiplex import MuxConnection, INITIAL_WINDOW
+
+
+class _Transport(object):
+    """Keeps what's written until it's delivered to the other end."""
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(bytes(data))
+
+    def writeSequence(self, data):
+        self.written.extend(bytes(chunk) for chunk in data)
+
+    def deliver(self, connection):
+        (written, self.written) = (self.written, [])
+        connection.receive(b''.join(written))
+
+
+class _Producer(object):
+    def __init__(self):
+        self.paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class _Handlers(object):
+    """Collects what arrives on a stream."""
+
+    def __init__(self, stream):
+        self.received = []
+        self.closed = False
+
+        stream.set_handlers(self.received.append, self.close)
+
+    @property
+    def data(self):
+        return b''.join(bytes(chunk) for chunk in self.received)
+
+    def close(self):
+        self.closed = True
+
+
+class MultiplexTest(unittest.TestCase):
+    """The relay's end of a multiplexed connection, and the host-process's."""
+
+    def setUp(self):
+        self.relay_transport = _Transport()
+        self.hp_transport = _Transport()
+
+        self.opened = []
+
+        self.relay = MuxConnection(self.relay_transport)
+        self.hp = MuxConnection(self.hp_transport, self.opened.append)
+
+    def __to_hp(self):
+        self.relay_transport.deliver(self.hp)
+
+    def __to_relay(self):
+        self.hp_transport.deliver(self.relay)
+
+    def __open(self, stream_id):
+        relay_stream = self.relay.open_stream(stream_id)
+        self.__to_hp()
+
+        hp_stream = self.opened[-1]
+        self.assertEqual(hp_stream.stream_id, stream_id)
+
+        return (relay_stream, hp_stream)
+
+    def test_streams(self):
+        (relay_first, hp_first) = self.__open(1)
+        (relay_second, hp_second) = self.__open(2)
+
+        relay_handlers = [_Handlers(relay_first), _Handlers(relay_second)]
+        hp_handlers = [_Handlers(hp_first), _Handlers(hp_second)]
+
+        relay_first.write(b'to the first')
+        relay_second.writeSequence([b'to the ', b'second'])
+        self.__to_hp()
+
+        hp_second.write(b'from the second')
+        self.__to_relay()
+
+        self.assertEqual([handlers.data for handlers in hp_handlers],
+                         [b'to the first', b'to the second'])
+        self.assertEqual([handlers.data for handlers in relay_handlers],
+                         [b'', b'from the second'])
+
+        # Either side can close a stream. The other streams carry on.
+        hp_first.close()
+        self.__to_relay()
+
+        self.assertTrue(relay_handlers[0].closed)
+        self.assertTrue(relay_first.closed)
+
+        relay_second.close()
+        self.__to_hp()
+
+        self.assertTrue(hp_handlers[1].closed)
+        self.assertFalse(hp_handlers[0].closed)
+
+        self.assertEqual(self.relay.stream_count, 0)
+        self.assertEqual(self.hp.stream_count, 0)
+
+        # Nothing is sent once a stream is closed.
+        relay_first.write(b'too late')
+        self.assertEqual(self.relay_transport.written, [])
+
+    def test_window(self):
+        """A stream whose receiver doesn't give the window back sends no more
+        than the window, and pauses its producer, until it's given back.
+        """
+
+        (relay_stream, hp_stream) = self.__open(1)
+        handlers = _Handlers(hp_stream)
+
+        producer = _Producer()
+        relay_stream.registerProducer(producer, True)
+
+        # Whatever the host-process's stream delivers to can't keep up.
+        hp_stream.pauseProducing()
+
+        data = b'x' * (INITIAL_WINDOW + 1000)
+        relay_stream.write(data)
+        self.__to_hp()
+
+        self.assertEqual(len(handlers.data), INITIAL_WINDOW)
+        self.assertTrue(producer.paused)
+
+        # Nothing more is sent for more data, or for the window that isn't
+        # given back.
+        relay_stream.write(b'y' * 10)
+        self.__to_relay()
+        self.__to_hp()
+
+        self.assertEqual(len(handlers.data), INITIAL_WINDOW)
+
+        hp_stream.resumeProducing()
+        self.__to_relay()
+        self.__to_hp()
+
+        self.assertEqual(handlers.data, data + b'y' * 10)
+        self.assertFalse(producer.paused)
+
+    def test_connection_lost(self):
+        """Every stream is closed when the connection is lost."""
+
+        streams = [self.__open(stream_id) for stream_id in (1, 2, 3)]
+
+        relay_handlers = [_Handlers(relay_stream)
+                          for (relay_stream, hp_stream)
+                          in streams]
+        hp_handlers = [_Handlers(hp_stream)
+                       for (relay_stream, hp_stream)
+                       in streams]
+
+        self.relay.connection_lost()
+        self.hp.connection_lost()
+
+        self.assertTrue(all(handlers.closed
+                            for handlers
+                            in relay_handlers + hp_handlers))
+
+        self.assertEqual(self.relay.stream_count, 0)
+        self.assertEqual(self.hp.stream_count, 0)
+
+        # The other side isn't told.
+        self.assertEqual(self.relay_transport.written, [])
+        self.assertEqual(self.hp_transport.written, [])
@@ -0,0 +1,197 @@
+import sys
+
+from collections import OrderedDict
+
+from twisted.internet.task import Clock
+from twisted.internet.testing import StringTransport
+from twisted.trial import unittest
+
+from relayserver.selection import FifoPolicy
+from relayserver.timing_wheel import TimingWheel
+
+if sys.version_info < (3,):
+    from relayserver import main
+
+_PENDING_TIMEOUT = 10
+
+
+class _Client(object):
+    peer = None
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.transport = StringTransport()
+        self.assigned = False
+
+    def watch_idle(self):
+        pass
+
+    def handle_assignment(self):
+        self.assigned = True
+
+    def write_from_stream(self, data):
+        pass
+
+
+class _Stream(object):
+    peer = None
+
+    def __init__(self):
+        self.transport = StringTransport()
+
+    def set_handlers(self, receive, close):
+        pass
+
+
+class _HostProcessConnection(object):
+    host_process_id = ''
+    peer = None
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.transport = StringTransport()
+        self.streams = []
+
+    def wait_for_client(self):
+        pass
+
+    def stop_waiting(self):
+        pass
+
+    def open_stream(self, stream_id):
+        self.streams.append(stream_id)
+        return _Stream()
+
+
+class _CommandChannel(object):
+    def __init__(self):
+        self.announced = []
+
+    def announce_assignment(self, hp_connection):
+        self.announced.append(hp_connection.session_id)
+
+
+class PendingClientsTest(unittest.TestCase):
+    """Clients that arrive while no HP connection is waiting are held, in
+    order, until one arrives or they time out.
+    """
+
+    if sys.version_info >= (3,):
+        skip = "The Twisted relay needs Python 2."
+
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(main, '_timers', TimingWheel(.1, self.clock))
+
+        self.patch(main, 'pending_timeout', _PENDING_TIMEOUT)
+        self.patch(main, 'pending_limit', 2)
+
+        # The host-process isn't advised about the pool.
+        self.patch(main, 'pool_low_mark', 0)
+
+        self.command_channel = _CommandChannel()
+        self.patch(main, 'has_command_channel', lambda: True)
+        self.patch(main,
+                   'get_command_channel',
+                   lambda host_process_id='': self.command_channel)
+
+        # The manager's state is kept on its class, so each test starts with
+        # its own.
+        for name in ('client_list', 'hp_assigned_list', 'hp_ending_list',
+                     'hp_multiplexed_list', 'hp_greeting_list',
+                     'map_client_to_hp', 'map_hp_to_client',
+                     'pending_clients'):
+            self.patch(main._AssignmentManager,
+                       '_AssignmentManager__' + name,
+                       OrderedDict())
+
+        self.patch(main._AssignmentManager,
+                   '_AssignmentManager__hp_parked',
+                   {})
+        self.patch(main._AssignmentManager,
+                   '_AssignmentManager__hp_waiting',
+                   FifoPolicy())
+
+        self.manager = main._AssignmentManager()
+
+    def queue_clients(self, count):
+        clients = [_Client(session_id) for session_id in range(1, count + 1)]
+
+        for client in clients:
+            self.assertTrue(self.manager.assign_new_client(client))
+
+        return clients
+
+    def queue_hp(self, session_id):
+        hp_connection = _HostProcessConnection(session_id)
+
+        self.manager.hp_connected(hp_connection)
+        self.manager.queue_new_hp(hp_connection)
+
+        return hp_connection
+
+    def test_assigned_in_order(self):
+        [client1, client2] = self.queue_clients(2)
+        self.assertFalse(client1.assigned)
+
+        hp1 = self.queue_hp(101)
+        self.assertIs(client1.peer, hp1)
+        self.assertTrue(client1.assigned)
+        self.assertFalse(client2.assigned)
+
+        hp2 = self.queue_hp(102)
+        self.assertIs(client2.peer, hp2)
+
+        self.assertEqual(self.command_channel.announced, [101, 102])
+        self.assertEqual(self.manager.get_waiting_count(), 0)
+
+        # Their expirations were cancelled.
+        self.assertEqual(len(main._timers), 0)
+
+        self.clock.advance(_PENDING_TIMEOUT * 2)
+        self.assertFalse(client1.transport.disconnecting)
+        self.assertFalse(client2.transport.disconnecting)
+
+    def test_expired(self):
+        [client] = self.queue_clients(1)
+
+        self.clock.advance(_PENDING_TIMEOUT - 1)
+        self.assertFalse(client.transport.disconnecting)
+
+        self.clock.advance(1.1)
+        self.assertTrue(client.transport.disconnecting)
+        self.assertTrue(self.manager.is_idle())
+
+        # The next HP connection waits, as there's nobody for it.
+        self.queue_hp(101)
+        self.assertIs(client.peer, None)
+        self.assertEqual(self.manager.get_waiting_count(), 1)
+
+    def test_limit(self):
+        self.queue_clients(2)
+
+        client = _Client(3)
+        self.assertFalse(self.manager.assign_new_client(client))
+
+    def test_dropped_while_waiting(self):
+        [client1, client2] = self.queue_clients(2)
+
+        self.manager.connection_lost_from_client(client1.session_id)
+        self.assertEqual(len(main._timers), 1)
+
+        self.queue_hp(101)
+        self.assertIs(client1.peer, None)
+        self.assertTrue(client2.assigned)
+
+    def test_multiplexed(self):
+        """A multiplexed connection takes everybody that's waiting."""
+
+        clients = self.queue_clients(2)
+
+        hp_connection = _HostProcessConnection(101)
+        self.manager.hp_connected(hp_connection)
+        self.manager.queue_new_multiplexed_hp(hp_connection)
+
+        self.assertEqual(hp_connection.streams, [1, 2])
+        self.assertTrue(all(client.assigned for client in clients))
+        self.assertEqual(len(main._timers), 0)
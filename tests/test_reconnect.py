@@ -0,0 +1,71 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from relayserver.reconnect import ReconnectScheduler
+
+
+class ReconnectSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.scheduler = ReconnectScheduler(rate=10, jitter=0,
+                                            clock=self.clock)
+
+        # The slots, in the order that they attempted to connect.
+        self.attempted = []
+
+    def schedule(self, slot, failed=False):
+        self.scheduler.schedule(slot,
+                                lambda: self.attempted.append(slot),
+                                failed)
+
+    def test_rate(self):
+        for slot in 'abc':
+            self.schedule(slot)
+
+        self.clock.advance(0)
+        self.assertEqual(self.attempted, ['a'])
+
+        self.clock.pump([.1, .1])
+        self.assertEqual(self.attempted, ['a', 'b', 'c'])
+
+    def test_cancel(self):
+        self.schedule('a')
+        self.schedule('b')
+        self.scheduler.cancel('a')
+
+        self.assertEqual(self.scheduler.pending_count, 1)
+
+        self.clock.pump([0, .1, .1])
+        self.assertEqual(self.attempted, ['b'])
+
+    def test_rescheduled_after_cancel(self):
+        """A slot that's cancelled and then scheduled again waits behind the
+        slots that were already waiting, and only connects once.
+        """
+
+        self.schedule('a')
+        self.schedule('b')
+        self.scheduler.cancel('a')
+        self.schedule('a')
+
+        self.clock.pump([0, .1, .1, .1])
+        self.assertEqual(self.attempted, ['b', 'a'])
+
+    def test_probe(self):
+        """Once a slot fails, one slot probes at a time until a handshake
+        succeeds, and then the rest are released.
+        """
+
+        self.schedule('a')
+        self.schedule('b')
+        self.clock.advance(0)
+
+        self.schedule('a', failed=True)
+        self.clock.pump([.1] * 10)
+
+        # b was the probe.
+        self.assertEqual(self.attempted, ['a', 'b'])
+
+        self.scheduler.handshake_succeeded('b')
+        self.clock.advance(0)
+        self.assertEqual(self.attempted, ['a', 'b', 'a'])
@@ -0,0 +1,71 @@
+"""Runs a relay and a host-process (as they're booted) and keeps a client's
+traffic flowing while the relay drains, or is replaced by another.
+"""
+
+import os
+import signal
+import time
+
+from tests.processes import ProcessTestCase, Client, TIMEOUT, wait, \
+                            try_echo
+
+
+class DrainTest(ProcessTestCase):
+    def test_drain(self):
+        relay = self.start_relay('--drain-timeout', TIMEOUT * 3)
+        self.start_host_process()
+
+        client = Client(self.tport)
+        self.stream(client, .5)
+
+        relay.send_signal(signal.SIGUSR1)
+
+        # New clients are no longer accepted, but the ones that we have
+        # carry on.
+        self.assertTrue(wait(lambda: try_echo(self.tport) is False))
+        self.stream(client, 1)
+
+        self.assertIs(relay.poll(), None)
+
+        # We're done once they are.
+        client.close()
+        self.assertTrue(wait(lambda: relay.poll() is not None))
+
+
+class HandoffTest(ProcessTestCase):
+    def test_handoff(self):
+        """A relay that replaces another takes over its listening sockets and
+        its connections. A client doesn't notice, and neither does the
+        host-process.
+        """
+
+        handoff_path = self.get_path('handoff.sock')
+
+        old_relay = self.start_relay('--handoff-path', handoff_path)
+        self.assertTrue(wait(lambda: os.path.exists(handoff_path)))
+
+        self.start_host_process()
+
+        client = Client(self.tport)
+        self.stream(client, .5)
+
+        new_relay = self.start_relay('--handoff-path', handoff_path)
+
+        # The old relay exits once it has handed everything over, while the
+        # client carries on.
+        deadline = time.time() + TIMEOUT
+        while old_relay.poll() is None and time.time() < deadline:
+            self.assertTrue(client.echo())
+            time.sleep(.01)
+
+        self.assertIsNot(old_relay.poll(), None)
+
+        self.stream(client, .5)
+        client.close()
+
+        # New clients are served by the new relay, from the host-process's
+        # connections that were handed over.
+        for i in range(5):
+            self.assertTrue(try_echo(self.tport))
+
+        self.assertIs(new_relay.poll(), None)
@@ -0,0 +1,255 @@
+from itertools import count
+from random import Random
+
+from twisted.trial import unittest
+
+from relayserver.selection import FifoPolicy, LeastLoadedPolicy, \
+                                  TwoChoicesPolicy, WeightedRoundRobinPolicy, \
+                                  create_policy
+
+
+class _Connection(object):
+    def __init__(self, session_id, host_process_id, weight=1):
+        self.session_id = session_id
+        self.host_process_id = host_process_id
+        self.weight = weight
+
+    def __repr__(self):
+        return '<%s %d>' % (self.host_process_id, self.session_id)
+
+
+class _PolicyTests(object):
+    def setUp(self):
+        self.policy = self.create_policy()
+        self.session_ids = count(1)
+
+    def add(self, host_process_id, count=1, weight=1):
+        connections = [_Connection(next(self.session_ids),
+                                   host_process_id,
+                                   weight)
+                       for i
+                       in range(count)]
+
+        for connection in connections:
+            self.policy.add(connection)
+
+        return connections
+
+    def select(self, count=1):
+        """Select count connections for clients, and return their
+        host-processes.
+        """
+
+        selected = []
+        for i in range(count):
+            connection = self.policy.select()
+            self.policy.started(connection)
+
+            selected.append(connection.host_process_id)
+
+        return selected
+
+    def test_empty(self):
+        self.assertEqual(len(self.policy), 0)
+        self.assertIs(self.policy.select(), None)
+        self.assertIs(self.policy.pop(), None)
+        self.assertIs(self.policy.remove(1), None)
+
+    def test_remove(self):
+        [a1, a2] = self.add('A', 2)
+        [b1] = self.add('B')
+
+        self.assertIs(self.policy.remove(a1.session_id), a1)
+        self.assertIs(self.policy.remove(a1.session_id), None)
+        self.assertIs(self.policy.remove(a2.session_id), a2)
+
+        self.assertNotIn(a1.session_id, self.policy)
+        self.assertIn(b1.session_id, self.policy)
+        self.assertEqual(len(self.policy), 1)
+
+        # A has nothing waiting, so it isn't picked.
+        self.assertIs(self.policy.select(), b1)
+        self.assertIs(self.policy.select(), None)
+
+    def test_pop(self):
+        self.add('A', 2)
+        self.add('B', 2)
+
+        popped = [self.policy.pop() for i in range(4)]
+
+        self.assertEqual(len(set(popped)), 4)
+        self.assertEqual(len(self.policy), 0)
+        self.assertIs(self.policy.pop(), None)
+
+        # They can wait again.
+        for connection in popped:
+            self.policy.add(connection)
+
+        self.assertEqual(len(self.policy), 4)
+
+    def test_each_connection_once(self):
+        connections = self.add('A', 3) + self.add('B', 3) + self.add('C', 3)
+
+        selected = []
+        for i in range(len(connections)):
+            connection = self.policy.select()
+            self.policy.started(connection)
+
+            selected.append(connection)
+
+        self.assertEqual(sorted(selected, key=lambda c: c.session_id),
+                         connections)
+        self.assertIs(self.policy.select(), None)
+
+
+class FifoPolicyTest(_PolicyTests, unittest.TestCase):
+    create_policy = FifoPolicy
+
+    def test_order(self):
+        self.add('A', 2)
+        self.add('B')
+        self.add('A')
+
+        self.assertEqual(self.select(4), ['A', 'A', 'B', 'A'])
+
+
+class LeastLoadedPolicyTest(_PolicyTests, unittest.TestCase):
+    create_policy = LeastLoadedPolicy
+
+    def test_order(self):
+        (a1, a2) = self.add('A', 3)[:2]
+        self.add('B', 3)
+
+        # On a tie, the one that has been at that load the longest.
+        self.assertEqual(self.select(4), ['A', 'B', 'A', 'B'])
+
+        self.policy.finished(a1)
+        self.policy.finished(a2)
+        self.assertEqual(self.select(2), ['A', 'B'])
+
+    def test_weights(self):
+        self.add('A', 6, weight=2)
+        self.add('B', 6, weight=1)
+
+        # At a load of one each, B has been at it longer.
+        self.assertEqual(self.select(6), ['A', 'B', 'A', 'B', 'A', 'A'])
+
+    def test_consistent(self):
+        """Whatever has happened, the host-process picked is one of the
+        least-loaded with connections waiting.
+        """
+
+        random = Random(1)
+
+        waiting = []
+        busy = []
+
+        for i in range(5000):
+            choice = random.random()
+
+            if choice < .4:
+                host_process_id = random.choice('ABCDE')
+                waiting.extend(self.add(host_process_id,
+                                        weight='ABCDE'.index(host_process_id)
+                                               + 1))
+            elif choice < .5 and waiting:
+                connection = waiting.pop(random.randrange(len(waiting)))
+                self.assertIs(self.policy.remove(connection.session_id),
+                              connection)
+            elif choice < .55 and waiting:
+                connection = self.policy.pop()
+                waiting.remove(connection)
+            elif choice < .8 and waiting:
+                loads = {}
+                for connection in waiting:
+                    clients = sum(1
+                                  for c
+                                  in busy
+                                  if c.host_process_id ==
+                                     connection.host_process_id)
+
+                    loads[connection.host_process_id] = \
+                        float(clients) / connection.weight
+
+                connection = self.policy.select()
+                self.assertEqual(loads[connection.host_process_id],
+                                 min(loads.values()))
+
+                self.policy.started(connection)
+
+                waiting.remove(connection)
+                busy.append(connection)
+            elif busy:
+                connection = busy.pop(random.randrange(len(busy)))
+                self.policy.finished(connection)
+
+            self.assertEqual(len(self.policy), len(waiting))
+
+
+class TwoChoicesPolicyTest(_PolicyTests, unittest.TestCase):
+    def create_policy(self):
+        return TwoChoicesPolicy(Random(1))
+
+    def test_two(self):
+        """With two host-processes, the less-loaded one is always picked."""
+
+        self.add('A', 10)
+        self.add('B', 10)
+
+        selected = self.select(10)
+        for i in range(0, 10, 2):
+            self.assertEqual(sorted(selected[i:i + 2]), ['A', 'B'])
+
+    def test_most_loaded(self):
+        """The most-loaded host-process loses every comparison."""
+
+        self.add('C', 20)
+        self.select(20)
+
+        self.add('A', 10)
+        self.add('B', 10)
+        self.add('C', 10)
+
+        self.assertNotIn('C', self.select(10))
+
+
+class WeightedRoundRobinPolicyTest(_PolicyTests, unittest.TestCase):
+    create_policy = WeightedRoundRobinPolicy
+
+    def test_order(self):
+        self.add('A', 20, weight=2)
+        self.add('B', 20, weight=1)
+
+        selected = self.select(30)
+        for i in range(0, 30, 3):
+            self.assertEqual(sorted(selected[i:i + 3]), ['A', 'A', 'B'])
+
+    def test_clients_ignored(self):
+        [a1] = self.add('A')
+        self.add('B', 2)
+
+        self.assertEqual(self.select(), ['A'])
+
+        # A's client doesn't count against it.
+        self.policy.add(_Connection(a1.session_id + 100, 'A'))
+        self.assertEqual(self.select(2), ['B', 'A'])
+
+    def test_rejoins(self):
+        """A host-process that ran out doesn't catch up on missed turns."""
+
+        self.add('A')
+        self.add('B', 10)
+
+        self.assertEqual(self.select(5), ['A', 'B', 'B', 'B', 'B'])
+
+        self.add('A', 10)
+        self.assertEqual(sorted(self.select(4)), ['A', 'A', 'B', 'B'])
+
+
+class CreatePolicyTest(unittest.TestCase):
+    def test_create(self):
+        self.assertIsInstance(create_policy('weighted'),
+                              WeightedRoundRobinPolicy)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, create_policy, 'random')
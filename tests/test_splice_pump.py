@@ -0,0 +1,159 @@
+import socket
+
+from threading import Thread
+
+from twisted.internet.defer import Deferred
+from twisted.trial import unittest
+
+from relayserver.splice_pump import SplicePump, is_supported
+
+_DATA_LENGTH = 4 * 1024 * 1024
+
+
+def _connect():
+    """Return both ends of a TCP connection."""
+
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+
+    connecting = socket.create_connection(listener.getsockname())
+    (accepted, address) = listener.accept()
+    listener.close()
+
+    return (connecting, accepted)
+
+def _receive(skt, length):
+    received = []
+    while length > 0:
+        data = skt.recv(min(length, 65536))
+        if not data:
+            break
+
+        received.append(data)
+        length -= len(data)
+
+    return b''.join(received)
+
+
+class _Transport(object):
+    """What the pump sees of the relay's side of a connection."""
+
+    def __init__(self, skt):
+        # As Twisted has it.
+        skt.setblocking(False)
+
+        self.socket = skt
+        self.lost = Deferred()
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def stopReading(self):
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+    def loseConnection(self):
+        self.socket.close()
+        self.lost.callback(None)
+
+
+class SplicePumpTest(unittest.TestCase):
+    """A client and a host-process, and the relay's side of each connection
+    handed to the pump.
+    """
+
+    if is_supported() is False:
+        skip = "splice() is not available on this system."
+
+    timeout = 30
+
+    def setUp(self):
+        self.pump = SplicePump()
+        self.pump.start()
+        self.addCleanup(self.pump.stop)
+
+        (self.client, client_relayed) = _connect()
+        (hp_relayed, self.hp) = _connect()
+
+        for skt in (self.client, self.hp):
+            skt.settimeout(5)
+            self.addCleanup(skt.close)
+
+        self.client_transport = _Transport(client_relayed)
+        self.hp_transport = _Transport(hp_relayed)
+
+    def add_pair(self, hp_recycles=False):
+        self.assertTrue(self.pump.add_pair(self.client_transport,
+                                           self.hp_transport,
+                                           hp_recycles))
+
+    def test_relay(self):
+        self.add_pair()
+
+        self.client.sendall(b'request')
+        self.assertEqual(_receive(self.hp, 7), b'request')
+
+        self.hp.sendall(b'response')
+        self.assertEqual(_receive(self.client, 8), b'response')
+
+    def __half_close(self, closing, other, direction):
+        """The one side says something and stops sending. The other side is
+        told once it has heard it, and can still send as much as it likes,
+        until it stops too.
+        """
+
+        self.add_pair()
+
+        closing.sendall(b'request')
+        closing.shutdown(socket.SHUT_WR)
+
+        self.assertEqual(_receive(other, 8), b'request')
+
+        def send():
+            other.sendall(b'x' * _DATA_LENGTH)
+            other.shutdown(socket.SHUT_WR)
+
+        sender = Thread(target=send)
+        sender.start()
+        self.addCleanup(sender.join)
+
+        self.assertEqual(len(_receive(closing, _DATA_LENGTH + 1)),
+                         _DATA_LENGTH)
+
+        self.assertEqual(self.pump.bytes_moved[direction], 7)
+        self.assertEqual(self.pump.bytes_moved[1 - direction], _DATA_LENGTH)
+
+    def test_client_half_closes(self):
+        self.__half_close(self.client, self.hp, 0)
+
+        # The pair is handed back through the side that hung up first.
+        def lost(ignored):
+            self.assertFalse(self.hp_transport.lost.called)
+
+        return self.client_transport.lost.addCallback(lost)
+
+    def test_hp_half_closes(self):
+        self.__half_close(self.hp, self.client, 1)
+
+        def lost(ignored):
+            self.assertFalse(self.client_transport.lost.called)
+
+        return self.hp_transport.lost.addCallback(lost)
+
+    def test_client_hangs_up_recycled(self):
+        """A recycled host-process connection isn't shut down: the relay
+        ends the session on it instead.
+        """
+
+        self.add_pair(hp_recycles=True)
+        self.client.shutdown(socket.SHUT_WR)
+
+        def lost(ignored):
+            self.hp.settimeout(.2)
+            self.assertRaises(socket.timeout, self.hp.recv, 1)
+            self.assertFalse(self.hp_transport.lost.called)
+
+        return self.client_transport.lost.addCallback(lost)
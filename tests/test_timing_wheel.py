@@ -0,0 +1,142 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from relayserver.timing_wheel import TimingWheel
+
+
+class TimingWheelTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.wheel = TimingWheel(.1, self.clock)
+
+        self.called = []
+
+    def __call_later(self, delay, name):
+        return self.wheel.callLater(delay, self.called.append, name)
+
+    def __advance_to(self, seconds):
+        self.clock.advance(seconds - self.clock.seconds())
+
+    def test_order(self):
+        self.__call_later(.35, 'c')
+        self.__call_later(.15, 'b2')
+        self.__call_later(.12, 'b1')
+        self.__call_later(.15, 'b3')
+        self.__call_later(.05, 'a')
+
+        self.__advance_to(.05)
+        self.assertEqual(self.called, [])
+
+        # Timers are up to a tick late, and those in the same tick are in the
+        # order that they're due in.
+        self.__advance_to(.1)
+        self.assertEqual(self.called, ['a'])
+
+        self.__advance_to(.2)
+        self.assertEqual(self.called, ['a', 'b1', 'b2', 'b3'])
+
+        self.__advance_to(1)
+        self.assertEqual(self.called, ['a', 'b1', 'b2', 'b3', 'c'])
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_cascade(self):
+        """Timers beyond the first wheel, and beyond the last, fire in the
+        tick that they're due in.
+        """
+
+        delays = [30, 2000, 200000, 7000000]
+        for delay in delays:
+            self.__call_later(delay, delay)
+
+        for delay in delays:
+            self.__advance_to(delay - .1)
+            self.assertNotIn(delay, self.called)
+
+            self.__advance_to(delay)
+            self.assertEqual(self.called[-1], delay)
+
+        self.assertEqual(self.called, delays)
+
+    def test_idle(self):
+        """A long timer doesn't keep the reactor busy with empty ticks."""
+
+        self.__call_later(300, 'idle')
+
+        [call] = self.clock.getDelayedCalls()
+        self.assertTrue(call.getTime() >= 25)
+
+        runs = 0
+        while self.clock.getDelayedCalls():
+            self.clock.advance(
+                self.clock.getDelayedCalls()[0].getTime() -
+                self.clock.seconds())
+
+            runs += 1
+
+        self.assertEqual(self.called, ['idle'])
+        self.assertTrue(runs <= 3)
+
+    def test_sooner(self):
+        """A timer that's due before the tick that's waited for is still on
+        time.
+        """
+
+        self.__call_later(300, 'later')
+        self.__call_later(.2, 'sooner')
+
+        self.__advance_to(.2)
+        self.assertEqual(self.called, ['sooner'])
+
+    def test_overdue(self):
+        def schedule_overdue():
+            self.called.append('first')
+            self.__call_later(0, 'overdue')
+
+        self.wheel.callLater(.5, schedule_overdue)
+        self.__call_later(1, 'second')
+
+        # The reactor was held up well beyond both.
+        self.__advance_to(10)
+        self.assertEqual(self.called, ['first', 'second', 'overdue'])
+
+        self.__call_later(-5, 'past')
+        self.__advance_to(10.1)
+        self.assertEqual(self.called[-1], 'past')
+
+    def test_cancel(self):
+        timer = self.__call_later(.5, 'cancelled')
+        self.assertTrue(timer.active())
+
+        self.clock.advance(.3)
+        timer.cancel()
+        self.assertFalse(timer.active())
+
+        # Nothing is waiting, so neither is the reactor.
+        self.assertEqual(len(self.wheel), 0)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+        self.clock.advance(1)
+        self.assertEqual(self.called, [])
+
+    def test_cancel_same_tick(self):
+        """A timer that's cancelled by another that's due in the same tick
+        doesn't fire.
+        """
+
+        timers = []
+
+        def cancel_others(i):
+            self.called.append(i)
+
+            for timer in timers:
+                timer.cancel()
+
+        for i in range(5):
+            timers.append(self.wheel.callLater(.5, cancel_others, i))
+
+        self.clock.advance(1)
+
+        self.assertEqual(self.called, [0])
+        self.assertFalse(any(timer.active() for timer in timers))
+        self.assertEqual(len(self.wheel), 0)
@@ -0,0 +1,168 @@
+import os
+import socket
+
+from twisted.trial import unittest
+
+from relayserver import worker_bus
+from relayserver.message_types import build_msg_bus_adopted, \
+                                      build_msg_bus_borrow, \
+                                      build_msg_bus_lend
+from relayserver.message_types.bus_pb2 import BusMessage
+from relayserver.worker_bus import WorkerBus
+
+
+def _connect(family, host):
+    """Return both ends of a TCP connection."""
+
+    listener = socket.socket(family)
+    listener.bind((host, 0))
+    listener.listen(1)
+
+    connecting = socket.socket(family)
+    connecting.connect(listener.getsockname())
+
+    (accepted, address) = listener.accept()
+    listener.close()
+
+    return (connecting, accepted)
+
+def _is_open(descriptor):
+    try:
+        os.fstat(descriptor)
+    except OSError:
+        return False
+
+    return True
+
+
+class _Reactor(object):
+    def listenUNIX(self, path, factory):
+        pass
+
+
+class _Transport(object):
+    def __init__(self, skt):
+        self.socket = skt
+
+    def fileno(self):
+        return self.socket.fileno()
+
+
+class _BusTransport(object):
+    def __init__(self):
+        self.descriptors = []
+
+    def sendFileDescriptor(self, descriptor):
+        self.descriptors.append(descriptor)
+
+
+class _Peer(object):
+    """Another worker, on the bus."""
+
+    def __init__(self):
+        self.transport = _BusTransport()
+        self.messages = []
+
+    def write_message(self, message):
+        self.messages.append(message)
+
+
+class _HostProcessConnection(object):
+    session_id = 7
+    recycles = True
+    host_process_id = 'hp'
+    weight = 2
+
+    def __init__(self, skt):
+        self.transport = _Transport(skt)
+
+
+class _Shard(object):
+    def __init__(self, hp_connection=None):
+        self.hp_connection = hp_connection
+        self.adopted = []
+
+    def lend_hp(self):
+        return self.hp_connection
+
+    def release_hp(self, hp_connection):
+        pass
+
+    def adopt_hp(self, skt, *args):
+        self.adopted.append((skt, args))
+
+
+class WorkerBusTest(unittest.TestCase):
+    def setUp(self):
+        self.patch(worker_bus, 'reactor', _Reactor())
+
+        (self.hp_socket, self.relay_socket) = \
+            _connect(socket.AF_INET, '127.0.0.1')
+
+        for skt in (self.hp_socket, self.relay_socket):
+            self.addCleanup(skt.close)
+
+        self.shard = _Shard(_HostProcessConnection(self.relay_socket))
+
+        self.bus = WorkerBus(0, 2, self.mktemp())
+        self.bus.start(self.shard)
+
+        self.peer = _Peer()
+
+    def __lend(self):
+        self.bus.handle_borrow(self.peer, build_msg_bus_borrow(1))
+
+        [descriptor] = self.peer.transport.descriptors
+        [message] = self.peer.messages
+
+        self.assertEqual(message.message_type, BusMessage.LEND)
+        self.assertEqual(message.session_id, 7)
+        self.assertEqual(message.family, socket.AF_INET)
+
+        return descriptor
+
+    def test_adopted(self):
+        descriptor = self.__lend()
+        self.assertTrue(_is_open(descriptor))
+
+        self.bus.handle_adopted(self.peer, build_msg_bus_adopted(1, 7))
+        self.assertFalse(_is_open(descriptor))
+
+        # Again, late.
+        self.bus.handle_adopted(self.peer, build_msg_bus_adopted(1, 7))
+
+    def test_peer_left(self):
+        """What we lent to a peer that leaves before adopting it is closed."""
+
+        descriptor = self.__lend()
+
+        self.bus.remove_peer(self.peer)
+        self.assertFalse(_is_open(descriptor))
+
+        self.bus.handle_adopted(self.peer, build_msg_bus_adopted(1, 7))
+
+    def test_borrowed_ipv6(self):
+        """A connection is adopted with the family that it was lent with."""
+
+        try:
+            (hp_socket, relay_socket) = _connect(socket.AF_INET6, '::1')
+        except socket.error:
+            raise unittest.SkipTest("IPv6 isn't available.")
+
+        self.addCleanup(hp_socket.close)
+        self.addCleanup(relay_socket.close)
+
+        message = build_msg_bus_lend(1, 7, True, 'hp', 2, socket.AF_INET6)
+        self.bus.handle_lend(self.peer,
+                             message,
+                             os.dup(relay_socket.fileno()))
+
+        [(skt, args)] = self.shard.adopted
+        self.addCleanup(skt.close)
+
+        self.assertEqual(skt.family, socket.AF_INET6)
+        self.assertEqual(skt.getpeername()[:2], hp_socket.getsockname()[:2])
+        self.assertEqual(args, (7, True, 'hp', 2))
+
+        [message] = self.peer.messages
+        self.assertEqual(message.message_type, BusMessage.ADOPTED)
@@ -0,0 +1,42 @@
+import os
+import signal
+import sys
+
+from twisted.trial import unittest
+
+from relayserver.workers import run_workers
+
+
+def _succeed(index, bus_directory):
+    pass
+
+def _fail_second(index, bus_directory):
+    if index == 1:
+        raise RuntimeError("Worker failed.")
+
+def _exit_second(index, bus_directory):
+    if index == 1:
+        sys.exit(3)
+
+
+class RunWorkersTest(unittest.TestCase):
+    """The relay's exit-status says whether any of its workers failed."""
+
+    def setUp(self):
+        # Leave the test-runner's signal-handlers alone.
+        self.patch(signal, 'signal', lambda signum, handler: None)
+
+        # The failed worker's traceback goes nowhere.
+        devnull = open(os.devnull, 'w')
+        self.addCleanup(devnull.close)
+
+        self.patch(sys, 'stderr', devnull)
+
+    def test_succeeded(self):
+        self.assertEqual(run_workers(2, _succeed), 0)
+
+    def test_failed(self):
+        self.assertEqual(run_workers(2, _fail_second), 1)
+
+    def test_exited(self):
+        self.assertEqual(run_workers(2, _exit_second), 1)